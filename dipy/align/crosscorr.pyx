@@ -4,6 +4,9 @@ import numpy as np
 from fused_types cimport floating
 cimport cython
 cimport numpy as cnp
+from cython.parallel import prange
+from dipy.utils.omp import thread_count
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 
 cdef inline int _int_max(int a, int b) nogil:
@@ -125,6 +128,149 @@ cdef inline void _update_factors(double[:, :, :, :] factors,
             factors[ss, rr, cc, SIJ] += sval*mval
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _window_sums_slice(floating[:, :, :] static,
+                             floating[:, :, :] moving,
+                             cnp.npy_intp s, cnp.npy_intp radius,
+                             double[:, :, :] rows,
+                             double[:, :, :] sums) nogil:
+    r"""Sums of the CC terms of slice `s` along in-plane windows
+
+    Writes in `sums[r, c]` the sums of the static and moving intensities,
+    their squares and their products along the in-plane window of the given
+    radius centered at (`r`, `c`) and clipped to the image. `rows` is a buffer
+    of the same shape as `sums`.
+    """
+    cdef:
+        cnp.npy_intp nr = static.shape[1]
+        cnp.npy_intp nc = static.shape[2]
+        cnp.npy_intp side = 2 * radius + 1
+        cnp.npy_intp r, c, it
+        double sval, mval
+        double acc[5]
+
+    # Sliding window along the columns
+    for r in range(nr):
+        for it in range(5):
+            acc[it] = 0
+        for c in range(nc + radius):
+            if c < nc:
+                sval = static[s, r, c]
+                mval = moving[s, r, c]
+                acc[SI] += sval
+                acc[SI2] += sval * sval
+                acc[SJ] += mval
+                acc[SJ2] += mval * mval
+                acc[SIJ] += sval * mval
+            if c >= side:
+                sval = static[s, r, c - side]
+                mval = moving[s, r, c - side]
+                acc[SI] -= sval
+                acc[SI2] -= sval * sval
+                acc[SJ] -= mval
+                acc[SJ2] -= mval * mval
+                acc[SIJ] -= sval * mval
+            if c >= radius:
+                for it in range(5):
+                    rows[r, c - radius, it] = acc[it]
+    # Sliding window along the rows
+    for c in range(nc):
+        for it in range(5):
+            acc[it] = 0
+        for r in range(nr + radius):
+            if r < nr:
+                for it in range(5):
+                    acc[it] += rows[r, c, it]
+            if r >= side:
+                for it in range(5):
+                    acc[it] -= rows[r - side, c, it]
+            if r >= radius:
+                for it in range(5):
+                    sums[r - radius, c, it] = acc[it]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _cc_factors_slices(floating[:, :, :] static,
+                             floating[:, :, :] moving,
+                             cnp.npy_intp radius, cnp.npy_intp first,
+                             cnp.npy_intp last, double[:, :, :] window,
+                             double[:, :, :] sums, double[:, :, :] rows,
+                             floating[:, :, :, :] factors) nogil:
+    r"""Computes the CC factors of slices `first` to `last` - 1
+
+    The sums along the cubic windows are obtained by sliding the in-plane
+    window sums along the slices, accumulating them in `window`. `sums` and
+    `rows` are buffers of the same shape as `window`.
+    """
+    cdef:
+        cnp.npy_intp ns = static.shape[0]
+        cnp.npy_intp nr = static.shape[1]
+        cnp.npy_intp nc = static.shape[2]
+        cnp.npy_intp side = 2 * radius + 1
+        cnp.npy_intp s, ss, r, c, it
+        cnp.npy_intp firsts, lasts, firstr, lastr, firstc, lastc
+        cnp.npy_intp sides, sider, sidec
+        double cnt
+        double Imean, Jmean, IJprods, Isq, Jsq
+
+    for r in range(nr):
+        for c in range(nc):
+            for it in range(5):
+                window[r, c, it] = 0
+    # s is the last slice of the window centered at slice ss = s - radius
+    for s in range(first - radius, last + radius):
+        if 0 <= s < ns:
+            _window_sums_slice(static, moving, s, radius, rows, sums)
+            for r in range(nr):
+                for c in range(nc):
+                    for it in range(5):
+                        window[r, c, it] += sums[r, c, it]
+        if s - side >= 0 and s - side >= first - radius:
+            _window_sums_slice(static, moving, s - side, radius, rows, sums)
+            for r in range(nr):
+                for c in range(nc):
+                    for it in range(5):
+                        window[r, c, it] -= sums[r, c, it]
+        ss = s - radius
+        if ss < first:
+            continue
+        firsts = _int_max(0, ss - radius)
+        lasts = _int_min(ns - 1, ss + radius)
+        sides = (lasts - firsts + 1)
+        for r in range(nr):
+            firstr = _int_max(0, r - radius)
+            lastr = _int_min(nr - 1, r + radius)
+            sider = (lastr - firstr + 1)
+            for c in range(nc):
+                firstc = _int_max(0, c - radius)
+                lastc = _int_min(nc - 1, c + radius)
+                sidec = (lastc - firstc + 1)
+                cnt = sides*sider*sidec
+                Imean = window[r, c, SI] / cnt
+                Jmean = window[r, c, SJ] / cnt
+                IJprods = (window[r, c, SIJ] -
+                           Jmean * window[r, c, SI] -
+                           Imean * window[r, c, SJ] +
+                           cnt * Jmean * Imean)
+                Isq = (window[r, c, SI2] -
+                       Imean * window[r, c, SI] -
+                       Imean * window[r, c, SI] +
+                       cnt * Imean * Imean)
+                Jsq = (window[r, c, SJ2] -
+                       Jmean * window[r, c, SJ] -
+                       Jmean * window[r, c, SJ] +
+                       cnt * Jmean * Jmean)
+                factors[ss, r, c, 0] = static[ss, r, c] - Imean
+                factors[ss, r, c, 1] = moving[ss, r, c] - Jmean
+                factors[ss, r, c, 2] = IJprods
+                factors[ss, r, c, 3] = Isq
+                factors[ss, r, c, 4] = Jsq
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
@@ -146,6 +292,9 @@ def precompute_cc_factors_3d(floating[:, :, :] static,
         the moving volume (notice that both images must already be in a common
         reference domain, i.e. the same S, R, C)
     radius : the radius of the neighborhood (cube of (2 * radius + 1)^3 voxels)
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -175,118 +324,27 @@ def precompute_cc_factors_3d(floating[:, :, :] static,
         cnp.npy_intp ns = static.shape[0]
         cnp.npy_intp nr = static.shape[1]
         cnp.npy_intp nc = static.shape[2]
-        cnp.npy_intp side = 2 * radius + 1
-        cnp.npy_intp firstc, lastc, firstr, lastr, firsts, lasts
-        cnp.npy_intp s, r, c, it, sides, sider, sidec
-        double cnt
-        cnp.npy_intp ssss, sss, ss, rr, cc, prev_ss, prev_rr, prev_cc
-        double Imean, Jmean, IJprods, Isq, Jsq
-        double[:, :, :, :] temp = np.zeros((2, nr, nc, 5), dtype=np.float64)
+        cnp.npy_intp chunk, nchunks
         floating[:, :, :, :] factors = np.zeros((ns, nr, nc, 5),
                                                 dtype=np.asarray(static).dtype)
 
+    set_num_threads(num_threads)
+    # Each thread processes a contiguous block of slices
+    nchunks = max(1, min(thread_count(), ns))
+    cdef:
+        double[:, :, :, :] window = np.empty((nchunks, nr, nc, 5))
+        double[:, :, :, :] sums = np.empty((nchunks, nr, nc, 5))
+        double[:, :, :, :] rows = np.empty((nchunks, nr, nc, 5))
+
     with nogil:
-        sss = 1
-        for s in range(ns+radius):
-            ss = _wrap(s - radius, ns)
-            sss = 1 - sss
-            firsts = _int_max(0, ss - radius)
-            lasts = _int_min(ns - 1, ss + radius)
-            sides = (lasts - firsts + 1)
-            for r in range(nr+radius):
-                rr = _wrap(r - radius, nr)
-                firstr = _int_max(0, rr - radius)
-                lastr = _int_min(nr - 1, rr + radius)
-                sider = (lastr - firstr + 1)
-                for c in range(nc+radius):
-                    cc = _wrap(c - radius, nc)
-                    # New corner
-                    _update_factors(temp, moving, static,
-                                    sss, rr, cc, s, r, c, 0)
-
-                    # Add signed sub-volumes
-                    if s > 0:
-                        prev_ss = 1 - sss
-                        for it in range(5):
-                            temp[sss, rr, cc, it] += temp[prev_ss, rr, cc, it]
-                        if r > 0:
-                            prev_rr = _wrap(rr-1, nr)
-                            for it in range(5):
-                                temp[sss, rr, cc, it] -= \
-                                    temp[prev_ss, prev_rr, cc, it]
-                            if c > 0:
-                                prev_cc = _wrap(cc-1, nc)
-                                for it in range(5):
-                                    temp[sss, rr, cc, it] += \
-                                        temp[prev_ss, prev_rr, prev_cc, it]
-                        if c > 0:
-                            prev_cc = _wrap(cc-1, nc)
-                            for it in range(5):
-                                temp[sss, rr, cc, it] -= \
-                                    temp[prev_ss, rr, prev_cc, it]
-                    if(r > 0):
-                        prev_rr = _wrap(rr-1, nr)
-                        for it in range(5):
-                            temp[sss, rr, cc, it] += \
-                                temp[sss, prev_rr, cc, it]
-                        if(c > 0):
-                            prev_cc = _wrap(cc-1, nc)
-                            for it in range(5):
-                                temp[sss, rr, cc, it] -= \
-                                    temp[sss, prev_rr, prev_cc, it]
-                    if(c > 0):
-                        prev_cc = _wrap(cc-1, nc)
-                        for it in range(5):
-                            temp[sss, rr, cc, it] += temp[sss, rr, prev_cc, it]
-
-                    # Add signed corners
-                    if s >= side:
-                        _update_factors(temp, moving, static,
-                                        sss, rr, cc, s-side, r, c, -1)
-                        if r >= side:
-                            _update_factors(temp, moving, static,
-                                            sss, rr, cc, s-side, r-side, c, 1)
-                            if c >= side:
-                                _update_factors(temp, moving, static, sss, rr,
-                                                cc, s-side, r-side, c-side, -1)
-                        if c >= side:
-                            _update_factors(temp, moving, static,
-                                            sss, rr, cc, s-side, r, c-side, 1)
-                    if r >= side:
-                        _update_factors(temp, moving, static,
-                                        sss, rr, cc, s, r-side, c, -1)
-                        if c >= side:
-                            _update_factors(temp, moving, static,
-                                            sss, rr, cc, s, r-side, c-side, 1)
-
-                    if c >= side:
-                        _update_factors(temp, moving, static,
-                                        sss, rr, cc, s, r, c-side, -1)
-                    # Compute final factors
-                    if s >= radius and r >= radius and c >= radius:
-                        firstc = _int_max(0, cc - radius)
-                        lastc = _int_min(nc - 1, cc + radius)
-                        sidec = (lastc - firstc + 1)
-                        cnt = sides*sider*sidec
-                        Imean = temp[sss, rr, cc, SI] / cnt
-                        Jmean = temp[sss, rr, cc, SJ] / cnt
-                        IJprods = (temp[sss, rr, cc, SIJ] -
-                                   Jmean * temp[sss, rr, cc, SI] -
-                                   Imean * temp[sss, rr, cc, SJ] +
-                                   cnt * Jmean * Imean)
-                        Isq = (temp[sss, rr, cc, SI2] -
-                               Imean * temp[sss, rr, cc, SI] -
-                               Imean * temp[sss, rr, cc, SI] +
-                               cnt * Imean * Imean)
-                        Jsq = (temp[sss, rr, cc, SJ2] -
-                               Jmean * temp[sss, rr, cc, SJ] -
-                               Jmean * temp[sss, rr, cc, SJ] +
-                               cnt * Jmean * Jmean)
-                        factors[ss, rr, cc, 0] = static[ss, rr, cc] - Imean
-                        factors[ss, rr, cc, 1] = moving[ss, rr, cc] - Jmean
-                        factors[ss, rr, cc, 2] = IJprods
-                        factors[ss, rr, cc, 3] = Isq
-                        factors[ss, rr, cc, 4] = Jsq
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            _cc_factors_slices(static, moving, radius,
+                               (chunk * ns) // nchunks,
+                               ((chunk + 1) * ns) // nchunks,
+                               window[chunk], sums[chunk], rows[chunk],
+                               factors)
+    if num_threads is not None:
+        restore_default_num_threads()
     return factors
 
 
@@ -30,6 +30,8 @@
         and the Optimizer at each level of the Gaussian pyramid. At each
         level, it will setup the metric to compute value and gradient of the
         metric with the input images with different levels of smoothing.
+        Several moving images can be registered concurrently towards the same
+        static image, sharing its scale space.
 
     References
     ----------
@@ -42,6 +44,11 @@
                Imaging, 22(1), 120-8, 2003.
 """
 
+import copy
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from time import time
+
 import numpy as np
 import numpy.linalg as npl
 import scipy.ndimage as ndimage
@@ -62,6 +69,8 @@ _transform_method[(2, 'nearest')] = vf.transform_2d_affine_nn
 _transform_method[(3, 'nearest')] = vf.transform_3d_affine_nn
 _transform_method[(2, 'linear')] = vf.transform_2d_affine
 _transform_method[(3, 'linear')] = vf.transform_3d_affine
+_transform_method[(4, 'nearest')] = vf.transform_4d_affine_nn
+_transform_method[(4, 'linear')] = vf.transform_4d_affine
 
 
 class AffineInversionError(Exception):
@@ -157,7 +166,8 @@ class AffineMap(object):
 
     def _apply_transform(self, image, interp='linear', image_grid2world=None,
                          sampling_grid_shape=None, sampling_grid2world=None,
-                         resample_only=False, apply_inverse=False):
+                         resample_only=False, apply_inverse=False,
+                         num_threads=None):
         """ Transforms the input image applying this affine transform
 
         This is a generic function to transform images using either this
@@ -175,8 +185,9 @@ class AffineMap(object):
 
         Parameters
         ----------
-        image : array, shape (X, Y) or (X, Y, Z)
-            the image to be transformed
+        image : array, shape (X, Y) or (X, Y, Z) or (X, Y, Z, N)
+            the image to be transformed. The N volumes of a 4D image are
+            transformed together.
         interp : string, either 'linear' or 'nearest'
             the type of interpolation to be used, either 'linear'
             (for k-linear interpolation) or 'nearest' for nearest neighbor
@@ -204,6 +215,9 @@ class AffineMap(object):
             transform. Otherwise, the image is transformed from the domain
             of this transform to its codomain using the (inverse) affine
             transform.
+        num_threads : int, optional
+            Number of OpenMP threads used to transform the image. If None
+            (the default) then all available threads will be used.
         Returns
         -------
         transformed : array, shape `sampling_grid_shape` or `self.domain_shape`
@@ -228,7 +242,7 @@ class AffineMap(object):
 
         # Verify valid image dimension
         img_dim = len(image.shape)
-        if img_dim < 2 or img_dim > 3:
+        if img_dim < 2 or img_dim > 4 or (img_dim == 4 and dim != 3):
             raise ValueError('Undefined transform for dim: %d' % (img_dim,))
 
         # Obtain grid-to-world transform for sampling grid
@@ -264,12 +278,16 @@ class AffineMap(object):
         # Transform the input image
         if interp == 'linear':
             image = image.astype(np.float64)
-        transformed = _transform_method[(dim, interp)](image, shape, comp)
+        # The volumes of a 4D image are transformed together
+        if img_dim == 4:
+            dim = 4
+        transformed = _transform_method[(dim, interp)](
+            image, shape, comp, num_threads=num_threads)
         return transformed
 
     def transform(self, image, interp='linear', image_grid2world=None,
                   sampling_grid_shape=None, sampling_grid2world=None,
-                  resample_only=False):
+                  resample_only=False, num_threads=None):
         """ Transforms the input image from co-domain to domain space
 
         By default, the transformed image is sampled at a grid defined by
@@ -278,8 +296,9 @@ class AffineMap(object):
 
         Parameters
         ----------
-        image : array, shape (X, Y) or (X, Y, Z)
-            the image to be transformed
+        image : array, shape (X, Y) or (X, Y, Z) or (X, Y, Z, N)
+            the image to be transformed. The N volumes of a 4D image are
+            transformed together.
         interp : string, either 'linear' or 'nearest'
             the type of interpolation to be used, either 'linear'
             (for k-linear interpolation) or 'nearest' for nearest neighbor
@@ -301,6 +320,9 @@ class AffineMap(object):
             If False (the default) the affine transform is applied normally.
             If True, then the affine transform is not applied, and the input
             image is just re-sampled on the domain grid of this transform.
+        num_threads : int, optional
+            Number of OpenMP threads used to transform the image. If None
+            (the default) then all available threads will be used.
         Returns
         -------
         transformed : array, shape `sampling_grid_shape` or
@@ -311,12 +333,13 @@ class AffineMap(object):
                                             sampling_grid_shape,
                                             sampling_grid2world,
                                             resample_only,
-                                            apply_inverse=False)
+                                            apply_inverse=False,
+                                            num_threads=num_threads)
         return np.array(transformed)
 
     def transform_inverse(self, image, interp='linear', image_grid2world=None,
                           sampling_grid_shape=None, sampling_grid2world=None,
-                          resample_only=False):
+                          resample_only=False, num_threads=None):
         """ Transforms the input image from domain to co-domain space
 
         By default, the transformed image is sampled at a grid defined by
@@ -325,8 +348,9 @@ class AffineMap(object):
 
         Parameters
         ----------
-        image : array, shape (X, Y) or (X, Y, Z)
-            the image to be transformed
+        image : array, shape (X, Y) or (X, Y, Z) or (X, Y, Z, N)
+            the image to be transformed. The N volumes of a 4D image are
+            transformed together.
         interp : string, either 'linear' or 'nearest'
             the type of interpolation to be used, either 'linear'
             (for k-linear interpolation) or 'nearest' for nearest neighbor
@@ -348,6 +372,9 @@ class AffineMap(object):
             If False (the default) the affine transform is applied normally.
             If True, then the affine transform is not applied, and the input
             image is just re-sampled on the domain grid of this transform.
+        num_threads : int, optional
+            Number of OpenMP threads used to transform the image. If None
+            (the default) then all available threads will be used.
         Returns
         -------
         transformed : array, shape `sampling_grid_shape` or
@@ -358,13 +385,14 @@ class AffineMap(object):
                                             sampling_grid_shape,
                                             sampling_grid2world,
                                             resample_only,
-                                            apply_inverse=True)
+                                            apply_inverse=True,
+                                            num_threads=num_threads)
         return np.array(transformed)
 
 
 class MutualInformationMetric(object):
 
-    def __init__(self, nbins=32, sampling_proportion=None):
+    def __init__(self, nbins=32, sampling_proportion=None, num_threads=None):
         r""" Initializes an instance of the Mutual Information metric
 
         This class implements the methods required by Optimizer to drive the
@@ -384,6 +412,10 @@ class MutualInformationMetric(object):
             then sparse sampling is used, where `sampling_proportion`
             specifies the proportion of voxels to be used. The default is
             None.
+        num_threads : int, optional
+            the number of OpenMP threads used to compute the joint histogram
+            and its gradient, and to transform the moving image. If None (the
+            default) then all available threads will be used.
 
         Notes
         -----
@@ -395,13 +427,15 @@ class MutualInformationMetric(object):
         coordinates. When using dense sampling, this random displacement is
         not applied.
         """
-        self.histogram = ParzenJointHistogram(nbins)
+        self.histogram = ParzenJointHistogram(nbins, num_threads)
         self.sampling_proportion = sampling_proportion
+        self.num_threads = num_threads
         self.metric_val = None
         self.metric_grad = None
 
     def setup(self, transform, static, moving, static_grid2world=None,
-              moving_grid2world=None, starting_affine=None):
+              moving_grid2world=None, starting_affine=None,
+              static_samples=None):
         r""" Prepares the metric to compute intensity densities and gradients
 
         The histograms will be setup to compute probability densities of
@@ -432,6 +466,12 @@ class MutualInformationMetric(object):
             instead of manually transforming the moving image to reduce
             interpolation artifacts. The default is None, implying no
             pre-alignment is performed.
+        static_samples : tuple (samples, static_vals), optional
+            the sampling points and the static intensities at them, as
+            returned by `sample_static` for the same static image. This
+            allows several registrations towards the same static image to
+            share their sampling points. Only used with sparse sampling. The
+            default is None, implying new sampling points are drawn.
         """
         n = transform.get_number_of_parameters()
         self.metric_grad = np.zeros(n, dtype=np.float64)
@@ -441,7 +481,7 @@ class MutualInformationMetric(object):
         if static_grid2world is None:
             static_grid2world = np.eye(self.dim + 1)
         self.transform = transform
-        self.static = np.array(static).astype(np.float64)
+        self.static = np.asarray(static, dtype=np.float64)
         self.moving = np.array(moving).astype(np.float64)
         self.static_grid2world = static_grid2world
         self.static_world2grid = npl.inv(static_grid2world)
@@ -469,25 +509,75 @@ class MutualInformationMetric(object):
             self.samples = None
             self.ns = 0
         else:
-            k = int(np.ceil(1.0 / self.sampling_proportion))
-            shape = np.array(static.shape, dtype=np.int32)
-            self.samples = sample_domain_regular(k, shape, static_grid2world)
-            self.samples = np.array(self.samples)
-            self.ns = self.samples.shape[0]
-            # Add a column of ones (homogeneous coordinates)
-            self.samples = np.hstack((self.samples, np.ones(self.ns)[:, None]))
-            if self.starting_affine is None:
-                self.samples_prealigned = self.samples
-            else:
-                self.samples_prealigned =\
-                    self.starting_affine.dot(self.samples.T).T
-            # Sample the static image
-            static_p = self.static_world2grid.dot(self.samples.T).T
-            static_p = static_p[..., :self.dim]
-            self.static_vals, inside = self.interp_method(static, static_p)
-            self.static_vals = np.array(self.static_vals, dtype=np.float64)
+            if static_samples is None:
+                static_samples = self.sample_static(static, static_grid2world)
+            self.set_static_samples(static_samples)
         self.histogram.setup(self.static, self.moving)
 
+    def set_static_samples(self, static_samples):
+        r""" Replaces the sparse sampling points of the metric
+
+        Allows to change the sampling points without repeating the rest of
+        `setup`, which must have been called before with sparse sampling.
+
+        Parameters
+        ----------
+        static_samples : tuple (samples, static_vals)
+            the sampling points and the static intensities at them, as
+            returned by `sample_static` for the static image given to `setup`.
+        """
+        self.samples, self.static_vals = static_samples
+        self.ns = self.samples.shape[0]
+        if self.starting_affine is None:
+            self.samples_prealigned = self.samples
+        else:
+            self.samples_prealigned =\
+                self.starting_affine.dot(self.samples.T).T
+
+    def sample_static(self, static, static_grid2world=None,
+                      sampling_proportion=None):
+        r""" Draws the sparse sampling points of the static image
+
+        Parameters
+        ----------
+        static : array, shape (S, R, C) or (R, C)
+            static image
+        static_grid2world : array (dim+1, dim+1), optional
+            the grid-to-space transform of the static image. The default is
+            None, implying the transform is the identity.
+        sampling_proportion : float in interval (0, 1], optional
+            the proportion of voxels to be sampled. The default is None,
+            implying the `sampling_proportion` of the metric is used.
+
+        Returns
+        -------
+        samples : array, shape (n, dim+1)
+            the sampling points in physical space (homogeneous coordinates),
+            `n` is determined by `sampling_proportion`.
+        static_vals : array, shape (n,)
+            the intensities of the static image at the sampling points.
+        """
+        dim = len(static.shape)
+        if static_grid2world is None:
+            static_grid2world = np.eye(dim + 1)
+        if sampling_proportion is None:
+            sampling_proportion = self.sampling_proportion
+        k = int(np.ceil(1.0 / sampling_proportion))
+        shape = np.array(static.shape, dtype=np.int32)
+        samples = np.array(sample_domain_regular(k, shape, static_grid2world))
+        ns = samples.shape[0]
+        # Add a column of ones (homogeneous coordinates)
+        samples = np.hstack((samples, np.ones(ns)[:, None]))
+        # Sample the static image
+        static_p = npl.inv(static_grid2world).dot(samples.T).T
+        static_p = static_p[..., :dim]
+        if dim == 2:
+            static_vals, inside = vf.interpolate_scalar_2d(static, static_p)
+        else:
+            static_vals, inside = vf.interpolate_scalar_3d(static, static_p)
+        static_vals = np.array(static_vals, dtype=np.float64)
+        return samples, static_vals
+
     def _update_histogram(self):
         r""" Updates the histogram according to the current affine transform
 
@@ -519,7 +609,8 @@ class MutualInformationMetric(object):
         moving_values = None
         if self.sampling_proportion is None:  # Dense case
             static_values = self.static
-            moving_values = self.affine_map.transform(self.moving)
+            moving_values = self.affine_map.transform(
+                self.moving, num_threads=self.num_threads)
             self.histogram.update_pdfs_dense(static_values, moving_values)
         else:  # Sparse case
             sp_to_moving = self.moving_world2grid.dot(self.affine_map.affine)
@@ -679,6 +770,46 @@ class MutualInformationMetric(object):
         return -1 * self.metric_val, -1 * self.metric_grad
 
 
+class _LevelConverged(Exception):
+    pass
+
+
+class _LevelMonitor(object):
+    r"""Objective function wrapper recording the metric at each iteration
+
+    Its `callback` raises `_LevelConverged` once the relative decrease of
+    the metric over the last `window` iterations falls below `tol` (never if
+    `tol` is None).
+    """
+    def __init__(self, fun, tol, window=5):
+        self.fun = fun
+        self.tol = tol
+        self.window = window
+        self.values = []
+        self.xk = None
+        self._last_x = None
+        self._last_f = None
+
+    def __call__(self, x):
+        f, g = self.fun(x)
+        self._last_x = np.array(x)
+        self._last_f = f
+        return f, g
+
+    def callback(self, xk):
+        self.xk = np.array(xk)
+        if self._last_x is not None and np.array_equal(self._last_x, xk):
+            f = self._last_f
+        else:
+            f, g = self(xk)
+        self.values.append(f)
+        if self.tol is None or len(self.values) <= self.window:
+            return
+        f_old = self.values[-1 - self.window]
+        if f_old - f <= self.tol * abs(f_old):
+            raise _LevelConverged()
+
+
 class AffineRegistration(object):
 
     def __init__(self,
@@ -689,7 +820,9 @@ class AffineRegistration(object):
                  method='L-BFGS-B',
                  ss_sigma_factor=None,
                  options=None,
-                 verbosity=VerbosityLevels.STATUS):
+                 verbosity=VerbosityLevels.STATUS,
+                 level_tol=None,
+                 gradient_noise_tol=None):
         """ Initializes an instance of the AffineRegistration class
 
         Parameters
@@ -730,6 +863,21 @@ class AffineRegistration(object):
         options : dict, optional
             extra optimization options. The default is None, implying
             no extra options are passed to the optimizer.
+        level_tol : float, optional
+            If not None, the optimization of each level stops as soon as the
+            relative decrease of the metric over the last 5 iterations falls
+            below `level_tol`, even if `level_iters` has not been reached
+            (requires Scipy >= 0.12). The default is None.
+        gradient_noise_tol : float, optional
+            If not None and the metric uses sparse sampling, the number of
+            samples is adapted at each level: starting from the metric's
+            `sampling_proportion`, it is doubled as long as the standard
+            error of the metric's gradient, estimated from disjoint subsets
+            of the samples, exceeds `gradient_noise_tol` times the norm of
+            the gradient. At the finer levels, where the gradient vanishes as
+            the images get aligned, the norm of the gradient at the coarsest
+            level is used instead if larger. The default is None, implying
+            the number of samples is fixed.
         """
         self.metric = metric
 
@@ -758,6 +906,9 @@ class AffineRegistration(object):
             self.sigmas = sigmas
 
         self.verbosity = verbosity
+        self.level_tol = level_tol
+        self.gradient_noise_tol = gradient_noise_tol
+        self.level_stats = None
 
     # Separately add a string that tells about the verbosity kwarg. This needs
     # to be separate, because it is set as a module-wide option in __init__:
@@ -821,62 +972,250 @@ class AffineRegistration(object):
         if params0 is None:
             params0 = self.transform.get_identity_parameters()
         self.params0 = params0
+        self.starting_affine = self._get_starting_affine(static,
+                                                         static_grid2world,
+                                                         moving,
+                                                         moving_grid2world,
+                                                         starting_affine)
+        # Build the scale space of the input images
+        self.moving_ss = self._build_scale_space(moving, moving_grid2world)
+        self.static_ss = self._build_scale_space(static, static_grid2world)
+
+    def _get_starting_affine(self, static, static_grid2world, moving,
+                             moving_grid2world, starting_affine):
+        r"""Pre-aligning matrix given by a `starting_affine` strategy
+
+        See `optimize` for the meaning of `starting_affine`.
+        """
+        dim = len(static.shape)
         if starting_affine is None:
-            self.starting_affine = np.eye(self.dim + 1)
+            return np.eye(dim + 1)
         elif isinstance(starting_affine, str):
             if starting_affine == 'mass':
                 affine_map = transform_centers_of_mass(static,
                                                        static_grid2world,
                                                        moving,
                                                        moving_grid2world)
-                self.starting_affine = affine_map.affine
             elif starting_affine == 'voxel-origin':
                 affine_map = transform_origins(static, static_grid2world,
                                                moving, moving_grid2world)
-                self.starting_affine = affine_map.affine
             elif starting_affine == 'centers':
                 affine_map = transform_geometric_centers(static,
                                                          static_grid2world,
                                                          moving,
                                                          moving_grid2world)
-                self.starting_affine = affine_map.affine
             else:
                 raise ValueError('Invalid starting_affine strategy')
+            return affine_map.affine
         elif (isinstance(starting_affine, np.ndarray) and
-              starting_affine.shape >= (self.dim, self.dim + 1)):
-            self.starting_affine = starting_affine
-        else:
-            raise ValueError('Invalid starting_affine matrix')
-        # Extract information from affine matrices to create the scale space
-        static_direction, static_spacing = \
-            get_direction_and_spacings(static_grid2world, self.dim)
-        moving_direction, moving_spacing = \
-            get_direction_and_spacings(moving_grid2world, self.dim)
+              starting_affine.shape >= (dim, dim + 1)):
+            return starting_affine
+        raise ValueError('Invalid starting_affine matrix')
+
+    def _build_scale_space(self, image, grid2world):
+        r"""Scale space of the intensity-normalized `image`"""
+        dim = len(image.shape)
+        # Extract information from the affine matrix to create the scale space
+        direction, spacing = get_direction_and_spacings(grid2world, dim)
+        image = ((image.astype(np.float64) - image.min()) /
+                 (image.max() - image.min()))
+        if self.use_isotropic:
+            return IsotropicScaleSpace(image, self.factors, self.sigmas,
+                                       grid2world, spacing, False)
+        return ScaleSpace(image, self.levels, grid2world, spacing,
+                          self.ss_sigma_factor, False)
+
+    def _get_static_levels(self, static_ss):
+        r"""Static images resampled at each level of the scale space
+
+        Returns a list whose `level`-th element is the pair (image,
+        grid2world) of the smoothed static image resampled on the domain of
+        that level, and, if the metric uses sparse sampling, the sampling
+        points drawn from it (see `MutualInformationMetric.sample_static`).
+        These only depend on the static image, so they can be shared by all
+        the registrations towards it.
+        """
+        original_static_shape = static_ss.get_image(0).shape
+        original_static_grid2world = static_ss.get_affine(0)
+        sparse = (isinstance(self.metric, MutualInformationMetric) and
+                  self.metric.sampling_proportion is not None)
+        static_levels = [None] * self.levels
+        # Draw the sampling points from the coarsest to the finest level, in
+        # the order `optimize` used to
+        for level in range(self.levels - 1, -1, -1):
+            # Resample the smooth static image to the shape of this level
+            smooth_static = static_ss.get_image(level)
+            current_static_shape = static_ss.get_domain_shape(level)
+            current_static_grid2world = static_ss.get_affine(level)
+
+            current_affine_map = AffineMap(None,
+                                           current_static_shape,
+                                           current_static_grid2world,
+                                           original_static_shape,
+                                           original_static_grid2world)
+            current_static = current_affine_map.transform(smooth_static)
+            samples = None
+            if sparse:
+                samples = self.metric.sample_static(current_static,
+                                                    current_static_grid2world)
+            static_levels[level] = (current_static, current_static_grid2world,
+                                    samples)
+        return static_levels
+
+    def _optimize_levels(self, metric, transform, static_levels, moving_ss,
+                         params0, starting_affine, concurrent=False,
+                         rng=None):
+        r"""Runs the multi-resolution optimization
+
+        Returns the optimal affine matrix, the value of the metric at the
+        finest level and the statistics of each level (see `optimize`). If
+        `concurrent`, as in `optimize_batch`, the level being optimized is
+        neither printed nor stored in the `current_level` attribute. `rng` is
+        the random generator used to adapt the number of samples (see
+        `_adapt_samples`).
+        """
+        if params0 is None:
+            params0 = transform.get_identity_parameters()
+        adaptive = (self.gradient_noise_tol is not None and
+                    isinstance(metric, MutualInformationMetric) and
+                    metric.sampling_proportion is not None)
+        noise_scale = None
+        level_stats = []
+        # The moving image is full resolution
+        current_moving_grid2world = moving_ss.get_affine(0)
+        for level in range(self.levels - 1, -1, -1):
+            if not concurrent:
+                self.current_level = level
+            max_iter = self.level_iters[-1 - level]
+            if not concurrent and self.verbosity >= VerbosityLevels.STATUS:
+                print('Optimizing level %d [max iter: %d]' % (level, max_iter))
+            start = time()
 
-        static = ((static.astype(np.float64) - static.min()) /
-                  (static.max() - static.min()))
-        moving = ((moving.astype(np.float64) - moving.min()) /
-                  (moving.max() - moving.min()))
+            current_static, current_static_grid2world, samples = \
+                static_levels[level]
+            current_moving = moving_ss.get_image(level)
 
-        # Build the scale space of the input images
-        if self.use_isotropic:
-            self.moving_ss = IsotropicScaleSpace(moving, self.factors,
-                                                 self.sigmas,
-                                                 moving_grid2world,
-                                                 moving_spacing, False)
-
-            self.static_ss = IsotropicScaleSpace(static, self.factors,
-                                                 self.sigmas,
-                                                 static_grid2world,
-                                                 static_spacing, False)
-        else:
-            self.moving_ss = ScaleSpace(moving, self.levels, moving_grid2world,
-                                        moving_spacing, self.ss_sigma_factor,
-                                        False)
+            # Prepare the metric for iterations at this resolution
+            if adaptive:
+                samples, grad_norm = self._adapt_samples(
+                    metric, transform, current_static,
+                    current_static_grid2world, current_moving,
+                    current_moving_grid2world, starting_affine, params0,
+                    samples, noise_scale, rng=rng)
+                if noise_scale is None:
+                    noise_scale = grad_norm
+            elif samples is None:
+                metric.setup(transform, current_static, current_moving,
+                             current_static_grid2world,
+                             current_moving_grid2world, starting_affine)
+            else:
+                metric.setup(transform, current_static, current_moving,
+                             current_static_grid2world,
+                             current_moving_grid2world, starting_affine,
+                             static_samples=samples)
 
-            self.static_ss = ScaleSpace(static, self.levels, static_grid2world,
-                                        static_spacing, self.ss_sigma_factor,
-                                        False)
+            # Optimize this level
+            if self.options is None:
+                options = {'gtol': 1e-4,
+                           'disp': False}
+            else:
+                options = dict(self.options)
+
+            if self.method == 'L-BFGS-B':
+                options['maxfun'] = max_iter
+            else:
+                options['maxiter'] = max_iter
+
+            stopped = False
+            if SCIPY_LESS_0_12:
+                # Older versions don't expect value and gradient from
+                # the same function
+                opt = Optimizer(metric.distance, params0,
+                                method=self.method, jac=metric.gradient,
+                                options=options)
+                params, fopt, nit = opt.xopt, opt.fopt, None
+            else:
+                monitor = _LevelMonitor(metric.distance_and_gradient,
+                                        self.level_tol)
+                try:
+                    opt = Optimizer(monitor, params0,
+                                    method=self.method, jac=True,
+                                    callback=monitor.callback,
+                                    options=options)
+                    params, fopt = opt.xopt, opt.fopt
+                except _LevelConverged:
+                    params, fopt = monitor.xk, monitor.values[-1]
+                    stopped = True
+                nit = len(monitor.values)
+
+            # Update starting_affine matrix with optimal parameters
+            T = transform.param_to_matrix(params)
+            starting_affine = T.dot(starting_affine)
+
+            # Start next iteration at identity
+            params0 = transform.get_identity_parameters()
+
+            if samples is None:
+                nsamples = current_static.size
+            else:
+                nsamples = len(samples[0])
+            level_stats.append({'level': level,
+                                'time': time() - start,
+                                'iterations': nit,
+                                'samples': nsamples,
+                                'distance': fopt,
+                                'stopped': stopped})
+            if not concurrent and self.verbosity >= VerbosityLevels.DIAGNOSE:
+                print('Level %d: %d samples, %s iterations, %.3f s' %
+                      (level, nsamples, nit, level_stats[-1]['time']))
+        return starting_affine, fopt, level_stats
+
+    def _adapt_samples(self, metric, transform, static, static_grid2world,
+                       moving, moving_grid2world, starting_affine, params0,
+                       samples, noise_scale=None, nsubsets=4, rng=None):
+        r"""Sampling points making the metric's gradient precise enough
+
+        Starting from `samples` (or from new points drawn with the metric's
+        `sampling_proportion` if None), the proportion of sampled voxels is
+        doubled until the standard error of the gradient at `params0`,
+        estimated from `nsubsets` disjoint random subsets of the samples,
+        does not exceed `self.gradient_noise_tol` times the norm of the
+        gradient, or times `noise_scale` if larger. Since the gradient
+        vanishes as the registration converges, `noise_scale` is the norm of
+        the gradient at the coarsest level for the finer ones.
+
+        The subsets are drawn with `rng`, a `np.random.RandomState`, or with
+        the global NumPy generator if None. The metric is left set up with the
+        returned samples. Returns the samples and the norm of the gradient.
+        """
+        if rng is None:
+            rng = np.random
+        proportion = metric.sampling_proportion
+        if samples is None:
+            samples = metric.sample_static(static, static_grid2world)
+        metric.setup(transform, static, moving, static_grid2world,
+                     moving_grid2world, starting_affine,
+                     static_samples=samples)
+        while True:
+            points, static_vals = samples
+            subsets = np.array_split(rng.permutation(len(points)), nsubsets)
+            grads = []
+            for subset in subsets:
+                metric.set_static_samples((points[subset],
+                                           static_vals[subset]))
+                grads.append(metric.gradient(params0))
+            metric.set_static_samples(samples)
+            grads = np.array(grads)
+            mean_norm = npl.norm(grads.mean(axis=0))
+            noise = npl.norm(grads.std(axis=0)) / np.sqrt(nsubsets)
+            scale = mean_norm
+            if noise_scale is not None:
+                scale = max(scale, noise_scale)
+            if noise <= self.gradient_noise_tol * scale or proportion >= 1:
+                return samples, mean_norm
+            proportion = min(1.0, 2 * proportion)
+            samples = metric.sample_static(static, static_grid2world,
+                                           proportion)
 
     def optimize(self, static, moving, transform, params0,
                  static_grid2world=None, moving_grid2world=None,
@@ -924,83 +1263,168 @@ class AffineRegistration(object):
         -------
         affine_map : instance of AffineMap
             the affine resulting affine transformation
+
+        Notes
+        -----
+        After the optimization, the `level_stats` attribute holds, for each
+        level from the coarsest to the finest, a dictionary with the level
+        ('level'), its optimization time in seconds ('time'), the number of
+        iterations ('iterations', None if unknown), the number of points
+        used by the metric ('samples'), the final value of the metric
+        ('distance') and whether the optimization was stopped by `level_tol`
+        ('stopped').
         '''
         self._init_optimizer(static, moving, transform, params0,
                              static_grid2world, moving_grid2world,
                              starting_affine)
         del starting_affine  # Now we must refer to self.starting_affine
 
-        # Multi-resolution iterations
-        original_static_shape = self.static_ss.get_image(0).shape
-        original_static_grid2world = self.static_ss.get_affine(0)
-        original_moving_shape = self.moving_ss.get_image(0).shape
-        original_moving_grid2world = self.moving_ss.get_affine(0)
-        affine_map = AffineMap(None,
-                               original_static_shape,
-                               original_static_grid2world,
-                               original_moving_shape,
-                               original_moving_grid2world)
-
-        for level in range(self.levels - 1, -1, -1):
-            self.current_level = level
-            max_iter = self.level_iters[-1 - level]
-            if self.verbosity >= VerbosityLevels.STATUS:
-                print('Optimizing level %d [max iter: %d]' % (level, max_iter))
-
-            # Resample the smooth static image to the shape of this level
-            smooth_static = self.static_ss.get_image(level)
-            current_static_shape = self.static_ss.get_domain_shape(level)
-            current_static_grid2world = self.static_ss.get_affine(level)
-
-            current_affine_map = AffineMap(None,
-                                           current_static_shape,
-                                           current_static_grid2world,
-                                           original_static_shape,
-                                           original_static_grid2world)
-            current_static = current_affine_map.transform(smooth_static)
-
-            # The moving image is full resolution
-            current_moving_grid2world = original_moving_grid2world
+        static_levels = self._get_static_levels(self.static_ss)
+        self.starting_affine, fopt, self.level_stats = \
+            self._optimize_levels(self.metric, self.transform, static_levels,
+                                  self.moving_ss, self.params0,
+                                  self.starting_affine)
+        self.params0 = self.transform.get_identity_parameters()
+
+        affine_map = AffineMap(self.starting_affine,
+                               self.static_ss.get_image(0).shape,
+                               self.static_ss.get_affine(0),
+                               self.moving_ss.get_image(0).shape,
+                               self.moving_ss.get_affine(0))
+        return affine_map
 
-            current_moving = self.moving_ss.get_image(level)
+    def optimize_batch(self, static, movings, transform, params0=None,
+                       static_grid2world=None, moving_grid2worlds=None,
+                       starting_affines=None, num_threads=None):
+        r''' Registers several moving images towards the same static image
 
-            # Prepare the metric for iterations at this resolution
-            self.metric.setup(transform, current_static, current_moving,
-                              current_static_grid2world,
-                              current_moving_grid2world, self.starting_affine)
+        The scale space of the static image, its resampling at each level and,
+        with sparse sampling, the sampling points are computed once and shared
+        by all the registrations, which are run concurrently. The same moving
+        image may be given several times with different `starting_affines`
+        (or `params0`) to perform a multi-start registration, the best start
+        being the one with the lowest value in `distances`.
 
-            # Optimize this level
-            if self.options is None:
-                self.options = {'gtol': 1e-4,
-                                'disp': False}
-
-            if self.method == 'L-BFGS-B':
-                self.options['maxfun'] = max_iter
-            else:
-                self.options['maxiter'] = max_iter
+        Parameters
+        ----------
+        static : array, shape (S, R, C) or (R, C)
+            the image to be used as reference during optimization.
+        movings : sequence of arrays, shapes (S', R', C') or (R', C')
+            the images to be registered towards `static`. Their shapes do
+            not need to be the same.
+        transform : instance of Transform
+            the transformation with respect to whose parameters the gradient
+            must be computed
+        params0 : array, shape (n,), or sequence of them, optional
+            parameters from which to start the optimization, either shared
+            by all the moving images or one per moving image. The default is
+            None, implying the optimization starts at the identity transform.
+        static_grid2world : array, shape (dim+1, dim+1), optional
+            the voxel-to-space transformation associated with the static
+            image. The default is None, implying the transform is the
+            identity.
+        moving_grid2worlds : array, shape (dim+1, dim+1), or sequence of them,
+            optional
+            the voxel-to-space transformation associated with the moving
+            images, either shared by all of them or one per moving image. The
+            default is None, implying the transforms are the identity.
+        starting_affines : string, or matrix, or None, or sequence of them,
+            optional
+            the pre-alignment of the moving images (see `optimize`), either
+            shared by all of them or one per moving image. The default is
+            None, implying all the registrations start from the identity.
+        num_threads : int, optional
+            Number of registrations run concurrently, each in its own thread.
+            If None (default) then all available threads will be used.
 
-            if SCIPY_LESS_0_12:
-                # Older versions don't expect value and gradient from
-                # the same function
-                opt = Optimizer(self.metric.distance, self.params0,
-                                method=self.method, jac=self.metric.gradient,
-                                options=self.options)
-            else:
-                opt = Optimizer(self.metric.distance_and_gradient,
-                                self.params0,
-                                method=self.method, jac=True,
-                                options=self.options)
-            params = opt.xopt
+        Returns
+        -------
+        affine_maps : list of AffineMap
+            the resulting affine transformation of each moving image. The
+            corresponding values of the metric at the finest level are
+            stored in the `distances` attribute (an array), and their
+            statistics per level (see `optimize`) in the `level_stats`
+            attribute (a list).
 
-            # Update starting_affine matrix with optimal parameters
-            T = self.transform.param_to_matrix(params)
-            self.starting_affine = T.dot(self.starting_affine)
+        Notes
+        -----
+        Each registration uses its own copy of the metric, so the metric
+        must support `copy.deepcopy`. When running several registrations
+        concurrently, the number of threads used by the metric itself
+        (e.g. `MutualInformationMetric(num_threads=1)`) should be reduced to
+        avoid oversubscribing the cores.
+        '''
+        nmovings = len(movings)
+        dim = len(static.shape)
+
+        def _per_moving(arg, is_single):
+            if arg is None or is_single(arg):
+                return [arg] * nmovings
+            arg = list(arg)
+            if len(arg) != nmovings:
+                raise ValueError('Expected one value per moving image')
+            return arg
+
+        def _is_matrix(arg):
+            return isinstance(arg, np.ndarray) and arg.ndim == 2
+
+        params0 = _per_moving(params0, lambda p: np.ndim(p) == 1)
+        moving_grid2worlds = _per_moving(moving_grid2worlds, _is_matrix)
+        starting_affines = _per_moving(
+            starting_affines, lambda a: isinstance(a, str) or _is_matrix(a))
+
+        self.dim = dim
+        self.transform = transform
+        self.nparams = transform.get_number_of_parameters()
+        self.static_ss = self._build_scale_space(static, static_grid2world)
+        static_levels = self._get_static_levels(self.static_ss)
+        original_static_shape = self.static_ss.get_image(0).shape
+        original_static_grid2world = self.static_ss.get_affine(0)
 
-            # Start next iteration at identity
-            self.params0 = self.transform.get_identity_parameters()
+        # Each registration draws its random numbers from its own generator,
+        # seeded here so that the results do not depend on the scheduling of
+        # the threads but only on the state of the global NumPy generator
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=nmovings)
+
+        def _register(i):
+            moving = movings[i]
+            moving_grid2world = moving_grid2worlds[i]
+            starting_affine = self._get_starting_affine(static,
+                                                        static_grid2world,
+                                                        moving,
+                                                        moving_grid2world,
+                                                        starting_affines[i])
+            moving_ss = self._build_scale_space(moving, moving_grid2world)
+            affine, fopt, level_stats = self._optimize_levels(
+                copy.deepcopy(self.metric), transform, static_levels,
+                moving_ss, params0[i], starting_affine, concurrent=True,
+                rng=np.random.RandomState(seeds[i]))
+            affine_map = AffineMap(affine,
+                                   original_static_shape,
+                                   original_static_grid2world,
+                                   moving_ss.get_image(0).shape,
+                                   moving_ss.get_affine(0))
+            return affine_map, fopt, level_stats
+
+        if num_threads is None:
+            num_threads = cpu_count()
+        num_threads = max(1, min(num_threads, nmovings))
+        if self.verbosity >= VerbosityLevels.STATUS:
+            print('Registering %d images [threads: %d]' % (nmovings,
+                                                           num_threads))
+        if num_threads > 1:
+            pool = ThreadPool(num_threads)
+            try:
+                results = pool.map(_register, range(nmovings))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_register(i) for i in range(nmovings)]
 
-        affine_map.set_affine(self.starting_affine)
-        return affine_map
+        self.distances = np.array([fopt for _, fopt, _ in results])
+        self.level_stats = [level_stats for _, _, level_stats in results]
+        return [affine_map for affine_map, _, _ in results]
 
 
 def align_centers_of_mass(static, static_grid2world,
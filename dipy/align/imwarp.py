@@ -3,6 +3,8 @@
 from __future__ import print_function
 import abc
 from dipy.utils.six import with_metaclass
+from multiprocessing.pool import ThreadPool
+from time import time
 import numpy as np
 import numpy.linalg as npl
 import scipy as sp
@@ -195,8 +197,89 @@ class DiffeomorphicMap(object):
             self.prealign_inv = npl.inv(prealign)
 
         self.is_inverse = False
-        self.forward = None
-        self.backward = None
+        self._forward = None
+        self._backward = None
+        # Callables reading the fields not loaded yet (see
+        # load_diffeomorphic_map)
+        self._field_loaders = {}
+        # Parameters of the fixed-point inversion computing a missing field
+        self.inv_iter = 20
+        self.inv_tol = 1e-3
+
+    @property
+    def forward(self):
+        r"""Forward displacement field
+
+        If this map was lazily loaded, the field is read from disk on first
+        access. If it is not available (None) but the backward field is, it is
+        computed as the inverse of the backward field.
+        """
+        if self._forward is None:
+            self._forward = self._get_missing_field('forward', 'backward')
+        return self._forward
+
+    @forward.setter
+    def forward(self, field):
+        self._field_loaders.pop('forward', None)
+        self._forward = field
+
+    @property
+    def backward(self):
+        r"""Backward displacement field
+
+        If this map was lazily loaded, the field is read from disk on first
+        access. If it is not available (None) but the forward field is, it is
+        computed as the inverse of the forward field.
+        """
+        if self._backward is None:
+            self._backward = self._get_missing_field('backward', 'forward')
+        return self._backward
+
+    @backward.setter
+    def backward(self, field):
+        self._field_loaders.pop('backward', None)
+        self._backward = field
+
+    def _get_missing_field(self, name, other_name):
+        r"""Loads field `name`, or inverts field `other_name` if not stored
+        """
+        loader = self._field_loaders.pop(name, None)
+        if loader is not None:
+            return loader()
+        other = getattr(self, '_' + other_name)
+        if other is None:
+            loader = self._field_loaders.pop(other_name, None)
+            if loader is None:
+                return None
+            other = loader()
+            setattr(self, '_' + other_name, other)
+        return self._invert_field(other)
+
+    def _invert_field(self, field):
+        r"""Inverts a displacement field defined on this map's field grid
+        """
+        if self.dim == 2:
+            invert_f = vfu.invert_vector_field_fixed_point_2d
+        else:
+            invert_f = vfu.invert_vector_field_fixed_point_3d
+        world2grid = self.disp_world2grid
+        if world2grid is None:
+            world2grid = np.eye(self.dim + 1)
+        _, spacing = get_direction_and_spacings(self.disp_grid2world, self.dim)
+        return np.asarray(invert_f(field, world2grid, spacing, self.inv_iter,
+                                   self.inv_tol))
+
+    def _share_fields(self, other):
+        r"""References the fields (loaded or not) of this map in `other`
+
+        The fields not loaded yet are only read once, by whichever map first
+        needs them, and are then shared by both maps.
+        """
+        other._forward = self._forward
+        other._backward = self._backward
+        other._field_loaders = dict(self._field_loaders)
+        other.inv_iter = self.inv_iter
+        other.inv_tol = self.inv_tol
 
     def interpret_matrix(self, obj):
         ''' Try to interpret `obj` as a matrix
@@ -258,26 +341,37 @@ class DiffeomorphicMap(object):
         self.backward = np.zeros(tuple(self.disp_shape) + (self.dim,),
                                  dtype=floating)
 
-    def _get_warping_function(self, interpolation):
+    def _get_warping_function(self, interpolation, image_dim=None):
         r"""Appropriate warping function for the given interpolation type
 
         Returns the right warping function from vector_fields that must be
-        called for the specified data dimension and interpolation type
+        called for the specified data dimension and interpolation type. The
+        volumes of a 4D image (image_dim = dim + 1) are warped together.
         """
-        if self.dim == 2:
+        if image_dim is None:
+            image_dim = self.dim
+        if image_dim != self.dim and (self.dim, image_dim) != (3, 4):
+            raise ValueError('Undefined warping of a %dD image by a %dD map'
+                             % (image_dim, self.dim))
+        if image_dim == 2:
             if interpolation == 'linear':
                 return vfu.warp_2d
             else:
                 return vfu.warp_2d_nn
-        else:
+        elif image_dim == 3:
             if interpolation == 'linear':
                 return vfu.warp_3d
             else:
                 return vfu.warp_3d_nn
+        else:
+            if interpolation == 'linear':
+                return vfu.warp_4d
+            else:
+                return vfu.warp_4d_nn
 
     def _warp_forward(self, image, interpolation='linear',
                       image_world2grid=None, out_shape=None,
-                      out_grid2world=None):
+                      out_grid2world=None, num_threads=None):
         r"""Warps an image in the forward direction
 
         Deforms the input image under this diffeomorphic map in the forward
@@ -289,6 +383,7 @@ class DiffeomorphicMap(object):
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
+            or (s, r, c, n) for n volumes if dim = 3
             the image to be warped under this transformation in the forward
             direction
         interpolation : string, either 'linear' or 'nearest'
@@ -301,6 +396,9 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        num_threads : int, optional
+            Number of OpenMP threads used to warp the image. If None (default)
+            then all available threads will be used.
 
         Returns
         -------
@@ -380,15 +478,15 @@ class DiffeomorphicMap(object):
         else:
             image = np.asarray(image, dtype=floating)
 
-        warp_f = self._get_warping_function(interpolation)
+        warp_f = self._get_warping_function(interpolation, image.ndim)
 
         warped = warp_f(image, self.forward, affine_idx_in, affine_idx_out,
-                        affine_disp, out_shape)
+                        affine_disp, out_shape, num_threads=num_threads)
         return warped
 
     def _warp_backward(self, image, interpolation='linear',
                        image_world2grid=None, out_shape=None,
-                       out_grid2world=None):
+                       out_grid2world=None, num_threads=None):
         r"""Warps an image in the backward direction
 
         Deforms the input image under this diffeomorphic map in the backward
@@ -400,6 +498,7 @@ class DiffeomorphicMap(object):
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
+            or (s, r, c, n) for n volumes if dim = 3
             the image to be warped under this transformation in the backward
             direction
         interpolation : string, either 'linear' or 'nearest'
@@ -412,6 +511,9 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        num_threads : int, optional
+            Number of OpenMP threads used to warp the image. If None (default)
+            then all available threads will be used.
 
         Returns
         -------
@@ -491,15 +593,15 @@ class DiffeomorphicMap(object):
         else:
             image = np.asarray(image, dtype=floating)
 
-        warp_f = self._get_warping_function(interpolation)
+        warp_f = self._get_warping_function(interpolation, image.ndim)
 
         warped = warp_f(image, self.backward, affine_idx_in, affine_idx_out,
-                        affine_disp, out_shape)
+                        affine_disp, out_shape, num_threads=num_threads)
 
         return warped
 
     def transform(self, image, interpolation='linear', image_world2grid=None,
-                  out_shape=None, out_grid2world=None):
+                  out_shape=None, out_grid2world=None, num_threads=None):
         r"""Warps an image in the forward direction
 
         Transforms the input image under this transformation in the forward
@@ -510,6 +612,7 @@ class DiffeomorphicMap(object):
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
+            or (s, r, c, n) for n volumes if dim = 3
             the image to be warped under this transformation in the forward
             direction
         interpolation : string, either 'linear' or 'nearest'
@@ -522,6 +625,9 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        num_threads : int, optional
+            Number of OpenMP threads used to warp the image. If None (default)
+            then all available threads will be used.
 
         Returns
         -------
@@ -538,15 +644,15 @@ class DiffeomorphicMap(object):
         if self.is_inverse:
             warped = self._warp_backward(image, interpolation,
                                          image_world2grid, out_shape,
-                                         out_grid2world)
+                                         out_grid2world, num_threads)
         else:
             warped = self._warp_forward(image, interpolation, image_world2grid,
-                                        out_shape, out_grid2world)
+                                        out_shape, out_grid2world, num_threads)
         return np.asarray(warped)
 
     def transform_inverse(self, image, interpolation='linear',
                           image_world2grid=None, out_shape=None,
-                          out_grid2world=None):
+                          out_grid2world=None, num_threads=None):
         r"""Warps an image in the backward direction
 
         Transforms the input image under this transformation in the backward
@@ -557,6 +663,7 @@ class DiffeomorphicMap(object):
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
+            or (s, r, c, n) for n volumes if dim = 3
             the image to be warped under this transformation in the forward
             direction
         interpolation : string, either 'linear' or 'nearest'
@@ -569,6 +676,9 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        num_threads : int, optional
+            Number of OpenMP threads used to warp the image. If None (default)
+            then all available threads will be used.
 
         Returns
         -------
@@ -580,13 +690,15 @@ class DiffeomorphicMap(object):
         See _warp_forward and _warp_backward documentation for further
         information.
         """
+        if out_shape is not None:
+            out_shape = np.asarray(out_shape, dtype=np.int32)
         if self.is_inverse:
             warped = self._warp_forward(image, interpolation, image_world2grid,
-                                        out_shape, out_grid2world)
+                                        out_shape, out_grid2world, num_threads)
         else:
             warped = self._warp_backward(image, interpolation,
                                          image_world2grid, out_shape,
-                                         out_grid2world)
+                                         out_grid2world, num_threads)
         return np.asarray(warped)
 
     def inverse(self):
@@ -609,8 +721,7 @@ class DiffeomorphicMap(object):
                                self.codomain_shape,
                                self.codomain_grid2world,
                                self.prealign)
-        inv.forward = self.forward
-        inv.backward = self.backward
+        self._share_fields(inv)
         inv.is_inverse = True
         return inv
 
@@ -706,8 +817,7 @@ class DiffeomorphicMap(object):
                                    self.codomain_shape,
                                    self.codomain_grid2world,
                                    self.prealign)
-        new_map.forward = self.forward
-        new_map.backward = self.backward
+        self._share_fields(new_map)
         new_map.is_inverse = self.is_inverse
         return new_map
 
@@ -830,6 +940,121 @@ class DiffeomorphicMap(object):
         return simplified
 
 
+_MAP_FIELDS = ('forward', 'backward')
+_MAP_SHAPES = ('disp_shape', 'domain_shape', 'codomain_shape')
+_MAP_AFFINES = ('disp_grid2world', 'domain_grid2world', 'codomain_grid2world',
+                'prealign')
+
+
+def save_diffeomorphic_map(fname, mapping, dtype='float16',
+                           include_backward=True):
+    r"""Saves a DiffeomorphicMap to a compressed file
+
+    The displacement fields and the affine transforms of the map are written
+    to a zlib-compressed numpy archive (.npz), the fields being stored with
+    a reduced precision if requested.
+
+    Parameters
+    ----------
+    fname : string
+        name of the file to be written
+    mapping : DiffeomorphicMap object
+        the map to be saved
+    dtype : string, optional
+        storage type of the displacement fields: 'float32' (lossless),
+        'float16' (default, relative error below 5e-4) or 'int16' (the fields
+        are quantized to 65535 uniform levels spanning their range, the error
+        is below half a level)
+    include_backward : bool, optional
+        if False, only the forward field is stored and the backward field is
+        recomputed, as the inverse of the forward field, when the loaded map
+        first needs it. Default is True.
+    """
+    if dtype not in ('float32', 'float16', 'int16'):
+        raise ValueError("Invalid storage type '%s'" % (dtype,))
+    arrays = {'dim': mapping.dim, 'is_inverse': mapping.is_inverse}
+    for name in _MAP_SHAPES:
+        arrays[name] = getattr(mapping, name)
+    for name in _MAP_AFFINES:
+        affine = getattr(mapping, name)
+        if affine is not None:
+            arrays[name] = affine
+    fields = _MAP_FIELDS if include_backward else _MAP_FIELDS[:1]
+    for name in fields:
+        field = getattr(mapping, name)
+        if dtype == 'int16':
+            scale = np.abs(field).max() / 32767.0
+            if scale == 0:
+                scale = 1.0
+            arrays[name] = np.round(field / scale).astype(np.int16)
+            arrays[name + '_scale'] = scale
+        else:
+            arrays[name] = np.asarray(field).astype(dtype)
+    with open(fname, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def _read_field(fname, name):
+    r"""Reads and decodes a displacement field saved by save_diffeomorphic_map
+    """
+    with np.load(fname) as data:
+        field = data[name].astype(floating)
+        if name + '_scale' in data.files:
+            field *= floating(data[name + '_scale'])
+    return field
+
+
+class _FieldLoader(object):
+    r"""Reads a saved displacement field the first time it is called
+
+    The maps sharing their fields (see `DiffeomorphicMap.inverse`) share
+    their loaders, so the field is only read once and the maps then
+    reference the same array.
+    """
+    def __init__(self, fname, name):
+        self.fname = fname
+        self.name = name
+        self.field = None
+
+    def __call__(self):
+        if self.field is None:
+            self.field = _read_field(self.fname, self.name)
+        return self.field
+
+
+def load_diffeomorphic_map(fname, lazy=True):
+    r"""Loads a DiffeomorphicMap saved by save_diffeomorphic_map
+
+    Parameters
+    ----------
+    fname : string
+        name of the file to be read
+    lazy : bool, optional
+        if True (default), each displacement field is read from the file the
+        first time it is needed (the file must then still exist at that
+        point), so that a map used in a single direction only ever holds one
+        field in memory. If False, the fields are read immediately.
+
+    Returns
+    -------
+    mapping : DiffeomorphicMap object
+        the loaded map. If its backward field was not saved, it is computed
+        on demand as the inverse of the forward field.
+    """
+    with np.load(fname) as data:
+        kwargs = {name: data[name] for name in _MAP_SHAPES + _MAP_AFFINES
+                  if name in data.files}
+        mapping = DiffeomorphicMap(int(data['dim']), **kwargs)
+        mapping.is_inverse = bool(data['is_inverse'])
+        stored = [name for name in _MAP_FIELDS if name in data.files]
+    for name in stored:
+        if lazy:
+            mapping._field_loaders[name] = _FieldLoader(fname, name)
+        else:
+            setattr(mapping, name, _read_field(fname, name))
+    return mapping
+
+
 class DiffeomorphicRegistration(with_metaclass(abc.ABCMeta, object)):
     def __init__(self, metric=None):
         r""" Diffeomorphic Registration
@@ -890,7 +1115,8 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                  opt_tol=1e-5,
                  inv_iter=20,
                  inv_tol=1e-3,
-                 callback=None):
+                 callback=None,
+                 low_memory=False):
         r""" Symmetric Diffeomorphic Registration (SyN) Algorithm
 
         Performs the multi-resolution optimization algorithm for non-linear
@@ -923,7 +1149,27 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         callback : function(SymmetricDiffeomorphicRegistration)
             a function receiving a SymmetricDiffeomorphicRegistration object
             to be called after each iteration (this optimizer will call this
-            function passing self as parameter)
+            function passing self as parameter). At the end of each iteration
+            (`RegistrationStages.ITER_END`), its record is available as
+            `iteration_log[-1]`: a dictionary with the pyramid level
+            ('level'), the iteration number within the level ('iteration'),
+            the total time ('time') and the time spent warping the images
+            ('warp_time'), initializing the metric ('metric_time'),
+            computing the forward and backward steps ('forward_time',
+            'backward_time', and 'steps_time' for both of them since they
+            may run concurrently) and inverting the fields
+            ('inversion_time'), in seconds, the energies of both steps
+            ('forward_energy', 'backward_energy'), the derivative of the
+            energy profile ('energy_derivative'), the largest inversion
+            error of the four field inversions ('inversion_error') and their
+            numbers of iterations ('inversion_iterations').
+        low_memory : boolean, optional
+            if True, the smoothed images of each pyramid level are released
+            once the level is done, the norms of the update steps are computed
+            in single precision without temporary vector fields, and the
+            partial transformation of the moving image is released once
+            composed into the final transformation (`moving_to_ref` is None
+            after the optimization). The default is False.
         """
         super(SymmetricDiffeomorphicRegistration, self).__init__(metric)
         if level_iters is None:
@@ -941,13 +1187,16 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.energy_window = 12
         self.energy_list = []
         self.full_energy_profile = []
+        self.iteration_log = []
         self.verbosity = VerbosityLevels.STATUS
         self.callback = callback
+        self.low_memory = low_memory
         self.moving_ss = None
         self.static_ss = None
         self.static_direction = None
         self.moving_direction = None
         self.mask0 = metric.mask0
+        self._pool = None
 
     def update(self, current_displacement, new_displacement,
                disp_world2grid, time_scaling):
@@ -981,16 +1230,20 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             the warped displacement field
         mean_norm : the mean norm of all vectors in current_displacement
         """
-        sq_field = np.sum((np.array(current_displacement) ** 2), -1)
-        mean_norm = np.sqrt(sq_field).mean()
+        current_displacement = np.asarray(current_displacement)
+        sq_field = current_displacement[..., 0] ** 2
+        for i in range(1, current_displacement.shape[-1]):
+            sq_field += current_displacement[..., i] ** 2
+        mean_norm = np.sqrt(sq_field, out=sq_field).mean()
+        del sq_field
         # We assume that both displacement fields have the same
         # grid2world transform, which implies premult_index=Identity
         # and premult_disp is the world2grid transform associated with
-        # the displacements' grid
+        # the displacements' grid. The composition is done in place.
         self.compose(current_displacement, new_displacement, None,
                      disp_world2grid, time_scaling, current_displacement)
 
-        return np.array(current_displacement), np.array(mean_norm)
+        return current_displacement, np.array(mean_norm)
 
     def get_map(self):
         r"""Returns the resulting diffeomorphic map
@@ -1150,6 +1403,9 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             4.Update backward
             5.Compute inverses
             6.Invert the inverses
+        Steps 1 and 3 are run concurrently with steps 2 and 4 if the metric
+        allows it (see `SimilarityMetric.concurrent_steps`). A record of the
+        iteration is appended to `iteration_log`.
 
         Returns
         -------
@@ -1159,6 +1415,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             where T = self.energy_window. If the current iteration is less than
             T then np.inf is returned instead.
         """
+        start = time()
         # Acquire current resolution information from scale spaces
         current_moving = self.moving_ss.get_image(self.current_level)
         current_static = self.static_ss.get_image(self.current_level)
@@ -1199,59 +1456,44 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.metric.use_static_image_dynamics(
             current_static, self.static_to_ref.inverse())
 
+        warp_time = time() - start
+
         # Initialize the metric for a new iteration
+        tic = time()
         self.metric.initialize_iteration()
+        metric_time = time() - tic
         if self.callback is not None:
             self.callback(self, RegistrationStages.ITER_START)
 
-        # Compute the forward step (to be used to update the forward transform)
-        fw_step = np.array(self.metric.compute_forward())
-
-        # set zero displacements at the boundary
-        fw_step[0, ...] = 0
-        fw_step[:, 0, ...] = 0
-        fw_step[-1, ...] = 0
-        fw_step[:, -1, ...] = 0
-        if(self.dim == 3):
-            fw_step[:, :, 0, ...] = 0
-            fw_step[:, :, -1, ...] = 0
-
-        # Normalize the forward step
-        nrm = np.sqrt(np.sum((fw_step/current_disp_spacing)**2, -1)).max()
-        if nrm > 0:
-            fw_step /= nrm
-
-        # Add to current total field
-        self.static_to_ref.forward, md_forward = self.update(
-            self.static_to_ref.forward, fw_step,
-            current_disp_world2grid, self.step_length)
-        del fw_step
-
-        # Keep track of the forward energy
-        fw_energy = self.metric.get_energy()
-
-        # Compose backward step (to be used to update the backward transform)
-        bw_step = np.array(self.metric.compute_backward())
-
-        # set zero displacements at the boundary
-        bw_step[0, ...] = 0
-        bw_step[:, 0, ...] = 0
-        if(self.dim == 3):
-            bw_step[:, :, 0, ...] = 0
-
-        # Normalize the backward step
-        nrm = np.sqrt(np.sum((bw_step/current_disp_spacing) ** 2, -1)).max()
-        if nrm > 0:
-            bw_step /= nrm
-
-        # Add to current total field
-        self.moving_to_ref.forward, md_backward = self.update(
-            self.moving_to_ref.forward, bw_step,
-            current_disp_world2grid, self.step_length)
-        del bw_step
+        # Compute the forward step (to be used to update the forward
+        # transform) and the backward step (to be used to update the backward
+        # transform) and add them to the current total fields
+        tic = time()
+        if self._pool is not None:
+            forward = self._pool.apply_async(self._forward_half_step,
+                                             (current_disp_spacing,
+                                              current_disp_world2grid))
+            backward = self._pool.apply_async(self._backward_half_step,
+                                              (current_disp_spacing,
+                                               current_disp_world2grid))
+            fw_field, fw_time = forward.get()
+            bw_field, bw_time = backward.get()
+            # The backward step does not change the energy
+            fw_energy = bw_energy = self.metric.get_energy()
+        else:
+            fw_field, fw_time = self._forward_half_step(
+                current_disp_spacing, current_disp_world2grid)
+            # Keep track of the forward energy
+            fw_energy = self.metric.get_energy()
+            bw_field, bw_time = self._backward_half_step(
+                current_disp_spacing, current_disp_world2grid)
+            bw_energy = self.metric.get_energy()
+        self.static_to_ref.forward = fw_field
+        self.moving_to_ref.forward = bw_field
+        del fw_field, bw_field
+        steps_time = time() - tic
 
         # Keep track of the energy
-        bw_energy = self.metric.get_energy()
         der = np.inf
         n_iter = len(self.energy_list)
         if len(self.energy_list) >= self.energy_window:
@@ -1265,36 +1507,59 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.energy_list.append(fw_energy + bw_energy)
 
         # Invert the forward model's forward field
-        self.static_to_ref.backward = np.array(
+        tic = time()
+        inv_stats = np.zeros((4, 2))
+        self.static_to_ref.backward = np.asarray(
             self.invert_vector_field(
                 self.static_to_ref.forward,
                 current_disp_world2grid,
                 current_disp_spacing,
-                self.inv_iter, self.inv_tol, self.static_to_ref.backward))
+                self.inv_iter, self.inv_tol, self.static_to_ref.backward,
+                stats=inv_stats[0]))
 
         # Invert the backward model's forward field
-        self.moving_to_ref.backward = np.array(
+        self.moving_to_ref.backward = np.asarray(
             self.invert_vector_field(
                 self.moving_to_ref.forward,
                 current_disp_world2grid,
                 current_disp_spacing,
-                self.inv_iter, self.inv_tol, self.moving_to_ref.backward))
+                self.inv_iter, self.inv_tol, self.moving_to_ref.backward,
+                stats=inv_stats[1]))
 
         # Invert the forward model's backward field
-        self.static_to_ref.forward = np.array(
+        self.static_to_ref.forward = np.asarray(
             self.invert_vector_field(
                 self.static_to_ref.backward,
                 current_disp_world2grid,
                 current_disp_spacing,
-                self.inv_iter, self.inv_tol, self.static_to_ref.forward))
+                self.inv_iter, self.inv_tol, self.static_to_ref.forward,
+                stats=inv_stats[2]))
 
         # Invert the backward model's backward field
-        self.moving_to_ref.forward = np.array(
+        self.moving_to_ref.forward = np.asarray(
             self.invert_vector_field(
                 self.moving_to_ref.backward,
                 current_disp_world2grid,
                 current_disp_spacing,
-                self.inv_iter, self.inv_tol, self.moving_to_ref.forward))
+                self.inv_iter, self.inv_tol, self.moving_to_ref.forward,
+                stats=inv_stats[3]))
+        inversion_time = time() - tic
+
+        self.iteration_log.append({
+            'level': self.current_level,
+            'iteration': n_iter,
+            'time': time() - start,
+            'warp_time': warp_time,
+            'metric_time': metric_time,
+            'forward_time': fw_time,
+            'backward_time': bw_time,
+            'steps_time': steps_time,
+            'inversion_time': inversion_time,
+            'forward_energy': fw_energy,
+            'backward_energy': bw_energy,
+            'energy_derivative': der,
+            'inversion_error': inv_stats[:, 0].max(),
+            'inversion_iterations': inv_stats[:, 1].astype(int).tolist()})
 
         # Free resources no longer needed to compute the forward and backward
         # steps
@@ -1304,6 +1569,73 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
 
         return der
 
+    def _get_max_norm(self, step, spacing):
+        r"""Maximum norm of the vectors of `step` measured in voxels"""
+        if not self.low_memory:
+            return np.sqrt(np.sum((step/spacing) ** 2, -1)).max()
+        spacing = np.asarray(spacing, dtype=step.dtype)
+        sq_norms = (step[..., 0] / spacing[0]) ** 2
+        for i in range(1, step.shape[-1]):
+            sq_norms += (step[..., i] / spacing[i]) ** 2
+        return np.sqrt(sq_norms.max())
+
+    def _forward_half_step(self, current_disp_spacing,
+                           current_disp_world2grid):
+        r"""Computes the forward step and adds it to the forward field
+
+        Returns the updated forward field of `static_to_ref` and the time
+        spent, in seconds.
+        """
+        tic = time()
+        fw_step = np.array(self.metric.compute_forward())
+
+        # set zero displacements at the boundary
+        fw_step[0, ...] = 0
+        fw_step[:, 0, ...] = 0
+        fw_step[-1, ...] = 0
+        fw_step[:, -1, ...] = 0
+        if(self.dim == 3):
+            fw_step[:, :, 0, ...] = 0
+            fw_step[:, :, -1, ...] = 0
+
+        # Normalize the forward step
+        nrm = self._get_max_norm(fw_step, current_disp_spacing)
+        if nrm > 0:
+            fw_step /= nrm
+
+        # Add to current total field
+        field, md_forward = self.update(
+            self.static_to_ref.forward, fw_step,
+            current_disp_world2grid, self.step_length)
+        return field, time() - tic
+
+    def _backward_half_step(self, current_disp_spacing,
+                            current_disp_world2grid):
+        r"""Computes the backward step and adds it to the backward field
+
+        Returns the updated forward field of `moving_to_ref` and the time
+        spent, in seconds.
+        """
+        tic = time()
+        bw_step = np.array(self.metric.compute_backward())
+
+        # set zero displacements at the boundary
+        bw_step[0, ...] = 0
+        bw_step[:, 0, ...] = 0
+        if(self.dim == 3):
+            bw_step[:, :, 0, ...] = 0
+
+        # Normalize the backward step
+        nrm = self._get_max_norm(bw_step, current_disp_spacing)
+        if nrm > 0:
+            bw_step /= nrm
+
+        # Add to current total field
+        field, md_backward = self.update(
+            self.moving_to_ref.forward, bw_step,
+            current_disp_world2grid, self.step_length)
+        return field, time() - tic
+
     def _approximate_derivative_direct(self, x, y):
         r"""Derivative of the degree-2 polynomial fit of the given x, y pairs
 
@@ -1357,6 +1689,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         The main multi-scale symmetric optimization algorithm
         """
         self.full_energy_profile = []
+        self.iteration_log = []
         if self.callback is not None:
             self.callback(self, RegistrationStages.OPT_START)
         for level in range(self.levels - 1, -1, -1):
@@ -1389,30 +1722,35 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
 
             self.full_energy_profile.extend(self.energy_list)
 
+            if self.low_memory:
+                self.static_ss.free_level(level)
+                self.moving_ss.free_level(level)
+
             if self.callback is not None:
                 self.callback(self, RegistrationStages.SCALE_END)
 
         # Reporting mean and std in stats[1] and stats[2]
-        residual, stats = self.static_to_ref.compute_inversion_error()
-
         if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.static_to_ref.compute_inversion_error()
             print('Static-Reference Residual error: %0.6f (%0.6f)'
                   % (stats[1], stats[2]))
 
-        residual, stats = self.moving_to_ref.compute_inversion_error()
-
-        if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.moving_to_ref.compute_inversion_error()
             print('Moving-Reference Residual error :%0.6f (%0.6f)'
                   % (stats[1], stats[2]))
+            del residual
 
         # Compose the two partial transformations
         self.static_to_ref = self.moving_to_ref.warp_endomorphism(
             self.static_to_ref.inverse()).inverse()
+        if self.low_memory:
+            self.moving_to_ref = None
 
         # Report mean and std for the composed deformation field
-        residual, stats = self.static_to_ref.compute_inversion_error()
         if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.static_to_ref.compute_inversion_error()
             print('Final residual error: %0.6f (%0.6f)' % (stats[1], stats[2]))
+            del residual
         if self.callback is not None:
             self.callback(self, RegistrationStages.OPT_END)
 
@@ -1456,10 +1794,21 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         if self.verbosity >= VerbosityLevels.DEBUG:
             print("Pre-align:", prealign)
 
-        self._init_optimizer(static.astype(floating), moving.astype(floating),
-                             static_grid2world, moving_grid2world, prealign)
-        self._optimize()
-        self._end_optimizer()
-        self.static_to_ref.forward = np.array(self.static_to_ref.forward)
-        self.static_to_ref.backward = np.array(self.static_to_ref.backward)
+        # The threads running the half-steps concurrently are shared by all
+        # the iterations
+        if self.metric.concurrent_steps:
+            self._pool = ThreadPool(2)
+        try:
+            self._init_optimizer(static.astype(floating),
+                                 moving.astype(floating), static_grid2world,
+                                 moving_grid2world, prealign)
+            self._optimize()
+            self._end_optimizer()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+        self.static_to_ref.forward = np.asarray(self.static_to_ref.forward)
+        self.static_to_ref.backward = np.asarray(self.static_to_ref.backward)
         return self.static_to_ref
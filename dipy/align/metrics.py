@@ -44,6 +44,10 @@ class SimilarityMetric(with_metaclass(abc.ABCMeta, object)):
         self.moving_spacing = None
         self.moving_direction = None
         self.mask0 = False
+        # Whether compute_forward and compute_backward may run concurrently.
+        # This requires compute_backward not to modify the metric (the energy
+        # is then the one computed by compute_forward)
+        self.concurrent_steps = False
 
     def set_levels_below(self, levels):
         r"""Informs the metric how many pyramid levels are below the current one
@@ -213,6 +217,7 @@ class CCMetric(SimilarityMetric):
         super(CCMetric, self).__init__(dim)
         self.sigma_diff = sigma_diff
         self.radius = radius
+        self.concurrent_steps = True
         self._connect_functions()
 
     def _connect_functions(self):
@@ -7,8 +7,11 @@ import numpy as np
 cimport numpy as cnp
 cimport cython
 import numpy.random as random
+from cython.parallel import prange
 from .fused_types cimport floating
 from . import vector_fields as vf
+from dipy.utils.omp import thread_count
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 from dipy.align.vector_fields cimport(_apply_affine_3d_x0,
                                       _apply_affine_3d_x1,
@@ -24,7 +27,7 @@ cdef extern from "dpy_math.h" nogil:
     double log(double)
 
 class ParzenJointHistogram(object):
-    def __init__(self, nbins):
+    def __init__(self, nbins, num_threads=None):
         r""" Computes joint histogram and derivatives with Parzen windows
 
         Base class to compute joint and marginal probability density
@@ -45,6 +48,12 @@ class ParzenJointHistogram(object):
         nbins : int
             the number of bins of the joint and marginal probability density
             functions (the actual number of bins of the joint PDF is nbins**2)
+        num_threads : int, optional
+            the number of OpenMP threads used to compute the histograms and
+            their gradients. Each thread accumulates a partial histogram over
+            its share of the voxels (or samples), the partial histograms are
+            then added up. If None (default) then all available threads will
+            be used.
 
         References
         ----------
@@ -76,6 +85,7 @@ class ParzenJointHistogram(object):
         # support of the cubic spline is 5 bins (the center plus 2 bins at each
         # side) we need a padding of 2, in the case of cubic splines.
         self.padding = 2
+        self.num_threads = num_threads
         self.setup_called = False
 
     def setup(self, static, moving, smask=None, mmask=None):
@@ -210,12 +220,14 @@ class ParzenJointHistogram(object):
             _compute_pdfs_dense_2d(static, moving, smask, mmask, self.smin,
                                    self.sdelta, self.mmin, self.mdelta,
                                    self.nbins, self.padding, self.joint,
-                                   self.smarginal, self.mmarginal)
+                                   self.smarginal, self.mmarginal,
+                                   self.num_threads)
         elif dim == 3:
             _compute_pdfs_dense_3d(static, moving, smask, mmask, self.smin,
                                    self.sdelta, self.mmin, self.mdelta,
                                    self.nbins, self.padding, self.joint,
-                                   self.smarginal, self.mmarginal)
+                                   self.smarginal, self.mmarginal,
+                                   self.num_threads)
 
     def update_pdfs_sparse(self, sval, mval):
         r''' Computes the Probability Density Functions from a set of samples
@@ -244,7 +256,8 @@ class ParzenJointHistogram(object):
         energy = _compute_pdfs_sparse(sval, mval, self.smin, self.sdelta,
                                       self.mmin, self.mdelta, self.nbins,
                                       self.padding, self.joint,
-                                      self.smarginal, self.mmarginal)
+                                      self.smarginal, self.mmarginal,
+                                      self.num_threads)
 
     def update_gradient_dense(self, theta, transform, static, moving,
                               grid2world, mgradient, smask=None, mmask=None):
@@ -314,12 +327,14 @@ class ParzenJointHistogram(object):
                 _joint_pdf_gradient_dense_2d[cython.double](theta, transform,
                     static, moving, grid2world, mgradient, smask, mmask,
                     self.smin, self.sdelta, self.mmin, self.mdelta,
-                    self.nbins, self.padding, self.joint_grad)
+                    self.nbins, self.padding, self.joint_grad,
+                    self.num_threads)
             elif mgradient.dtype == np.float32:
                 _joint_pdf_gradient_dense_2d[cython.float](theta, transform,
                     static, moving, grid2world, mgradient, smask, mmask,
                     self.smin, self.sdelta, self.mmin, self.mdelta,
-                    self.nbins, self.padding, self.joint_grad)
+                    self.nbins, self.padding, self.joint_grad,
+                    self.num_threads)
             else:
                 raise ValueError('Grad. field dtype must be floating point')
 
@@ -328,12 +343,14 @@ class ParzenJointHistogram(object):
                 _joint_pdf_gradient_dense_3d[cython.double](theta, transform,
                     static, moving, grid2world, mgradient, smask, mmask,
                     self.smin, self.sdelta, self.mmin, self.mdelta,
-                    self.nbins, self.padding, self.joint_grad)
+                    self.nbins, self.padding, self.joint_grad,
+                    self.num_threads)
             elif mgradient.dtype == np.float32:
                 _joint_pdf_gradient_dense_3d[cython.float](theta, transform,
                     static, moving, grid2world, mgradient, smask, mmask,
                     self.smin, self.sdelta, self.mmin, self.mdelta,
-                    self.nbins, self.padding, self.joint_grad)
+                    self.nbins, self.padding, self.joint_grad,
+                    self.num_threads)
             else:
                 raise ValueError('Grad. field dtype must be floating point')
 
@@ -393,12 +410,12 @@ class ParzenJointHistogram(object):
                 _joint_pdf_gradient_sparse_2d[cython.double](theta, transform,
                     sval, mval, sample_points, mgradient, self.smin,
                     self.sdelta, self.mmin, self.mdelta, self.nbins,
-                    self.padding, self.joint_grad)
+                    self.padding, self.joint_grad, self.num_threads)
             elif mgradient.dtype == np.float32:
                 _joint_pdf_gradient_sparse_2d[cython.float](theta, transform,
                     sval, mval, sample_points, mgradient, self.smin,
                     self.sdelta, self.mmin, self.mdelta, self.nbins,
-                    self.padding, self.joint_grad)
+                    self.padding, self.joint_grad, self.num_threads)
             else:
                 raise ValueError('Gradients dtype must be floating point')
 
@@ -407,12 +424,12 @@ class ParzenJointHistogram(object):
                 _joint_pdf_gradient_sparse_3d[cython.double](theta, transform,
                     sval, mval, sample_points, mgradient, self.smin,
                     self.sdelta, self.mmin, self.mdelta, self.nbins,
-                    self.padding, self.joint_grad)
+                    self.padding, self.joint_grad, self.num_threads)
             elif mgradient.dtype == np.float32:
                 _joint_pdf_gradient_sparse_3d[cython.float](theta, transform,
                     sval, mval, sample_points, mgradient, self.smin,
                     self.sdelta, self.mmin, self.mdelta, self.nbins,
-                    self.padding, self.joint_grad)
+                    self.padding, self.joint_grad, self.num_threads)
             else:
                 raise ValueError('Gradients dtype must be floating point')
         else:
@@ -421,6 +438,16 @@ class ParzenJointHistogram(object):
             raise ValueError(msg)
 
 
+cdef cnp.npy_intp _nb_partials(cnp.npy_intp size):
+    r""" Number of partial histograms to accumulate in parallel
+
+    One partial histogram is used for each of the threads OpenMP is currently
+    set up to use, but no more than the number of items (slices, rows or
+    samples) to distribute among them.
+    """
+    return max(1, min(thread_count(), size))
+
+
 cdef inline double _bin_normalize(double x, double mval, double delta) nogil:
     r''' Normalizes intensity x to the range covered by the Parzen histogram
     We assume that mval was computed as:
@@ -576,7 +603,8 @@ cdef _compute_pdfs_dense_2d(double[:, :] static, double[:, :] moving,
                             double smin, double sdelta,
                             double mmin, double mdelta,
                             int nbins, int padding, double[:, :] joint,
-                            double[:] smarginal, double[:] mmarginal):
+                            double[:] smarginal, double[:] mmarginal,
+                            num_threads=None):
     r''' Joint Probability Density Function of intensities of two 2D images
 
     Parameters
@@ -612,39 +640,59 @@ cdef _compute_pdfs_dense_2d(double[:, :] static, double[:, :] moving,
         the array to write the marginal PDF associated with the static image
     mmarginal : array, shape (nbins,)
         the array to write the marginal PDF associated with the moving image
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp nrows = static.shape[0]
         cnp.npy_intp ncols = static.shape[1]
         cnp.npy_intp offset, valid_points
-        cnp.npy_intp i, j, r, c
+        cnp.npy_intp i, j, r, c, chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, sum
 
-    joint[...] = 0
-    sum = 0
-    valid_points = 0
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(nrows)
+    cdef:
+        double[:, :, :] partial_joint = np.zeros((nchunks, nbins, nbins))
+        double[:, :] partial_smarginal = np.zeros((nchunks, nbins))
+        double[:] partial_sum = np.zeros(nchunks)
+        cnp.npy_intp[:] partial_points = np.zeros(nchunks, dtype=np.intp)
+
     with nogil:
-        smarginal[:] = 0
-        for i in range(nrows):
-            for j in range(ncols):
-                if smask is not None and smask[i, j] == 0:
-                    continue
-                if mmask is not None and mmask[i, j] == 0:
-                    continue
-                valid_points += 1
-                rn = _bin_normalize(static[i, j], smin, sdelta)
-                r = _bin_index(rn, nbins, padding)
-                cn = _bin_normalize(moving[i, j], mmin, mdelta)
-                c = _bin_index(cn, nbins, padding)
-                spline_arg = (c - 2) - cn
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * nrows) // nchunks
+            last = ((chunk + 1) * nrows) // nchunks
+            for i in range(first, last):
+                for j in range(ncols):
+                    if smask is not None and smask[i, j] == 0:
+                        continue
+                    if mmask is not None and mmask[i, j] == 0:
+                        continue
+                    partial_points[chunk] += 1
+                    rn = _bin_normalize(static[i, j], smin, sdelta)
+                    r = _bin_index(rn, nbins, padding)
+                    cn = _bin_normalize(moving[i, j], mmin, mdelta)
+                    c = _bin_index(cn, nbins, padding)
+                    spline_arg = (c - 2) - cn
 
-                smarginal[r] += 1
-                for offset in range(-2, 3):
-                    val = _cubic_spline(spline_arg)
-                    joint[r, c + offset] += val
-                    sum += val
-                    spline_arg += 1.0
+                    partial_smarginal[chunk, r] += 1
+                    for offset in range(-2, 3):
+                        val = _cubic_spline(spline_arg)
+                        partial_joint[chunk, r, c + offset] += val
+                        partial_sum[chunk] += val
+                        spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_joint, axis=0, out=np.asarray(joint))
+    np.sum(partial_smarginal, axis=0, out=np.asarray(smarginal))
+    sum = np.sum(partial_sum)
+    valid_points = np.sum(partial_points)
+    with nogil:
         if sum > 0:
             for i in range(nbins):
                 for j in range(nbins):
@@ -664,7 +712,8 @@ cdef _compute_pdfs_dense_3d(double[:, :, :] static, double[:, :, :] moving,
                             double smin, double sdelta,
                             double mmin, double mdelta,
                             int nbins, int padding, double[:, :] joint,
-                            double[:] smarginal, double[:] mmarginal):
+                            double[:] smarginal, double[:] mmarginal,
+                            num_threads=None):
     r''' Joint Probability Density Function of intensities of two 3D images
 
     Parameters
@@ -700,42 +749,61 @@ cdef _compute_pdfs_dense_3d(double[:, :, :] static, double[:, :, :] moving,
         the array to write the marginal PDF associated with the static image
     mmarginal : array, shape (nbins,)
         the array to write the marginal PDF associated with the moving image
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp nslices = static.shape[0]
         cnp.npy_intp nrows = static.shape[1]
         cnp.npy_intp ncols = static.shape[2]
         cnp.npy_intp offset, valid_points
-        cnp.npy_intp k, i, j, r, c
+        cnp.npy_intp k, i, j, r, c, chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, sum
 
-    joint[...] = 0
-    sum = 0
-    with nogil:
-        valid_points = 0
-        smarginal[:] = 0
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if smask is not None and smask[k, i, j] == 0:
-                        continue
-                    if mmask is not None and mmask[k, i, j] == 0:
-                        continue
-                    valid_points += 1
-                    rn = _bin_normalize(static[k, i, j], smin, sdelta)
-                    r = _bin_index(rn, nbins, padding)
-                    cn = _bin_normalize(moving[k, i, j], mmin, mdelta)
-                    c = _bin_index(cn, nbins, padding)
-                    spline_arg = (c - 2) - cn
-
-                    smarginal[r] += 1
-                    for offset in range(-2, 3):
-                        val = _cubic_spline(spline_arg)
-                        joint[r, c + offset] += val
-                        sum += val
-                        spline_arg += 1.0
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(nslices)
+    cdef:
+        double[:, :, :] partial_joint = np.zeros((nchunks, nbins, nbins))
+        double[:, :] partial_smarginal = np.zeros((nchunks, nbins))
+        double[:] partial_sum = np.zeros(nchunks)
+        cnp.npy_intp[:] partial_points = np.zeros(nchunks, dtype=np.intp)
 
+    with nogil:
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * nslices) // nchunks
+            last = ((chunk + 1) * nslices) // nchunks
+            for k in range(first, last):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if smask is not None and smask[k, i, j] == 0:
+                            continue
+                        if mmask is not None and mmask[k, i, j] == 0:
+                            continue
+                        partial_points[chunk] += 1
+                        rn = _bin_normalize(static[k, i, j], smin, sdelta)
+                        r = _bin_index(rn, nbins, padding)
+                        cn = _bin_normalize(moving[k, i, j], mmin, mdelta)
+                        c = _bin_index(cn, nbins, padding)
+                        spline_arg = (c - 2) - cn
+
+                        partial_smarginal[chunk, r] += 1
+                        for offset in range(-2, 3):
+                            val = _cubic_spline(spline_arg)
+                            partial_joint[chunk, r, c + offset] += val
+                            partial_sum[chunk] += val
+                            spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_joint, axis=0, out=np.asarray(joint))
+    np.sum(partial_smarginal, axis=0, out=np.asarray(smarginal))
+    sum = np.sum(partial_sum)
+    valid_points = np.sum(partial_points)
+    with nogil:
         if sum > 0:
             for i in range(nbins):
                 for j in range(nbins):
@@ -753,7 +821,8 @@ cdef _compute_pdfs_dense_3d(double[:, :, :] static, double[:, :, :] moving,
 cdef _compute_pdfs_sparse(double[:] sval, double[:] mval, double smin,
                           double sdelta, double mmin, double mdelta,
                           int nbins, int padding, double[:, :] joint,
-                          double[:] smarginal, double[:] mmarginal):
+                          double[:] smarginal, double[:] mmarginal,
+                          num_threads=None):
     r''' Probability Density Functions of paired intensities
 
     Parameters
@@ -783,35 +852,51 @@ cdef _compute_pdfs_sparse(double[:] sval, double[:] mval, double smin,
         the array to write the marginal PDF associated with the static image
     mmarginal : array, shape (nbins,)
         the array to write the marginal PDF associated with the moving image
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp n = sval.shape[0]
         cnp.npy_intp offset, valid_points
-        cnp.npy_intp i, r, c
+        cnp.npy_intp i, j, r, c, chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, sum
 
-    joint[...] = 0
-    sum = 0
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(n)
+    cdef:
+        double[:, :, :] partial_joint = np.zeros((nchunks, nbins, nbins))
+        double[:, :] partial_smarginal = np.zeros((nchunks, nbins))
+        double[:] partial_sum = np.zeros(nchunks)
 
     with nogil:
-        valid_points = 0
-        smarginal[:] = 0
-        for i in range(n):
-            valid_points += 1
-            rn = _bin_normalize(sval[i], smin, sdelta)
-            r = _bin_index(rn, nbins, padding)
-            cn = _bin_normalize(mval[i], mmin, mdelta)
-            c = _bin_index(cn, nbins, padding)
-            spline_arg = (c - 2) - cn
-
-            smarginal[r] += 1
-            for offset in range(-2, 3):
-                val = _cubic_spline(spline_arg)
-                joint[r, c + offset] += val
-                sum += val
-                spline_arg += 1.0
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * n) // nchunks
+            last = ((chunk + 1) * n) // nchunks
+            for i in range(first, last):
+                rn = _bin_normalize(sval[i], smin, sdelta)
+                r = _bin_index(rn, nbins, padding)
+                cn = _bin_normalize(mval[i], mmin, mdelta)
+                c = _bin_index(cn, nbins, padding)
+                spline_arg = (c - 2) - cn
 
+                partial_smarginal[chunk, r] += 1
+                for offset in range(-2, 3):
+                    val = _cubic_spline(spline_arg)
+                    partial_joint[chunk, r, c + offset] += val
+                    partial_sum[chunk] += val
+                    spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_joint, axis=0, out=np.asarray(joint))
+    np.sum(partial_smarginal, axis=0, out=np.asarray(smarginal))
+    sum = np.sum(partial_sum)
+    valid_points = n
+    with nogil:
         if sum > 0:
             for i in range(nbins):
                 for j in range(nbins):
@@ -832,7 +917,8 @@ cdef _joint_pdf_gradient_dense_2d(double[:] theta, Transform transform,
                                   floating[:, :, :] mgradient, int[:, :] smask,
                                   int[:, :] mmask, double smin, double sdelta,
                                   double mmin, double mdelta, int nbins,
-                                  int padding, double[:, :, :] grad_pdf):
+                                  int padding, double[:, :, :] grad_pdf,
+                                  num_threads=None):
     r''' Gradient of the joint PDF w.r.t. transform parameters theta
 
     Computes the vector of partial derivatives of the joint histogram w.r.t.
@@ -878,53 +964,74 @@ cdef _joint_pdf_gradient_dense_2d(double[:] theta, Transform transform,
         sides of the histogram is actually 2*padding)
     grad_pdf : array, shape (nbins, nbins, len(theta))
         the array to write the gradient to
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp nrows = static.shape[0]
         cnp.npy_intp ncols = static.shape[1]
         cnp.npy_intp n = theta.shape[0]
         cnp.npy_intp offset, valid_points
-        int constant_jacobian = 0
-        cnp.npy_intp k, i, j, r, c
+        int constant_jacobian
+        cnp.npy_intp k, i, j, r, c, chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, norm_factor
-        double[:, :] J = np.empty(shape=(2, n), dtype=np.float64)
-        double[:] prod = np.empty(shape=(n,), dtype=np.float64)
-        double[:] x = np.empty(shape=(2,), dtype=np.float64)
 
-    grad_pdf[...] = 0
-    with nogil:
-        valid_points = 0
-        for i in range(nrows):
-            for j in range(ncols):
-                if smask is not None and smask[i, j] == 0:
-                    continue
-                if mmask is not None and mmask[i, j] == 0:
-                    continue
-
-                valid_points += 1
-                x[0] = _apply_affine_2d_x0(i, j, 1, grid2world)
-                x[1] = _apply_affine_2d_x1(i, j, 1, grid2world)
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(nrows)
+    cdef:
+        double[:, :, :] J = np.empty(shape=(nchunks, 2, n), dtype=np.float64)
+        double[:, :] prod = np.empty(shape=(nchunks, n), dtype=np.float64)
+        double[:, :] x = np.empty(shape=(nchunks, 2), dtype=np.float64)
+        double[:, :, :, :] partial_grad = np.zeros((nchunks, nbins, nbins, n))
+        cnp.npy_intp[:] partial_points = np.zeros(nchunks, dtype=np.intp)
 
-                if constant_jacobian == 0:
-                    constant_jacobian = transform._jacobian(theta, x, J)
+    with nogil:
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * nrows) // nchunks
+            last = ((chunk + 1) * nrows) // nchunks
+            constant_jacobian = 0
+            for i in range(first, last):
+                for j in range(ncols):
+                    if smask is not None and smask[i, j] == 0:
+                        continue
+                    if mmask is not None and mmask[i, j] == 0:
+                        continue
 
-                for k in range(n):
-                    prod[k] = (J[0, k] * mgradient[i, j, 0] +
-                               J[1, k] * mgradient[i, j, 1])
+                    partial_points[chunk] += 1
+                    x[chunk, 0] = _apply_affine_2d_x0(i, j, 1, grid2world)
+                    x[chunk, 1] = _apply_affine_2d_x1(i, j, 1, grid2world)
 
-                rn = _bin_normalize(static[i, j], smin, sdelta)
-                r = _bin_index(rn, nbins, padding)
-                cn = _bin_normalize(moving[i, j], mmin, mdelta)
-                c = _bin_index(cn, nbins, padding)
-                spline_arg = (c - 2) - cn
+                    if constant_jacobian == 0:
+                        constant_jacobian = transform._jacobian(theta,
+                                                                x[chunk],
+                                                                J[chunk])
 
-                for offset in range(-2, 3):
-                    val = _cubic_spline_derivative(spline_arg)
                     for k in range(n):
-                        grad_pdf[r, c + offset, k] -= val * prod[k]
-                    spline_arg += 1.0
+                        prod[chunk, k] = (J[chunk, 0, k] * mgradient[i, j, 0] +
+                                          J[chunk, 1, k] * mgradient[i, j, 1])
 
+                    rn = _bin_normalize(static[i, j], smin, sdelta)
+                    r = _bin_index(rn, nbins, padding)
+                    cn = _bin_normalize(moving[i, j], mmin, mdelta)
+                    c = _bin_index(cn, nbins, padding)
+                    spline_arg = (c - 2) - cn
+
+                    for offset in range(-2, 3):
+                        val = _cubic_spline_derivative(spline_arg)
+                        for k in range(n):
+                            partial_grad[chunk, r, c + offset, k] -= (
+                                val * prod[chunk, k])
+                        spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_grad, axis=0, out=np.asarray(grad_pdf))
+    valid_points = np.sum(partial_points)
+    with nogil:
         norm_factor = valid_points * mdelta
         if norm_factor > 0:
             for i in range(nbins):
@@ -942,7 +1049,7 @@ cdef _joint_pdf_gradient_dense_3d(double[:] theta, Transform transform,
                                   int[:, :, :] mmask, double smin,
                                   double sdelta, double mmin, double mdelta,
                                   int nbins, int padding,
-                                  double[:, :, :] grad_pdf):
+                                  double[:, :, :] grad_pdf, num_threads=None):
     r''' Gradient of the joint PDF w.r.t. transform parameters theta
 
     Computes the vector of partial derivatives of the joint histogram w.r.t.
@@ -988,6 +1095,11 @@ cdef _joint_pdf_gradient_dense_3d(double[:] theta, Transform transform,
         sides of the histogram is actually 2*padding)
     grad_pdf : array, shape (nbins, nbins, len(theta))
         the array to write the gradient to
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp nslices = static.shape[0]
@@ -995,49 +1107,68 @@ cdef _joint_pdf_gradient_dense_3d(double[:] theta, Transform transform,
         cnp.npy_intp ncols = static.shape[2]
         cnp.npy_intp n = theta.shape[0]
         cnp.npy_intp offset, valid_points
-        int constant_jacobian = 0
-        cnp.npy_intp l, k, i, j, r, c
+        int constant_jacobian
+        cnp.npy_intp l, k, i, j, r, c, chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, norm_factor
-        double[:, :] J = np.empty(shape=(3, n), dtype=np.float64)
-        double[:] prod = np.empty(shape=(n,), dtype=np.float64)
-        double[:] x = np.empty(shape=(3,), dtype=np.float64)
-
-    grad_pdf[...] = 0
-    with nogil:
-        valid_points = 0
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if smask is not None and smask[k, i, j] == 0:
-                        continue
-                    if mmask is not None and mmask[k, i, j] == 0:
-                        continue
-                    valid_points += 1
-                    x[0] = _apply_affine_3d_x0(k, i, j, 1, grid2world)
-                    x[1] = _apply_affine_3d_x1(k, i, j, 1, grid2world)
-                    x[2] = _apply_affine_3d_x2(k, i, j, 1, grid2world)
-
-                    if constant_jacobian == 0:
-                        constant_jacobian = transform._jacobian(theta, x, J)
 
-                    for l in range(n):
-                        prod[l] = (J[0, l] * mgradient[k, i, j, 0] +
-                                   J[1, l] * mgradient[k, i, j, 1] +
-                                   J[2, l] * mgradient[k, i, j, 2])
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(nslices)
+    cdef:
+        double[:, :, :] J = np.empty(shape=(nchunks, 3, n), dtype=np.float64)
+        double[:, :] prod = np.empty(shape=(nchunks, n), dtype=np.float64)
+        double[:, :] x = np.empty(shape=(nchunks, 3), dtype=np.float64)
+        double[:, :, :, :] partial_grad = np.zeros((nchunks, nbins, nbins, n))
+        cnp.npy_intp[:] partial_points = np.zeros(nchunks, dtype=np.intp)
 
-                    rn = _bin_normalize(static[k, i, j], smin, sdelta)
-                    r = _bin_index(rn, nbins, padding)
-                    cn = _bin_normalize(moving[k, i, j], mmin, mdelta)
-                    c = _bin_index(cn, nbins, padding)
-                    spline_arg = (c - 2) - cn
+    with nogil:
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * nslices) // nchunks
+            last = ((chunk + 1) * nslices) // nchunks
+            constant_jacobian = 0
+            for k in range(first, last):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if smask is not None and smask[k, i, j] == 0:
+                            continue
+                        if mmask is not None and mmask[k, i, j] == 0:
+                            continue
+                        partial_points[chunk] += 1
+                        x[chunk, 0] = _apply_affine_3d_x0(k, i, j, 1,
+                                                          grid2world)
+                        x[chunk, 1] = _apply_affine_3d_x1(k, i, j, 1,
+                                                          grid2world)
+                        x[chunk, 2] = _apply_affine_3d_x2(k, i, j, 1,
+                                                          grid2world)
+
+                        if constant_jacobian == 0:
+                            constant_jacobian = transform._jacobian(
+                                theta, x[chunk], J[chunk])
 
-                    for offset in range(-2, 3):
-                        val = _cubic_spline_derivative(spline_arg)
                         for l in range(n):
-                            grad_pdf[r, c + offset, l] -= val * prod[l]
-                        spline_arg += 1.0
-
+                            prod[chunk, l] = (
+                                J[chunk, 0, l] * mgradient[k, i, j, 0] +
+                                J[chunk, 1, l] * mgradient[k, i, j, 1] +
+                                J[chunk, 2, l] * mgradient[k, i, j, 2])
+
+                        rn = _bin_normalize(static[k, i, j], smin, sdelta)
+                        r = _bin_index(rn, nbins, padding)
+                        cn = _bin_normalize(moving[k, i, j], mmin, mdelta)
+                        c = _bin_index(cn, nbins, padding)
+                        spline_arg = (c - 2) - cn
+
+                        for offset in range(-2, 3):
+                            val = _cubic_spline_derivative(spline_arg)
+                            for l in range(n):
+                                partial_grad[chunk, r, c + offset, l] -= (
+                                    val * prod[chunk, l])
+                            spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_grad, axis=0, out=np.asarray(grad_pdf))
+    valid_points = np.sum(partial_points)
+    with nogil:
         norm_factor = valid_points * mdelta
         if norm_factor > 0:
             for i in range(nbins):
@@ -1052,7 +1183,7 @@ cdef _joint_pdf_gradient_sparse_2d(double[:] theta, Transform transform,
                                    floating[:, :] mgradient, double smin,
                                    double sdelta, double mmin,
                                    double mdelta, int nbins, int padding,
-                                   double[:, :, :] grad_pdf):
+                                   double[:, :, :] grad_pdf, num_threads=None):
     r''' Gradient of the joint PDF w.r.t. transform parameters theta
 
     Computes the vector of partial derivatives of the joint histogram w.r.t.
@@ -1091,43 +1222,61 @@ cdef _joint_pdf_gradient_sparse_2d(double[:] theta, Transform transform,
         sides of the histogram is actually 2*padding)
     grad_pdf : array, shape (nbins, nbins, len(theta))
         the array to write the gradient to
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp n = theta.shape[0]
         cnp.npy_intp m = sval.shape[0]
         cnp.npy_intp offset
-        int constant_jacobian = 0
-        cnp.npy_intp i, j, r, c, valid_points
+        int constant_jacobian
+        cnp.npy_intp i, j, k, r, c, valid_points
+        cnp.npy_intp chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, norm_factor
-        double[:, :] J = np.empty(shape=(2, n), dtype=np.float64)
-        double[:] prod = np.empty(shape=(n,), dtype=np.float64)
 
-    grad_pdf[...] = 0
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(m)
+    cdef:
+        double[:, :, :] J = np.empty(shape=(nchunks, 2, n), dtype=np.float64)
+        double[:, :] prod = np.empty(shape=(nchunks, n), dtype=np.float64)
+        double[:, :, :, :] partial_grad = np.zeros((nchunks, nbins, nbins, n))
+
     with nogil:
-        valid_points = 0
-        for i in range(m):
-            valid_points += 1
-            if constant_jacobian == 0:
-                constant_jacobian = transform._jacobian(theta,
-                                                        sample_points[i], J)
-
-            for j in range(n):
-                prod[j] = (J[0, j] * mgradient[i, 0] +
-                           J[1, j] * mgradient[i, 1])
-
-            rn = _bin_normalize(sval[i], smin, sdelta)
-            r = _bin_index(rn, nbins, padding)
-            cn = _bin_normalize(mval[i], mmin, mdelta)
-            c = _bin_index(cn, nbins, padding)
-            spline_arg = (c - 2) - cn
-
-            for offset in range(-2, 3):
-                val = _cubic_spline_derivative(spline_arg)
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * m) // nchunks
+            last = ((chunk + 1) * m) // nchunks
+            constant_jacobian = 0
+            for i in range(first, last):
+                if constant_jacobian == 0:
+                    constant_jacobian = transform._jacobian(
+                        theta, sample_points[i], J[chunk])
+
                 for j in range(n):
-                    grad_pdf[r, c + offset, j] -= val * prod[j]
-                spline_arg += 1.0
+                    prod[chunk, j] = (J[chunk, 0, j] * mgradient[i, 0] +
+                                      J[chunk, 1, j] * mgradient[i, 1])
 
+                rn = _bin_normalize(sval[i], smin, sdelta)
+                r = _bin_index(rn, nbins, padding)
+                cn = _bin_normalize(mval[i], mmin, mdelta)
+                c = _bin_index(cn, nbins, padding)
+                spline_arg = (c - 2) - cn
+
+                for offset in range(-2, 3):
+                    val = _cubic_spline_derivative(spline_arg)
+                    for j in range(n):
+                        partial_grad[chunk, r, c + offset, j] -= (
+                            val * prod[chunk, j])
+                    spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_grad, axis=0, out=np.asarray(grad_pdf))
+    valid_points = m
+    with nogil:
         norm_factor = valid_points * mdelta
         if norm_factor > 0:
             for i in range(nbins):
@@ -1142,7 +1291,7 @@ cdef _joint_pdf_gradient_sparse_3d(double[:] theta, Transform transform,
                                    floating[:, :] mgradient, double smin,
                                    double sdelta, double mmin,
                                    double mdelta, int nbins, int padding,
-                                   double[:, :, :] grad_pdf):
+                                   double[:, :, :] grad_pdf, num_threads=None):
     r''' Gradient of the joint PDF w.r.t. transform parameters theta
 
     Computes the vector of partial derivatives of the joint histogram w.r.t.
@@ -1181,45 +1330,62 @@ cdef _joint_pdf_gradient_sparse_3d(double[:] theta, Transform transform,
         sides of the histogram is actually 2*padding)
     grad_pdf : array, shape (nbins, nbins, len(theta))
         the array to write the gradient to
+    num_threads : int, optional
+        the number of OpenMP threads. Each thread accumulates a partial
+        histogram over its share of the samples, the partial histograms are
+        then added up. If None (default) then all available threads will be
+        used.
     '''
     cdef:
         cnp.npy_intp n = theta.shape[0]
         cnp.npy_intp m = sval.shape[0]
-        cnp.npy_intp offset, valid_points
-        int constant_jacobian = 0
-        cnp.npy_intp i, j, r, c
+        cnp.npy_intp offset
+        int constant_jacobian
+        cnp.npy_intp i, j, k, r, c, valid_points
+        cnp.npy_intp chunk, first, last, nchunks
         double rn, cn
         double val, spline_arg, norm_factor
-        double[:, :] J = np.empty(shape=(3, n), dtype=np.float64)
-        double[:] prod = np.empty(shape=(n,), dtype=np.float64)
 
-    grad_pdf[...] = 0
+    set_num_threads(num_threads)
+    nchunks = _nb_partials(m)
+    cdef:
+        double[:, :, :] J = np.empty(shape=(nchunks, 3, n), dtype=np.float64)
+        double[:, :] prod = np.empty(shape=(nchunks, n), dtype=np.float64)
+        double[:, :, :, :] partial_grad = np.zeros((nchunks, nbins, nbins, n))
+
     with nogil:
-        valid_points = 0
-        for i in range(m):
-            valid_points += 1
-
-            if constant_jacobian == 0:
-                constant_jacobian = transform._jacobian(theta,
-                                                        sample_points[i], J)
-
-            for j in range(n):
-                prod[j] = (J[0, j] * mgradient[i, 0] +
-                           J[1, j] * mgradient[i, 1] +
-                           J[2, j] * mgradient[i, 2])
-
-            rn = _bin_normalize(sval[i], smin, sdelta)
-            r = _bin_index(rn, nbins, padding)
-            cn = _bin_normalize(mval[i], mmin, mdelta)
-            c = _bin_index(cn, nbins, padding)
-            spline_arg = (c - 2) - cn
-
-            for offset in range(-2, 3):
-                val = _cubic_spline_derivative(spline_arg)
+        for chunk in prange(nchunks, schedule='static', chunksize=1):
+            first = (chunk * m) // nchunks
+            last = ((chunk + 1) * m) // nchunks
+            constant_jacobian = 0
+            for i in range(first, last):
+                if constant_jacobian == 0:
+                    constant_jacobian = transform._jacobian(
+                        theta, sample_points[i], J[chunk])
+
                 for j in range(n):
-                    grad_pdf[r, c + offset, j] -= val * prod[j]
-                spline_arg += 1.0
+                    prod[chunk, j] = (J[chunk, 0, j] * mgradient[i, 0] +
+                                      J[chunk, 1, j] * mgradient[i, 1] +
+                                      J[chunk, 2, j] * mgradient[i, 2])
 
+                rn = _bin_normalize(sval[i], smin, sdelta)
+                r = _bin_index(rn, nbins, padding)
+                cn = _bin_normalize(mval[i], mmin, mdelta)
+                c = _bin_index(cn, nbins, padding)
+                spline_arg = (c - 2) - cn
+
+                for offset in range(-2, 3):
+                    val = _cubic_spline_derivative(spline_arg)
+                    for j in range(n):
+                        partial_grad[chunk, r, c + offset, j] -= (
+                            val * prod[chunk, j])
+                    spline_arg = spline_arg + 1.0
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    np.sum(partial_grad, axis=0, out=np.asarray(grad_pdf))
+    valid_points = m
+    with nogil:
         norm_factor = valid_points * mdelta
         if norm_factor > 0:
             for i in range(nbins):
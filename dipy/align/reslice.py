@@ -1,22 +1,51 @@
-from multiprocessing import Pool, cpu_count
+from distutils.version import LooseVersion
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
 import warnings
 
+import nibabel as nib
+from nibabel.spatialimages import HeaderDataError
 import numpy as np
+import scipy
 from scipy.ndimage import affine_transform
 
+# Before scipy 0.18, the offset given to affine_transform with a 1D matrix
+# was not applied in output coordinates, so volumes can not be split in slabs
+SCIPY_LESS_0_18 = (LooseVersion(scipy.version.short_version) <
+                   LooseVersion('0.18'))
 
-def _affine_transform(kwargs):
-    return affine_transform(**kwargs)
+
+def _nifti_memmap(fname, shape, dtype, affine):
+    """ Creates a NIfTI-1 file whose data can be written through the returned
+    memory map, one volume at a time. The affine is stored as nibabel does
+    when saving a `Nifti1Image` created without header. """
+    hdr = nib.Nifti1Header()
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_qform(affine, code='unknown')
+    hdr.set_sform(affine, code='aligned')
+    offset = 352  # header and empty extension flag
+    hdr.set_data_offset(offset)
+    dtype = hdr.get_data_dtype()
+    with open(fname, 'wb') as f:
+        hdr.write_to(f)
+        f.write(b'\x00' * (offset - f.tell()))
+        f.truncate(offset + int(np.prod(shape)) * dtype.itemsize)
+    return np.memmap(fname, dtype=dtype, mode='r+', offset=offset,
+                     shape=shape, order='F')
 
 
 def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
-            num_processes=1):
+            num_processes=1, out_fname=None):
     """Reslice data with new voxel resolution defined by ``new_zooms``
 
     Parameters
     ----------
     data : array, shape (I,J,K) or (I,J,K,N)
-        3d volume or 4d volume with datasets
+        3d volume or 4d volume with datasets. The volumes of a 4d volume are
+        read one at a time, so `data` may also be a memory map (as returned
+        by nibabel for uncompressed images).
     affine : array, shape (4,4)
         mapping from voxel coordinates to world coordinates
     zooms : tuple, shape (3,)
@@ -34,15 +63,21 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
         Value used for points outside the boundaries of the input if
         mode='constant'.
     num_processes : int
-        Split the calculation to a pool of children processes. This only
-        applies to 4D `data` arrays. If a positive integer then it defines
-        the size of the multiprocessing pool that will be used. If 0, then
-        the size of the pool will equal the number of cores available.
+        Split the calculation to a pool of threads sharing the input and
+        output arrays. If a positive integer then it defines the size of the
+        pool that will be used. If 0, then the size of the pool will equal
+        the number of cores available. With ``order`` 0 or 1, each volume is
+        split into slabs resliced concurrently, otherwise the volumes of a 4d
+        `data` array are resliced concurrently.
+    out_fname : string, optional
+        If given, the resliced data are written, volume by volume, to this
+        uncompressed NIfTI-1 file (.nii) instead of being allocated in memory.
 
     Returns
     -------
     data2 : array, shape (I,J,K) or (I,J,K,N)
-        datasets resampled into isotropic voxel size
+        datasets resampled into isotropic voxel size. If `out_fname` is given,
+        a memory map of the data of that file.
     affine2 : array, shape (4,4)
         new affine for the resampled image
 
@@ -67,42 +102,84 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
     >>> data2.shape == (77, 77, 40)
     True
     """
+    if out_fname is not None:
+        if out_fname.endswith('.gz'):
+            raise ValueError('Only uncompressed NIfTI files can be written '
+                             'volume by volume')
+        try:
+            nib.Nifti1Header().set_data_dtype(data.dtype)
+        except HeaderDataError:
+            raise ValueError('Data of type {0} can not be stored in a NIfTI '
+                             'file'.format(data.dtype))
     # We are suppressing warnings emitted by scipy >= 0.18,
     # described in https://github.com/nipy/dipy/issues/1107.
     # These warnings are not relevant to us, as long as our offset
-    # input to scipy's affine_transform is [0, 0, 0]
+    # input to scipy's affine_transform is [0, 0, 0] with older versions
     warnings.simplefilter("ignore")
     new_zooms = np.array(new_zooms, dtype='f8')
     zooms = np.array(zooms, dtype='f8')
     R = new_zooms / zooms
     new_shape = zooms / new_zooms * np.array(data.shape[:3])
     new_shape = tuple(np.round(new_shape).astype('i8'))
-    kwargs = {'matrix': R, 'output_shape': new_shape, 'order': order,
-              'mode': mode, 'cval': cval}
-    if data.ndim == 3:
-        data2 = affine_transform(input=data, **kwargs)
-    if data.ndim == 4:
-        data2 = np.zeros(new_shape+(data.shape[-1],), data.dtype)
-        if not num_processes:
-            num_processes = cpu_count()
-        if num_processes < 2:
-            for i in range(data.shape[-1]):
-                affine_transform(input=data[..., i], output=data2[..., i],
-                                 **kwargs)
-        else:
-            params = []
-            for i in range(data.shape[-1]):
-                _kwargs = {'input': data[..., i]}
-                _kwargs.update(kwargs)
-                params.append(_kwargs)
-            pool = Pool(num_processes)
-            for i, result in enumerate(pool.imap(_affine_transform, params)):
-                data2[..., i] = result
-            pool.close()
+    shape = tuple(data.shape)
+    nvols = shape[3] if len(shape) == 4 else 1
+    if not num_processes:
+        num_processes = cpu_count()
 
     Rx = np.eye(4)
     Rx[:3, :3] = np.diag(R)
     affine2 = np.dot(affine, Rx)
+
+    out_shape = new_shape + shape[3:]
+    if out_fname is None:
+        data2 = np.zeros(out_shape, data.dtype)
+    else:
+        data2 = _nifti_memmap(out_fname, out_shape, data.dtype, affine2)
+
+    def _volume(i):
+        return np.asarray(data[..., i] if len(shape) == 4 else data)
+
+    def _output(i):
+        return data2[..., i] if len(shape) == 4 else data2
+
+    def _reslice(volume, output, start=0, stop=new_shape[0]):
+        # Output slab [start, stop) along the first axis
+        offset = (R[0] * start, 0, 0)
+        affine_transform(volume, R, offset=offset,
+                         output_shape=(stop - start,) + new_shape[1:],
+                         output=output[start:stop], order=order, mode=mode,
+                         cval=cval)
+
+    pool = ThreadPool(num_processes) if num_processes > 1 else None
+    try:
+        if pool is None:
+            for i in range(nvols):
+                _reslice(_volume(i), _output(i))
+        elif order <= 1 and not SCIPY_LESS_0_18:
+            # Without spline prefiltering the slabs are independent
+            nslabs = min(num_processes, new_shape[0])
+            bounds = np.linspace(0, new_shape[0], nslabs + 1).astype(int)
+            for i in range(nvols):
+                volume, output = _volume(i), _output(i)
+                pool.map(lambda k: _reslice(volume, output, bounds[k],
+                                            bounds[k + 1]),
+                         range(nslabs))
+        else:
+            pool.map(lambda i: _reslice(_volume(i), _output(i)),
+                     range(nvols))
+    except BaseException:
+        if out_fname is not None:
+            # Do not leave a partially written file behind
+            data2 = None
+            os.remove(out_fname)
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if out_fname is not None:
+        data2.flush()
+
     # Turn warnings back on:
     warnings.filterwarnings('always')
     return data2, affine2
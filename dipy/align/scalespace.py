@@ -191,6 +191,20 @@ class ScaleSpace(object):
         """
         return self._get_attribute(self.images, level)
 
+    def free_level(self, level):
+        r"""Releases the smoothed image of a given level
+
+        The properties of the level (shape, spacing, affine...) remain
+        available, but `get_image` returns None for it afterwards.
+
+        Parameters
+        ----------
+        level : int, 0 <= from_level < L, (L = number of resolutions)
+            the scale space level whose smooth image is released
+        """
+        self._get_attribute(self.images, level)
+        self.images[level] = None
+
     def get_domain_shape(self, level):
         r"""Shape the sub-sampled image must have at a particular level
 
@@ -1,4 +1,8 @@
 import abc
+import copy
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from time import time
 import numpy as np
 from dipy.utils.six import with_metaclass
 from dipy.core.optimize import Optimizer
@@ -6,7 +10,8 @@ from dipy.align.bundlemin import (_bundle_minimum_distance,
                                   distance_matrix_mdf)
 from dipy.tracking.streamline import (transform_streamlines,
                                       unlist_streamlines,
-                                      center_streamlines)
+                                      center_streamlines,
+                                      set_number_of_points)
 from dipy.core.geometry import (compose_transformations,
                                 compose_matrix,
                                 decompose_matrix)
@@ -299,6 +304,120 @@ class StreamlineLinearRegistration(object):
 
         """
 
+        self._check_number_of_points(static, moving)
+        self._set_default_options()
+        return self._optimize(self.metric, static, moving, mat, self.x0,
+                              self.verbose)
+
+    def optimize_batch(self, statics, movings, mats=None, x0s=None,
+                       nb_points=None, num_threads=None):
+        """ Registers several pairs of sets of streamlines concurrently
+
+        Parameters
+        ----------
+        statics : sequence of streamlines
+            Reference or fixed sets of streamlines, one per pair. The same
+            set may be given for several pairs (e.g. an atlas bundle).
+        movings : sequence of streamlines
+            Moving sets of streamlines, one per pair.
+        mats : array or sequence of arrays, optional
+            Transformation (4, 4) matrix to start the registration of each
+            pair (see ``optimize``), either shared by all the pairs or one per
+            pair. Default value None means that the centers of the sets of
+            streamlines are aligned.
+        x0s : sequence, optional
+            Initial parametrizations (see ``x0`` in the constructor) from
+            which each pair is registered. With more than one of them, the
+            registration of a pair is restarted from each one and the map
+            with the lowest final value of the metric is kept. Default value
+            None means that only ``self.x0`` is used.
+        nb_points : int, optional
+            If given, all the streamlines are first resampled to this number
+            of points with ``set_number_of_points``, each distinct set being
+            resampled once even if it is used by several pairs.
+        num_threads : int, optional
+            Number of registrations run concurrently, each in its own thread.
+            If None (default) then all available threads will be used.
+
+        Returns
+        -------
+        maps : list of StreamlineRegistrationMap
+            The map of each pair. The time (in seconds) spent registering each
+            pair, summed over the starts, is stored in the ``times`` attribute
+            (an array).
+
+        Notes
+        -----
+        Each registration uses its own copy of the metric, so the metric
+        must support ``copy.deepcopy``. When running several registrations
+        concurrently, the number of threads of the metric itself (the
+        ``num_threads`` parameter of the constructor) should be reduced to
+        avoid oversubscribing the cores.
+        """
+        npairs = len(statics)
+        if len(movings) != npairs:
+            raise ValueError('Expected as many moving as static sets')
+        if mats is None or (hasattr(mats, 'ndim') and mats.ndim == 2):
+            mats = [mats] * npairs
+        elif len(mats) != npairs:
+            raise ValueError('Expected one matrix per pair')
+        if x0s is None:
+            x0s = [self.x0]
+        else:
+            x0s = [self._set_x0(x0) for x0 in x0s]
+
+        if nb_points is not None:
+            resampled = {}
+
+            def _resample(streamlines):
+                key = id(streamlines)
+                if key not in resampled:
+                    resampled[key] = set_number_of_points(streamlines,
+                                                          nb_points)
+                return resampled[key]
+
+            statics = [_resample(static) for static in statics]
+            movings = [_resample(moving) for moving in movings]
+            del resampled
+        for static, moving in zip(statics, movings):
+            self._check_number_of_points(static, moving)
+        self._set_default_options()
+
+        tasks = [(i, x0) for i in range(npairs) for x0 in x0s]
+
+        def _register(task):
+            i, x0 = task
+            start = time()
+            srm = self._optimize(copy.deepcopy(self.metric), statics[i],
+                                 movings[i], mats[i], x0, False)
+            return srm, time() - start
+
+        if num_threads is None:
+            num_threads = cpu_count()
+        num_threads = max(1, min(num_threads, len(tasks)))
+        if num_threads > 1:
+            pool = ThreadPool(num_threads)
+            try:
+                results = pool.map(_register, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_register(task) for task in tasks]
+
+        maps = []
+        self.times = np.zeros(npairs)
+        nstarts = len(x0s)
+        for i in range(npairs):
+            starts = results[i * nstarts:(i + 1) * nstarts]
+            maps.append(min([srm for srm, _ in starts],
+                            key=lambda srm: srm.fopt))
+            self.times[i] = sum([elapsed for _, elapsed in starts])
+        return maps
+
+    def _check_number_of_points(self, static, moving):
+        """ check that all the streamlines have the same number of points"""
+
         msg = 'need to have the same number of points. Use '
         msg += 'set_number_of_points from dipy.tracking.streamline'
 
@@ -311,6 +430,23 @@ class StreamlineLinearRegistration(object):
         if not np.all(np.array(list(map(len, moving))) == static[0].shape[0]):
             raise ValueError('Static and moving streamlines ' + msg)
 
+    def _set_default_options(self):
+        """ set the default options of the optimization method if needed"""
+
+        if self.options is not None:
+            return
+
+        if self.method == 'Powell':
+            self.options = {'xtol': 1e-6, 'ftol': 1e-6, 'maxiter': 1e6}
+
+        if self.method == 'L-BFGS-B':
+            self.options = {'maxcor': 10, 'ftol': 1e-7,
+                            'gtol': 1e-5, 'eps': 1e-8,
+                            'maxiter': 100}
+
+    def _optimize(self, metric, static, moving, mat, x0, verbose):
+        """ registers moving to static with the given metric from x0"""
+
         if mat is None:
             static_centered, static_shift = center_streamlines(static)
             moving_centered, moving_shift = center_streamlines(moving)
@@ -325,32 +461,24 @@ class StreamlineLinearRegistration(object):
             static_mat = np.eye(4)
             moving_mat = mat
 
-        self.metric.setup(static_centered, moving_centered)
+        metric.setup(static_centered, moving_centered)
 
-        distance = self.metric.distance
+        distance = metric.distance
 
         if self.method == 'Powell':
 
-            if self.options is None:
-                self.options = {'xtol': 1e-6, 'ftol': 1e-6, 'maxiter': 1e6}
-
-            opt = Optimizer(distance, self.x0.tolist(),
+            opt = Optimizer(distance, x0.tolist(),
                             method=self.method, options=self.options,
                             evolution=self.evolution)
 
         if self.method == 'L-BFGS-B':
 
-            if self.options is None:
-                self.options = {'maxcor': 10, 'ftol': 1e-7,
-                                'gtol': 1e-5, 'eps': 1e-8,
-                                'maxiter': 100}
-
-            opt = Optimizer(distance, self.x0.tolist(),
+            opt = Optimizer(distance, x0.tolist(),
                             method=self.method,
                             bounds=self.bounds, options=self.options,
                             evolution=self.evolution)
 
-        if self.verbose:
+        if verbose:
             opt.print_summary()
 
         opt_mat = compose_matrix44(opt.xopt)
@@ -35,6 +35,14 @@ def test_cc_factors_3d():
         expected = np.asarray(cc.precompute_cc_factors_3d_test(a, b, radius))
         assert_array_almost_equal(factors, expected, decimal=5)
 
+    # The slices are split among the threads
+    for num_threads in [1, 2, 3, 25]:
+        factors = np.asarray(cc.precompute_cc_factors_3d(a[:5], b[:5], 3,
+                                                         num_threads))
+        expected = np.asarray(cc.precompute_cc_factors_3d_test(a[:5], b[:5],
+                                                               3))
+        assert_array_almost_equal(factors, expected, decimal=5)
+
 
 def test_compute_cc_steps_2d():
     # Select arbitrary images' shape (same shape for both images)
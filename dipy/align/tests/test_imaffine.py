@@ -283,6 +283,122 @@ def test_affreg_defaults():
             assert(reduction > 0.9)
 
 
+def test_affreg_batch():
+    np.random.seed(1246592)
+    ttype = ('RIGID', 2)
+    factor = factors[ttype][0]
+    transform = regtransforms[ttype]
+    movings = []
+    for i in range(3):
+        static, moving, static_grid2world, moving_grid2world, smask, mmask, \
+            T = setup_random_transform(transform, factor, 1, 1.0)
+        movings.append(moving)
+    start_sad = [np.abs(static - moving).sum() for moving in movings]
+
+    # Dense sampling: same result as registering each image separately
+    metric = imaffine.MutualInformationMetric(32, num_threads=1)
+    affreg = imaffine.AffineRegistration(metric, [100, 50, 25],
+                                         verbosity=0)
+    expected = [affreg.optimize(static, moving, transform, None,
+                                static_grid2world, moving_grid2world).affine
+                for moving in movings]
+    for num_threads in [1, 2, None]:
+        affine_maps = affreg.optimize_batch(static, movings, transform,
+                                            None, static_grid2world,
+                                            moving_grid2world,
+                                            num_threads=num_threads)
+        assert_equal(len(affine_maps), 3)
+        assert_equal(affreg.distances.shape, (3,))
+        for affine_map, affine in zip(affine_maps, expected):
+            assert_array_almost_equal(affine_map.affine, affine)
+
+    # Sparse sampling shares the sampling points of the static image
+    metric = imaffine.MutualInformationMetric(32, factors[ttype][1])
+    affreg = imaffine.AffineRegistration(metric, [1000, 100, 50],
+                                         verbosity=0)
+    affine_maps = affreg.optimize_batch(static, movings, transform,
+                                        starting_affines='mass',
+                                        num_threads=2)
+    for moving, affine_map, sad in zip(movings, affine_maps, start_sad):
+        end_sad = np.abs(static - affine_map.transform(moving)).sum()
+        assert(1 - end_sad / sad > 0.9)
+
+    # Per-image arguments must match the number of moving images
+    assert_raises(ValueError, affreg.optimize_batch, static, movings,
+                  transform, starting_affines=['mass', 'centers'])
+
+
+def test_affreg_adaptive():
+    np.random.seed(8753212)
+    ttype = ('RIGID', 2)
+    transform = regtransforms[ttype]
+    static, moving, static_grid2world, moving_grid2world, smask, mmask, T = \
+        setup_random_transform(transform, factors[ttype][0], 1, 1.0)
+    start_sad = np.abs(static - moving).sum()
+
+    stats = {}
+    for level_tol, noise_tol in [(None, None), (1e-2, None), (None, 0.05)]:
+        metric = imaffine.MutualInformationMetric(32, 0.1)
+        affreg = imaffine.AffineRegistration(metric, [1000, 100, 50],
+                                             verbosity=0,
+                                             level_tol=level_tol,
+                                             gradient_noise_tol=noise_tol)
+        affine_map = affreg.optimize(static, moving, transform, None,
+                                     static_grid2world, moving_grid2world)
+        end_sad = np.abs(static - affine_map.transform(moving)).sum()
+        assert(1 - end_sad / start_sad > 0.9)
+
+        level_stats = affreg.level_stats
+        assert_array_equal([d['level'] for d in level_stats], [2, 1, 0])
+        for d in level_stats:
+            assert(d['time'] >= 0)
+            assert(d['samples'] > 0)
+            assert(d['iterations'] <= 1000)
+        if level_tol is None:
+            assert_equal([d['stopped'] for d in level_stats], [False] * 3)
+        stats[level_tol, noise_tol] = level_stats
+
+    # Levels stop early on a relative improvement criterion
+    fixed = stats[None, None]
+    stopped = stats[1e-2, None]
+    assert(any(d['stopped'] for d in stopped))
+    assert(sum(d['iterations'] for d in stopped) <
+           sum(d['iterations'] for d in fixed))
+
+    # The number of samples is only ever increased
+    adapted = stats[None, 0.05]
+    for d_fixed, d_adapted in zip(fixed, adapted):
+        assert(d_adapted['samples'] >= d_fixed['samples'])
+    assert(any(d_adapted['samples'] > d_fixed['samples']
+               for d_fixed, d_adapted in zip(fixed, adapted)))
+
+    # Once the coarsest level has aligned the images, the gradient vanishes
+    # but the finer levels are not sampled densely for all that
+    metric = imaffine.MutualInformationMetric(32, 0.1)
+    affreg = imaffine.AffineRegistration(metric, [1000, 100, 50],
+                                         verbosity=0, gradient_noise_tol=0.2)
+    affine_map = affreg.optimize(static, moving, transform, None,
+                                 static_grid2world, moving_grid2world)
+    end_sad = np.abs(static - affine_map.transform(moving)).sum()
+    assert(1 - end_sad / start_sad > 0.9)
+    assert(affreg.level_stats[-1]['samples'] < static.size)
+
+    # Batch registrations adapt their samples reproducibly, whatever the
+    # scheduling of their threads
+    results = []
+    for num_threads in [1, 3]:
+        np.random.seed(8753212)
+        affine_maps = affreg.optimize_batch(static, [moving] * 3, transform,
+                                            None, static_grid2world,
+                                            moving_grid2world,
+                                            num_threads=num_threads)
+        results.append(([affine_map.affine for affine_map in affine_maps],
+                        [[d['samples'] for d in level_stats]
+                         for level_stats in affreg.level_stats]))
+    assert_array_equal(results[0][0], results[1][0])
+    assert_equal(results[0][1], results[1][1])
+
+
 def test_mi_gradient():
     np.random.seed(2022966)
     # Test the gradient of mutual information
@@ -528,7 +644,11 @@ def test_affine_map():
             affine_map = imaffine.AffineMap(np.eye(dim),
                                             cod_shape[:dim], None,
                                             dom_shape[:dim], None)
-            for sh in [(2,), (2, 2, 2, 2)]:
+            invalid_shapes = [(2,), (2, 2, 2, 2, 2)]
+            if dim == 2:
+                # Only 3D transforms apply to the volumes of a 4D image
+                invalid_shapes.append((2, 2, 2, 2))
+            for sh in invalid_shapes:
                 img = np.zeros(sh)
                 assert_raises(ValueError, affine_map.transform, img)
                 assert_raises(ValueError, affine_map.transform_inverse, img)
@@ -546,6 +666,29 @@ def test_affine_map():
             assert_raises(AffineInversionError, affine_map.set_affine, aff_inf)
 
 
+def test_affine_map_4d():
+    np.random.seed(6438821)
+    dom_shape = np.array([20, 21, 22], dtype=np.int32)
+    cod_shape = np.array([24, 23, 19], dtype=np.int32)
+    volumes = np.random.rand(*(tuple(cod_shape) + (5,)))
+    labels = np.random.randint(0, 10, tuple(cod_shape) + (5,))
+    affine = create_affine_transforms(3, [0.1 * dom_shape], [np.pi / 10.0],
+                                      [1.1], np.array([.5, 2.0, 1.5]))[0]
+    affine_map = imaffine.AffineMap(affine, dom_shape, np.eye(4),
+                                    cod_shape, np.diag([1.1, 0.9, 1.0, 1.0]))
+
+    # Each volume is transformed like a 3D image
+    for interp, image in [('linear', volumes), ('nearest', labels)]:
+        actual = affine_map.transform(image, interp)
+        assert_equal(actual.shape, tuple(dom_shape) + (5,))
+        for v in range(image.shape[-1]):
+            assert_array_equal(actual[..., v],
+                               affine_map.transform(image[..., v], interp))
+        actual = affine_map.transform_inverse(actual, interp,
+                                              num_threads=2)
+        assert_equal(actual.shape, tuple(cod_shape) + (5,))
+
+
 def test_MIMetric_invalid_params():
     transform = regtransforms[('AFFINE', 3)]
     static = np.random.rand(20, 20, 20)
@@ -1,6 +1,8 @@
 from __future__ import print_function
+from os.path import join as pjoin
 import numpy as np
 import nibabel.eulerangles as eulerangles
+from nibabel.tmpdirs import TemporaryDirectory
 from numpy.testing import (assert_equal,
                            assert_array_equal,
                            assert_array_almost_equal,
@@ -308,6 +310,120 @@ def test_diffeomorphic_map_simplification_3d():
     assert_equal(simplified.disp_world2grid, None)
 
 
+def test_diffeomorphic_map_4d():
+    np.random.seed(8153427)
+    domain_shape = (16, 18, 17)
+    codomain_shape = (20, 15, 19)
+    d, dinv = vfu.create_harmonic_fields_3d(domain_shape[0], domain_shape[1],
+                                            domain_shape[2], 0.3, 4)
+    prealign = np.diag([1.1, 0.9, 1.0, 1.0])
+    diff_map = imwarp.DiffeomorphicMap(3, domain_shape, None,
+                                       domain_shape, None,
+                                       codomain_shape, None,
+                                       prealign)
+    diff_map.forward = np.array(d, dtype=floating)
+    diff_map.backward = np.array(dinv, dtype=floating)
+
+    volumes = np.random.rand(*(codomain_shape + (6,)))
+    labels = np.random.randint(0, 10, codomain_shape + (6,)).astype(np.int32)
+
+    # Each volume is warped like a 3D image
+    for interpolation, image in [('linear', volumes), ('nearest', labels)]:
+        warped = diff_map.transform(image, interpolation)
+        assert_equal(warped.shape, domain_shape + (6,))
+        for v in range(image.shape[-1]):
+            expected = diff_map.transform(image[..., v], interpolation)
+            assert_array_equal(warped[..., v], expected)
+        warped = diff_map.transform_inverse(warped, interpolation,
+                                            out_shape=codomain_shape,
+                                            num_threads=2)
+        assert_equal(warped.shape, codomain_shape + (6,))
+
+    # A 2D map can not warp a 3D image
+    map_2d = imwarp.DiffeomorphicMap(2, domain_shape[:2])
+    map_2d.allocate()
+    assert_raises(ValueError, map_2d.transform, volumes[..., 0])
+
+
+def test_diffeomorphic_map_save_load():
+    np.random.seed(2022966)
+    domain_shape = (16, 18, 17)
+    codomain_shape = (20, 15, 19)
+    d, dinv = vfu.create_harmonic_fields_3d(domain_shape[0], domain_shape[1],
+                                            domain_shape[2], 0.3, 4)
+    grid2world = np.diag([1.5, 1.5, 2.0, 1.0])
+    prealign = np.diag([1.1, 0.9, 1.0, 1.0])
+    diff_map = imwarp.DiffeomorphicMap(3, domain_shape, grid2world,
+                                       domain_shape, grid2world,
+                                       codomain_shape, None,
+                                       prealign)
+    diff_map.forward = np.array(d, dtype=floating)
+    diff_map.backward = np.array(dinv, dtype=floating)
+    image = np.random.rand(*codomain_shape)
+    expected = diff_map.transform(image)
+    max_disp = np.abs(diff_map.forward).max()
+
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'map.npz')
+        for dtype, decimal in [('float32', 6), ('float16', 3), ('int16', 4)]:
+            imwarp.save_diffeomorphic_map(fname, diff_map, dtype)
+            for lazy in [True, False]:
+                loaded = imwarp.load_diffeomorphic_map(fname, lazy)
+                assert_equal(loaded.dim, 3)
+                assert_array_equal(loaded.codomain_shape, codomain_shape)
+                assert_array_equal(loaded.disp_grid2world, grid2world)
+                assert_equal(loaded.codomain_grid2world, None)
+                assert_array_equal(loaded.prealign, prealign)
+                assert_equal(loaded.forward.dtype, floating)
+                assert_array_almost_equal(loaded.forward / max_disp,
+                                          diff_map.forward / max_disp,
+                                          decimal)
+                assert_array_almost_equal(loaded.backward / max_disp,
+                                          diff_map.backward / max_disp,
+                                          decimal)
+                assert_array_almost_equal(loaded.transform(image), expected,
+                                          decimal - 2)
+
+        # The inverse of a map is saved as such
+        imwarp.save_diffeomorphic_map(fname, diff_map.inverse(), 'float32')
+        loaded = imwarp.load_diffeomorphic_map(fname)
+        assert_equal(loaded.is_inverse, True)
+        assert_array_equal(loaded.get_forward_field(), diff_map.backward)
+
+        # Without the backward field, it is computed when needed
+        imwarp.save_diffeomorphic_map(fname, diff_map, 'float32',
+                                      include_backward=False)
+        loaded = imwarp.load_diffeomorphic_map(fname)
+        assert_array_almost_equal(loaded.transform(image), expected, 6)
+        assert_equal(loaded.transform_inverse(expected).shape,
+                     codomain_shape)
+        residual, stats = loaded.compute_inversion_error()
+        assert_equal(stats[1] < 1e-2, True)
+
+        # Lazily loaded fields are shared by shallow copies and inverses, and
+        # only read once
+        loaded = imwarp.load_diffeomorphic_map(fname)
+        inverse = loaded.inverse()
+        copy = loaded.shallow_copy()
+        assert_array_equal(inverse.get_backward_field(), diff_map.forward)
+        assert_array_equal(copy.forward, diff_map.forward)
+        assert_equal(loaded.forward is inverse.get_backward_field(), True)
+        assert_equal(copy.forward is loaded.forward, True)
+
+        assert_raises(ValueError, imwarp.save_diffeomorphic_map, fname,
+                      diff_map, 'int8')
+
+    # A discarded field is recomputed as the inverse of the other one
+    diff_map.backward = None
+    residual, stats = diff_map.compute_inversion_error()
+    assert_equal(stats[1] < 1e-2, True)
+
+    # Maps without fields stay empty
+    empty = imwarp.DiffeomorphicMap(3, domain_shape)
+    assert_equal(empty.forward, None)
+    assert_equal(empty.backward, None)
+
+
 def test_optimizer_exceptions():
     r""" Test exceptions from SyN
     """
@@ -774,6 +890,83 @@ def test_cc_3d():
     assert(reduced > 0.9)
 
 
+def test_syn_iteration_log():
+    fname = get_data('t1_coronal_slice')
+    image = np.load(fname)
+    moving, static = get_warped_stacked_image(image, 5, 0.1, 4)
+    stages = []
+
+    def callback(sdr, stage):
+        if stage == imwarp.RegistrationStages.ITER_END:
+            stages.append(sdr.iteration_log[-1])
+
+    mappings = []
+    for concurrent_steps in [False, True]:
+        del stages[:]
+        metric = metrics.CCMetric(3, 2.0, 2)
+        metric.concurrent_steps = concurrent_steps
+        optimizer = imwarp.SymmetricDiffeomorphicRegistration(
+            metric, [5, 3], opt_tol=-1, callback=callback)
+        optimizer.verbosity = VerbosityLevels.NONE
+        mappings.append(optimizer.optimize(static, moving))
+
+        log = optimizer.iteration_log
+        assert_equal(len(log), 8)
+        assert_equal(stages, log)
+        assert_equal([rec['level'] for rec in log], [1] * 5 + [0] * 3)
+        assert_equal([rec['iteration'] for rec in log],
+                     [0, 1, 2, 3, 4, 0, 1, 2])
+        for rec in log:
+            for key in ['warp_time', 'metric_time', 'steps_time',
+                        'inversion_time']:
+                assert(0 <= rec[key] <= rec['time'])
+            assert(rec['forward_time'] <= rec['steps_time'])
+            assert(rec['backward_time'] <= rec['steps_time'])
+            assert_equal(rec['forward_energy'], rec['backward_energy'])
+            assert(0 <= rec['inversion_error'])
+            assert_equal(len(rec['inversion_iterations']), 4)
+        energies = [rec['forward_energy'] + rec['backward_energy']
+                    for rec in log]
+        assert_array_equal(energies, optimizer.full_energy_profile)
+
+    # Running the half-steps concurrently does not change the result
+    assert_array_equal(mappings[0].forward, mappings[1].forward)
+    assert_array_equal(mappings[0].backward, mappings[1].backward)
+
+
+def test_syn_low_memory():
+    fname = get_data('t1_coronal_slice')
+    image = np.load(fname)
+    moving, static = get_warped_stacked_image(image, 5, 0.1, 4)
+    freed = []
+
+    def callback(sdr, stage):
+        if stage == imwarp.RegistrationStages.SCALE_END:
+            level = sdr.current_level
+            freed.append((sdr.static_ss.get_image(level),
+                          sdr.moving_ss.get_image(level)))
+
+    mappings = []
+    for low_memory in [False, True]:
+        del freed[:]
+        metric = metrics.CCMetric(3, 2.0, 2)
+        optimizer = imwarp.SymmetricDiffeomorphicRegistration(
+            metric, [5, 3], callback=callback, low_memory=low_memory)
+        optimizer.verbosity = VerbosityLevels.NONE
+        mappings.append(optimizer.optimize(static, moving))
+        assert_equal(optimizer.moving_to_ref is None, low_memory)
+        for static_image, moving_image in freed:
+            assert_equal(static_image is None, low_memory)
+            assert_equal(moving_image is None, low_memory)
+        assert_equal(mappings[-1].forward.dtype, floating)
+        assert_equal(mappings[-1].backward.dtype, floating)
+
+    assert_array_almost_equal(mappings[0].forward, mappings[1].forward, 3)
+    assert_array_almost_equal(mappings[0].backward, mappings[1].backward, 3)
+    assert_array_almost_equal(mappings[1].transform(moving),
+                              mappings[0].transform(moving), 3)
+
+
 def test_em_3d_gauss_newton():
     r''' Test 3D SyN with EM metric, Gauss-Newton optimizer
 
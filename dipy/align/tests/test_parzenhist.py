@@ -314,6 +314,50 @@ def setup_random_transform(transform, rfactor, nslices=45, sigma=1):
     return static, moving, static_g2w, moving_g2w, smask, mmask, M
 
 
+def test_parzen_num_threads():
+    # The partial histograms of the threads add up to the same densities and
+    # gradients, whatever the number of threads
+    for ttype in [('AFFINE', 2), ('AFFINE', 3)]:
+        dim = ttype[1]
+        nslices = 1 if dim == 2 else 15
+        transform = regtransforms[ttype]
+        static, moving, static_g2w, moving_g2w, smask, mmask, M = \
+            setup_random_transform(transform, factors[ttype], nslices, 5.0)
+        theta = transform.get_identity_parameters()
+        shape = np.array(static.shape, dtype=np.int32)
+        spacing = np.ones(dim, dtype=np.float64)
+        mgrad, inside = vf.gradient(moving.astype(np.float32), moving_g2w,
+                                    spacing, shape, static_g2w)
+        np.random.seed(4362782)
+        points = np.random.rand(500, dim) * (shape - 1)
+        sval = np.array(static.reshape(-1)[:500])
+        mval = np.array(moving.reshape(-1)[:500])
+        sgrad = np.array(np.random.rand(500, dim))
+
+        results = []
+        for num_threads in [1, 2, 3, None]:
+            parzen_hist = ParzenJointHistogram(32, num_threads=num_threads)
+            parzen_hist.setup(static, moving, smask, mmask)
+            parzen_hist.update_pdfs_dense(static, moving, smask, mmask)
+            result = [parzen_hist.joint.copy(), parzen_hist.smarginal.copy(),
+                      parzen_hist.mmarginal.copy()]
+            parzen_hist.update_gradient_dense(theta, transform, static,
+                                              moving, static_g2w, mgrad,
+                                              smask, mmask)
+            result.append(parzen_hist.joint_grad.copy())
+            parzen_hist.update_pdfs_sparse(sval, mval)
+            result += [parzen_hist.joint.copy(), parzen_hist.smarginal.copy(),
+                       parzen_hist.mmarginal.copy()]
+            parzen_hist.update_gradient_sparse(theta, transform, sval, mval,
+                                               points, sgrad)
+            result.append(parzen_hist.joint_grad.copy())
+            results.append(result)
+
+        for result in results[1:]:
+            for actual, expected in zip(result, results[0]):
+                assert_array_almost_equal(actual, expected, decimal=8)
+
+
 def test_joint_pdf_gradients_dense():
     # Compare the analytical and numerical (finite differences) gradient of
     # the joint distribution (i.e. derivatives of each histogram cell) w.r.t.
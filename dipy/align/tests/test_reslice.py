@@ -1,9 +1,14 @@
+import os
+from os.path import join as pjoin
+
 import numpy as np
 import nibabel as nib
+from nibabel.tmpdirs import TemporaryDirectory
 from numpy.testing import (run_module_suite,
                            assert_,
                            assert_equal,
-                           assert_almost_equal)
+                           assert_almost_equal,
+                           assert_raises)
 from dipy.data import get_data
 from dipy.align.reslice import reslice
 from dipy.denoise.noise_estimate import estimate_sigma
@@ -64,6 +69,52 @@ def test_resample():
     assert_almost_equal(affine2, affine3)
 
 
+def test_reslice_threads_and_file():
+    fimg, _, _ = get_data("small_25")
+    img = nib.load(fimg)
+    # Slabs are resampled at coordinates equal up to rounding errors
+    data = img.get_data().astype(np.float64)
+    affine = img.affine
+    zooms = img.header.get_zooms()[:3]
+    new_zooms = (1.3, 0.9, 1.7)
+
+    # Slabs of 3D volumes and volumes of 4D ones are resliced concurrently
+    for order in [0, 1, 3]:
+        data2, affine2 = reslice(data, affine, zooms, new_zooms, order)
+        for num_processes in [2, 3]:
+            data3, affine3 = reslice(data, affine, zooms, new_zooms, order,
+                                     num_processes=num_processes)
+            assert_almost_equal(data3, data2)
+            data3, _ = reslice(data[..., 1], affine, zooms, new_zooms, order,
+                               num_processes=num_processes)
+            assert_almost_equal(data3, data2[..., 1])
+
+    # The resliced volumes are written to a NIfTI file
+    data2, affine2 = reslice(data, affine, zooms, new_zooms)
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'resliced.nii')
+        data3, affine3 = reslice(data, affine, zooms, new_zooms,
+                                 num_processes=2, out_fname=fname)
+        assert_almost_equal(data3, data2)
+        img3 = nib.load(fname)
+        assert_equal(img3.shape, data2.shape)
+        assert_almost_equal(img3.get_data(), data2)
+        assert_almost_equal(affine3, affine2)
+        assert_almost_equal(img3.affine, affine2)
+        assert_almost_equal(img3.header.get_zooms()[:3], new_zooms, 5)
+        del data3, img3
+        assert_raises(ValueError, reslice, data, affine, zooms, new_zooms,
+                      out_fname=fname + '.gz')
+        # The type of the data must be supported by NIfTI
+        assert_raises(ValueError, reslice, data > 0, affine, zooms,
+                      new_zooms, out_fname=fname)
+        # The file is removed if the volumes can not be resliced
+        fname = pjoin(tmpdir, 'failed.nii')
+        assert_raises(RuntimeError, reslice, data, affine, zooms, new_zooms,
+                      mode='unknown', out_fname=fname)
+        assert_(not os.path.exists(fname))
+
+
 if __name__ == '__main__':
 
     run_module_suite()
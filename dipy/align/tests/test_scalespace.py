@@ -81,6 +81,14 @@ def test_scale_space_exceptions():
     ss = ScaleSpace(image, 3)
     for invalid_level in [-1, 3, 4]:
         assert_raises(ValueError, ss.get_image, invalid_level)
+        assert_raises(ValueError, ss.free_level, invalid_level)
+
+    # Released levels keep their properties
+    shape = ss.get_domain_shape(2)
+    ss.free_level(2)
+    assert_equal(ss.get_image(2), None)
+    assert_array_equal(ss.get_domain_shape(2), shape)
+    assert_equal(ss.get_image(1).shape, target_shape)
 
     # Verify that the mask is correctly applied, when requested
     ss = ScaleSpace(image, 3, mask0=True)
@@ -482,6 +482,43 @@ def test_cascade_of_optimizations_and_threading():
     assert_(slm3.fopt < slm2.fopt)
 
 
+def test_optimize_batch():
+    static = fornix_streamlines()[:20]
+    static, _ = center_streamlines(static)
+    movings = [transform_streamlines(static, compose_matrix44(x))
+               for x in [[0, 0, 20, 45., 0, 0], [5, -3, 0, 0, 20., -10]]]
+    slr = StreamlineLinearRegistration(x0=6, num_threads=1)
+    expected = [slr.optimize(static, moving) for moving in movings]
+
+    for num_threads in [1, 2, None]:
+        maps = slr.optimize_batch([static] * 2, movings,
+                                  num_threads=num_threads)
+        assert_equal(len(maps), 2)
+        assert_equal(slr.times.shape, (2,))
+        assert_(np.all(slr.times > 0))
+        for srm, srm_expected, moving in zip(maps, expected, movings):
+            assert_array_almost_equal(srm.matrix, srm_expected.matrix)
+            assert_almost_equal(srm.fopt, srm_expected.fopt)
+            evaluate_convergence(static, srm.transform(moving))
+
+    # The best of several starts is kept
+    x0s = [np.zeros(6), np.array([0, 0, 0, 90., 0, 0])]
+    maps = slr.optimize_batch([static] * 2, movings, x0s=x0s)
+    for srm, srm_expected in zip(maps, expected):
+        assert_(srm.fopt <= srm_expected.fopt + 1e-6)
+
+    # Streamlines of different lengths are resampled
+    raw = [set_number_of_points(s, 10 + i)
+           for i, s in enumerate(fornix_streamlines(no_pts=20)[:20])]
+    maps = slr.optimize_batch([raw], [raw], nb_points=12)
+    assert_array_almost_equal(maps[0].matrix, np.eye(4), 4)
+    assert_raises(ValueError, slr.optimize_batch, [raw], [static])
+
+    assert_raises(ValueError, slr.optimize_batch, [static], movings)
+    assert_raises(ValueError, slr.optimize_batch, [static] * 2, movings,
+                  mats=[np.eye(4)] * 3)
+
+
 if __name__ == '__main__':
 
     run_module_suite()
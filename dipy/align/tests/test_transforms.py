@@ -1,3 +1,5 @@
+import pickle
+
 from dipy.align.transforms import regtransforms, Transform
 import numpy as np
 from numpy.testing import (assert_array_equal,
@@ -252,6 +254,15 @@ def test_invalid_transform():
     assert_equal(actual, expected)
 
 
+def test_pickle_transform():
+    for transform in regtransforms.values():
+        restored = pickle.loads(pickle.dumps(transform))
+        assert_equal(type(restored), type(transform))
+        theta = transform.get_identity_parameters() + 0.1
+        assert_array_equal(restored.param_to_matrix(theta),
+                           transform.param_to_matrix(theta))
+
+
 if __name__ == '__main__':
     test_number_of_parameters()
     test_jacobian_functions()
@@ -259,3 +270,4 @@ if __name__ == '__main__':
     test_param_to_matrix_3d()
     test_identity_parameters()
     test_invalid_transform()
+    test_pickle_transform()
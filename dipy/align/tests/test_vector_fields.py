@@ -10,6 +10,7 @@ from dipy.core import geometry
 from dipy.align import floating
 from dipy.align import imwarp
 from dipy.align import vector_fields as vfu
+from dipy.align.imaffine import AffineMap
 from dipy.align.transforms import regtransforms
 from dipy.align.parzenhist import sample_domain_regular
 
@@ -1233,10 +1234,14 @@ def test_invert_vector_field_2d():
             # make sure the field remains invertible after the re-mapping
             vfu.reorient_vector_field_2d(dcopy, gt_affine)
 
+            inv_stats = np.zeros(2)
             inv_approx =\
                 vfu.invert_vector_field_fixed_point_2d(dcopy, gt_affine_inv,
                                                        np.array([s, s]),
-                                                       40, 1e-7)
+                                                       40, 1e-7,
+                                                       stats=inv_stats)
+            assert(0 < inv_stats[1] <= 40)
+            assert(0 <= inv_stats[0] < 1e-2)
 
             mapping = imwarp.DiffeomorphicMap(2, (nr, nc), gt_affine)
             mapping.forward = dcopy
@@ -1301,8 +1306,12 @@ def test_invert_vector_field_3d():
             # force more iteration by changing the parameters.
             # We will investigate this issue with more detail in the future.
 
+            inv_stats = np.zeros(2)
             inv_approx = vfu.invert_vector_field_fixed_point_3d(
-                dcopy, gt_affine_inv, np.array([s, s, s]) * 0.5, 40, 1e-7)
+                dcopy, gt_affine_inv, np.array([s, s, s]) * 0.5, 40, 1e-7,
+                stats=inv_stats)
+            assert(0 < inv_stats[1] <= 40)
+            assert(0 <= inv_stats[0] < 1e-2)
 
             mapping = imwarp.DiffeomorphicMap(3, (nr, nc), gt_affine)
             mapping.forward = dcopy
@@ -1745,3 +1754,122 @@ def test_gradient_3d():
                   shape, invalid_affine)
     assert_raises(ValueError, vfu.gradient, img, sp_to_grid, invalid_spacings,
                   shape, T)
+
+
+def test_kernels_num_threads():
+    # The results must not depend on the number of threads
+    np.random.seed(5324989)
+    ns, nr, nc = 21, 17, 15
+    d, dinv = vfu.create_harmonic_fields_3d(ns, nr, nc, 0.2, 4)
+    d = np.asarray(d).astype(floating)
+    volume = np.random.rand(ns, nr, nc).astype(floating)
+    labels = np.random.randint(0, 5, (ns, nr, nc)).astype(np.int32)
+    out_shape = np.array((ns + 3, nr - 2, nc + 1), dtype=np.int32)
+    A = np.diag([0.9, 1.1, 1.0, 1.0])
+    A[:3, 3] = [1.5, -0.5, 0.2]
+    B = np.diag([1.05, 0.95, 1.0, 1.0])
+    spacing = np.ones(3)
+
+    image = volume[ns // 2]
+    d2d = np.asarray(d[ns // 2, :, :, 1:])
+    shape2d = out_shape[1:]
+    A2d = A[1:, 1:]
+    B2d = B[1:, 1:]
+
+    def run(num_threads):
+        comp, stats = vfu.compose_vector_fields_3d(d, d, A, B, 1.0, None,
+                                                   num_threads=num_threads)
+        return [
+            vfu.warp_3d(volume, d, A, B, A, out_shape,
+                        num_threads=num_threads),
+            vfu.warp_3d_nn(labels, d, A, B, A, out_shape,
+                           num_threads=num_threads),
+            vfu.transform_3d_affine(volume, out_shape, A,
+                                    num_threads=num_threads),
+            vfu.transform_3d_affine_nn(labels, out_shape, A,
+                                       num_threads=num_threads),
+            vfu.warp_2d(image, d2d, A2d, B2d, A2d, shape2d,
+                        num_threads=num_threads),
+            vfu.warp_2d_nn(labels[0], d2d, A2d, B2d, A2d, shape2d,
+                           num_threads=num_threads),
+            vfu.transform_2d_affine(image, shape2d, A2d,
+                                    num_threads=num_threads),
+            vfu.transform_2d_affine_nn(labels[0], shape2d, A2d,
+                                       num_threads=num_threads),
+            comp, stats,
+            vfu.invert_vector_field_fixed_point_3d(d, np.eye(4), spacing, 10,
+                                                   1e-3,
+                                                   num_threads=num_threads)]
+
+    expected = run(1)
+    for num_threads in [2, 3, None]:
+        for result, expect in zip(run(num_threads), expected):
+            assert_array_equal(result, expect)
+
+    # Warping the same volume with a DiffeomorphicMap or an AffineMap
+    mapping = imwarp.DiffeomorphicMap(3, (ns, nr, nc))
+    mapping.forward = d
+    mapping.backward = d
+    assert_array_equal(mapping.transform(volume, num_threads=1),
+                       mapping.transform(volume, num_threads=2))
+    assert_array_equal(mapping.transform_inverse(labels, 'nearest',
+                                                 num_threads=1),
+                       mapping.transform_inverse(labels, 'nearest',
+                                                 num_threads=2))
+
+    affine_map = AffineMap(A, (ns, nr, nc), np.eye(4), (ns, nr, nc),
+                           np.eye(4))
+    assert_array_equal(affine_map.transform(volume, num_threads=1),
+                       affine_map.transform(volume, num_threads=2))
+    assert_array_equal(affine_map.transform_inverse(volume, num_threads=1),
+                       affine_map.transform_inverse(volume, num_threads=2))
+
+
+def test_warping_4d():
+    # Warping the volumes of a 4D image together is the same as warping them
+    # one at a time
+    np.random.seed(1246592)
+    ns, nr, nc, nv = 15, 17, 13, 4
+    d, dinv = vfu.create_harmonic_fields_3d(ns, nr, nc, 0.2, 4)
+    d = np.asarray(d).astype(floating)
+    volumes = np.random.rand(ns, nr, nc, nv).astype(floating)
+    labels = np.random.randint(0, 5, (ns, nr, nc, nv)).astype(np.int32)
+    out_shape = np.array((ns + 2, nr - 3, nc + 1), dtype=np.int32)
+    A = np.diag([0.9, 1.1, 1.0, 1.0])
+    A[:3, 3] = [1.5, -0.5, 0.2]
+    B = np.diag([1.05, 0.95, 1.0, 1.0])
+
+    # Without affine_idx_in the field is sampled at the output grid, which
+    # must then have the field's shape
+    for affine_idx_in, affine_idx_out, affine_disp, shape in [
+            (None, None, None, np.array((ns, nr, nc), dtype=np.int32)),
+            (A, B, A, out_shape)]:
+        warped = vfu.warp_4d(volumes, d, affine_idx_in, affine_idx_out,
+                             affine_disp, shape)
+        warped_nn = vfu.warp_4d_nn(labels, d, affine_idx_in, affine_idx_out,
+                                   affine_disp, shape)
+        assert_equal(warped.shape, tuple(shape) + (nv,))
+        for v in range(nv):
+            expected = vfu.warp_3d(volumes[..., v], d, affine_idx_in,
+                                   affine_idx_out, affine_disp, shape)
+            assert_array_equal(warped[..., v], expected)
+            expected = vfu.warp_3d_nn(labels[..., v], d, affine_idx_in,
+                                      affine_idx_out, affine_disp, shape)
+            assert_array_equal(warped_nn[..., v], expected)
+
+    transformed = vfu.transform_4d_affine(volumes, out_shape, A)
+    transformed_nn = vfu.transform_4d_affine_nn(labels, out_shape, A)
+    for v in range(nv):
+        assert_array_equal(transformed[..., v],
+                           vfu.transform_3d_affine(volumes[..., v],
+                                                   out_shape, A))
+        assert_array_equal(transformed_nn[..., v],
+                           vfu.transform_3d_affine_nn(labels[..., v],
+                                                      out_shape, A))
+
+    # Test exception is raised when the affine transform matrix is not valid
+    invalid = np.zeros((3, 3), dtype=np.float64)
+    assert_raises(ValueError, vfu.warp_4d, volumes, d, invalid, None, None,
+                  out_shape)
+    assert_raises(ValueError, vfu.transform_4d_affine_nn, labels, out_shape,
+                  invalid)
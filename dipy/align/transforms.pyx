@@ -39,6 +39,10 @@ cdef class Transform:
         self.dim = -1
         self.number_of_parameters = -1
 
+    def __reduce__(self):
+        # Transforms have no state besides their type
+        return (type(self), ())
+
     cdef int _jacobian(self, double[:] theta, double[:] x,
                        double[:, :] J)nogil:
         return -1
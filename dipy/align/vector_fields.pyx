@@ -6,7 +6,10 @@
 import numpy as np
 cimport numpy as cnp
 cimport cython
+from cython.parallel import prange
+from libc.stdlib cimport calloc, free
 from .fused_types cimport floating, number
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 
 cdef extern from "dpy_math.h" nogil:
@@ -569,6 +572,176 @@ cdef inline int _interpolate_scalar_3d(floating[:, :, :] volume,
     return 1 if inside == 8 else 0
 
 
+cdef inline int _interpolate_scalar_4d(floating[:, :, :, :] volumes,
+                                       double dkk, double dii, double djj,
+                                       floating *out) nogil:
+    r"""Trilinear interpolation of the volumes of a 4D image
+
+    Interpolates each 3D volume of the 4D image at (dkk, dii, djj) and
+    stores the results in out, one per volume (last axis). The interpolation
+    weights are computed only once and used for all volumes. If
+    (dkk, dii, djj) is outside the image's domain, zeros are written to out
+    instead.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image
+    dkk : floating
+        the first coordinate of the interpolating position
+    dii : floating
+        the second coordinate of the interpolating position
+    djj : floating
+        the third coordinate of the interpolating position
+    out : array, shape (N,)
+        the array which the interpolation results will be written to
+
+    Returns
+    -------
+    inside : int
+        if (dkk, dii, djj) is inside the domain of the image,
+        inside == 1, otherwise inside == 0
+    """
+    cdef:
+        cnp.npy_intp ns = volumes.shape[0]
+        cnp.npy_intp nr = volumes.shape[1]
+        cnp.npy_intp nc = volumes.shape[2]
+        cnp.npy_intp nv = volumes.shape[3]
+        cnp.npy_intp kk, ii, jj, v
+        int inside
+        double alpha, beta, calpha, cbeta, gamma, cgamma, w
+    for v in range(nv):
+        out[v] = 0
+    if not (-1 < dkk < ns and -1 < dii < nr and -1 < djj < nc):
+        return 0
+    # find the top left index and the interpolation coefficients
+    kk = <int>floor(dkk)
+    ii = <int>floor(dii)
+    jj = <int>floor(djj)
+
+    cgamma = dkk - kk
+    calpha = dii - ii
+    cbeta = djj - jj
+    alpha = 1 - calpha
+    beta = 1 - cbeta
+    gamma = 1 - cgamma
+
+    inside = 0
+    # ---top-left
+    if (ii >= 0) and (jj >= 0) and (kk >= 0):
+        w = alpha * beta * gamma
+        for v in range(nv):
+            out[v] += w * volumes[kk, ii, jj, v]
+        inside += 1
+    # ---top-right
+    jj += 1
+    if (ii >= 0) and (jj < nc) and (kk >= 0):
+        w = alpha * cbeta * gamma
+        for v in range(nv):
+            out[v] += w * volumes[kk, ii, jj, v]
+        inside += 1
+    # ---bottom-right
+    ii += 1
+    if (ii < nr) and (jj < nc) and (kk >= 0):
+        w = calpha * cbeta * gamma
+        for v in range(nv):
+            out[v] += w * volumes[kk, ii, jj, v]
+        inside += 1
+    # ---bottom-left
+    jj -= 1
+    if (ii < nr) and (jj >= 0) and (kk >= 0):
+        w = calpha * beta * gamma
+        for v in range(nv):
+            out[v] += w * volumes[kk, ii, jj, v]
+        inside += 1
+    kk += 1
+    if(kk < ns):
+        ii -= 1
+        if (ii >= 0) and (jj >= 0):
+            w = alpha * beta * cgamma
+            for v in range(nv):
+                out[v] += w * volumes[kk, ii, jj, v]
+            inside += 1
+        jj += 1
+        if (ii >= 0) and (jj < nc):
+            w = alpha * cbeta * cgamma
+            for v in range(nv):
+                out[v] += w * volumes[kk, ii, jj, v]
+            inside += 1
+        # ---bottom-right
+        ii += 1
+        if (ii < nr) and (jj < nc):
+            w = calpha * cbeta * cgamma
+            for v in range(nv):
+                out[v] += w * volumes[kk, ii, jj, v]
+            inside += 1
+        # ---bottom-left
+        jj -= 1
+        if (ii < nr) and (jj >= 0):
+            w = calpha * beta * cgamma
+            for v in range(nv):
+                out[v] += w * volumes[kk, ii, jj, v]
+            inside += 1
+    return 1 if inside == 8 else 0
+
+
+cdef inline int _interpolate_scalar_nn_4d(number[:, :, :, :] volumes,
+                                          double dkk, double dii, double djj,
+                                          number *out) nogil:
+    r"""Nearest-neighbor interpolation of the volumes of a 4D image
+
+    Interpolates each 3D volume of the 4D image at (dkk, dii, djj) using
+    nearest neighbor interpolation and stores the results in out, one per
+    volume (last axis). If (dkk, dii, djj) is outside the image's domain,
+    zeros are written to out instead.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image
+    dkk : float
+        the first coordinate of the interpolating position
+    dii : float
+        the second coordinate of the interpolating position
+    djj : float
+        the third coordinate of the interpolating position
+    out : array, shape (N,)
+        the array which the interpolation results will be written to
+
+    Returns
+    -------
+    inside : int
+        if (dkk, dii, djj) is inside the domain of the image,
+        inside == 1, otherwise inside == 0
+    """
+    cdef:
+        cnp.npy_intp ns = volumes.shape[0]
+        cnp.npy_intp nr = volumes.shape[1]
+        cnp.npy_intp nc = volumes.shape[2]
+        cnp.npy_intp nv = volumes.shape[3]
+        cnp.npy_intp kk, ii, jj, v
+    for v in range(nv):
+        out[v] = 0
+    if not (0 <= dkk <= ns - 1 and 0 <= dii <= nr - 1 and 0 <= djj <= nc - 1):
+        return 0
+    # find the top left index and round to the nearest voxel
+    kk = <int>floor(dkk)
+    ii = <int>floor(dii)
+    jj = <int>floor(djj)
+    if (1 - (dkk - kk)) < (dkk - kk):
+        kk += 1
+    if (1 - (dii - ii)) < (dii - ii):
+        ii += 1
+    if (1 - (djj - jj)) < (djj - jj):
+        jj += 1
+    # no one is affected
+    if not ((0 <= kk < ns) and (0 <= ii < nr) and (0 <= jj < nc)):
+        return 0
+    for v in range(nv):
+        out[v] = volumes[kk, ii, jj, v]
+    return 1
+
+
 def interpolate_vector_3d(floating[:, :, :, :] field, double[:, :] locations):
     r"""Trilinear interpolation of a 3D vector field
 
@@ -919,13 +1092,13 @@ def compose_vector_fields_2d(floating[:, :, :] d1, floating[:, :, :] d2,
     return np.asarray(comp), np.asarray(stats)
 
 
-cdef void _compose_vector_fields_3d(floating[:, :, :, :] d1,
-                                    floating[:, :, :, :] d2,
-                                    double[:, :] premult_index,
-                                    double[:, :] premult_disp,
-                                    double t,
-                                    floating[:, :, :, :] comp,
-                                    double[:] stats) nogil:
+cdef int _compose_vector_fields_3d(floating[:, :, :, :] d1,
+                                   floating[:, :, :, :] d2,
+                                   double[:, :] premult_index,
+                                   double[:, :] premult_disp,
+                                   double t,
+                                   floating[:, :, :, :] comp,
+                                   double[:] stats) nogil except -1:
     r"""Computes the composition of two 3D displacement fields
 
     Computes the composition of the two 3-D displacements d1 and d2. The
@@ -1000,7 +1173,15 @@ cdef void _compose_vector_fields_3d(floating[:, :, :, :] d1,
         double nn
         cnp.npy_intp i, j, k
         double di, dj, dk, dii, djj, dkk, diii, djjj, dkkk
-    for k in range(ns1):
+        double *slice_stats
+
+    # The statistics of each slice are accumulated separately, then reduced
+    # in order, so they do not depend on the number of threads
+    slice_stats = <double *> calloc(4 * ns1, sizeof(double))
+    if slice_stats == NULL:
+        with gil:
+            raise MemoryError()
+    for k in prange(ns1, schedule='guided'):
         for i in range(nr1):
             for j in range(nc1):
 
@@ -1027,9 +1208,9 @@ cdef void _compose_vector_fields_3d(floating[:, :, :, :] d1,
                     diii = _apply_affine_3d_x1(k, i, j, 1, premult_index)
                     djjj = _apply_affine_3d_x2(k, i, j, 1, premult_index)
 
-                dkkk += dk
-                diii += di
-                djjj += dj
+                dkkk = dkkk + dk
+                diii = diii + di
+                djjj = djjj + dj
 
                 # If d1 and comp are the same array, this will correctly update
                 # d1[k,i,j], which will never be accessed again
@@ -1045,26 +1226,35 @@ cdef void _compose_vector_fields_3d(floating[:, :, :, :] d1,
                     comp[k, i, j, 2] = t * comp[k, i, j, 2] + djj
                     nn = (comp[k, i, j, 0] ** 2 + comp[k, i, j, 1] ** 2 +
                           comp[k, i, j, 2]**2)
-                    meanNorm += nn
-                    stdNorm += nn * nn
-                    cnt += 1
-                    if(maxNorm < nn):
-                        maxNorm = nn
+                    slice_stats[4 * k] += nn
+                    slice_stats[4 * k + 1] += nn * nn
+                    slice_stats[4 * k + 2] += 1
+                    if(slice_stats[4 * k + 3] < nn):
+                        slice_stats[4 * k + 3] = nn
                 else:
                     comp[k, i, j, 0] = 0
                     comp[k, i, j, 1] = 0
                     comp[k, i, j, 2] = 0
+    for k in range(ns1):
+        meanNorm += slice_stats[4 * k]
+        stdNorm += slice_stats[4 * k + 1]
+        cnt += <int> slice_stats[4 * k + 2]
+        if(maxNorm < slice_stats[4 * k + 3]):
+            maxNorm = slice_stats[4 * k + 3]
+    free(slice_stats)
     meanNorm /= cnt
     stats[0] = sqrt(maxNorm)
     stats[1] = sqrt(meanNorm)
     stats[2] = sqrt(stdNorm / cnt - meanNorm * meanNorm)
+    return 0
 
 
 def compose_vector_fields_3d(floating[:, :, :, :] d1, floating[:, :, :, :] d2,
                              double[:, :] premult_index,
                              double[:, :] premult_disp,
                              double time_scaling,
-                             floating[:, :, :, :] comp):
+                             floating[:, :, :, :] comp,
+                             num_threads=None):
     r"""Computes the composition of two 3D displacement fields
 
     Computes the composition of the two 3-D displacements d1 and d2. The
@@ -1103,6 +1293,9 @@ def compose_vector_fields_3d(floating[:, :, :, :] d1, floating[:, :, :, :] d2,
     comp : array, shape (S, R, C, 3), same dimension as d1
         the buffer to write the composition to. If None, the buffer will be
         created internally
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -1128,8 +1321,14 @@ def compose_vector_fields_3d(floating[:, :, :, :] d1, floating[:, :, :, :] d2,
     if not is_valid_affine(premult_disp, 3):
         raise ValueError("Invalid displacement pre-multiplication matrix")
 
-    _compose_vector_fields_3d[floating](d1, d2, premult_index, premult_disp,
-                                        time_scaling, comp, stats)
+    set_num_threads(num_threads)
+    try:
+        _compose_vector_fields_3d[floating](d1, d2, premult_index,
+                                            premult_disp, time_scaling, comp,
+                                            stats)
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(comp), np.asarray(stats)
 
 
@@ -1137,7 +1336,8 @@ def invert_vector_field_fixed_point_2d(floating[:, :, :] d,
                                        double[:, :] d_world2grid,
                                        double[:] spacing,
                                        int max_iter, double tolerance,
-                                       floating[:, :, :] start=None):
+                                       floating[:, :, :] start=None,
+                                       double[:] stats=None):
     r"""Computes the inverse of a 2D displacement fields
 
     Computes the inverse of the given 2-D displacement field d using the
@@ -1165,6 +1365,9 @@ def invert_vector_field_fixed_point_2d(floating[:, :, :] d,
         an approximation to the inverse displacement field (if no approximation
         is available, None can be provided and the start displacement field
         will be zero)
+    stats : array, shape (2,), optional
+        if provided, the inversion error of the last iteration and the number
+        of iterations performed are written in stats[0] and stats[1]
 
     Returns
     -------
@@ -1190,8 +1393,9 @@ def invert_vector_field_fixed_point_2d(floating[:, :, :] d,
         double sr = spacing[0], sc = spacing[1]
 
     ftype = np.asarray(d).dtype
+    if stats is None:
+        stats = np.zeros(shape=(2,), dtype=np.float64)
     cdef:
-        double[:] stats = np.zeros(shape=(2,), dtype=np.float64)
         double[:] substats = np.empty(shape=(3,), dtype=np.float64)
         double[:, :] norms = np.zeros(shape=(nr, nc), dtype=np.float64)
         floating[:, :, :] p = np.zeros(shape=(nr, nc, 2), dtype=ftype)
@@ -1232,7 +1436,7 @@ def invert_vector_field_fixed_point_2d(floating[:, :, :] d,
                     p[i, j, 1] = p[i, j, 1] - step_factor * q[i, j, 1]
             error /= (nr * nc)
             iter_count += 1
-        stats[0] = substats[1]
+        stats[0] = error
         stats[1] = iter_count
     return np.asarray(p)
 
@@ -1241,7 +1445,9 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
                                        double[:, :] d_world2grid,
                                        double[:] spacing,
                                        int max_iter, double tol,
-                                       floating[:, :, :, :] start=None):
+                                       floating[:, :, :, :] start=None,
+                                       num_threads=None,
+                                       double[:] stats=None):
     r"""Computes the inverse of a 3D displacement fields
 
     Computes the inverse of the given 3-D displacement field d using the
@@ -1269,6 +1475,12 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
         an approximation to the inverse displacement field (if no approximation
         is available, None can be provided and the start displacement field
         will be zero)
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
+    stats : array, shape (2,), optional
+        if provided, the inversion error of the last iteration and the number
+        of iterations performed are written in stats[0] and stats[1]
 
     Returns
     -------
@@ -1288,6 +1500,7 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
         cnp.npy_intp nr = d.shape[1]
         cnp.npy_intp nc = d.shape[2]
         int iter_count, current
+        cnp.npy_intp i, j, k
         double dkk, dii, djj, dk, di, dj
         double difmag, mag, maxlen, step_factor
         double epsilon = 0.5
@@ -1295,10 +1508,13 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
         double ss = spacing[0], sr = spacing[1], sc = spacing[2]
 
     ftype = np.asarray(d).dtype
+    if stats is None:
+        stats = np.zeros(shape=(2,), dtype=np.float64)
     cdef:
-        double[:] stats = np.zeros(shape=(2,), dtype=np.float64)
         double[:] substats = np.zeros(shape=(3,), dtype=np.float64)
         double[:, :, :] norms = np.zeros(shape=(ns, nr, nc), dtype=np.float64)
+        double[:] slice_error = np.zeros(shape=(ns,), dtype=np.float64)
+        double[:] slice_difmag = np.zeros(shape=(ns,), dtype=np.float64)
         floating[:, :, :, :] p = np.zeros(shape=(ns, nr, nc, 3), dtype=ftype)
         floating[:, :, :, :] q = np.zeros(shape=(ns, nr, nc, 3), dtype=ftype)
 
@@ -1308,46 +1524,57 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
     if start is not None:
         p[...] = start
 
-    with nogil:
-        iter_count = 0
-        difmag = 1
-        while (0.1 < difmag) and (iter_count < max_iter) and (tol < error):
-            if iter_count == 0:
-                epsilon = 0.75
-            else:
-                epsilon = 0.5
-            _compose_vector_fields_3d[floating](p, d, None, d_world2grid,
-                                                1.0, q, substats)
-            difmag = 0
-            error = 0
-            for k in range(ns):
-                for i in range(nr):
-                    for j in range(nc):
-                        mag = sqrt((q[k, i, j, 0]/ss) ** 2 +
-                                   (q[k, i, j, 1]/sr) ** 2 +
-                                   (q[k, i, j, 2]/sc) ** 2)
-                        norms[k, i, j] = mag
-                        error += mag
-                        if(difmag < mag):
-                            difmag = mag
-            maxlen = difmag*epsilon
-            for k in range(ns):
-                for i in range(nr):
-                    for j in range(nc):
-                        if norms[k, i, j] > maxlen:
-                            step_factor = epsilon * maxlen / norms[k, i, j]
-                        else:
-                            step_factor = epsilon
-                        p[k, i, j, 0] = (p[k, i, j, 0] -
-                                         step_factor * q[k, i, j, 0])
-                        p[k, i, j, 1] = (p[k, i, j, 1] -
-                                         step_factor * q[k, i, j, 1])
-                        p[k, i, j, 2] = (p[k, i, j, 2] -
-                                         step_factor * q[k, i, j, 2])
-            error /= (ns * nr * nc)
-            iter_count += 1
-        stats[0] = error
-        stats[1] = iter_count
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+            iter_count = 0
+            difmag = 1
+            while (0.1 < difmag) and (iter_count < max_iter) and (tol < error):
+                if iter_count == 0:
+                    epsilon = 0.75
+                else:
+                    epsilon = 0.5
+                _compose_vector_fields_3d[floating](p, d, None, d_world2grid,
+                                                    1.0, q, substats)
+                for k in prange(ns, schedule='guided'):
+                    slice_error[k] = 0
+                    slice_difmag[k] = 0
+                    for i in range(nr):
+                        for j in range(nc):
+                            mag = sqrt((q[k, i, j, 0]/ss) ** 2 +
+                                       (q[k, i, j, 1]/sr) ** 2 +
+                                       (q[k, i, j, 2]/sc) ** 2)
+                            norms[k, i, j] = mag
+                            slice_error[k] += mag
+                            if(slice_difmag[k] < mag):
+                                slice_difmag[k] = mag
+                difmag = 0
+                error = 0
+                for k in range(ns):
+                    error += slice_error[k]
+                    if(difmag < slice_difmag[k]):
+                        difmag = slice_difmag[k]
+                maxlen = difmag*epsilon
+                for k in prange(ns, schedule='guided'):
+                    for i in range(nr):
+                        for j in range(nc):
+                            if norms[k, i, j] > maxlen:
+                                step_factor = epsilon * maxlen / norms[k, i, j]
+                            else:
+                                step_factor = epsilon
+                            p[k, i, j, 0] = (p[k, i, j, 0] -
+                                             step_factor * q[k, i, j, 0])
+                            p[k, i, j, 1] = (p[k, i, j, 1] -
+                                             step_factor * q[k, i, j, 1])
+                            p[k, i, j, 2] = (p[k, i, j, 2] -
+                                             step_factor * q[k, i, j, 2])
+                error /= (ns * nr * nc)
+                iter_count += 1
+            stats[0] = error
+            stats[1] = iter_count
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(p)
 
 
@@ -1870,7 +2097,8 @@ def warp_3d(floating[:, :, :] volume, floating[:, :, :, :] d1,
             double[:, :] affine_idx_in=None,
             double[:, :] affine_idx_out=None,
             double[:, :] affine_disp=None,
-            int[:] out_shape=None):
+            int[:] out_shape=None,
+            num_threads=None):
     r"""Warps a 3D volume using trilinear interpolation
 
     Deforms the input volume under the given transformation. The warped volume
@@ -1896,6 +2124,9 @@ def warp_3d(floating[:, :, :] volume, floating[:, :, :, :] d1,
         the matrix C in eq. (1) above
     out_shape : array, shape (3,)
         the number of slices, rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -1946,62 +2177,68 @@ def warp_3d(floating[:, :, :] volume, floating[:, :, :, :] d1,
 
     cdef floating[:, :, :] warped = np.zeros(shape=(nslices, nrows, ncols),
                                              dtype=np.asarray(volume).dtype)
-    cdef floating[:] tmp = np.zeros(shape=(3,), dtype = np.asarray(d1).dtype)
-
-    with nogil:
-
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if affine_idx_in is None:
-                        dkk = d1[k, i, j, 0]
-                        dii = d1[k, i, j, 1]
-                        djj = d1[k, i, j, 2]
-                    else:
-                        dk = _apply_affine_3d_x0(
-                            k, i, j, 1, affine_idx_in)
-                        di = _apply_affine_3d_x1(
-                            k, i, j, 1, affine_idx_in)
-                        dj = _apply_affine_3d_x2(
-                            k, i, j, 1, affine_idx_in)
-                        inside = _interpolate_vector_3d[floating](d1, dk, di,
-                                                                  dj, &tmp[0])
-                        dkk = tmp[0]
-                        dii = tmp[1]
-                        djj = tmp[2]
-
-                    if affine_disp is not None:
-                        dk = _apply_affine_3d_x0(
-                            dkk, dii, djj, 0, affine_disp)
-                        di = _apply_affine_3d_x1(
-                            dkk, dii, djj, 0, affine_disp)
-                        dj = _apply_affine_3d_x2(
-                            dkk, dii, djj, 0, affine_disp)
-                    else:
-                        dk = dkk
-                        di = dii
-                        dj = djj
-
-                    if affine_idx_out is not None:
-                        dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
-                                                       affine_idx_out)
-                        dii = di + _apply_affine_3d_x1(k, i, j, 1,
-                                                       affine_idx_out)
-                        djj = dj + _apply_affine_3d_x2(k, i, j, 1,
-                                                       affine_idx_out)
-                    else:
-                        dkk = dk + k
-                        dii = di + i
-                        djj = dj + j
-
-                    inside = _interpolate_scalar_3d[floating](volume, dkk,
-                                                              dii, djj,
-                                                              &warped[k,i,j])
+    cdef floating[:, :] tmp = np.zeros(shape=(nslices, 3),
+                                       dtype=np.asarray(d1).dtype)
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine_idx_in is None:
+                            dkk = d1[k, i, j, 0]
+                            dii = d1[k, i, j, 1]
+                            djj = d1[k, i, j, 2]
+                        else:
+                            dk = _apply_affine_3d_x0(
+                                k, i, j, 1, affine_idx_in)
+                            di = _apply_affine_3d_x1(
+                                k, i, j, 1, affine_idx_in)
+                            dj = _apply_affine_3d_x2(
+                                k, i, j, 1, affine_idx_in)
+                            inside = _interpolate_vector_3d[floating](
+                                d1, dk, di, dj, &tmp[k, 0])
+                            dkk = tmp[k, 0]
+                            dii = tmp[k, 1]
+                            djj = tmp[k, 2]
+
+                        if affine_disp is not None:
+                            dk = _apply_affine_3d_x0(
+                                dkk, dii, djj, 0, affine_disp)
+                            di = _apply_affine_3d_x1(
+                                dkk, dii, djj, 0, affine_disp)
+                            dj = _apply_affine_3d_x2(
+                                dkk, dii, djj, 0, affine_disp)
+                        else:
+                            dk = dkk
+                            di = dii
+                            dj = djj
+
+                        if affine_idx_out is not None:
+                            dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
+                                                           affine_idx_out)
+                            dii = di + _apply_affine_3d_x1(k, i, j, 1,
+                                                           affine_idx_out)
+                            djj = dj + _apply_affine_3d_x2(k, i, j, 1,
+                                                           affine_idx_out)
+                        else:
+                            dkk = dk + k
+                            dii = di + i
+                            djj = dj + j
+
+                        inside = _interpolate_scalar_3d[floating](
+                            volume, dkk, dii, djj, &warped[k,i,j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(warped)
 
 
 def transform_3d_affine(floating[:, :, :] volume, int[:] ref_shape,
-                        double[:, :] affine):
+                        double[:, :] affine,
+                        num_threads=None):
     r"""Transforms a 3D volume by an affine transform with trilinear interp.
 
     Deforms the input volume under the given affine transformation using
@@ -2017,6 +2254,9 @@ def transform_3d_affine(floating[:, :, :] volume, int[:] ref_shape,
         the shape of the resulting volume
     affine : array, shape (4, 4)
         the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2048,21 +2288,26 @@ def transform_3d_affine(floating[:, :, :] volume, int[:] ref_shape,
     if not is_valid_affine(affine, 3):
         raise ValueError("Invalid affine transform matrix")
 
-    with nogil:
-
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if affine is not None:
-                        dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
-                        dii = _apply_affine_3d_x1(k, i, j, 1, affine)
-                        djj = _apply_affine_3d_x2(k, i, j, 1, affine)
-                    else:
-                        dkk = k
-                        dii = i
-                        djj = j
-                    inside = _interpolate_scalar_3d[floating](volume, dkk,
-                        dii, djj, &out[k,i,j])
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine is not None:
+                            dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
+                            dii = _apply_affine_3d_x1(k, i, j, 1, affine)
+                            djj = _apply_affine_3d_x2(k, i, j, 1, affine)
+                        else:
+                            dkk = k
+                            dii = i
+                            djj = j
+                        inside = _interpolate_scalar_3d[floating](volume, dkk,
+                            dii, djj, &out[k,i,j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(out)
 
 
@@ -2070,7 +2315,8 @@ def warp_3d_nn(number[:, :, :] volume, floating[:, :, :, :] d1,
                double[:, :] affine_idx_in=None,
                double[:, :] affine_idx_out=None,
                double[:, :] affine_disp=None,
-               int[:] out_shape=None):
+               int[:] out_shape=None,
+               num_threads=None):
     r"""Warps a 3D volume using using nearest-neighbor interpolation
 
     Deforms the input volume under the given transformation. The warped volume
@@ -2096,6 +2342,9 @@ def warp_3d_nn(number[:, :, :] volume, floating[:, :, :, :] d1,
         the matrix C in eq. (1) above
     out_shape : array, shape (3,)
         the number of slices, rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2146,61 +2395,68 @@ def warp_3d_nn(number[:, :, :] volume, floating[:, :, :, :] d1,
 
     cdef number[:, :, :] warped = np.zeros(shape=(nslices, nrows, ncols),
                                            dtype=np.asarray(volume).dtype)
-    cdef floating[:] tmp = np.zeros(shape=(3,), dtype = np.asarray(d1).dtype)
-
-    with nogil:
-
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if affine_idx_in is None:
-                        dkk = d1[k, i, j, 0]
-                        dii = d1[k, i, j, 1]
-                        djj = d1[k, i, j, 2]
-                    else:
-                        dk = _apply_affine_3d_x0(
-                            k, i, j, 1, affine_idx_in)
-                        di = _apply_affine_3d_x1(
-                            k, i, j, 1, affine_idx_in)
-                        dj = _apply_affine_3d_x2(
-                            k, i, j, 1, affine_idx_in)
-                        inside = _interpolate_vector_3d[floating](d1, dk, di,
-                                                                  dj, &tmp[0])
-                        dkk = tmp[0]
-                        dii = tmp[1]
-                        djj = tmp[2]
-
-                    if affine_disp is not None:
-                        dk = _apply_affine_3d_x0(
-                            dkk, dii, djj, 0, affine_disp)
-                        di = _apply_affine_3d_x1(
-                            dkk, dii, djj, 0, affine_disp)
-                        dj = _apply_affine_3d_x2(
-                            dkk, dii, djj, 0, affine_disp)
-                    else:
-                        dk = dkk
-                        di = dii
-                        dj = djj
-
-                    if affine_idx_out is not None:
-                        dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
-                                                       affine_idx_out)
-                        dii = di + _apply_affine_3d_x1(k, i, j, 1,
-                                                       affine_idx_out)
-                        djj = dj + _apply_affine_3d_x2(k, i, j, 1,
-                                                       affine_idx_out)
-                    else:
-                        dkk = dk + k
-                        dii = di + i
-                        djj = dj + j
-
-                    inside = _interpolate_scalar_nn_3d[number](volume, dkk, dii, djj,
-                                                       &warped[k,i,j])
+    cdef floating[:, :] tmp = np.zeros(shape=(nslices, 3),
+                                       dtype=np.asarray(d1).dtype)
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine_idx_in is None:
+                            dkk = d1[k, i, j, 0]
+                            dii = d1[k, i, j, 1]
+                            djj = d1[k, i, j, 2]
+                        else:
+                            dk = _apply_affine_3d_x0(
+                                k, i, j, 1, affine_idx_in)
+                            di = _apply_affine_3d_x1(
+                                k, i, j, 1, affine_idx_in)
+                            dj = _apply_affine_3d_x2(
+                                k, i, j, 1, affine_idx_in)
+                            inside = _interpolate_vector_3d[floating](
+                                d1, dk, di, dj, &tmp[k, 0])
+                            dkk = tmp[k, 0]
+                            dii = tmp[k, 1]
+                            djj = tmp[k, 2]
+
+                        if affine_disp is not None:
+                            dk = _apply_affine_3d_x0(
+                                dkk, dii, djj, 0, affine_disp)
+                            di = _apply_affine_3d_x1(
+                                dkk, dii, djj, 0, affine_disp)
+                            dj = _apply_affine_3d_x2(
+                                dkk, dii, djj, 0, affine_disp)
+                        else:
+                            dk = dkk
+                            di = dii
+                            dj = djj
+
+                        if affine_idx_out is not None:
+                            dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
+                                                           affine_idx_out)
+                            dii = di + _apply_affine_3d_x1(k, i, j, 1,
+                                                           affine_idx_out)
+                            djj = dj + _apply_affine_3d_x2(k, i, j, 1,
+                                                           affine_idx_out)
+                        else:
+                            dkk = dk + k
+                            dii = di + i
+                            djj = dj + j
+
+                        inside = _interpolate_scalar_nn_3d[number](
+                            volume, dkk, dii, djj, &warped[k,i,j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(warped)
 
 
 def transform_3d_affine_nn(number[:, :, :] volume, int[:] ref_shape,
-                           double[:, :] affine=None):
+                           double[:, :] affine=None,
+                           num_threads=None):
     r"""Transforms a 3D volume by an affine transform with NN interpolation
 
     Deforms the input volume under the given affine transformation using
@@ -2216,6 +2472,9 @@ def transform_3d_affine_nn(number[:, :, :] volume, int[:] ref_shape,
         the shape of the resulting volume
     affine : array, shape (4, 4)
         the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2246,21 +2505,396 @@ def transform_3d_affine_nn(number[:, :, :] volume, int[:] ref_shape,
     if not is_valid_affine(affine, 3):
         raise ValueError("Invalid affine transform matrix")
 
-    with nogil:
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine is not None:
+                            dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
+                            dii = _apply_affine_3d_x1(k, i, j, 1, affine)
+                            djj = _apply_affine_3d_x2(k, i, j, 1, affine)
+                        else:
+                            dkk = k
+                            dii = i
+                            djj = j
+                        _interpolate_scalar_nn_3d[number](
+                            volume, dkk, dii, djj, &out[k,i,j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+    return np.asarray(out)
 
-        for k in range(nslices):
-            for i in range(nrows):
-                for j in range(ncols):
-                    if affine is not None:
-                        dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
-                        dii = _apply_affine_3d_x1(k, i, j, 1, affine)
-                        djj = _apply_affine_3d_x2(k, i, j, 1, affine)
-                    else:
-                        dkk = k
-                        dii = i
-                        djj = j
-                    _interpolate_scalar_nn_3d[number](volume, dkk, dii, djj,
-                                                      &out[k,i,j])
+
+def warp_4d(floating[:, :, :, :] volumes, floating[:, :, :, :] d1,
+            double[:, :] affine_idx_in=None,
+            double[:, :] affine_idx_out=None,
+            double[:, :] affine_disp=None,
+            int[:] out_shape=None,
+            num_threads=None):
+    r"""Warps the volumes of a 4D image using trilinear interpolation
+
+    Deforms each 3D volume of the input 4D image (e.g. a diffusion weighted
+    series, or spherical harmonics coefficients) under the given
+    transformation, like `warp_3d`. The sampling location of each voxel and
+    its interpolation weights are computed only once and used for all the
+    volumes.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image, whose N volumes are to be transformed
+    d1 : array, shape (S', R', C', 3)
+        the displacement field driving the transformation
+    affine_idx_in : array, shape (4, 4)
+        the matrix A in eq. (1) of `warp_3d`
+    affine_idx_out : array, shape (4, 4)
+        the matrix B in eq. (1) of `warp_3d`
+    affine_disp : array, shape (4, 4)
+        the matrix C in eq. (1) of `warp_3d`
+    out_shape : array, shape (3,)
+        the number of slices, rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
+
+    Returns
+    -------
+    warped : array, shape = out_shape + (N,)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = volumes.shape[0]
+        cnp.npy_intp nrows = volumes.shape[1]
+        cnp.npy_intp ncols = volumes.shape[2]
+        cnp.npy_intp nvols = volumes.shape[3]
+        cnp.npy_intp i, j, k
+        int inside
+        double dkk, dii, djj, dk, di, dj
+
+    if not is_valid_affine(affine_idx_in, 3):
+        raise ValueError("Invalid inner index multiplication matrix")
+    if not is_valid_affine(affine_idx_out, 3):
+        raise ValueError("Invalid outer index multiplication matrix")
+    if not is_valid_affine(affine_disp, 3):
+        raise ValueError("Invalid displacement multiplication matrix")
+
+    if out_shape is not None:
+        nslices = out_shape[0]
+        nrows = out_shape[1]
+        ncols = out_shape[2]
+    elif d1 is not None:
+        nslices = d1.shape[0]
+        nrows = d1.shape[1]
+        ncols = d1.shape[2]
+
+    cdef floating[:, :, :, ::1] warped = np.zeros(
+        shape=(nslices, nrows, ncols, nvols), dtype=np.asarray(volumes).dtype)
+    cdef floating[:, :] tmp = np.zeros(shape=(nslices, 3),
+                                       dtype=np.asarray(d1).dtype)
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine_idx_in is None:
+                            dkk = d1[k, i, j, 0]
+                            dii = d1[k, i, j, 1]
+                            djj = d1[k, i, j, 2]
+                        else:
+                            dk = _apply_affine_3d_x0(
+                                k, i, j, 1, affine_idx_in)
+                            di = _apply_affine_3d_x1(
+                                k, i, j, 1, affine_idx_in)
+                            dj = _apply_affine_3d_x2(
+                                k, i, j, 1, affine_idx_in)
+                            inside = _interpolate_vector_3d[floating](
+                                d1, dk, di, dj, &tmp[k, 0])
+                            dkk = tmp[k, 0]
+                            dii = tmp[k, 1]
+                            djj = tmp[k, 2]
+
+                        if affine_disp is not None:
+                            dk = _apply_affine_3d_x0(
+                                dkk, dii, djj, 0, affine_disp)
+                            di = _apply_affine_3d_x1(
+                                dkk, dii, djj, 0, affine_disp)
+                            dj = _apply_affine_3d_x2(
+                                dkk, dii, djj, 0, affine_disp)
+                        else:
+                            dk = dkk
+                            di = dii
+                            dj = djj
+
+                        if affine_idx_out is not None:
+                            dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
+                                                           affine_idx_out)
+                            dii = di + _apply_affine_3d_x1(k, i, j, 1,
+                                                           affine_idx_out)
+                            djj = dj + _apply_affine_3d_x2(k, i, j, 1,
+                                                           affine_idx_out)
+                        else:
+                            dkk = dk + k
+                            dii = di + i
+                            djj = dj + j
+
+                        inside = _interpolate_scalar_4d[floating](
+                            volumes, dkk, dii, djj, &warped[k, i, j, 0])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+    return np.asarray(warped)
+
+
+def warp_4d_nn(number[:, :, :, :] volumes, floating[:, :, :, :] d1,
+               double[:, :] affine_idx_in=None,
+               double[:, :] affine_idx_out=None,
+               double[:, :] affine_disp=None,
+               int[:] out_shape=None,
+               num_threads=None):
+    r"""Warps the volumes of a 4D image using nearest-neighbor interpolation
+
+    Deforms each 3D volume of the input 4D image under the given
+    transformation, like `warp_3d_nn`. The sampling location of each voxel is
+    computed only once and used for all the volumes.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image, whose N volumes are to be transformed
+    d1 : array, shape (S', R', C', 3)
+        the displacement field driving the transformation
+    affine_idx_in : array, shape (4, 4)
+        the matrix A in eq. (1) of `warp_3d_nn`
+    affine_idx_out : array, shape (4, 4)
+        the matrix B in eq. (1) of `warp_3d_nn`
+    affine_disp : array, shape (4, 4)
+        the matrix C in eq. (1) of `warp_3d_nn`
+    out_shape : array, shape (3,)
+        the number of slices, rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
+
+    Returns
+    -------
+    warped : array, shape = out_shape + (N,)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = volumes.shape[0]
+        cnp.npy_intp nrows = volumes.shape[1]
+        cnp.npy_intp ncols = volumes.shape[2]
+        cnp.npy_intp nvols = volumes.shape[3]
+        cnp.npy_intp i, j, k
+        int inside
+        double dkk, dii, djj, dk, di, dj
+
+    if not is_valid_affine(affine_idx_in, 3):
+        raise ValueError("Invalid inner index multiplication matrix")
+    if not is_valid_affine(affine_idx_out, 3):
+        raise ValueError("Invalid outer index multiplication matrix")
+    if not is_valid_affine(affine_disp, 3):
+        raise ValueError("Invalid displacement multiplication matrix")
+
+    if out_shape is not None:
+        nslices = out_shape[0]
+        nrows = out_shape[1]
+        ncols = out_shape[2]
+    elif d1 is not None:
+        nslices = d1.shape[0]
+        nrows = d1.shape[1]
+        ncols = d1.shape[2]
+
+    cdef number[:, :, :, ::1] warped = np.zeros(
+        shape=(nslices, nrows, ncols, nvols), dtype=np.asarray(volumes).dtype)
+    cdef floating[:, :] tmp = np.zeros(shape=(nslices, 3),
+                                       dtype=np.asarray(d1).dtype)
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine_idx_in is None:
+                            dkk = d1[k, i, j, 0]
+                            dii = d1[k, i, j, 1]
+                            djj = d1[k, i, j, 2]
+                        else:
+                            dk = _apply_affine_3d_x0(
+                                k, i, j, 1, affine_idx_in)
+                            di = _apply_affine_3d_x1(
+                                k, i, j, 1, affine_idx_in)
+                            dj = _apply_affine_3d_x2(
+                                k, i, j, 1, affine_idx_in)
+                            inside = _interpolate_vector_3d[floating](
+                                d1, dk, di, dj, &tmp[k, 0])
+                            dkk = tmp[k, 0]
+                            dii = tmp[k, 1]
+                            djj = tmp[k, 2]
+
+                        if affine_disp is not None:
+                            dk = _apply_affine_3d_x0(
+                                dkk, dii, djj, 0, affine_disp)
+                            di = _apply_affine_3d_x1(
+                                dkk, dii, djj, 0, affine_disp)
+                            dj = _apply_affine_3d_x2(
+                                dkk, dii, djj, 0, affine_disp)
+                        else:
+                            dk = dkk
+                            di = dii
+                            dj = djj
+
+                        if affine_idx_out is not None:
+                            dkk = dk + _apply_affine_3d_x0(k, i, j, 1,
+                                                           affine_idx_out)
+                            dii = di + _apply_affine_3d_x1(k, i, j, 1,
+                                                           affine_idx_out)
+                            djj = dj + _apply_affine_3d_x2(k, i, j, 1,
+                                                           affine_idx_out)
+                        else:
+                            dkk = dk + k
+                            dii = di + i
+                            djj = dj + j
+
+                        inside = _interpolate_scalar_nn_4d[number](
+                            volumes, dkk, dii, djj, &warped[k, i, j, 0])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+    return np.asarray(warped)
+
+
+def transform_4d_affine(floating[:, :, :, :] volumes, int[:] ref_shape,
+                        double[:, :] affine=None, num_threads=None):
+    r"""Transforms the volumes of a 4D image by an affine transform
+
+    Deforms each 3D volume of the input 4D image under the given affine
+    transformation using tri-linear interpolation, like
+    `transform_3d_affine`. The interpolation weights of each voxel are
+    computed only once and used for all the volumes.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image, whose N volumes are to be transformed
+    ref_shape : array, shape (3,)
+        the shape of the resulting volumes
+    affine : array, shape (4, 4)
+        the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
+
+    Returns
+    -------
+    out : array, shape (S', R', C', N)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = ref_shape[0]
+        cnp.npy_intp nrows = ref_shape[1]
+        cnp.npy_intp ncols = ref_shape[2]
+        cnp.npy_intp nvols = volumes.shape[3]
+        cnp.npy_intp i, j, k
+        double dkk, dii, djj
+        floating[:, :, :, ::1] out = np.zeros(
+            shape=(nslices, nrows, ncols, nvols),
+            dtype=np.asarray(volumes).dtype)
+
+    if not is_valid_affine(affine, 3):
+        raise ValueError("Invalid affine transform matrix")
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine is not None:
+                            dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
+                            dii = _apply_affine_3d_x1(k, i, j, 1, affine)
+                            djj = _apply_affine_3d_x2(k, i, j, 1, affine)
+                        else:
+                            dkk = k
+                            dii = i
+                            djj = j
+                        _interpolate_scalar_4d[floating](
+                            volumes, dkk, dii, djj, &out[k, i, j, 0])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+    return np.asarray(out)
+
+
+def transform_4d_affine_nn(number[:, :, :, :] volumes, int[:] ref_shape,
+                           double[:, :] affine=None, num_threads=None):
+    r"""Transforms the volumes of a 4D image by an affine transform with NN
+
+    Deforms each 3D volume of the input 4D image under the given affine
+    transformation using nearest neighbor interpolation, like
+    `transform_3d_affine_nn`. The sampled voxel is computed only once and
+    used for all the volumes.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the input 4D image, whose N volumes are to be transformed
+    ref_shape : array, shape (3,)
+        the shape of the resulting volumes
+    affine : array, shape (4, 4)
+        the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the slices are processed with. If None (default)
+        then all available threads will be used.
+
+    Returns
+    -------
+    out : array, shape (S', R', C', N)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = ref_shape[0]
+        cnp.npy_intp nrows = ref_shape[1]
+        cnp.npy_intp ncols = ref_shape[2]
+        cnp.npy_intp nvols = volumes.shape[3]
+        cnp.npy_intp i, j, k
+        double dkk, dii, djj
+        number[:, :, :, ::1] out = np.zeros(
+            shape=(nslices, nrows, ncols, nvols),
+            dtype=np.asarray(volumes).dtype)
+
+    if not is_valid_affine(affine, 3):
+        raise ValueError("Invalid affine transform matrix")
+
+    set_num_threads(num_threads)
+    try:
+        with nogil:
+
+            for k in prange(nslices, schedule='guided'):
+                for i in range(nrows):
+                    for j in range(ncols):
+                        if affine is not None:
+                            dkk = _apply_affine_3d_x0(k, i, j, 1, affine)
+                            dii = _apply_affine_3d_x1(k, i, j, 1, affine)
+                            djj = _apply_affine_3d_x2(k, i, j, 1, affine)
+                        else:
+                            dkk = k
+                            dii = i
+                            djj = j
+                        _interpolate_scalar_nn_4d[number](
+                            volumes, dkk, dii, djj, &out[k, i, j, 0])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(out)
 
 
@@ -2268,7 +2902,8 @@ def warp_2d(floating[:, :] image, floating[:, :, :] d1,
             double[:, :] affine_idx_in=None,
             double[:, :] affine_idx_out=None,
             double[:, :] affine_disp=None,
-            int[:] out_shape=None):
+            int[:] out_shape=None,
+            num_threads=None):
     r"""Warps a 2D image using bilinear interpolation
 
     Deforms the input image under the given transformation. The warped image
@@ -2294,6 +2929,9 @@ def warp_2d(floating[:, :] image, floating[:, :, :] d1,
         the matrix C in eq. (1) above
     out_shape : array, shape (2,)
         the number of rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the rows are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2338,51 +2976,60 @@ def warp_2d(floating[:, :] image, floating[:, :, :] d1,
         ncols = d1.shape[1]
     cdef floating[:, :] warped = np.zeros(shape=(nrows, ncols),
                                           dtype=np.asarray(image).dtype)
-    cdef floating[:] tmp = np.zeros(shape=(2,), dtype=np.asarray(d1).dtype)
-
-    with nogil:
+    cdef floating[:, :] tmp = np.zeros(shape=(nrows, 2),
+                                       dtype=np.asarray(d1).dtype)
 
-        for i in range(nrows):
-            for j in range(ncols):
-                # Apply inner index pre-multiplication
-                if affine_idx_in is None:
-                    dii = d1[i, j, 0]
-                    djj = d1[i, j, 1]
-                else:
-                    di = _apply_affine_2d_x0(
-                        i, j, 1, affine_idx_in)
-                    dj = _apply_affine_2d_x1(
-                        i, j, 1, affine_idx_in)
-                    _interpolate_vector_2d[floating](d1, di, dj, &tmp[0])
-                    dii = tmp[0]
-                    djj = tmp[1]
+    set_num_threads(num_threads)
+    try:
+        with nogil:
 
-                # Apply displacement multiplication
-                if affine_disp is not None:
-                    di = _apply_affine_2d_x0(
-                        dii, djj, 0, affine_disp)
-                    dj = _apply_affine_2d_x1(
-                        dii, djj, 0, affine_disp)
-                else:
-                    di = dii
-                    dj = djj
+            for i in prange(nrows, schedule='guided'):
+                for j in range(ncols):
+                    # Apply inner index pre-multiplication
+                    if affine_idx_in is None:
+                        dii = d1[i, j, 0]
+                        djj = d1[i, j, 1]
+                    else:
+                        di = _apply_affine_2d_x0(
+                            i, j, 1, affine_idx_in)
+                        dj = _apply_affine_2d_x1(
+                            i, j, 1, affine_idx_in)
+                        _interpolate_vector_2d[floating](d1, di, dj,
+                                                         &tmp[i, 0])
+                        dii = tmp[i, 0]
+                        djj = tmp[i, 1]
+
+                    # Apply displacement multiplication
+                    if affine_disp is not None:
+                        di = _apply_affine_2d_x0(
+                            dii, djj, 0, affine_disp)
+                        dj = _apply_affine_2d_x1(
+                            dii, djj, 0, affine_disp)
+                    else:
+                        di = dii
+                        dj = djj
 
-                # Apply outer index multiplication and add the displacements
-                if affine_idx_out is not None:
-                    dii = di + _apply_affine_2d_x0(i, j, 1, affine_idx_out)
-                    djj = dj + _apply_affine_2d_x1(i, j, 1, affine_idx_out)
-                else:
-                    dii = di + i
-                    djj = dj + j
+                    # Apply outer index multiplication and add the
+                    # displacements
+                    if affine_idx_out is not None:
+                        dii = di + _apply_affine_2d_x0(i, j, 1, affine_idx_out)
+                        djj = dj + _apply_affine_2d_x1(i, j, 1, affine_idx_out)
+                    else:
+                        dii = di + i
+                        djj = dj + j
 
-                # Interpolate the input image at the resulting location
-                _interpolate_scalar_2d[floating](image, dii, djj,
-                                                 &warped[i, j])
+                    # Interpolate the input image at the resulting location
+                    _interpolate_scalar_2d[floating](image, dii, djj,
+                                                     &warped[i, j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(warped)
 
 
 def transform_2d_affine(floating[:, :] image, int[:] ref_shape,
-                        double[:, :] affine=None):
+                        double[:, :] affine=None,
+                        num_threads=None):
     r"""Transforms a 2D image by an affine transform with bilinear interp.
 
     Deforms the input image under the given affine transformation using
@@ -2398,6 +3045,9 @@ def transform_2d_affine(floating[:, :] image, int[:] ref_shape,
         the shape of the resulting image
     affine : array, shape (3, 3)
         the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the rows are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2426,18 +3076,23 @@ def transform_2d_affine(floating[:, :] image, int[:] ref_shape,
     if not is_valid_affine(affine, 2):
         raise ValueError("Invalid affine transform matrix")
 
-    with nogil:
+    set_num_threads(num_threads)
+    try:
+        with nogil:
 
-        for i in range(nrows):
-            for j in range(ncols):
-                if affine is not None:
-                    dii = _apply_affine_2d_x0(i, j, 1, affine)
-                    djj = _apply_affine_2d_x1(i, j, 1, affine)
-                else:
-                    dii = i
-                    djj = j
-                _interpolate_scalar_2d[floating](image, dii, djj,
-                                                 &out[i, j])
+            for i in prange(nrows, schedule='guided'):
+                for j in range(ncols):
+                    if affine is not None:
+                        dii = _apply_affine_2d_x0(i, j, 1, affine)
+                        djj = _apply_affine_2d_x1(i, j, 1, affine)
+                    else:
+                        dii = i
+                        djj = j
+                    _interpolate_scalar_2d[floating](image, dii, djj,
+                                                     &out[i, j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(out)
 
 
@@ -2445,7 +3100,8 @@ def warp_2d_nn(number[:, :] image, floating[:, :, :] d1,
                double[:, :] affine_idx_in=None,
                double[:, :] affine_idx_out=None,
                double[:, :] affine_disp=None,
-               int[:] out_shape=None):
+               int[:] out_shape=None,
+               num_threads=None):
     r"""Warps a 2D image using nearest neighbor interpolation
 
     Deforms the input image under the given transformation. The warped image
@@ -2471,6 +3127,9 @@ def warp_2d_nn(number[:, :] image, floating[:, :, :] d1,
         the matrix C in eq. (1) above
     out_shape : array, shape (2,)
         the number of rows and columns of the sampling grid
+    num_threads : int, optional
+        Number of threads the rows are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2515,51 +3174,60 @@ def warp_2d_nn(number[:, :] image, floating[:, :, :] d1,
         ncols = d1.shape[1]
     cdef number[:, :] warped = np.zeros(shape=(nrows, ncols),
                                         dtype=np.asarray(image).dtype)
-    cdef floating[:] tmp = np.zeros(shape=(2,), dtype=np.asarray(d1).dtype)
+    cdef floating[:, :] tmp = np.zeros(shape=(nrows, 2),
+                                       dtype=np.asarray(d1).dtype)
 
-    with nogil:
-
-        for i in range(nrows):
-            for j in range(ncols):
-                # Apply inner index pre-multiplication
-                if affine_idx_in is None:
-                    dii = d1[i, j, 0]
-                    djj = d1[i, j, 1]
-                else:
-                    di = _apply_affine_2d_x0(
-                        i, j, 1, affine_idx_in)
-                    dj = _apply_affine_2d_x1(
-                        i, j, 1, affine_idx_in)
-                    _interpolate_vector_2d[floating](d1, di, dj, &tmp[0])
-                    dii = tmp[0]
-                    djj = tmp[1]
+    set_num_threads(num_threads)
+    try:
+        with nogil:
 
-                # Apply displacement multiplication
-                if affine_disp is not None:
-                    di = _apply_affine_2d_x0(
-                        dii, djj, 0, affine_disp)
-                    dj = _apply_affine_2d_x1(
-                        dii, djj, 0, affine_disp)
-                else:
-                    di = dii
-                    dj = djj
+            for i in prange(nrows, schedule='guided'):
+                for j in range(ncols):
+                    # Apply inner index pre-multiplication
+                    if affine_idx_in is None:
+                        dii = d1[i, j, 0]
+                        djj = d1[i, j, 1]
+                    else:
+                        di = _apply_affine_2d_x0(
+                            i, j, 1, affine_idx_in)
+                        dj = _apply_affine_2d_x1(
+                            i, j, 1, affine_idx_in)
+                        _interpolate_vector_2d[floating](d1, di, dj,
+                                                         &tmp[i, 0])
+                        dii = tmp[i, 0]
+                        djj = tmp[i, 1]
+
+                    # Apply displacement multiplication
+                    if affine_disp is not None:
+                        di = _apply_affine_2d_x0(
+                            dii, djj, 0, affine_disp)
+                        dj = _apply_affine_2d_x1(
+                            dii, djj, 0, affine_disp)
+                    else:
+                        di = dii
+                        dj = djj
 
-                # Apply outer index multiplication and add the displacements
-                if affine_idx_out is not None:
-                    dii = di + _apply_affine_2d_x0(i, j, 1, affine_idx_out)
-                    djj = dj + _apply_affine_2d_x1(i, j, 1, affine_idx_out)
-                else:
-                    dii = di + i
-                    djj = dj + j
+                    # Apply outer index multiplication and add the
+                    # displacements
+                    if affine_idx_out is not None:
+                        dii = di + _apply_affine_2d_x0(i, j, 1, affine_idx_out)
+                        djj = dj + _apply_affine_2d_x1(i, j, 1, affine_idx_out)
+                    else:
+                        dii = di + i
+                        djj = dj + j
 
-                # Interpolate the input image at the resulting location
-                _interpolate_scalar_nn_2d[number](image, dii, djj,
-                                                  &warped[i, j])
+                    # Interpolate the input image at the resulting location
+                    _interpolate_scalar_nn_2d[number](image, dii, djj,
+                                                      &warped[i, j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(warped)
 
 
 def transform_2d_affine_nn(number[:, :] image, int[:] ref_shape,
-                           double[:, :] affine=None):
+                           double[:, :] affine=None,
+                           num_threads=None):
     r"""Transforms a 2D image by an affine transform with NN interpolation
 
     Deforms the input image under the given affine transformation using
@@ -2575,6 +3243,9 @@ def transform_2d_affine_nn(number[:, :] image, int[:] ref_shape,
         the shape of the resulting image
     affine : array, shape (3, 3)
         the affine transform to be applied
+    num_threads : int, optional
+        Number of threads the rows are processed with. If None (default)
+        then all available threads will be used.
 
     Returns
     -------
@@ -2603,18 +3274,23 @@ def transform_2d_affine_nn(number[:, :] image, int[:] ref_shape,
     if not is_valid_affine(affine, 2):
         raise ValueError("Invalid affine transform matrix")
 
-    with nogil:
+    set_num_threads(num_threads)
+    try:
+        with nogil:
 
-        for i in range(nrows):
-            for j in range(ncols):
-                if affine is not None:
-                    dii = _apply_affine_2d_x0(i, j, 1, affine)
-                    djj = _apply_affine_2d_x1(i, j, 1, affine)
-                else:
-                    dii = i
-                    djj = j
-                _interpolate_scalar_nn_2d[number](image, dii, djj,
-                                                  &out[i, j])
+            for i in prange(nrows, schedule='guided'):
+                for j in range(ncols):
+                    if affine is not None:
+                        dii = _apply_affine_2d_x0(i, j, 1, affine)
+                        djj = _apply_affine_2d_x1(i, j, 1, affine)
+                    else:
+                        dii = i
+                        djj = j
+                    _interpolate_scalar_nn_2d[number](image, dii, djj,
+                                                      &out[i, j])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
     return np.asarray(out)
 
 
@@ -4,10 +4,13 @@ Only L-BFGS-B and Powell is supported in this class for versions of
 Scipy < 0.12. All optimizers are available for scipy >= 0.12.
 """
 import abc
+import os
 from distutils.version import LooseVersion
+from time import time
 import numpy as np
 import scipy
 import scipy.sparse as sps
+from scipy.sparse.linalg import LinearOperator
 import scipy.optimize as opt
 from dipy.utils.six import with_metaclass
 
@@ -275,6 +278,8 @@ def spdot(A, B):
     Parameters
     ----------
     A, B : arrays of shape (m, n), (n, k)
+        `A` may also be a ``scipy.sparse.linalg.LinearOperator``, such as a
+        `RowBlockMatrix`.
 
     Returns
     -------
@@ -284,7 +289,9 @@ def spdot(A, B):
     See discussion here:
     http://mail.scipy.org/pipermail/scipy-user/2010-November/027700.html
     """
-    if sps.issparse(A) and sps.issparse(B):
+    if isinstance(A, LinearOperator):
+        return A.dot(B)
+    elif sps.issparse(A) and sps.issparse(B):
         return A * B
     elif sps.issparse(A) and not sps.issparse(B):
         return (A * B).view(type=B.__class__)
@@ -300,7 +307,10 @@ def sparse_nnls(y, X,
                 non_neg=True,
                 check_error_iter=10,
                 max_error_checks=10,
-                converge_on_sse=0.99):
+                converge_on_sse=0.99,
+                h0=None,
+                rtol=None,
+                callback=None):
     """
 
     Solve y=Xh for h, using gradient descent, with X a sparse matrix
@@ -312,7 +322,8 @@ def sparse_nnls(y, X,
         The data. Needs to be dense.
 
     X : ndarray. May be either sparse or dense. Shape (N, M)
-       The regressors
+       The regressors. May also be a `RowBlockMatrix`, read by blocks of rows
+       from memory-mapped arrays.
 
     momentum : float, optional (default: 1).
         The persistence of the gradient.
@@ -335,14 +346,30 @@ def sparse_nnls(y, X,
       a percentage improvement in SSE that is required each time to say
       that things are still going well.
 
+    h0 : 1-d array of shape (M), optional
+        Initial estimate of the parameters, e.g. the result of a previous
+        fit, to warm start the gradient descent. Default: the origin.
+
+    rtol : float, optional
+        Stop as soon as the relative residual, ``|y - Xh| / |y|``, is below
+        this value. Default: no early stopping on the residual.
+
+    callback : callable, optional
+        Called after each iteration as ``callback(iteration, h, sse,
+        iteration_time)``, with `iteration_time` the time in seconds spent on
+        the iteration.
+
     Returns
     -------
     h_best : The best estimate of the parameters.
 
     """
     num_regressors = X.shape[1]
-    # Initialize the parameters at the origin:
-    h = np.zeros(num_regressors)
+    # Initialize the parameters at the origin, unless warm started:
+    if h0 is None:
+        h = np.zeros(num_regressors)
+    else:
+        h = np.array(h0, dtype=float)
     # If nothing good happens, we'll return that:
     h_best = h
     gradient = np.zeros(num_regressors)
@@ -351,13 +378,16 @@ def sparse_nnls(y, X,
     sse_best = np.inf   # This will keep track of the best performance so far
     count_bad = 0  # Number of times estimation error has gone up.
     error_checks = 0  # How many error checks have we done so far
+    y_norm = np.sqrt(np.dot(y, y))
+    # The residuals are computed once per iteration, as they are needed both
+    # for the gradient and the sum of squared error:
+    residuals = spdot(X, h) - y
 
     while 1:
+        tic = time()
         if iteration > 1:
-            # The sum of squared error given the current parameter setting:
-            sse = np.sum((y - spdot(X, h)) ** 2)
             # The gradient is (Kay 2008 supplemental page 27):
-            gradient = spdot(X.T, spdot(X, h) - y)
+            gradient = spdot(X.T, residuals)
             gradient += momentum * gradient
             # Normalize to unit-length
             unit_length_gradient = (gradient /
@@ -367,11 +397,17 @@ def sparse_nnls(y, X,
             if non_neg:
                 # Set negative values to 0:
                 h[h < 0] = 0
+            residuals = spdot(X, h) - y
+
+        # This calculates the sum of squared residuals at this point:
+        sse = np.dot(residuals, residuals)
+        if callback is not None:
+            callback(iteration, h, sse, time() - tic)
+        if rtol is not None and np.sqrt(sse) <= rtol * y_norm:
+            return h
 
         # Every once in a while check whether it's converged:
         if np.mod(iteration, check_error_iter):
-            # This calculates the sum of squared residuals at this point:
-            sse = np.sum((y - spdot(X, h)) ** 2)
             # Did we do better this time around?
             if sse < ss_residuals_min:
                 # Update your expectations about the minimum error:
@@ -393,6 +429,81 @@ def sparse_nnls(y, X,
         iteration += 1
 
 
+class RowBlockMatrix(LinearOperator):
+    """
+    A sparse matrix in compressed sparse row (CSR) format, multiplied by
+    blocks of rows.
+
+    The CSR arrays can be memory-mapped (see `save` and `load`), so that only
+    one block of rows is held in memory at a time. This allows
+    `sparse_nnls` to solve problems whose matrix doesn't fit in memory.
+
+    Parameters
+    ----------
+    data, indices, indptr : arrays
+        The CSR arrays of the matrix, as in ``scipy.sparse.csr_matrix``.
+    shape : tuple of 2 ints
+        The shape of the matrix.
+    block_size : int, optional
+        The number of rows multiplied at a time. Default: 100000.
+    """
+    def __init__(self, data, indices, indptr, shape, block_size=100000):
+        LinearOperator.__init__(self, data.dtype, tuple(shape))
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.block_size = block_size
+
+    @classmethod
+    def from_csr(cls, X, block_size=100000):
+        """Wrap a ``scipy.sparse`` matrix."""
+        X = sps.csr_matrix(X)
+        return cls(X.data, X.indices, X.indptr, X.shape, block_size)
+
+    def save(self, dirname):
+        """Save the CSR arrays as .npy files in the directory `dirname`."""
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        for name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(dirname, name + '.npy'), getattr(self, name))
+        np.save(os.path.join(dirname, 'shape.npy'), np.array(self.shape))
+
+    @classmethod
+    def load(cls, dirname, block_size=100000, mmap_mode='r'):
+        """Load a matrix saved with `save`, memory-mapping its arrays by
+        default."""
+        data, indices, indptr = [
+            np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode)
+            for name in ['data', 'indices', 'indptr']]
+        shape = np.load(os.path.join(dirname, 'shape.npy'))
+        return cls(data, indices, indptr, shape, block_size)
+
+    def _blocks(self):
+        """Generate the blocks of rows as ``(start, stop, csr_matrix)``."""
+        for start in range(0, self.shape[0], self.block_size):
+            stop = min(start + self.block_size, self.shape[0])
+            first, last = self.indptr[start], self.indptr[stop]
+            block = sps.csr_matrix((np.asarray(self.data[first:last]),
+                                    np.asarray(self.indices[first:last]),
+                                    self.indptr[start:stop + 1] - first),
+                                   shape=(stop - start, self.shape[1]))
+            yield start, stop, block
+
+    def _matvec(self, x):
+        x = np.ravel(x)
+        out = np.empty(self.shape[0], dtype=np.result_type(self.dtype, x))
+        for start, stop, block in self._blocks():
+            out[start:stop] = block.dot(x)
+        return out
+
+    def _rmatvec(self, x):
+        x = np.ravel(x)
+        out = np.zeros(self.shape[1], dtype=np.result_type(self.dtype, x))
+        for start, stop, block in self._blocks():
+            out += block.T.dot(x[start:stop])
+        return out
+
+
 class SKLearnLinearSolver(with_metaclass(abc.ABCMeta, object)):
     """
     Provide a sklearn-like uniform interface to algorithms that solve problems
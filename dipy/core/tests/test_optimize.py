@@ -1,8 +1,12 @@
+import shutil
+import tempfile
+
 import numpy as np
 import scipy.sparse as sps
 
 import numpy.testing as npt
-from dipy.core.optimize import Optimizer, SCIPY_LESS_0_12, sparse_nnls, spdot
+from dipy.core.optimize import (Optimizer, SCIPY_LESS_0_12, sparse_nnls,
+                                 spdot, RowBlockMatrix)
 import dipy.core.optimize as opt
 
 
@@ -165,5 +169,44 @@ def test_sparse_nnls():
     npt.assert_array_almost_equal(beta, beta_hat_sparse, decimal=1)
 
 
+def test_sparse_nnls_warm_start_and_early_stopping():
+    rng = np.random.RandomState(0)
+    beta = rng.rand(10)
+    X = rng.randn(1000, 10)
+    y = np.dot(X, beta)
+    iterations = []
+    beta_hat = sparse_nnls(y, X, rtol=0.1,
+                           callback=lambda i, h, sse, t: iterations.append(i))
+    residual = np.sqrt(np.sum((y - np.dot(X, beta_hat)) ** 2))
+    npt.assert_(residual <= 0.1 * np.sqrt(np.dot(y, y)))
+    npt.assert_equal(iterations, list(range(1, len(iterations) + 1)))
+
+    # Starting from the solution, it stops right away:
+    iterations = []
+    beta_hat = sparse_nnls(y, X, h0=beta, rtol=1e-10,
+                           callback=lambda i, h, sse, t: iterations.append(i))
+    npt.assert_array_equal(beta_hat, beta)
+    npt.assert_equal(iterations, [1])
+
+
+def test_row_block_matrix():
+    rng = np.random.RandomState(0)
+    X = sps.random(100, 20, density=0.1, format='csr', random_state=rng)
+    h = rng.rand(20)
+    r = rng.rand(100)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        RowBlockMatrix.from_csr(X).save(tmpdir)
+        X_blocks = RowBlockMatrix.load(tmpdir, block_size=7)
+        npt.assert_equal(X_blocks.shape, X.shape)
+        npt.assert_array_almost_equal(spdot(X_blocks, h), X.dot(h))
+        npt.assert_array_almost_equal(spdot(X_blocks.T, r), X.T.dot(r))
+        npt.assert_array_almost_equal(sparse_nnls(X.dot(h), X_blocks),
+                                      sparse_nnls(X.dot(h), X), decimal=3)
+        del X_blocks
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 if __name__ == '__main__':
     npt.run_module_suite()
@@ -2,10 +2,17 @@ import operator
 import numpy as np
 
 from abc import ABCMeta, abstractmethod
+from multiprocessing import cpu_count
+from warnings import warn
 
 from dipy.segment.metric import Metric
+from dipy.segment.metric import IdentityFeature
 from dipy.segment.metric import ResampleFeature
-from dipy.segment.metric import AveragePointwiseEuclideanMetric
+from dipy.segment.metric import (SumPointwiseEuclideanMetric,
+                                 AveragePointwiseEuclideanMetric,
+                                 MinimumAverageDirectFlipMetric,
+                                 CosineMetric)
+from dipy.utils.multiproc import fork_context
 
 
 class Identity:
@@ -386,6 +393,125 @@ class ClusterMapCentroid(ClusterMap):
         return [cluster.centroid for cluster in self.clusters]
 
 
+class TreeCluster(ClusterCentroid):
+    """ Provides functionalities for interacting with a node of a tree of
+    clusters.
+
+    Useful container to retrieve the indices of elements grouped together,
+    the cluster's centroid and its subclusters, i.e. the clusters obtained
+    by clustering its elements with a smaller threshold.
+
+    Parameters
+    ----------
+    threshold : float
+        Threshold used to obtain this cluster.
+    centroid : 2D array
+        Centroid of this cluster.
+    id : int
+        Id of this cluster among its siblings.
+    indices : list of int (optional)
+        Indices of the elements of this cluster.
+    refdata : list (optional)
+        Actual elements that clustered indices refer to.
+    """
+    def __init__(self, threshold, centroid, id=0, indices=None,
+                 refdata=Identity()):
+        super(TreeCluster, self).__init__(centroid, id, indices, refdata)
+        self.threshold = threshold
+        self.parent = None
+        self.children = []
+
+    def add(self, child):
+        """ Adds a subcluster to this cluster.
+
+        Parameters
+        ----------
+        child : `TreeCluster` object
+            Subcluster to add.
+        """
+        child.parent = self
+        self.children.append(child)
+
+    @property
+    def is_leaf(self):
+        return len(self.children) == 0
+
+
+class TreeClusterMap(ClusterMapCentroid):
+    """ Provides functionalities for interacting with a tree of clusters.
+
+    The root of the tree holds all the elements. The clusters of a level of
+    the tree partition the elements and are obtained by clustering with the
+    same threshold the elements of the clusters of the previous level.
+    Iterating or indexing this cluster map gives the clusters of the last
+    level, i.e. the leaves.
+
+    Parameters
+    ----------
+    root : `TreeCluster` object
+        Root of the tree.
+    refdata : list (optional)
+        Actual elements that clustered indices refer to.
+    """
+    def __init__(self, root, refdata=Identity()):
+        self.root = root
+        self.nb_levels = 1
+        cluster = root
+        while not cluster.is_leaf:
+            cluster = cluster.children[0]
+            self.nb_levels += 1
+
+        super(TreeClusterMap, self).__init__(refdata)
+        self._clusters = self.get_clusters(self.nb_levels - 1).clusters
+
+    @property
+    def refdata(self):
+        return self._refdata
+
+    @refdata.setter
+    def refdata(self, value):
+        if value is None:
+            value = Identity()
+
+        self._refdata = value
+        for cluster in self.iter_preorder():
+            cluster.refdata = self._refdata
+
+    def iter_preorder(self):
+        """ Iterates through the clusters of the tree, parents first. """
+        stack = [self.root]
+        while stack:
+            cluster = stack.pop()
+            yield cluster
+            stack.extend(cluster.children[::-1])
+
+    def get_clusters(self, level):
+        """ Gets the clusters of a level of the tree.
+
+        Parameters
+        ----------
+        level : int
+            Level of the tree, 0 being the root.
+
+        Returns
+        -------
+        `ClusterMapCentroid` object
+            Clusters of the given level.
+        """
+        if not 0 <= level < self.nb_levels:
+            raise ValueError("'level' must be between 0 and {0}."
+                             .format(self.nb_levels - 1))
+
+        clusters = [self.root]
+        for _ in range(level):
+            clusters = [child for cluster in clusters
+                        for child in cluster.children]
+
+        cluster_map = ClusterMapCentroid(self.refdata)
+        cluster_map.add_cluster(*clusters)
+        return cluster_map
+
+
 class Clustering(object):
     __metaclass__ = ABCMeta
 
@@ -411,6 +537,61 @@ class Clustering(object):
         raise NotImplementedError(msg)
 
 
+# QuickBundles instance and streamlines shared with the worker processes.
+# Metrics are extension types which can not always be pickled, so they are
+# inherited by the forked workers instead of being sent to them.
+_worker_quickbundles = None
+
+
+def _cluster_partition_worker(ordering):
+    """ Clusters a partition of the streamlines in a worker process. """
+    qb, streamlines = _worker_quickbundles
+    return qb._cluster_partition(streamlines, ordering)
+
+
+class _FeaturesMetric(Metric):
+    """ Computes the distance of a metric between already extracted
+    features. """
+    def __init__(self, metric):
+        super(_FeaturesMetric, self).__init__(IdentityFeature())
+        self.metric = metric
+
+    def are_compatible(self, shape1, shape2):
+        return self.metric.are_compatible(shape1, shape2)
+
+    def dist(self, features1, features2):
+        return self.metric.dist(features1, features2)
+
+
+def _centroid_metric(metric):
+    """ Metric comparing centroids, i.e. features, the way `metric` compares
+    the features it extracts from streamlines. """
+    if type(metric) in (SumPointwiseEuclideanMetric,
+                        AveragePointwiseEuclideanMetric,
+                        MinimumAverageDirectFlipMetric,
+                        CosineMetric):
+        return type(metric)(IdentityFeature())
+    return _FeaturesMetric(metric)
+
+
+def _align_features(metric, features, reference):
+    """ Returns `features`, flipped if it is then closer to `reference`.
+
+    The orientation is decided with the pointwise distance to `reference`
+    since `metric` may itself be invariant to the orientation (e.g. MDF).
+    """
+    if metric.feature.is_order_invariant:
+        return features
+    features = np.asarray(features)
+    reference = np.asarray(reference)
+    if features.shape != reference.shape:
+        return features
+    flipped = features[::-1]
+    if np.sum((flipped - reference)**2) < np.sum((features - reference)**2):
+        return flipped
+    return features
+
+
 class QuickBundles(Clustering):
     r""" Clusters streamlines using QuickBundles [Garyfallidis12]_.
 
@@ -433,6 +614,31 @@ class QuickBundles(Clustering):
         12 points.
     max_nb_clusters : int
         Limits the creation of bundles.
+    nbr_processes : int, optional
+        Number of processes used to cluster the streamlines. If 0 or None,
+        all the available cpus are used (Default: 1). See Notes.
+    partition_size : int, optional
+        Number of streamlines per partition when clustering with several
+        processes (Default: 100000).
+
+    Notes
+    -----
+    With the pointwise Euclidean metrics, including the default one, the
+    centroids are indexed by a grid over their centers of mass and those
+    which can not be within `threshold` of a streamline are not compared to
+    it. This speeds up the clustering when there are many bundles without
+    changing its result.
+
+    With several processes, the streamlines are split, following `ordering`,
+    in partitions of `partition_size` streamlines which are clustered
+    concurrently. The centroids of the partitions are then merged by a
+    second QuickBundles pass, using the same metric and threshold, and the
+    centroids of the merged clusters are the averages of the partial
+    centroids weighted by their sizes. The partitions do not depend on
+    `nbr_processes`, so the clustering is deterministic for a given
+    `ordering` and `partition_size`. It is identical to the sequential one
+    when there is a single partition. Parallel clustering requires the
+    worker processes to be forked.
 
     Examples
     --------
@@ -471,9 +677,12 @@ class QuickBundles(Clustering):
     """
 
     def __init__(self, threshold, metric="MDF_12points",
-                 max_nb_clusters=np.iinfo('i4').max):
+                 max_nb_clusters=np.iinfo('i4').max, nbr_processes=1,
+                 partition_size=100000):
         self.threshold = threshold
         self.max_nb_clusters = max_nb_clusters
+        self.nbr_processes = nbr_processes
+        self.partition_size = partition_size
 
         if isinstance(metric, Metric):
             self.metric = metric
@@ -500,11 +709,183 @@ class QuickBundles(Clustering):
         `ClusterMapCentroid` object
             Result of the clustering.
         """
+        nbr_processes = self.nbr_processes
+        if not nbr_processes:
+            nbr_processes = cpu_count()
+
+        if nbr_processes > 1:
+            cluster_map = self._cluster_parallel(streamlines, ordering,
+                                                 nbr_processes)
+        else:
+            from dipy.segment.clustering_algorithms import quickbundles
+            cluster_map = quickbundles(streamlines, self.metric,
+                                       threshold=self.threshold,
+                                       max_nb_clusters=self.max_nb_clusters,
+                                       ordering=ordering)
+
+        cluster_map.refdata = streamlines
+        return cluster_map
+
+    def _cluster_partition(self, streamlines, ordering):
+        """ Clusters a partition of the streamlines.
+
+        Returns the centroids of the clusters and the indices of their
+        streamlines.
+        """
         from dipy.segment.clustering_algorithms import quickbundles
         cluster_map = quickbundles(streamlines, self.metric,
                                    threshold=self.threshold,
                                    max_nb_clusters=self.max_nb_clusters,
                                    ordering=ordering)
-
-        cluster_map.refdata = streamlines
+        indices = [np.array(cluster.indices, dtype=np.intp)
+                   for cluster in cluster_map]
+        return cluster_map.centroids, indices
+
+    def _cluster_parallel(self, streamlines, ordering, nbr_processes):
+        global _worker_quickbundles
+
+        if ordering is None:
+            ordering = np.arange(len(streamlines))
+        ordering = np.asarray(list(ordering), dtype=np.intp)
+        partitions = [ordering[i:i + self.partition_size]
+                      for i in range(0, len(ordering), self.partition_size)]
+
+        if len(partitions) <= 1:
+            from dipy.segment.clustering_algorithms import quickbundles
+            return quickbundles(streamlines, self.metric,
+                                threshold=self.threshold,
+                                max_nb_clusters=self.max_nb_clusters,
+                                ordering=ordering)
+
+        context = fork_context()
+        if context is None:
+            warn("Parallel clustering requires worker processes to be "
+                 "forked. Clustering the partitions with a single process.")
+            results = [self._cluster_partition(streamlines, partition)
+                       for partition in partitions]
+        else:
+            _worker_quickbundles = (self, streamlines)
+            pool = context.Pool(min(nbr_processes, len(partitions)))
+            _worker_quickbundles = None
+            try:
+                # `map` returns the results in the order of the partitions.
+                results = pool.map(_cluster_partition_worker, partitions,
+                                   chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+
+        return self._merge_partitions(results)
+
+    def _merge_partitions(self, results):
+        """ Merges the clusters of the partitions with a second QuickBundles
+        pass over their centroids.
+        """
+        from dipy.segment.clustering_algorithms import quickbundles
+        centroids = [c for partial_centroids, _ in results
+                     for c in partial_centroids]
+        indices = [i for _, partial_indices in results
+                   for i in partial_indices]
+
+        metric = _centroid_metric(self.metric)
+        merged = quickbundles(centroids, metric,
+                              threshold=self.threshold,
+                              max_nb_clusters=self.max_nb_clusters)
+
+        cluster_map = ClusterMapCentroid()
+        for cluster in merged:
+            members = cluster.indices
+            sizes = np.array([len(indices[i]) for i in members], dtype=float)
+            # The centroid of the second pass can not serve as reference:
+            # with MDF, its members are averaged without being flipped.
+            reference = centroids[members[0]]
+            aligned = [_align_features(self.metric, centroids[i], reference)
+                       for i in members]
+            centroid = np.average(aligned, axis=0, weights=sizes)
+            cluster_indices = np.concatenate([indices[i] for i in members])
+            cluster_map.add_cluster(
+                ClusterCentroid(centroid.astype(cluster.centroid.dtype),
+                                id=cluster.id,
+                                indices=cluster_indices.tolist()))
         return cluster_map
+
+
+class QuickBundlesX(Clustering):
+    r""" Clusters streamlines using QuickBundles at several thresholds.
+
+    Produces in a single pass the clusterings of QuickBundles at decreasing
+    thresholds, organized as a tree. A streamline is first assigned to its
+    closest bundle at the largest threshold. It is then only compared with
+    the subbundles of that bundle at the next threshold, and so on. The
+    clustering at the largest threshold is identical to the one of
+    `QuickBundles`, the finer ones nest in the coarser ones.
+
+    Parameters
+    ----------
+    thresholds : list of float
+        Decreasing thresholds, one per level of the tree. A threshold is the
+        maximum distance from a bundle for a streamline to be still
+        considered as part of it.
+    metric : str or `Metric` object (optional)
+        The distance metric to use when comparing two streamlines. By default,
+        the Minimum average Direct-Flip (MDF) distance [Garyfallidis12]_ is
+        used and streamlines are automatically resampled so they have
+        12 points.
+
+    Examples
+    --------
+    >>> from dipy.segment.clustering import QuickBundlesX
+    >>> from dipy.data import get_data
+    >>> from nibabel import trackvis as tv
+    >>> streams, hdr = tv.read(get_data('fornix'))
+    >>> streamlines = [i[0] for i in streams]
+    >>> qbx = QuickBundlesX(thresholds=[20., 10., 5.])
+    >>> tree = qbx.cluster(streamlines)
+    >>> [len(tree.get_clusters(level)) for level in range(tree.nb_levels)]
+    [1, 1, 4, 14]
+    >>> list(map(len, tree.get_clusters(2)))
+    [61, 191, 47, 1]
+
+    References
+    ----------
+    .. [Garyfallidis12] Garyfallidis E. et al., QuickBundles a method for
+                        tractography simplification, Frontiers in Neuroscience,
+                        vol 6, no 175, 2012.
+    """
+
+    def __init__(self, thresholds, metric="MDF_12points"):
+        thresholds = list(thresholds)
+        if len(thresholds) == 0 or np.any(np.diff(thresholds) >= 0):
+            raise ValueError("'thresholds' must be strictly decreasing.")
+
+        self.thresholds = thresholds
+
+        if isinstance(metric, Metric):
+            self.metric = metric
+        elif metric == "MDF_12points":
+            feature = ResampleFeature(nb_points=12)
+            self.metric = AveragePointwiseEuclideanMetric(feature)
+        else:
+            raise ValueError("Unknown metric: {0}".format(metric))
+
+    def cluster(self, streamlines, ordering=None):
+        """ Clusters `streamlines` into bundles at every threshold.
+
+        Parameters
+        ----------
+        streamlines : list of 2D arrays
+            Each 2D array represents a sequence of 3D points (points, 3).
+        ordering : iterable of indices
+            Specifies the order in which data points will be clustered.
+
+        Returns
+        -------
+        `TreeClusterMap` object
+            Tree of the clusters, the clusters of the i-th threshold being at
+            level i+1.
+        """
+        from dipy.segment.clustering_algorithms import quickbundlesx
+        tree = quickbundlesx(streamlines, self.metric,
+                             thresholds=self.thresholds, ordering=ordering)
+        tree.refdata = streamlines
+        return tree
@@ -7,7 +7,8 @@ import numpy as np
 from cythonutils cimport Data2D, shape2tuple
 from metricspeed cimport Metric
 from clusteringspeed cimport ClustersCentroid, Centroid, QuickBundles
-from dipy.segment.clustering import ClusterMapCentroid, ClusterCentroid
+from dipy.segment.clustering import (ClusterMapCentroid, ClusterCentroid,
+                                     TreeCluster, TreeClusterMap)
 
 DTYPE = np.float32
 DEF BIGGEST_DOUBLE = 1.7976931348623157e+308  # np.finfo('f8').max
@@ -106,3 +107,99 @@ def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clust
         qb.update_step(cluster_id)
 
     return clusters_centroid2clustermap_centroid(qb.clusters)
+
+
+def quickbundlesx(streamlines, Metric metric, thresholds, ordering=None):
+    """ Clusters streamlines using QuickBundles at several thresholds at once.
+
+    Streamlines are clustered with QuickBundles at the first (largest)
+    threshold. Within each of these clusters, they are clustered again at the
+    next threshold and so on. At every level, a streamline is only compared
+    with the centroids of the subclusters of the cluster it has been assigned
+    to at the previous level.
+
+    Parameters
+    ----------
+    streamlines : list of 2D arrays
+        List of streamlines to cluster.
+    metric : `Metric` object
+        Tells how to compute the distance between two streamlines.
+    thresholds : list of double
+        Decreasing thresholds, one per level of the tree.
+    ordering : iterable of indices, optional
+        Iterate through `data` using the given ordering.
+
+    Returns
+    -------
+    `TreeClusterMap` object
+        Tree of the clusters, its root holds all the streamlines.
+    """
+    # Thresholds of np.inf and -np.inf are not supported, clip them to
+    # 'biggest_double' and 0 respectively.
+    levels = [BIGGEST_DOUBLE] + [max(min(t, BIGGEST_DOUBLE), 0)
+                                 for t in thresholds]
+
+    if ordering is None:
+        ordering = xrange(len(streamlines))
+
+    # Check if `ordering` or `streamlines` are empty
+    first_idx, ordering = peek(ordering)
+    if first_idx is None or len(streamlines) == 0:
+        return TreeClusterMap(TreeCluster(np.inf, np.zeros(0, dtype=DTYPE)))
+
+    features_shape = shape2tuple(metric.feature.c_infer_shape(streamlines[first_idx].astype(DTYPE)))
+
+    # Each node clusters the streamlines of a cluster of the previous level.
+    # The single cluster of the first node, with an infinite threshold, is
+    # the root of the tree.
+    nodes = [QuickBundles(features_shape, metric, levels[0])]
+    nodes_children = [[]]
+    cdef QuickBundles qb
+    cdef int idx, node, level, cluster_id
+    cdef int nb_levels = len(levels)
+
+    for idx in ordering:
+        streamline = streamlines[idx]
+        if not streamline.flags.writeable or streamline.dtype != DTYPE:
+            streamline = streamline.astype(DTYPE)
+
+        node = 0
+        for level in range(nb_levels):
+            qb = nodes[node]
+            cluster_id = qb.assignment_step(streamline, idx)
+            qb.update_step(cluster_id)
+
+            if level == nb_levels - 1:
+                break
+
+            # Subclusters of a new cluster are gathered in a new node.
+            children = nodes_children[node]
+            if cluster_id == len(children):
+                children.append(len(nodes))
+                nodes.append(QuickBundles(features_shape, metric, levels[level + 1]))
+                nodes_children.append([])
+
+            node = children[cluster_id]
+
+    root, = _tree_clusters(nodes, nodes_children, 0,
+                           [np.inf] + list(thresholds), 0)
+    return TreeClusterMap(root)
+
+
+def _tree_clusters(nodes, nodes_children, node, thresholds, level):
+    """ Converts the clusters of a node, and recursively their subclusters,
+    to `TreeCluster` objects. """
+    clusters = []
+    cluster_map = clusters_centroid2clustermap_centroid((<QuickBundles> nodes[node]).clusters)
+    for cluster in cluster_map:
+        tree_cluster = TreeCluster(thresholds[level], cluster.centroid,
+                                   id=cluster.id, indices=cluster.indices)
+        if level + 1 < len(thresholds):
+            for child in _tree_clusters(nodes, nodes_children,
+                                        nodes_children[node][cluster.id],
+                                        thresholds, level + 1):
+                tree_cluster.add(child)
+
+        clusters.append(tree_cluster)
+
+    return clusters
@@ -33,6 +33,28 @@ cdef class ClustersCentroid(Clusters):
     cdef int c_update(ClustersCentroid self, int id_cluster) nogil except -1
 
 
+cdef class CentroidsGrid(object):
+    cdef double cell_size
+    cdef int ndim
+    cdef int capacity
+    cdef int nb_cells
+    cdef long long* cells_coords
+    cdef int* cells_head
+    cdef char* cells_used
+    cdef int nb_clusters
+    cdef int* clusters_cell
+    cdef int* clusters_next
+    cdef int* clusters_prev
+    cdef int* candidates
+
+    cdef void c_clear(CentroidsGrid self) nogil
+    cdef void c_cell(CentroidsGrid self, Data2D features, long long* coords) nogil
+    cdef int c_find_cell(CentroidsGrid self, long long* coords, int insert) nogil except -2
+    cdef int c_grow(CentroidsGrid self) nogil except -1
+    cdef int c_update(CentroidsGrid self, int id_cluster, Data2D centroid) nogil except -1
+    cdef int c_candidates(CentroidsGrid self, Data2D features) nogil except -1
+
+
 cdef class QuickBundles(object):
     cdef Shape features_shape
     cdef Data2D features
@@ -41,7 +63,8 @@ cdef class QuickBundles(object):
     cdef Metric metric
     cdef double threshold
     cdef int max_nb_clusters
+    cdef CentroidsGrid grid
 
-    cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features) nogil except *
+    cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features, int prune=*) nogil except *
     cdef int assignment_step(QuickBundles self, Data2D datum, int datum_id) nogil except -1
     cdef void update_step(QuickBundles self, int cluster_id) nogil except *
@@ -4,15 +4,19 @@
 import numpy as np
 cimport numpy as cnp
 
-from libc.math cimport fabs
-from libc.stdlib cimport calloc, realloc, free
+from libc.math cimport fabs, floor
+from libc.stdlib cimport malloc, calloc, realloc, free
 from libc.string cimport memset
 from cythonutils cimport Data2D, Shape, shape2tuple, tuple2shape, same_shape
+from dipy.segment.metricspeed import (SumPointwiseEuclideanMetric,
+                                      AveragePointwiseEuclideanMetric,
+                                      MinimumAverageDirectFlipMetric)
 
 
 DTYPE = np.float32
 DEF BIGGEST_DOUBLE = 1.7976931348623157e+308  # np.finfo('f8').max
 DEF BIGGEST_INT = 2147483647  # np.iinfo('i4').max
+DEF GRID_MAX_NDIM = 3
 
 
 cdef class Clusters:
@@ -200,6 +204,292 @@ cdef class ClustersCentroid(Clusters):
         return Clusters.c_create_cluster(self)
 
 
+cdef inline unsigned long long hash_cell(long long* coords, int ndim) nogil:
+    """ FNV-1a hash of the coordinates of a cell. """
+    cdef:
+        int d
+        unsigned long long h = 14695981039346656037ULL
+
+    for d in range(ndim):
+        h = (h ^ <unsigned long long> coords[d]) * 1099511628211ULL
+
+    return h ^ (h >> 32)
+
+
+cdef class CentroidsGrid(object):
+    """ Provides a spatial index of the centroids of clusters.
+
+    The centroids are bucketed, according to their center of mass, in the
+    cells of a regular grid stored in a hash table. The centers of mass of
+    two sequential data whose pointwise Euclidean distances average to less
+    than `cell_size` are less than `cell_size` apart, hence in neighbouring
+    cells.
+
+    Parameters
+    ----------
+    cell_size : double
+        Size of the cells of the grid.
+    ndim : int
+        Number of dimensions of the points of the centroids (at most 3).
+    """
+    def __init__(CentroidsGrid self, double cell_size, int ndim):
+        if ndim < 1 or ndim > GRID_MAX_NDIM:
+            raise ValueError("'ndim' must be between 1 and {0}.".format(GRID_MAX_NDIM))
+
+        self.cell_size = cell_size
+        self.ndim = ndim
+        self.capacity = 64
+        self.nb_cells = 0
+        self.cells_coords = <long long*> malloc(self.capacity * GRID_MAX_NDIM * sizeof(long long))
+        self.cells_head = <int*> malloc(self.capacity * sizeof(int))
+        self.cells_used = <char*> calloc(self.capacity, sizeof(char))
+        self.nb_clusters = 0
+        self.clusters_cell = NULL
+        self.clusters_next = NULL
+        self.clusters_prev = NULL
+        self.candidates = NULL
+        if (self.cells_coords == NULL or self.cells_head == NULL or
+                self.cells_used == NULL):
+            raise MemoryError()
+
+    def __dealloc__(CentroidsGrid self):
+        free(self.cells_coords)
+        free(self.cells_head)
+        free(self.cells_used)
+        free(self.clusters_cell)
+        free(self.clusters_next)
+        free(self.clusters_prev)
+        free(self.candidates)
+
+    cdef void c_clear(CentroidsGrid self) nogil:
+        """ Removes all the cells and clusters from the grid. """
+        free(self.clusters_cell)
+        free(self.clusters_next)
+        free(self.clusters_prev)
+        free(self.candidates)
+        self.clusters_cell = NULL
+        self.clusters_next = NULL
+        self.clusters_prev = NULL
+        self.candidates = NULL
+        self.nb_clusters = 0
+        memset(self.cells_used, 0, self.capacity * sizeof(char))
+        self.nb_cells = 0
+
+    cdef void c_cell(CentroidsGrid self, Data2D features, long long* coords) nogil:
+        """ Computes the coordinates of the cell of the center of mass of
+        `features`. """
+        cdef:
+            cnp.npy_intp N = features.shape[0], n
+            int d
+            double com
+
+        for d in range(self.ndim):
+            com = 0
+            for n in range(N):
+                com += features[n, d]
+
+            coords[d] = <long long> floor(com / N / self.cell_size)
+
+    cdef int c_find_cell(CentroidsGrid self, long long* coords, int insert) nogil except -2:
+        """ Finds the slot of a cell in the hash table.
+
+        Returns -1 if the cell is not in the hash table, unless `insert` is
+        true in which case the cell is added to it.
+        """
+        cdef:
+            int d, slot, same
+            unsigned long long mask = self.capacity - 1
+
+        if insert and 2 * (self.nb_cells + 1) > self.capacity:
+            self.c_grow()
+            mask = self.capacity - 1
+
+        slot = hash_cell(coords, self.ndim) & mask
+        while self.cells_used[slot]:
+            same = 1
+            for d in range(self.ndim):
+                same &= self.cells_coords[slot * GRID_MAX_NDIM + d] == coords[d]
+
+            if same:
+                return slot
+
+            slot = (slot + 1) & mask
+
+        if not insert:
+            return -1
+
+        self.cells_used[slot] = 1
+        self.cells_head[slot] = -1
+        for d in range(self.ndim):
+            self.cells_coords[slot * GRID_MAX_NDIM + d] = coords[d]
+
+        self.nb_cells += 1
+        return slot
+
+    cdef int c_grow(CentroidsGrid self) nogil except -1:
+        """ Doubles the capacity of the hash table. """
+        cdef:
+            int i, d, slot, old_capacity = self.capacity
+            long long* old_coords = self.cells_coords
+            int* old_head = self.cells_head
+            char* old_used = self.cells_used
+            int* new_slots = <int*> malloc(old_capacity * sizeof(int))
+            unsigned long long mask
+
+        self.capacity *= 2
+        mask = self.capacity - 1
+        self.cells_coords = <long long*> malloc(self.capacity * GRID_MAX_NDIM * sizeof(long long))
+        self.cells_head = <int*> malloc(self.capacity * sizeof(int))
+        self.cells_used = <char*> calloc(self.capacity, sizeof(char))
+
+        if (new_slots == NULL or self.cells_coords == NULL or
+                self.cells_head == NULL or self.cells_used == NULL):
+            # Keep the hash table as it was
+            free(new_slots)
+            free(self.cells_coords)
+            free(self.cells_head)
+            free(self.cells_used)
+            self.capacity = old_capacity
+            self.cells_coords = old_coords
+            self.cells_head = old_head
+            self.cells_used = old_used
+            with gil:
+                raise MemoryError()
+
+        for i in range(old_capacity):
+            if not old_used[i]:
+                continue
+
+            slot = hash_cell(&old_coords[i * GRID_MAX_NDIM], self.ndim) & mask
+            while self.cells_used[slot]:
+                slot = (slot + 1) & mask
+
+            self.cells_used[slot] = 1
+            self.cells_head[slot] = old_head[i]
+            for d in range(self.ndim):
+                self.cells_coords[slot * GRID_MAX_NDIM + d] = old_coords[i * GRID_MAX_NDIM + d]
+
+            new_slots[i] = slot
+
+        for i in range(self.nb_clusters):
+            if self.clusters_cell[i] >= 0:
+                self.clusters_cell[i] = new_slots[self.clusters_cell[i]]
+
+        free(new_slots)
+        free(old_coords)
+        free(old_head)
+        free(old_used)
+        return 0
+
+    cdef int c_update(CentroidsGrid self, int id_cluster, Data2D centroid) nogil except -1:
+        """ Adds a cluster to the grid or moves it to the cell of its
+        updated centroid.
+
+        Parameters
+        ----------
+        id_cluster : int
+            Index of the cluster.
+        centroid : 2d array (float)
+            Centroid of the cluster.
+        """
+        cdef:
+            long long coords[GRID_MAX_NDIM]
+            int i, slot, old_slot
+            int* clusters_cell
+            int* clusters_next
+            int* clusters_prev
+            int* candidates
+
+        while id_cluster >= self.nb_clusters:
+            i = self.nb_clusters
+            clusters_cell = <int*> realloc(self.clusters_cell, (i+1)*sizeof(int))
+            if clusters_cell != NULL:
+                self.clusters_cell = clusters_cell
+            clusters_next = <int*> realloc(self.clusters_next, (i+1)*sizeof(int))
+            if clusters_next != NULL:
+                self.clusters_next = clusters_next
+            clusters_prev = <int*> realloc(self.clusters_prev, (i+1)*sizeof(int))
+            if clusters_prev != NULL:
+                self.clusters_prev = clusters_prev
+            candidates = <int*> realloc(self.candidates, (i+1)*sizeof(int))
+            if candidates != NULL:
+                self.candidates = candidates
+
+            if (clusters_cell == NULL or clusters_next == NULL or
+                    clusters_prev == NULL or candidates == NULL):
+                # The old buffers are still allocated, release them and
+                # leave an empty, but consistent, grid.
+                self.c_clear()
+                with gil:
+                    raise MemoryError()
+
+            self.clusters_cell[i] = -1
+            self.nb_clusters += 1
+
+        self.c_cell(centroid, coords)
+        slot = self.c_find_cell(coords, 1)
+        old_slot = self.clusters_cell[id_cluster]
+        if slot == old_slot:
+            return 0
+
+        # Unlink the cluster from its previous cell
+        if old_slot >= 0:
+            if self.clusters_prev[id_cluster] >= 0:
+                self.clusters_next[self.clusters_prev[id_cluster]] = self.clusters_next[id_cluster]
+            else:
+                self.cells_head[old_slot] = self.clusters_next[id_cluster]
+
+            if self.clusters_next[id_cluster] >= 0:
+                self.clusters_prev[self.clusters_next[id_cluster]] = self.clusters_prev[id_cluster]
+
+        # Link the cluster at the head of its new cell
+        self.clusters_prev[id_cluster] = -1
+        self.clusters_next[id_cluster] = self.cells_head[slot]
+        if self.cells_head[slot] >= 0:
+            self.clusters_prev[self.cells_head[slot]] = id_cluster
+
+        self.cells_head[slot] = id_cluster
+        self.clusters_cell[id_cluster] = slot
+        return 0
+
+    cdef int c_candidates(CentroidsGrid self, Data2D features) nogil except -1:
+        """ Collects in `self.candidates` the clusters whose centroid lies in
+        the cell of `features` or in a neighbouring one.
+
+        Returns
+        -------
+        int
+            Number of candidate clusters.
+        """
+        cdef:
+            long long coords[GRID_MAX_NDIM]
+            long long neighbour[GRID_MAX_NDIM]
+            int i, d, k, slot, nb_candidates = 0
+            int nb_neighbours = 1
+
+        self.c_cell(features, coords)
+        for d in range(self.ndim):
+            nb_neighbours *= 3
+
+        for i in range(nb_neighbours):
+            k = i
+            for d in range(self.ndim):
+                neighbour[d] = coords[d] + (k % 3) - 1
+                k /= 3
+
+            slot = self.c_find_cell(neighbour, 0)
+            if slot < 0:
+                continue
+
+            k = self.cells_head[slot]
+            while k >= 0:
+                self.candidates[nb_candidates] = k
+                nb_candidates += 1
+                k = self.clusters_next[k]
+
+        return nb_candidates
+
+
 cdef class QuickBundles(object):
     def __init__(QuickBundles self, features_shape, Metric metric, double threshold, int max_nb_clusters=BIGGEST_INT):
         self.metric = metric
@@ -210,13 +500,36 @@ cdef class QuickBundles(object):
         self.features = np.empty(features_shape, dtype=DTYPE)
         self.features_flip = np.empty(features_shape, dtype=DTYPE)
 
-    cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features) nogil except *:
+        # The pointwise Euclidean distances between two sequential data
+        # average to more than the distance between their centers of mass.
+        # With these metrics, the centroids are indexed by a grid so that
+        # only those which can be within `threshold` are compared.
+        self.grid = None
+        cell_size = 0
+        if type(metric) in (AveragePointwiseEuclideanMetric,
+                            MinimumAverageDirectFlipMetric):
+            cell_size = threshold
+        elif type(metric) is SumPointwiseEuclideanMetric:
+            cell_size = threshold / self.features_shape.dims[0]
+
+        if (0 < threshold < BIGGEST_DOUBLE and cell_size > 0 and
+                self.features_shape.ndim == 2 and
+                self.features_shape.dims[1] <= GRID_MAX_NDIM):
+            # Enlarge the cells slightly to be immune to rounding errors.
+            self.grid = CentroidsGrid(cell_size * (1 + 1e-6),
+                                      self.features_shape.dims[1])
+
+    cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features, int prune=1) nogil except *:
         """ Finds the nearest cluster of a datum given its `features` vector.
 
         Parameters
         ----------
         features : 2D array
             Features of a datum.
+        prune : int, optional
+            If true and the centroids are indexed by a grid, only the
+            clusters which can be within `threshold` are considered. The
+            nearest cluster is then exact only if it is within `threshold`.
 
         Returns
         -------
@@ -224,18 +537,32 @@ cdef class QuickBundles(object):
             Nearest cluster to `features` according to the given metric.
         """
         cdef:
-            cnp.npy_intp k
+            cnp.npy_intp i, k, nb_candidates
             double dist
             NearestCluster nearest_cluster
 
         nearest_cluster.id = -1
         nearest_cluster.dist = BIGGEST_DOUBLE
 
-        for k in range(self.clusters.c_size()):
+        if not prune or self.grid is None:
+            for k in range(self.clusters.c_size()):
+                dist = self.metric.c_dist(self.clusters.centroids[k].features, features)
+
+                # Keep track of the nearest cluster
+                if dist < nearest_cluster.dist:
+                    nearest_cluster.dist = dist
+                    nearest_cluster.id = k
+
+            return nearest_cluster
+
+        nb_candidates = self.grid.c_candidates(features)
+        for i in range(nb_candidates):
+            k = self.grid.candidates[i]
             dist = self.metric.c_dist(self.clusters.centroids[k].features, features)
 
-            # Keep track of the nearest cluster
-            if dist < nearest_cluster.dist:
+            # Candidates are not sorted, break ties as the exhaustive search
+            # does, i.e. in favour of the first cluster.
+            if dist < nearest_cluster.dist or (dist == nearest_cluster.dist and k < nearest_cluster.id):
                 nearest_cluster.dist = dist
                 nearest_cluster.id = k
 
@@ -265,6 +592,9 @@ cdef class QuickBundles(object):
             Data2D features_to_add = self.features
             NearestCluster nearest_cluster, nearest_cluster_flip
             Shape features_shape = self.metric.feature.c_infer_shape(datum)
+            # Pruning is exact only if the datum can be assigned to a new
+            # cluster when no cluster is within the threshold.
+            int prune = self.clusters.c_size() < self.max_nb_clusters
 
         # Check if datum is compatible with the metric
         if not same_shape(features_shape, self.features_shape):
@@ -278,12 +608,20 @@ cdef class QuickBundles(object):
 
         # Find nearest cluster to datum
         self.metric.feature.c_extract(datum, self.features)
-        nearest_cluster = self.find_nearest_cluster(self.features)
+        nearest_cluster = self.find_nearest_cluster(self.features, prune)
 
         # Find nearest cluster to s_i_flip if metric is not order invariant
         if not self.metric.feature.is_order_invariant:
             self.metric.feature.c_extract(datum[::-1], self.features_flip)
-            nearest_cluster_flip = self.find_nearest_cluster(self.features_flip)
+            nearest_cluster_flip = self.find_nearest_cluster(self.features_flip, prune)
+
+            # The orientation of the datum added to a new cluster depends on
+            # its nearest cluster, however far it is.
+            if (self.grid is not None and prune and
+                    not nearest_cluster.dist < self.threshold and
+                    not nearest_cluster_flip.dist < self.threshold):
+                nearest_cluster = self.find_nearest_cluster(self.features, 0)
+                nearest_cluster_flip = self.find_nearest_cluster(self.features_flip, 0)
 
             # If we found a lower distance using a flipped datum,
             #  add the flipped version instead
@@ -314,3 +652,5 @@ cdef class QuickBundles(object):
 
         """
         self.clusters.c_update(cluster_id)
+        if self.grid is not None:
+            self.grid.c_update(cluster_id, self.clusters.centroids[cluster_id].features)
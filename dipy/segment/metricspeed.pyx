@@ -2,10 +2,13 @@
 # cython: wraparound=False, cdivision=True, boundscheck=False
 
 import numpy as np
+cimport numpy as cnp
+from cython.parallel import prange
 
 from libc.math cimport sqrt, acos
 
-from cythonutils cimport tuple2shape, shape2tuple, same_shape
+from cythonutils cimport Data2D, Shape, tuple2shape, shape2tuple, same_shape
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 from featurespeed cimport IdentityFeature, ResampleFeature
 
 DEF biggest_double = 1.7976931348623157e+308  #  np.finfo('f8').max
@@ -365,7 +368,28 @@ cdef class CosineMetric(CythonMetric):
         return acos(cos_theta) / PI  # Normalized cosine distance
 
 
-cpdef distance_matrix(Metric metric, data1, data2=None):
+cdef _extract_features(Metric metric, data, Shape shape):
+    """ Extracts the features of every datum in `data`. """
+    cdef:
+        cnp.npy_intp i
+        float[:, :, :] features = np.empty((len(data),) + shape2tuple(shape),
+                                           dtype=np.float32)
+
+    for i in range(len(data)):
+        datum = data[i]
+        if not datum.flags.writeable or datum.dtype != np.float32:
+            datum = datum.astype(np.float32)
+
+        if not same_shape(metric.feature.c_infer_shape(datum), shape):
+            raise ValueError("All features do not have the same shape!")
+
+        metric.feature.c_extract(datum, features[i])
+
+    return features
+
+
+cpdef distance_matrix(Metric metric, data1, data2=None, out=None,
+                      callback=None, tile_size=1024, num_threads=None):
     """ Computes the distance matrix between two lists of sequential data.
 
     The distance matrix is obtained by computing the pairwise distance of all
@@ -382,31 +406,81 @@ cpdef distance_matrix(Metric metric, data1, data2=None):
         List of sequences of N-dimensional points.
     data2 : list of 2D arrays
         Llist of sequences of N-dimensional points.
+    out : 2D array, optional
+        Array of shape (len(data1), len(data2)), e.g. a `np.memmap`, in which
+        the distance matrix is written. If None and `callback` is None, a new
+        array is allocated.
+    callback : callable, optional
+        Called as ``callback(row, tile)`` for every tile of rows of the
+        distance matrix, `tile` holding the rows starting at `row`. `tile`
+        is only valid during the call, it is overwritten by the next tile.
+        Tiles can thus be processed or saved without holding the whole
+        matrix in memory.
+    tile_size : int, optional
+        Number of rows of the distance matrix computed at once
+        (Default: 1024).
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) then all available threads will be used.
 
     Returns
     -------
     2D array (double)
-        Distance matrix.
+        Distance matrix, `out` if provided. None if only `callback` is
+        provided.
+
+    Notes
+    -----
+    Features are extracted once for every sequence. The rows of a tile are
+    computed in parallel.
     """
-    cdef int i, j
+    cdef:
+        cnp.npy_intp i, j, row, nb_rows
+        cnp.npy_intp N = len(data1), M
+        float[:, :, :] features1, features2
+        double[:, ::1] tile_view
+
     if data2 is None:
         data2 = data1
 
-    shape = metric.feature.infer_shape(data1[0].astype(np.float32))
-    distance_matrix = np.zeros((len(data1), len(data2)), dtype=np.float64)
-    cdef:
-        Data2D features1 = np.empty(shape, np.float32)
-        Data2D features2 = np.empty(shape, np.float32)
-
-    for i in range(len(data1)):
-        datum1 = data1[i] if data1[i].flags.writeable and data1[i].dtype is np.float32 else data1[i].astype(np.float32)
-        metric.feature.c_extract(datum1, features1)
-        for j in range(len(data2)):
-            datum2 = data2[j] if data2[j].flags.writeable and data2[j].dtype is np.float32 else data2[j].astype(np.float32)
-            metric.feature.c_extract(datum2, features2)
-            distance_matrix[i, j] = metric.c_dist(features1, features2)
-
-    return distance_matrix
+    M = len(data2)
+    if out is None and callback is None:
+        out = np.zeros((N, M), dtype=np.float64)
+    elif out is not None and out.shape != (N, M):
+        raise ValueError("'out' must have shape {0}.".format((N, M)))
+
+    if N == 0 or M == 0:
+        return out
+
+    if tile_size < 1:
+        raise ValueError("'tile_size' must be positive.")
+
+    shape = metric.feature.c_infer_shape(data1[0].astype(np.float32))
+    features1 = _extract_features(metric, data1, shape)
+    features2 = features1 if data2 is data1 else _extract_features(metric, data2, shape)
+
+    tile = np.empty((min(tile_size, N), M), dtype=np.float64)
+    tile_view = tile
+
+    set_num_threads(num_threads)
+    try:
+        for row in range(0, N, tile_size):
+            nb_rows = min(tile_size, N - row)
+            with nogil:
+                for i in prange(nb_rows, schedule='guided'):
+                    for j in range(M):
+                        tile_view[i, j] = metric.c_dist(features1[row + i],
+                                                        features2[j])
+
+            if out is not None:
+                out[row:row + nb_rows] = tile[:nb_rows]
+            if callback is not None:
+                callback(row, tile[:nb_rows])
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+
+    return out
 
 
 cpdef double dist(Metric metric, datum1, datum2) except -1:
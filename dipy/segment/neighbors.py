@@ -0,0 +1,154 @@
+""" Nearest neighbours search among streamlines using the MDF distance. """
+import numpy as np
+from scipy.spatial import cKDTree
+
+from dipy.segment.metric import ResampleFeature
+
+
+class MDFIndex(object):
+    """ Provides nearest neighbours queries among a set of streamlines.
+
+    Streamlines are compared with the MDF (Minimum average Direct-Flip)
+    distance [Garyfallidis12]_ once resampled to `nb_points` points. The
+    resampled streamlines are indexed by a KD-tree over their flattened
+    coordinates, which is built once and can be queried many times without
+    scanning all the streamlines.
+
+    Parameters
+    ----------
+    streamlines : list of 2D arrays
+        Streamlines (sequences of 3D points) to index.
+    nb_points : int, optional
+        Number of points the streamlines are resampled to (Default: 12).
+    leafsize : int, optional
+        Number of points at which the KD-tree switches to brute-force
+        (Default: 16).
+
+    Notes
+    -----
+    The MDF distance is the average of the Euclidean distances between the
+    points of two streamlines, in the direct or in the flipped order. It is
+    bounded by the Euclidean distance between the flattened coordinates,
+    divided by `nb_points`. The KD-tree is queried with that bound in both
+    orientations, then the MDF distance of the candidates is computed exactly.
+    The results are therefore exact.
+
+    An index can be pickled, the KD-tree being rebuilt when unpickled.
+
+    References
+    ----------
+    .. [Garyfallidis12] Garyfallidis E. et al., QuickBundles a method for
+                        tractography simplification, Frontiers in Neuroscience,
+                        vol 6, no 175, 2012.
+    """
+    def __init__(self, streamlines, nb_points=12, leafsize=16):
+        self.nb_points = nb_points
+        self.leafsize = leafsize
+        self.features = self._extract(streamlines)
+        self._build()
+
+    def _build(self):
+        self._tree = cKDTree(self.features.reshape((len(self.features), -1)),
+                             leafsize=self.leafsize)
+
+    def _extract(self, streamlines):
+        feature = ResampleFeature(nb_points=self.nb_points)
+        features = np.empty((len(streamlines), self.nb_points, 3),
+                            dtype=np.float32)
+        for i, s in enumerate(streamlines):
+            features[i] = feature.extract(np.asarray(s))
+        return features
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getstate__(self):
+        return {'nb_points': self.nb_points, 'leafsize': self.leafsize,
+                'features': self.features}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def _mdf(self, feature, indices):
+        """ MDF distances between a resampled streamline and the indexed
+        streamlines `indices`. """
+        candidates = self.features[indices].astype(np.float64)
+        feature = feature.astype(np.float64)
+        direct = np.sqrt(((candidates - feature) ** 2).sum(-1)).mean(-1)
+        flipped = np.sqrt(((candidates - feature[::-1]) ** 2).sum(-1)).mean(-1)
+        return np.minimum(direct, flipped)
+
+    def _candidates(self, feature, radius):
+        """ Indices of the streamlines possibly within MDF distance `radius`
+        of a resampled streamline. """
+        # The MDF distance is at least the euclidean distance between the
+        # flattened streamlines divided by the number of points.
+        r = radius * self.nb_points
+        direct = self._tree.query_ball_point(feature.ravel(), r)
+        flipped = self._tree.query_ball_point(feature[::-1].ravel(), r)
+        return np.union1d(np.asarray(direct, dtype=np.intp),
+                          np.asarray(flipped, dtype=np.intp))
+
+    def query_radius(self, streamline, radius, return_distance=False):
+        """ Finds the streamlines within a MDF distance of a streamline.
+
+        Parameters
+        ----------
+        streamline : 2D array
+            Sequence of 3D points.
+        radius : float
+            Maximum MDF distance.
+        return_distance : bool, optional
+            If True, also return the distances (Default: False).
+
+        Returns
+        -------
+        indices : 1D array
+            Indices of the streamlines within `radius`, sorted by distance.
+        distances : 1D array
+            MDF distances of these streamlines, if `return_distance` is True.
+        """
+        feature = self._extract([streamline])[0]
+        indices = self._candidates(feature, radius)
+        distances = self._mdf(feature, indices)
+        keep = distances <= radius
+        indices, distances = indices[keep], distances[keep]
+        order = np.argsort(distances, kind='mergesort')
+        if return_distance:
+            return indices[order], distances[order]
+        return indices[order]
+
+    def query(self, streamline, k=1):
+        """ Finds the `k` streamlines closest to a streamline.
+
+        Parameters
+        ----------
+        streamline : 2D array
+            Sequence of 3D points.
+        k : int, optional
+            Number of neighbours (Default: 1).
+
+        Returns
+        -------
+        distances : 1D array
+            MDF distances of the `k` nearest streamlines, sorted.
+        indices : 1D array
+            Indices of the `k` nearest streamlines.
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.zeros(0), np.zeros(0, dtype=np.intp)
+
+        feature = self._extract([streamline])[0]
+        # The k nearest neighbours in the flattened space, in both
+        # orientations, bound the distance of the k nearest MDF neighbours.
+        _, direct = self._tree.query(feature.ravel(), k)
+        _, flipped = self._tree.query(feature[::-1].ravel(), k)
+        indices = np.union1d(np.atleast_1d(direct), np.atleast_1d(flipped))
+        bound = np.sort(self._mdf(feature, indices))[k - 1]
+
+        indices = self._candidates(feature, bound)
+        distances = self._mdf(feature, indices)
+        order = np.argsort(distances, kind='mergesort')[:k]
+        return distances[order], indices[order]
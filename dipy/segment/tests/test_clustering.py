@@ -5,6 +5,7 @@ import copy
 
 from dipy.segment.clustering import Cluster, ClusterCentroid
 from dipy.segment.clustering import ClusterMap, ClusterMapCentroid
+from dipy.segment.clustering import TreeCluster, TreeClusterMap
 from dipy.segment.clustering import Clustering
 
 from nose.tools import assert_equal, assert_true, assert_false
@@ -745,6 +746,39 @@ def test_cluster_map_centroid_comparison_with_int():
     assert_array_equal(list(clusters[subset][1]), clusters2_indices)
 
 
+def test_tree_cluster_map():
+    root = TreeCluster(np.inf, features, indices=[0, 1, 2, 3, 4])
+    for i, indices in enumerate([[0, 3], [1, 2, 4]]):
+        root.add(TreeCluster(10., features, id=i, indices=indices))
+
+    root.children[0].add(TreeCluster(5., features, indices=[0, 3]))
+    root.children[1].add(TreeCluster(5., features, id=0, indices=[1, 4]))
+    root.children[1].add(TreeCluster(5., features, id=1, indices=[2]))
+    assert_true(root.children[1].parent is root)
+    assert_false(root.is_leaf)
+    assert_true(root.children[1].children[1].is_leaf)
+
+    tree = TreeClusterMap(root)
+    assert_equal(tree.nb_levels, 3)
+    assert_equal(list(map(len, tree.get_clusters(0))), [5])
+    assert_equal(list(map(len, tree.get_clusters(1))), [2, 3])
+    assert_equal(list(map(len, tree.get_clusters(2))), [2, 2, 1])
+    assert_equal(type(tree.get_clusters(1)), ClusterMapCentroid)
+    assert_raises(ValueError, tree.get_clusters, 3)
+
+    # The clusters of the cluster map are the leaves of the tree
+    assert_equal(len(tree), 3)
+    assert_equal(tree.clusters_sizes(), [2, 2, 1])
+    assert_arrays_equal(tree.centroids, [features] * 3)
+    assert_equal(len(list(tree.iter_preorder())), 6)
+
+    # Setting the reference data propagates to all the clusters
+    tree.refdata = data
+    assert_arrays_equal(tree.root[:], data)
+    assert_arrays_equal(tree[2], [data[2]])
+    assert_arrays_equal(tree.get_clusters(1)[0], [data[0], data[3]])
+
+
 def test_subclassing_clustering():
     class SubClustering(Clustering):
         def cluster(self, data, ordering=None):
@@ -255,5 +255,46 @@ def test_distance_matrix():
                                                       data2[j]))
 
 
+def test_distance_matrix_tiles():
+    rng = np.random.RandomState(42)
+    data = [rng.rand(rng.randint(5, 20), 3) * 10 for _ in range(30)]
+    data2 = data[:12]
+    feature = dipymetric.ResampleFeature(nb_points=8)
+    metric = dipymetric.AveragePointwiseEuclideanMetric(feature)
+    expected = np.array([[dipymetric.dist(metric, d1, d2) for d2 in data2]
+                         for d1 in data])
+
+    for tile_size in [1, 7, 30, 100]:
+        for num_threads in [1, 2, None]:
+            D = dipymetric.distance_matrix(metric, data, data2,
+                                           tile_size=tile_size,
+                                           num_threads=num_threads)
+            assert_array_equal(D, expected)
+
+    # Distances written in a provided array
+    out = np.ones((len(data), len(data2)))
+    D = dipymetric.distance_matrix(metric, data, data2, out=out, tile_size=7)
+    assert_true(D is out)
+    assert_array_equal(out, expected)
+    assert_raises(ValueError, dipymetric.distance_matrix, metric, data, data2,
+                  out=np.zeros((len(data), len(data))))
+
+    # Tiles streamed to a callback
+    tiles = []
+
+    def callback(row, tile):
+        tiles.append((row, tile.copy()))
+
+    D = dipymetric.distance_matrix(metric, data, data2, callback=callback,
+                                   tile_size=7)
+    assert_equal(D, None)
+    assert_array_equal([row for row, _ in tiles], [0, 7, 14, 21, 28])
+    assert_array_equal(np.concatenate([tile for _, tile in tiles]), expected)
+
+    # Features of different shapes can not be compared
+    metric = dipymetric.SumPointwiseEuclideanMetric()
+    assert_raises(ValueError, dipymetric.distance_matrix, metric, data)
+
+
 if __name__ == '__main__':
     run_module_suite()
@@ -0,0 +1,72 @@
+import pickle
+
+import numpy as np
+from nose.tools import assert_equal
+from numpy.testing import (assert_array_equal, assert_array_almost_equal,
+                           run_module_suite)
+
+from dipy.segment.metric import ResampleFeature, mdf
+from dipy.segment.neighbors import MDFIndex
+
+
+def _random_streamlines(rng, nb_streamlines):
+    return [np.cumsum(rng.randn(rng.randint(5, 30), 3), axis=0)
+            for _ in range(nb_streamlines)]
+
+
+def _brute_force_mdf(streamlines, streamline, nb_points=12):
+    feature = ResampleFeature(nb_points=nb_points)
+    s = feature.extract(streamline)
+    return np.array([mdf(feature.extract(t), s) for t in streamlines])
+
+
+def test_mdf_index_query_radius():
+    rng = np.random.RandomState(42)
+    streamlines = _random_streamlines(rng, 200)
+    index = MDFIndex(streamlines)
+    assert_equal(len(index), 200)
+
+    for streamline in _random_streamlines(rng, 5) + streamlines[:2]:
+        expected = _brute_force_mdf(streamlines, streamline)
+        for radius in [2., 5., 10.]:
+            indices, distances = index.query_radius(streamline, radius,
+                                                    return_distance=True)
+            assert_array_equal(np.sort(indices),
+                               np.flatnonzero(expected <= radius))
+            assert_array_almost_equal(distances, expected[indices], 4)
+            assert_array_equal(np.diff(distances) >= 0, True)
+
+    # A flipped streamline is at distance 0
+    indices = index.query_radius(streamlines[3][::-1], 1e-3)
+    assert_array_equal(indices, [3])
+
+
+def test_mdf_index_query():
+    rng = np.random.RandomState(42)
+    streamlines = _random_streamlines(rng, 200)
+    index = MDFIndex(streamlines)
+
+    for streamline in _random_streamlines(rng, 5):
+        expected = _brute_force_mdf(streamlines, streamline)
+        for k in [1, 5, 20]:
+            distances, indices = index.query(streamline, k)
+            assert_array_almost_equal(distances, np.sort(expected)[:k], 4)
+            assert_array_almost_equal(expected[indices], distances, 4)
+
+    distances, indices = index.query(streamlines[0], k=500)
+    assert_equal(len(indices), 200)
+
+
+def test_mdf_index_pickle():
+    rng = np.random.RandomState(42)
+    streamlines = _random_streamlines(rng, 50)
+    index = MDFIndex(streamlines, nb_points=8)
+    index2 = pickle.loads(pickle.dumps(index))
+    assert_equal(index2.nb_points, 8)
+    assert_array_equal(index2.features, index.features)
+    assert_array_equal(index2.query_radius(streamlines[0], 5.),
+                       index.query_radius(streamlines[0], 5.))
+
+
+if __name__ == '__main__':
+    run_module_suite()
@@ -3,14 +3,15 @@ import itertools
 
 
 from nose.tools import assert_equal, assert_raises
-from numpy.testing import assert_array_equal, run_module_suite
+from numpy.testing import (assert_array_equal, assert_array_almost_equal,
+                           run_module_suite)
 from dipy.testing.memory import get_type_refcount
 from dipy.testing import assert_arrays_equal
 
-from dipy.segment.clustering import QuickBundles
+from dipy.segment.clustering import QuickBundles, QuickBundlesX
 
 import dipy.segment.metric as dipymetric
-from dipy.segment.clustering_algorithms import quickbundles
+from dipy.segment.clustering_algorithms import quickbundles, quickbundlesx
 import dipy.tracking.streamline as streamline_utils
 
 
@@ -163,6 +164,135 @@ def test_quickbundles_with_not_order_invariant_metric():
     assert_array_equal(clusters[0].centroid, streamline)
 
 
+def test_quickbundles_parallel():
+    rng = np.random.RandomState(42)
+    rdata = [d + rng.randn(*d.shape).astype(dtype)
+             for d in streamline_utils.set_number_of_points(data * 20, 10)]
+    ordering = rng.permutation(len(rdata))
+    clusters = QuickBundles(threshold=2*threshold).cluster(rdata, ordering)
+
+    # A single partition gives the sequential clustering.
+    qb = QuickBundles(threshold=2*threshold, nbr_processes=2)
+    clusters_parallel = qb.cluster(rdata, ordering)
+    assert_equal(clusters_parallel, clusters)
+    assert_arrays_equal(clusters_parallel.centroids, clusters.centroids)
+
+    # Partitions are merged deterministically, whatever the number of
+    # processes used.
+    results = []
+    for nbr_processes in [2, 3]:
+        qb = QuickBundles(threshold=2*threshold, nbr_processes=nbr_processes,
+                          partition_size=15)
+        results.append(qb.cluster(rdata, ordering))
+
+    assert_equal(results[0], results[1])
+    assert_arrays_equal(results[0].centroids, results[1].centroids)
+    assert_equal(results[0].refdata, rdata)
+    results[0].refdata = None
+    assert_array_equal(sorted(itertools.chain(*results[0])),
+                       range(len(rdata)))
+
+
+def test_quickbundles_parallel_flipped_partitions():
+    # Partitions holding oppositely oriented copies of the same bundle are
+    # merged into a single cluster whose centroid keeps one orientation.
+    streamline = np.arange(12*3, dtype=dtype).reshape((-1, 3))
+    streamlines = [streamline] * 3 + [streamline[::-1]] * 2
+
+    for metric in ["MDF_12points",
+                   dipymetric.MinimumAverageDirectFlipMetric()]:
+        qb = QuickBundles(threshold=2*threshold, metric=metric,
+                          nbr_processes=2, partition_size=3)
+        clusters = qb.cluster(streamlines)
+        assert_equal(len(clusters), 1)
+        assert_array_equal(clusters.clusters_sizes(), [5])
+        assert_array_equal(sorted(clusters[0].indices), range(5))
+        assert_array_almost_equal(clusters[0].centroid, streamline,
+                                  decimal=4)
+
+
+def test_quickbundles_centroids_pruning():
+    # With the pointwise Euclidean metrics, the centroids which can not be
+    # within the threshold are pruned. Subclasses defined in Python are not
+    # pruned and provide the exhaustive clustering.
+    class SumMetric(dipymetric.SumPointwiseEuclideanMetric):
+        pass
+
+    class AverageMetric(dipymetric.AveragePointwiseEuclideanMetric):
+        pass
+
+    class MDFMetric(dipymetric.MinimumAverageDirectFlipMetric):
+        pass
+
+    rng = np.random.RandomState(42)
+    streamlines = [np.cumsum(rng.randn(rng.randint(5, 30), 3), axis=0) +
+                   rng.rand(3) * 50 for _ in range(1000)]
+    streamlines = streamline_utils.set_number_of_points(streamlines, 12)
+    feature = dipymetric.ResampleFeature(nb_points=12)
+
+    for metric, exhaustive_metric, thresholds in [
+            (dipymetric.SumPointwiseEuclideanMetric(feature),
+             SumMetric(feature), [50, 100]),
+            (dipymetric.AveragePointwiseEuclideanMetric(feature),
+             AverageMetric(feature), [2, 5, 10]),
+            (dipymetric.MinimumAverageDirectFlipMetric(), MDFMetric(), [5])]:
+        for threshold in thresholds:
+            for max_nb_clusters in [np.iinfo('i4').max, 20]:
+                qb = QuickBundles(threshold, metric=metric,
+                                  max_nb_clusters=max_nb_clusters)
+                clusters = qb.cluster(streamlines)
+                qb = QuickBundles(threshold, metric=exhaustive_metric,
+                                  max_nb_clusters=max_nb_clusters)
+                expected = qb.cluster(streamlines)
+                assert_equal(clusters, expected)
+                assert_arrays_equal(clusters.centroids, expected.centroids)
+
+
+def test_quickbundlesx():
+    assert_raises(ValueError, QuickBundlesX, thresholds=[])
+    assert_raises(ValueError, QuickBundlesX, thresholds=[5., 10.])
+
+    metric = dipymetric.SumPointwiseEuclideanMetric()
+    tree = quickbundlesx([], metric, [10., 5.])
+    assert_equal(tree.nb_levels, 1)
+    assert_equal(len(tree.root), 0)
+
+    rng = np.random.RandomState(42)
+    streamlines = [np.cumsum(rng.randn(rng.randint(5, 30), 3), axis=0) +
+                   rng.rand(3) * 50 for _ in range(500)]
+    ordering = rng.permutation(len(streamlines))
+    thresholds = [30., 15., 5.]
+    tree = QuickBundlesX(thresholds).cluster(streamlines, ordering)
+    assert_equal(tree.nb_levels, 4)
+    assert_equal(tree.root.threshold, np.inf)
+    assert_equal(tree.refdata, streamlines)
+    assert_equal(len(tree), len(tree.get_clusters(3)))
+
+    # The first level is the clustering of QuickBundles
+    clusters = QuickBundles(thresholds[0]).cluster(streamlines, ordering)
+    assert_equal(tree.get_clusters(1), clusters)
+    assert_arrays_equal(tree.get_clusters(1).centroids, clusters.centroids)
+
+    tree.refdata = None
+    assert_array_equal(tree.root.indices, ordering)
+    metric = QuickBundles(threshold=0).metric
+    for level, threshold in enumerate(thresholds, start=1):
+        assert_array_equal(sorted(itertools.chain(*tree.get_clusters(level))),
+                           range(len(streamlines)))
+        # Subclusters are obtained by clustering their parent with
+        # QuickBundles.
+        for parent in tree.get_clusters(level - 1):
+            subclusters = quickbundles(streamlines, metric, threshold,
+                                       ordering=parent.indices)
+            assert_equal(list(subclusters), parent.children)
+            assert_equal([c.threshold for c in parent.children],
+                         [threshold] * len(parent.children))
+
+    # Finer levels have more clusters
+    sizes = [len(tree.get_clusters(level)) for level in range(4)]
+    assert_array_equal(np.diff(sizes) > 0, True)
+
+
 def test_quickbundles_memory_leaks():
     qb = QuickBundles(threshold=2*threshold)
 
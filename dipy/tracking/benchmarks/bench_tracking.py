@@ -0,0 +1,84 @@
+""" Benchmarks for local tracking
+
+Run all benchmarks with::
+
+    import dipy.tracking as dipytracking
+    dipytracking.bench()
+
+If you have doctests enabled by default in nose (with a noserc file or
+environment variable), and you have a numpy version <= 1.6.1, this will also
+run the doctests, let's hope they pass.
+
+Run this benchmark with:
+
+    nosetests -s --match '(?:^|[\\b_\\.//-])[Bb]ench' bench_tracking.py
+"""
+import numpy as np
+from numpy.testing import measure, assert_array_equal
+
+from dipy.data import get_sphere
+from dipy.direction import ProbabilisticDirectionGetter
+from dipy.tracking.local import (ActTissueClassifier, LocalTracking,
+                                 ParticleFilteringTracking)
+from dipy.tracking.utils import seeds_from_mask
+from dipy.utils.omp import cpu_count
+
+DATA = {}
+
+
+def setup():
+    global DATA
+    rng = np.random.RandomState(42)
+    sphere = get_sphere('repulsion100')
+    shape = (20, 20, 20)
+
+    wm = np.zeros(shape)
+    wm[2:-2, 2:-2, 2:-2] = 1
+    gm = np.zeros(shape)
+    gm[2:-2, 2:-2, -2] = 1
+    csf = np.ones(shape) - wm - gm
+    pmf = rng.random_sample(shape + (sphere.vertices.shape[0],))
+
+    DATA['dg'] = ProbabilisticDirectionGetter.from_pmf(pmf, 30, sphere)
+    DATA['tc'] = ActTissueClassifier.from_pve(wm, gm, csf)
+    DATA['seeds'] = seeds_from_mask(wm, density=1)
+
+
+def bench_particle_filtering_tracking():
+    repeat = 1
+    dg = DATA['dg']
+    tc = DATA['tc']
+    seeds = DATA['seeds']
+    nbr_processes = cpu_count()
+
+    def local(**kwargs):
+        return list(LocalTracking(dg, tc, seeds, np.eye(4), 0.5,
+                                  max_cross=1, random_seed=0, **kwargs))
+
+    def pft(**kwargs):
+        return list(ParticleFilteringTracking(dg, tc, seeds, np.eye(4), 0.5,
+                                              max_cross=1, random_seed=0,
+                                              **kwargs))
+
+    msg = "Timing tracking from {0:,} seeds."
+    print(msg.format(len(seeds)))
+    local_time = measure("local()", repeat)
+    print("LocalTracking time: {0:.3f} sec".format(local_time))
+
+    pft_time = measure("pft()", repeat)
+    print("ParticleFilteringTracking time: {0:.3f} sec".format(pft_time))
+    print("PFT slow down of {0:.2f}x".format(pft_time / local_time))
+
+    pft_time_parallel = measure("pft(nbr_processes=nbr_processes)", repeat)
+    print("ParticleFilteringTracking time ({0} processes): "
+          "{1:.3f} sec".format(nbr_processes, pft_time_parallel))
+    print("Speed up of {0:.2f}x".format(pft_time / pft_time_parallel))
+
+    # Make sure it produces the same results.
+    for s1, s2 in zip(pft(), pft(nbr_processes=nbr_processes)):
+        assert_array_equal(s1, s2)
+
+
+if __name__ == "__main__":
+    setup()
+    bench_particle_filtering_tracking()
@@ -6,13 +6,15 @@
 # cython: embedsignature=True
 
 cimport cython
+from cython.parallel import prange, parallel
 
-from libc.stdlib cimport calloc, realloc, free
+from libc.stdlib cimport calloc, malloc, realloc, free
 from libc.string cimport memcpy
 
 import time
 import numpy as np
 cimport numpy as cnp
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 
 cdef extern from "dpy_math.h" nogil:
@@ -450,9 +452,40 @@ def most_similar_track_mam(tracks,metric='avg'):
         track2others[j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
     return si, track2others
 
+def _pack_tracks(tracks):
+    """ Concatenate tracks into a single C-contiguous float32 array.
+
+    Returns
+    -------
+    points : array, shape (sum(Ni), 3)
+    offsets : array, shape (len(tracks),)
+        Index in `points` of the first point of each track.
+    lengths : array, shape (len(tracks),)
+        Number of points Ni of each track.
+    """
+    lengths = np.array([len(t) for t in tracks], dtype=np.intp)
+    offsets = np.zeros(len(tracks), dtype=np.intp)
+    if len(tracks) == 0:
+        return np.zeros((0, 3), dtype=f32_dt), offsets, lengths
+    offsets[1:] = np.cumsum(lengths)[:-1]
+    points = np.ascontiguousarray(np.concatenate(tracks), dtype=f32_dt)
+    return points, offsets, lengths
+
+
+def _check_out(out, shape):
+    """ Return the output distance matrix, allocated if `out` is None. """
+    if out is None:
+        return np.zeros(shape, dtype=np.double)
+    if out.shape != shape or out.dtype != np.double:
+        raise ValueError("out should be an array of float64 of shape "
+                         "{0}".format(shape))
+    return out
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def bundles_distances_mam(tracksA, tracksB, metric='avg'):
+def bundles_distances_mam(tracksA, tracksB, metric='avg', num_threads=None,
+                          out=None):
     ''' Calculate distances between list of tracks A and list of tracks B
 
     Parameters
@@ -463,6 +496,13 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
        of tracks as arrays, shape (N1,3) .. (Nm,3)
     metric : str
        'avg', 'min', 'max'
+    num_threads : int
+        Number of threads. If None (default) then all available threads
+        will be used.
+    out : array, shape (len(tracksA), len(tracksB)), optional
+        Array of float64 in which the distances are written, for example a
+        ``np.memmap`` for matrices that don't fit in memory. Default: a new
+        array is allocated.
 
     Returns
     -------
@@ -471,7 +511,7 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
 
     '''
     cdef:
-        size_t i, j, lentA, lentB
+        cnp.npy_intp i, j, lentA, lentB
         int metric_type
     if metric=='avg':
         metric_type = 0
@@ -481,57 +521,54 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
         metric_type = 2
     else:
         raise ValueError('Metric should be one of avg, min, max')
-    # preprocess tracks
-    cdef:
-        size_t longest_track_len = 0, track_len
-        size_t longest_track_lenA = 0, longest_track_lenB = 0
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
-    # process tracks to predictable memory layout, find longest track
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-        track_len = tracksA32[i].shape[0]
-        if track_len > longest_track_lenA:
-            longest_track_lenA = track_len
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-        track_len = tracksB32[i].shape[0]
-        if track_len > longest_track_lenB:
-            longest_track_lenB = track_len
-    if longest_track_lenB > longest_track_lenA:
-        longest_track_lenA = longest_track_lenB
-    # preallocate buffer array for track distance calculations
+    # process tracks to predictable memory layout
     cdef:
-        cnp.ndarray [cnp.float32_t, ndim=1] distances_buffer
-        cnp.float32_t *t1_ptr, *t2_ptr, *min_buffer
-    distances_buffer = np.zeros((longest_track_lenA*2,), dtype=np.float32)
-    min_buffer = <cnp.float32_t *> distances_buffer.data
-    # cycle over tracks
+        cnp.npy_intp longest_track_len = 0
+        cnp.float32_t[:, ::1] pointsA, pointsB
+        cnp.npy_intp[:] offsetsA, offsetsB, lengthsA, lengthsB
+        double[:, :] DM
+    pointsA, offsetsA, lengthsA = _pack_tracks(tracksA)
+    pointsB, offsetsB, lengthsB = _pack_tracks(tracksB)
+    lentA = lengthsA.shape[0]
+    lentB = lengthsB.shape[0]
+    out = _check_out(out, (lentA, lentB))
+    if lentA == 0 or lentB == 0:
+        return out
+    DM = out
+    longest_track_len = max(np.max(lengthsA), np.max(lengthsB))
+    # cycle over tracks, each thread using its own buffer for the track
+    # distance calculations
     cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        size_t t1_len, t2_len
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        t1_len = t1.shape[0]
-        t1_ptr = <cnp.float32_t *>t1.data
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            t2_len = t2.shape[0]
-            t2_ptr = <cnp.float32_t *>t2.data
-            DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
-
-    return DM
+        cnp.float32_t *min_buffer
+        cnp.npy_intp nb_failed = 0
+    set_num_threads(num_threads)
+    try:
+        with nogil, parallel():
+            min_buffer = <cnp.float32_t *> malloc(2 * longest_track_len *
+                                                  sizeof(cnp.float32_t))
+            for i in prange(lentA, schedule='guided'):
+                # The tracks of a thread without buffer are counted, so
+                # that the error is raised once the buffers are released
+                if min_buffer == NULL:
+                    nb_failed += 1
+                    continue
+                for j in range(lentB):
+                    DM[i, j] = czhang(lengthsA[i], &pointsA[offsetsA[i], 0],
+                                      lengthsB[j], &pointsB[offsetsB[j], 0],
+                                      min_buffer, metric_type)
+            free(min_buffer)
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+    if nb_failed:
+        raise MemoryError()
+
+    return out
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def bundles_distances_mdf(tracksA, tracksB):
+def bundles_distances_mdf(tracksA, tracksB, num_threads=None, out=None):
     ''' Calculate distances between list of tracks A and list of tracks B
 
     All tracks need to have the same number of points
@@ -542,6 +579,13 @@ def bundles_distances_mdf(tracksA, tracksB):
        of tracks as arrays, [(N,3) .. (N,3)]
     tracksB : sequence
        of tracks as arrays, [(N,3) .. (N,3)]
+    num_threads : int
+        Number of threads. If None (default) then all available threads
+        will be used.
+    out : array, shape (len(tracksA), len(tracksB)), optional
+        Array of float64 in which the distances are written, for example a
+        ``np.memmap`` for matrices that don't fit in memory. Default: a new
+        array is allocated.
 
     Returns
     -------
@@ -554,49 +598,32 @@ def bundles_distances_mdf(tracksA, tracksB):
 
     '''
     cdef:
-        size_t i, j, lentA, lentB
-    # preprocess tracks
-    cdef:
-        size_t longest_track_len = 0, track_len
-        longest_track_lenA, longest_track_lenB
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
+        cnp.npy_intp i, j, lentA, lentB, t_len
     # process tracks to predictable memory layout
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-    # preallocate buffer array for track distance calculations
     cdef:
-        cnp.float32_t *t1_ptr, *t2_ptr, *min_buffer
+        cnp.float32_t[:, ::1] pointsA, pointsB
+        cnp.npy_intp[:] offsetsA, offsetsB, lengthsA, lengthsB
+        double[:, :] DM
+    pointsA, offsetsA, lengthsA = _pack_tracks(tracksA)
+    pointsB, offsetsB, lengthsB = _pack_tracks(tracksB)
+    lentA = lengthsA.shape[0]
+    lentB = lengthsB.shape[0]
+    out = _check_out(out, (lentA, lentB))
+    if lentA == 0 or lentB == 0:
+        return out
+    DM = out
     # cycle over tracks
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        size_t t1_len, t2_len
-        float d[2]
-    t_len = tracksA32[0].shape[0]
+    t_len = lengthsA[0]
 
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        #t1_len = t1.shape[0]
-        t1_ptr = <cnp.float32_t *>t1.data
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            #t2_len = t2.shape[0]
-            t2_ptr = <cnp.float32_t *>t2.data
-            #DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
-            track_direct_flip_dist(t1_ptr, t2_ptr,t_len,<float *>d)
-            if d[0]<d[1]:
-                DM[i,j]=d[0]
-            else:
-                DM[i,j]=d[1]
-    return DM
+    set_num_threads(num_threads)
+    with nogil:
+        for i in prange(lentA, schedule='guided'):
+            for j in range(lentB):
+                DM[i, j] = track_mdf(&pointsA[offsetsA[i], 0],
+                                     &pointsB[offsetsB[j], 0], t_len)
+    if num_threads is not None:
+        restore_default_num_threads()
+    return out
 
 
 
@@ -1413,6 +1440,16 @@ cdef void track_direct_flip_dist(float *a,float *b,long rows,float *out) nogil:
     out[1]=distf/<float>rows
 
 
+cdef inline float track_mdf(float *a, float *b, long rows) nogil:
+    ''' Minimum of the direct and flipped average distances between two
+    tracks, see ``track_direct_flip_dist`` '''
+    cdef float d[2]
+    track_direct_flip_dist(a, b, rows, d)
+    if d[0] < d[1]:
+        return d[0]
+    return d[1]
+
+
 @cython.cdivision(True)
 cdef inline void track_direct_flip_3dist(float *a1, float *b1,float  *c1,float *a2, float *b2, float *c2, float *out) nogil:
     ''' Calculate the euclidean distance between two 3pt tracks
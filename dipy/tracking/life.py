@@ -6,7 +6,10 @@ Pestilli, F., Yeatman, J, Rokem, A. Kay, K. and Wandell B.A. (2014). Validation
 and statistical inference in living connectomes. Nature Methods 11:
 1058-1063. doi:10.1038/nmeth.3098
 """
+import os
+
 import numpy as np
+from numpy.lib.format import open_memmap
 import scipy.sparse as sps
 import scipy.linalg as la
 
@@ -15,6 +18,7 @@ from dipy.utils.six.moves import range
 from dipy.tracking.utils import unique_rows
 from dipy.tracking.streamline import transform_streamlines
 from dipy.tracking.vox2track import _voxel2streamline
+from dipy.core.sphere import HemiSphere
 import dipy.data as dpd
 import dipy.core.optimize as opt
 from dipy.testing import setup_test
@@ -254,6 +258,34 @@ class LifeSignalMaker(object):
 
         return self.signal[idx]
 
+    def signal_indices(self, xyz):
+        """
+        Indices into `self.signal` of the signals of many gradients, the
+        signals not already calculated being calculated.
+
+        Parameters
+        ----------
+        xyz : array of shape (n, 3)
+            The spatial gradients, e.g. along the nodes of streamlines.
+
+        Returns
+        -------
+        idx : array of shape (n,)
+            The index of the vertex of the sphere closest to each gradient.
+        """
+        idx = np.empty(len(xyz), dtype=np.intp)
+        # Find the closest vertices by chunks, to bound the memory used by the
+        # cosine similarities:
+        for start in range(0, len(xyz), 10000):
+            cos_sim = np.dot(xyz[start:start + 10000], self.sphere.vertices.T)
+            if isinstance(self.sphere, HemiSphere):
+                cos_sim = np.abs(cos_sim)
+            idx[start:start + 10000] = np.argmax(cos_sim, -1)
+
+        for this_idx in np.setdiff1d(idx, self._calculated):
+            self.calc_signal(self.sphere.vertices[this_idx])
+        return idx
+
     def streamline_signal(self, streamline):
         """
         Approximate the signal for a given streamline
@@ -265,6 +297,38 @@ class LifeSignalMaker(object):
         return sig_out
 
 
+def _packed_gradients(points, lengths):
+    """
+    Calculate the gradients of many streamlines along the spatial dimension
+
+    Equivalent to `streamline_gradients` for each streamline, the points of
+    all the streamlines being concatenated in `points`.
+
+    Parameters
+    ----------
+    points : array of shape (N, 3)
+        The concatenated 3d coordinates of the streamlines.
+    lengths : array of shape (S,)
+        The number of nodes of each streamline.
+
+    Returns
+    -------
+    Array of shape (N, 3): Spatial gradients along the nodes.
+    """
+    grad = np.zeros_like(points)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    # Central differences, the endpoints are overwritten below:
+    grad[1:-1] = (points[2:] - points[:-2]) / 2.0
+    # First differences at the endpoints:
+    first, last = starts[lengths > 1], ends[lengths > 1] - 1
+    grad[first] = points[first + 1] - points[first]
+    grad[last] = points[last] - points[last - 1]
+    # Single node streamlines have no gradient:
+    grad[starts[lengths == 1]] = 0
+    return grad
+
+
 def voxel2streamline(streamline, transformed=False, affine=None,
                      unique_idx=None):
     """
@@ -314,6 +378,19 @@ def voxel2streamline(streamline, transformed=False, affine=None,
                              unique_idx.astype(np.intp))
 
 
+def _rows_index(coords, unique_coords):
+    """
+    The index of each row of `coords` in `unique_coords`, which contains all
+    the rows of `coords` once.
+    """
+    low = unique_coords.min(0)
+    dims = unique_coords.max(0) - low + 1
+    ids = np.ravel_multi_index((coords - low).T, dims)
+    unique_ids = np.ravel_multi_index((unique_coords - low).T, dims)
+    sorter = np.argsort(unique_ids)
+    return sorter[np.searchsorted(unique_ids, ids, sorter=sorter)]
+
+
 class FiberModel(ReconstModel):
     """
     A class for representing and solving predictive models based on
@@ -337,7 +414,8 @@ class FiberModel(ReconstModel):
         # Initialize the super-class:
         ReconstModel.__init__(self, gtab)
 
-    def setup(self, streamline, affine, evals=[0.001, 0, 0], sphere=None):
+    def setup(self, streamline, affine, evals=[0.001, 0, 0], sphere=None,
+              matrix_dir=None, block_size=100000):
         """
         Set up the necessary components for the LiFE model: the matrix of
         fiber-contributions to the DWI signal, and the coordinates of voxels
@@ -359,69 +437,137 @@ class FiberModel(ReconstModel):
             gradients along the streamlines to calculate the matrix, instead of
             an approximation. Defaults to use the 724-vertex symmetric sphere
             from :mod:`dipy.data`
-        """
-        if sphere is not False:
-            SignalMaker = LifeSignalMaker(self.gtab,
-                                          evals=evals,
-                                          sphere=sphere)
+        matrix_dir : str (optional)
+            If given, the matrix is written block by block to memory-mapped
+            files in this directory (see `dipy.core.optimize.RowBlockMatrix`)
+            and is never held in memory as a whole. Only a few integers per
+            node of the streamlines are. With `sphere=False`, the signals of
+            the nodes are also kept in a file of this directory while the
+            matrix is built. Default: None.
+        block_size : int (optional)
+            Number of rows of the matrix built, and read when `matrix_dir` is
+            given, at a time. Default: 100000.
 
+        Returns
+        -------
+        life_matrix : `scipy.sparse.csr_matrix`, or
+            `dipy.core.optimize.RowBlockMatrix` if `matrix_dir` is given
+        vox_coords : array of shape (n, 3)
+            The coordinates of the voxels of the rows of the matrix.
+        """
         if affine is None:
             affine = np.eye(4)
         streamline = transform_streamlines(streamline, affine)
         # Assign some local variables, for shorthand:
+        lengths = np.array([len(s) for s in streamline], dtype=np.intp)
+        n_fibers = len(lengths)
         all_coords = np.concatenate(streamline)
-        vox_coords = unique_rows(np.round(all_coords).astype(np.intp))
-        del all_coords
+        node_coords = np.round(all_coords).astype(np.intp)
+        vox_coords = unique_rows(node_coords)
         # We only consider the diffusion-weighted signals:
         n_bvecs = self.gtab.bvals[~self.gtab.b0s_mask].shape[0]
-        v2f, v2fn = voxel2streamline(streamline, transformed=True,
-                                     affine=affine, unique_idx=vox_coords)
-        # How many fibers in each voxel (this will determine how many
-        # components are in the matrix):
-        n_unique_f = len(np.hstack(v2f.values()))
-        # Preallocate these, which will be used to generate the sparse
-        # matrix:
-        f_matrix_sig = np.zeros(n_unique_f * n_bvecs, dtype=np.float)
-        f_matrix_row = np.zeros(n_unique_f * n_bvecs, dtype=np.intp)
-        f_matrix_col = np.zeros(n_unique_f * n_bvecs, dtype=np.intp)
-
-        fiber_signal = []
-        for s_idx, s in enumerate(streamline):
-            if sphere is not False:
-                fiber_signal.append(SignalMaker.streamline_signal(s))
-            else:
-                fiber_signal.append(streamline_signal(s, self.gtab, evals))
+        if matrix_dir is not None and not os.path.isdir(matrix_dir):
+            os.makedirs(matrix_dir)
 
-        del streamline
+        # The signal of each node of the streamlines is the row
+        # node_sig_idx[node] of signal_table:
+        signal_fname = None
         if sphere is not False:
+            SignalMaker = LifeSignalMaker(self.gtab,
+                                          evals=evals,
+                                          sphere=sphere)
+            node_sig_idx = SignalMaker.signal_indices(
+                _packed_gradients(all_coords, lengths))
+            signal_table = SignalMaker.signal
             del SignalMaker
-
-        keep_ct = 0
-        range_bvecs = np.arange(n_bvecs).astype(int)
-        # In each voxel:
-        for v_idx in range(vox_coords.shape[0]):
-            mat_row_idx = (range_bvecs + v_idx * n_bvecs).astype(np.intp)
-            # For each fiber in that voxel:
-            for f_idx in v2f[v_idx]:
-                # For each fiber-voxel combination, store the row/column
-                # indices in the pre-allocated linear arrays
-                f_matrix_row[keep_ct:keep_ct+n_bvecs] = mat_row_idx
-                f_matrix_col[keep_ct:keep_ct+n_bvecs] = f_idx
-
-                vox_fiber_sig = np.zeros(n_bvecs)
-                for node_idx in v2fn[f_idx][v_idx]:
-                    # Sum the signal from each node of the fiber in that voxel:
-                    vox_fiber_sig += fiber_signal[f_idx][node_idx]
-                # And add the summed thing into the corresponding rows:
-                f_matrix_sig[keep_ct:keep_ct+n_bvecs] += vox_fiber_sig
-                keep_ct = keep_ct + n_bvecs
-
-        del v2f, v2fn
-        # Allocate the sparse matrix, using the more memory-efficient 'csr'
-        # format:
-        life_matrix = sps.csr_matrix((f_matrix_sig,
-                                     [f_matrix_row, f_matrix_col]))
-
+        else:
+            node_sig_idx = np.arange(len(all_coords))
+            if matrix_dir is None:
+                signal_table = np.concatenate(
+                    [streamline_signal(s, self.gtab, evals)
+                     for s in streamline])
+            else:
+                signal_fname = os.path.join(matrix_dir, 'node_signal.npy')
+                signal_table = open_memmap(signal_fname, mode='w+',
+                                           dtype=np.float64,
+                                           shape=(len(all_coords), n_bvecs))
+                for s, end in zip(streamline, np.cumsum(lengths)):
+                    signal_table[end - len(s):end] = \
+                        streamline_signal(s, self.gtab, evals)
+        del streamline, all_coords
+
+        # The voxel (row of vox_coords) and fiber of each node:
+        node_vox = _rows_index(node_coords, vox_coords)
+        node_fiber = np.repeat(np.arange(n_fibers), lengths)
+        del node_coords
+
+        # Group the nodes by voxel-fiber combination, each combination
+        # contributing the sum of the signals of its nodes:
+        vox_fiber = node_vox * n_fibers + node_fiber
+        del node_vox, node_fiber
+        order = np.argsort(vox_fiber, kind='mergesort')
+        vox_fiber = vox_fiber[order]
+        starts = np.flatnonzero(np.diff(vox_fiber)) + 1
+        starts = np.concatenate([[0], starts, [len(vox_fiber)]])
+        starts = starts.astype(np.intp)
+        v_idx, f_idx = np.divmod(vox_fiber[starts[:-1]], n_fibers)
+        del vox_fiber
+
+        # Row v * n_bvecs + b of the matrix holds the signals along bvec b of
+        # the fibers going through voxel v, in the order of the fibers:
+        n_vox = len(vox_coords)
+        shape = (n_vox * n_bvecs, f_idx.max() + 1)
+        vox_start = np.zeros(n_vox + 1, dtype=np.intp)
+        vox_start[1:] = np.cumsum(np.bincount(v_idx, minlength=n_vox))
+        nnz = vox_start[-1] * n_bvecs
+        index_dtype = np.int32 if max(nnz, shape[1]) < 2 ** 31 else np.int64
+        indptr = np.zeros(shape[0] + 1, dtype=index_dtype)
+        indptr[1:] = np.cumsum(np.repeat(np.diff(vox_start), n_bvecs))
+        if matrix_dir is None:
+            data = np.empty(nnz, dtype=np.float64)
+            indices = np.empty(nnz, dtype=index_dtype)
+        else:
+            data, indices = [
+                open_memmap(os.path.join(matrix_dir, name + '.npy'),
+                            mode='w+', dtype=dtype, shape=(nnz,))
+                for name, dtype in [('data', np.float64),
+                                    ('indices', index_dtype)]]
+
+        # Fill the matrix by blocks of voxels:
+        range_bvecs = np.arange(n_bvecs, dtype=np.intp)
+        vox_per_block = max(1, block_size // max(1, n_bvecs))
+        for v0 in range(0, n_vox, vox_per_block):
+            v1 = min(v0 + vox_per_block, n_vox)
+            p0, p1 = vox_start[v0], vox_start[v1]
+            n0, n1 = starts[p0], starts[p1]
+            node_sig = signal_table[node_sig_idx[order[n0:n1]]]
+            pair_sig = np.add.reduceat(node_sig, starts[p0:p1] - n0, axis=0)
+            del node_sig
+            # Position in data of the signal of each combination along each
+            # bvec:
+            pair_vox = v_idx[p0:p1]
+            n_pair_fibers = vox_start[pair_vox + 1] - vox_start[pair_vox]
+            first = (vox_start[pair_vox] * (n_bvecs - 1) +
+                     np.arange(p0, p1) - p0 * n_bvecs)
+            pos = first[:, None] + range_bvecs * n_pair_fibers[:, None]
+            block_data = np.empty((p1 - p0) * n_bvecs, dtype=np.float64)
+            block_indices = np.empty((p1 - p0) * n_bvecs, dtype=index_dtype)
+            block_data[pos] = pair_sig
+            block_indices[pos] = f_idx[p0:p1, None]
+            data[p0 * n_bvecs:p1 * n_bvecs] = block_data
+            indices[p0 * n_bvecs:p1 * n_bvecs] = block_indices
+            del pair_sig, block_data, block_indices
+
+        if matrix_dir is None:
+            life_matrix = sps.csr_matrix((data, indices, indptr), shape=shape)
+        else:
+            del data, indices, signal_table
+            if signal_fname is not None:
+                os.remove(signal_fname)
+            np.save(os.path.join(matrix_dir, 'indptr.npy'), indptr)
+            np.save(os.path.join(matrix_dir, 'shape.npy'), np.array(shape))
+            life_matrix = opt.RowBlockMatrix.load(matrix_dir,
+                                                  block_size=block_size)
         return life_matrix, vox_coords
 
     def _signals(self, data, vox_coords):
@@ -452,7 +598,8 @@ class FiberModel(ReconstModel):
                 vox_data)
 
     def fit(self, data, streamline, affine=None, evals=[0.001, 0, 0],
-            sphere=None):
+            sphere=None, beta0=None, matrix_dir=None, block_size=100000,
+            rtol=None, callback=None):
         """
         Fit the LiFE FiberModel for data and a set of streamlines associated
         with this data
@@ -480,6 +627,28 @@ class FiberModel(ReconstModel):
             gradients along the streamlines to calculate the matrix, instead of
             an approximation.
 
+        beta0 : array (optional)
+           Initial weights of the streamlines, e.g. the `beta` of a previous
+           fit, to warm start the solver. Default: zeros.
+
+        matrix_dir : str (optional)
+           If given, the LiFE matrix is built block by block in memory-mapped
+           files of this directory, from which the solver reads it by blocks of
+           `block_size` rows (see `FiberModel.setup`). Default: None.
+
+        block_size : int (optional)
+           Number of rows of the matrix built and read at a time.
+           Default: 100000.
+
+        rtol : float (optional)
+           Stop the solver when the relative residual of the fit is below this
+           value. Default: None.
+
+        callback : callable (optional)
+           Called after each iteration of the solver as
+           ``callback(iteration, beta, sse, iteration_time)``, see
+           :func:`dipy.core.optimize.sparse_nnls`.
+
         Returns
         -------
         FiberFit class instance
@@ -487,10 +656,12 @@ class FiberModel(ReconstModel):
         if affine is None:
             affine = np.eye(4)
         life_matrix, vox_coords = \
-            self.setup(streamline, affine, evals=evals, sphere=sphere)
+            self.setup(streamline, affine, evals=evals, sphere=sphere,
+                       matrix_dir=matrix_dir, block_size=block_size)
         (to_fit, weighted_signal, b0_signal, relative_signal, mean_sig,
          vox_data) = self._signals(data, vox_coords)
-        beta = opt.sparse_nnls(to_fit, life_matrix)
+        beta = opt.sparse_nnls(to_fit, life_matrix, h0=beta0, rtol=rtol,
+                               callback=callback)
         return FiberFit(self, life_matrix, vox_coords, to_fit, beta,
                         weighted_signal, b0_signal, relative_signal, mean_sig,
                         vox_data, streamline, affine, evals)
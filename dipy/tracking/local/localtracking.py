@@ -1,9 +1,15 @@
+import random
+from itertools import islice
+from multiprocessing import cpu_count
+from warnings import warn
+
 import numpy as np
 
 from dipy.tracking.local.localtrack import local_tracker, pft_tracker
 from dipy.tracking.local.tissue_classifier import ConstrainedTissueClassifier
 
 from dipy.align import Bunch
+from dipy.utils.multiproc import fork_context
 from dipy.tracking import utils
 
 
@@ -14,6 +20,34 @@ from dipy.tracking import utils
 TissueTypes = Bunch(OUTSIDEIMAGE=-1, INVALIDPOINT=0, TRACKPOINT=1, ENDPOINT=2)
 
 
+# Tracker shared with the worker processes. Direction getters and tissue
+# classifiers are extension types which can not be pickled, so the tracker is
+# inherited by the forked workers instead of being sent to them.
+_worker_tracker = None
+
+
+def _init_tracking_worker():
+    # Forked workers inherit the state of the random number generators,
+    # reseed them so that they do not all draw the same sequences.
+    random.seed()
+    np.random.seed()
+
+
+def _track_seeds_chunk(chunk):
+    """Tracks a chunk of ``(seed_index, seed)`` in a worker process.
+
+    Each worker process owns its copy of the tracker, hence of its
+    streamline and particle buffers.
+    """
+    tracker = _worker_tracker
+    F = np.empty((tracker.max_length + 1, 3), dtype=float)
+    B = F.copy()
+    streamlines = []
+    for i, s in chunk:
+        streamlines.extend(tracker._track_seed(i, s, F, B))
+    return streamlines
+
+
 class LocalTracking(object):
 
     @staticmethod
@@ -36,7 +70,7 @@ class LocalTracking(object):
 
     def __init__(self, direction_getter, tissue_classifier, seeds, affine,
                  step_size, max_cross=None, maxlen=500, fixedstep=True,
-                 return_all=True):
+                 return_all=True, random_seed=None, nbr_processes=1):
         """Creates streamlines by using local fiber-tracking.
 
         Parameters
@@ -69,6 +103,18 @@ class LocalTracking(object):
         return_all : bool
             If true, return all generated streamlines, otherwise only
             streamlines reaching end points or exiting the image.
+        random_seed : int or None
+            If not None, the random number generators (``random`` and
+            ``np.random``) are reset to ``random_seed + i`` before tracking
+            from the i-th seed, making the streamlines of a seed reproducible
+            independently of the number of processes used. The global state
+            of the generators is overwritten while iterating over the
+            streamlines and restored once the iteration is done.
+        nbr_processes : int
+            Number of processes used to track the seeds. If 0 or None, the
+            number of cores available is used. Streamlines are returned in the
+            same order as with a single process. Multiple processes are only
+            supported on platforms where processes are started by forking.
         """
 
         self.direction_getter = direction_getter
@@ -81,6 +127,7 @@ class LocalTracking(object):
         if maxlen < 1:
             raise ValueError("maxlen must be greater than 0.")
         self.affine = affine
+        self._inv_affine = np.linalg.inv(affine)
         self._voxel_size = np.ascontiguousarray(self._get_voxel_size(affine),
                                                 dtype=float)
         self.step_size = step_size
@@ -88,6 +135,8 @@ class LocalTracking(object):
         self.max_cross = max_cross
         self.max_length = maxlen
         self.return_all = return_all
+        self.random_seed = random_seed
+        self.nbr_processes = nbr_processes
 
     def _tracker(self, seed, first_step, streamline):
         return local_tracker(self.direction_getter,
@@ -106,39 +155,104 @@ class LocalTracking(object):
 
     def _generate_streamlines(self):
         """A streamline generator"""
+        nbr_processes = self.nbr_processes
+        if not nbr_processes:
+            nbr_processes = cpu_count()
+        context = fork_context() if nbr_processes > 1 else None
+        if nbr_processes > 1 and context is None:
+            warn("Parallel tracking requires worker processes to be forked. "
+                 "Tracking with a single process.")
+            nbr_processes = 1
 
-        # Get inverse transform (lin/offset) for seeds
-        inv_A = np.linalg.inv(self.affine)
-        lin = inv_A[:3, :3]
-        offset = inv_A[:3, 3]
+        if nbr_processes > 1:
+            streamlines = self._generate_streamlines_parallel(nbr_processes,
+                                                              context)
+        else:
+            streamlines = self._generate_streamlines_serial()
+        for streamline in streamlines:
+            yield streamline
 
+    def _generate_streamlines_serial(self):
         F = np.empty((self.max_length + 1, 3), dtype=float)
         B = F.copy()
-        for s in self.seeds:
-            s = np.dot(lin, s) + offset
-            directions = self.direction_getter.initial_direction(s)
-            if directions.size == 0 and self.return_all:
-                # only the seed position
-                yield [s]
-            directions = directions[:self.max_cross]
-            for first_step in directions:
-                stepsF, tissue_class = self._tracker(s, first_step, F)
-                if not (self.return_all or
-                        tissue_class == TissueTypes.ENDPOINT or
-                        tissue_class == TissueTypes.OUTSIDEIMAGE):
-                    continue
-                first_step = -first_step
-                stepsB, tissue_class = self._tracker(s, first_step, B)
-                if not (self.return_all or
-                        tissue_class == TissueTypes.ENDPOINT or
-                        tissue_class == TissueTypes.OUTSIDEIMAGE):
-                    continue
-                if stepsB == 1:
-                    streamline = F[:stepsF].copy()
-                else:
-                    parts = (B[stepsB - 1:0:-1], F[:stepsF])
-                    streamline = np.concatenate(parts, axis=0)
-                yield streamline
+        if self.random_seed is not None:
+            # The generators are reseeded for each seed, restore the state of
+            # the caller once the tracking is done.
+            random_state = random.getstate()
+            np_random_state = np.random.get_state()
+        try:
+            for i, s in enumerate(self.seeds):
+                for streamline in self._track_seed(i, s, F, B):
+                    yield streamline
+        finally:
+            if self.random_seed is not None:
+                random.setstate(random_state)
+                np.random.set_state(np_random_state)
+
+    def _generate_streamlines_parallel(self, nbr_processes, context):
+        global _worker_tracker
+
+        try:
+            nbr_seeds = len(self.seeds)
+        except TypeError:
+            nbr_seeds = None
+        if nbr_seeds:
+            chunk_size = int(np.ceil(nbr_seeds / float(nbr_processes ** 2)))
+        else:
+            chunk_size = 100
+        seeds = enumerate(self.seeds)
+        chunks = iter(lambda: list(islice(seeds, chunk_size)), [])
+
+        _worker_tracker = self
+        pool = context.Pool(nbr_processes, initializer=_init_tracking_worker)
+        _worker_tracker = None
+        try:
+            for streamlines in pool.imap(_track_seeds_chunk, chunks):
+                for streamline in streamlines:
+                    yield streamline
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _track_seed(self, seed_index, s, F, B):
+        """Returns the streamlines tracked from a single seed.
+
+        ``F`` and ``B`` are the buffers for the forward and backward tracking.
+        """
+        # Get inverse transform (lin/offset) for seeds
+        lin = self._inv_affine[:3, :3]
+        offset = self._inv_affine[:3, 3]
+
+        if self.random_seed is not None:
+            random.seed(self.random_seed + seed_index)
+            np.random.seed(self.random_seed + seed_index)
+
+        streamlines = []
+        s = np.dot(lin, s) + offset
+        directions = self.direction_getter.initial_direction(s)
+        if directions.size == 0 and self.return_all:
+            # only the seed position
+            streamlines.append([s])
+        directions = directions[:self.max_cross]
+        for first_step in directions:
+            stepsF, tissue_class = self._tracker(s, first_step, F)
+            if not (self.return_all or
+                    tissue_class == TissueTypes.ENDPOINT or
+                    tissue_class == TissueTypes.OUTSIDEIMAGE):
+                continue
+            first_step = -first_step
+            stepsB, tissue_class = self._tracker(s, first_step, B)
+            if not (self.return_all or
+                    tissue_class == TissueTypes.ENDPOINT or
+                    tissue_class == TissueTypes.OUTSIDEIMAGE):
+                continue
+            if stepsB == 1:
+                streamline = F[:stepsF].copy()
+            else:
+                parts = (B[stepsB - 1:0:-1], F[:stepsF])
+                streamline = np.concatenate(parts, axis=0)
+            streamlines.append(streamline)
+        return streamlines
 
 
 class ParticleFilteringTracking(LocalTracking):
@@ -146,7 +260,8 @@ class ParticleFilteringTracking(LocalTracking):
     def __init__(self, direction_getter, tissue_classifier, seeds, affine,
                  step_size, max_cross=None, maxlen=500,
                  pft_back_tracking_dist=2, pft_front_tracking_dist=1,
-                 pft_max_trial=20, particle_count=15, return_all=True):
+                 pft_max_trial=20, particle_count=15, return_all=True,
+                 random_seed=None, nbr_processes=1):
         r"""A streamline generator using the particle filtering tractography
         method [1]_.
 
@@ -192,6 +307,19 @@ class ParticleFilteringTracking(LocalTracking):
         return_all : bool
             If true, return all generated streamlines, otherwise only
             streamlines reaching end points or exiting the image.
+        random_seed : int or None
+            If not None, the random number generators (``random`` and
+            ``np.random``) are reset to ``random_seed + i`` before tracking
+            from the i-th seed, making the streamlines of a seed reproducible
+            independently of the number of processes used. The global state
+            of the generators is overwritten while iterating over the
+            streamlines and restored once the iteration is done.
+        nbr_processes : int
+            Number of processes used to track the seeds. If 0 or None, the
+            number of cores available is used. Each process holds its own
+            particle buffers, of size proportional to ``particle_count``.
+            Multiple processes are only supported on platforms where processes
+            are started by forking.
 
         References
         ----------
@@ -239,7 +367,9 @@ class ParticleFilteringTracking(LocalTracking):
                                                         max_cross,
                                                         maxlen,
                                                         True,
-                                                        return_all)
+                                                        return_all,
+                                                        random_seed,
+                                                        nbr_processes)
 
     def _tracker(self, seed, first_step, streamline):
         return pft_tracker(self.direction_getter,
@@ -8,6 +8,7 @@ from dipy.tracking.local import (BinaryTissueClassifier,
                                  ThresholdTissueClassifier,
                                  ActTissueClassifier,
                                  CmcTissueClassifier)
+from dipy.tracking.local.interpolation import trilinear_interpolate4d
 from dipy.tracking.local.localtracking import TissueTypes
 
 
@@ -152,6 +153,89 @@ def test_act_tissue_classifier():
         npt.assert_equal(state, TissueTypes.OUTSIDEIMAGE)
 
 
+def test_act_tissue_classifier_homogeneous_cells():
+    """This tests that the act tissue classifier returns the tissue types
+    of the interpolated maps, in and out of the homogeneous cells.
+    """
+    # Piecewise constant maps, with homogeneous regions and boundaries
+    np.random.seed(1234)
+    blocks = np.random.random((3, 3, 3, 3))
+    blocks /= blocks.sum(axis=-1)[..., None]
+    blocks[0, 0, 0] = [1, 0, 0]
+    blocks[1, 1, 1] = [0, 1, 0]
+    blocks[2, 2, 2] = [0, 0, 1]
+    blocks = blocks.repeat(3, axis=0).repeat(3, axis=1).repeat(3, axis=2)
+    gm, wm, csf = np.rollaxis(blocks, -1)
+
+    act_tc = ActTissueClassifier(include_map=gm, exclude_map=csf)
+
+    pts = np.random.random((5000, 3)) * (np.array(gm.shape) + 1) - 1
+    for pt in pts:
+        state = act_tc.check_point(pt)
+        try:
+            gm_res = trilinear_interpolate4d(gm[..., None], pt)[0]
+            csf_res = trilinear_interpolate4d(csf[..., None], pt)[0]
+        except IndexError:
+            npt.assert_equal(state, TissueTypes.OUTSIDEIMAGE)
+            continue
+        if gm_res > 0.5:
+            npt.assert_equal(state, TissueTypes.ENDPOINT)
+        elif csf_res > 0.5:
+            npt.assert_equal(state, TissueTypes.INVALIDPOINT)
+        else:
+            npt.assert_equal(state, TissueTypes.TRACKPOINT)
+
+
+def test_cmc_tissue_classifier_homogeneous_cells():
+    """This tests that the cmc tissue classifier returns the tissue types
+    drawn from the interpolated maps, in and out of the homogeneous cells.
+    """
+    np.random.seed(1234)
+    blocks = np.random.random((3, 3, 3, 3))
+    blocks /= blocks.sum(axis=-1)[..., None]
+    blocks[0, 0, 0] = [1, 0, 0]
+    blocks[1, 1, 1] = [0, 1, 0]
+    blocks[1, 1, 2] = [0, 1, 0]
+    blocks[2, 2, 2] = [0, 0, 1]
+    blocks = blocks.repeat(3, axis=0).repeat(3, axis=1).repeat(3, axis=2)
+    gm, wm, csf = np.rollaxis(blocks, -1)
+
+    correction_factor = 0.5
+    cmc_tc = CmcTissueClassifier(include_map=gm, exclude_map=csf,
+                                 step_size=correction_factor,
+                                 average_voxel_size=1)
+
+    def expected_state(pt):
+        try:
+            gm_res = trilinear_interpolate4d(gm[..., None], pt)[0]
+            csf_res = trilinear_interpolate4d(csf[..., None], pt)[0]
+        except IndexError:
+            return TissueTypes.OUTSIDEIMAGE
+        if gm_res + csf_res <= 0:
+            return TissueTypes.TRACKPOINT
+        num = max(0, 1 - gm_res - csf_res)
+        p = (num / (num + gm_res + csf_res)) ** correction_factor
+        if np.random.random() < p:
+            return TissueTypes.TRACKPOINT
+        if np.random.random() < gm_res / (gm_res + csf_res):
+            return TissueTypes.ENDPOINT
+        return TissueTypes.INVALIDPOINT
+
+    # Random points in the white matter only cells
+    pts = np.random.random((1000, 3)) * 2 + 3
+    pts[500:, 2] += 3
+    # Random points everywhere
+    pts = np.concatenate([pts, np.random.random((5000, 3)) *
+                          (np.array(gm.shape) + 1) - 1])
+    for i, pt in enumerate(pts):
+        np.random.seed(i)
+        state = cmc_tc.check_point(pt)
+        np.random.seed(i)
+        npt.assert_equal(state, expected_state(pt))
+        if i < 1000:
+            npt.assert_equal(state, TissueTypes.TRACKPOINT)
+
+
 def test_cmc_tissue_classifier():
     """This tests that the cmc tissue classifier returns expected
      tissue types.
@@ -9,7 +9,8 @@ from dipy.direction import (DeterministicMaximumDirectionGetter,
                             PeaksAndMetrics,
                             ProbabilisticDirectionGetter)
 from dipy.tracking.local import (ActTissueClassifier, BinaryTissueClassifier,
-                                 LocalTracking, ParticleFilteringTracking,
+                                 CmcTissueClassifier, LocalTracking,
+                                 ParticleFilteringTracking,
                                  ThresholdTissueClassifier)
 from dipy.tracking.local.interpolation import trilinear_interpolate4d
 from dipy.tracking.local.localtracking import TissueTypes
@@ -409,6 +410,77 @@ def test_particle_filtering_tractography():
         lambda: ParticleFilteringTracking(dg, tc, seeds, np.eye(4), step_size,
                                           particle_count=-1))
 
+
+def test_particle_filtering_tractography_parallel():
+    """This tests that the ParticleFilteringTracking is reproducible with a
+    fixed random seed, whatever the number of processes used.
+    """
+    sphere = get_sphere('repulsion100')
+    step_size = 0.2
+
+    simple_wm = np.zeros((5, 6, 5))
+    simple_wm[1:4, 1:4, 1:4] = 1
+    simple_gm = np.zeros(simple_wm.shape)
+    simple_gm[1:4, 4, 1:4] = 1
+    simple_csf = np.ones(simple_wm.shape) - simple_wm - simple_gm
+    tc = ActTissueClassifier.from_pve(simple_wm, simple_gm, simple_csf)
+    seeds = seeds_from_mask(simple_wm, density=2)
+
+    np.random.seed(0)
+    pmf = np.random.random(simple_wm.shape + (sphere.vertices.shape[0],))
+    dg = ProbabilisticDirectionGetter.from_pmf(pmf, 60, sphere)
+
+    def pft(**kwargs):
+        return list(ParticleFilteringTracking(dg, tc, seeds, np.eye(4),
+                                              step_size, max_cross=1,
+                                              pft_back_tracking_dist=1,
+                                              pft_front_tracking_dist=0.5,
+                                              **kwargs))
+
+    serial = pft(random_seed=42)
+    npt.assert_equal(len(serial), len(seeds))
+    for streamlines in [pft(random_seed=42),
+                        pft(random_seed=42, nbr_processes=2)]:
+        npt.assert_equal(len(streamlines), len(serial))
+        for s1, s2 in zip(streamlines, serial):
+            npt.assert_array_equal(s1, s2)
+
+    # Streamlines of a seed do not depend on the other seeds
+    subset = list(ParticleFilteringTracking(dg, tc, seeds[1:], np.eye(4),
+                                            step_size, max_cross=1,
+                                            pft_back_tracking_dist=1,
+                                            pft_front_tracking_dist=0.5,
+                                            random_seed=43))
+    for s1, s2 in zip(subset, serial[1:]):
+        npt.assert_array_equal(s1, s2)
+
+    # The Cmc tissue classifier draws its stopping decisions from np.random
+    cmc_tc = CmcTissueClassifier.from_pve(simple_wm, simple_gm, simple_csf,
+                                          step_size=step_size,
+                                          average_voxel_size=1)
+    random_state = np.random.get_state()
+    cmc_serial = list(ParticleFilteringTracking(dg, cmc_tc, seeds, np.eye(4),
+                                                step_size, max_cross=1,
+                                                random_seed=42))
+    npt.assert_equal(np.random.get_state()[1], random_state[1])
+    for nbr_processes in [1, 2]:
+        cmc_streamlines = list(ParticleFilteringTracking(
+            dg, cmc_tc, seeds, np.eye(4), step_size, max_cross=1,
+            random_seed=42, nbr_processes=nbr_processes))
+        npt.assert_equal(len(cmc_streamlines), len(cmc_serial))
+        for s1, s2 in zip(cmc_streamlines, cmc_serial):
+            npt.assert_array_equal(s1, s2)
+
+    local_serial = list(LocalTracking(dg, tc, seeds, np.eye(4), step_size,
+                                      max_cross=1, random_seed=0))
+    local_parallel = list(LocalTracking(dg, tc, seeds, np.eye(4), step_size,
+                                        max_cross=1, random_seed=0,
+                                        nbr_processes=3))
+    npt.assert_equal(len(local_parallel), len(local_serial))
+    for s1, s2 in zip(local_parallel, local_serial):
+        npt.assert_array_equal(s1, s2)
+
+
 def test_maximum_deterministic_tracker():
     """This tests that the Maximum Deterministic Direction Getter plays nice
     LocalTracking and produces reasonable streamlines in a simple example.
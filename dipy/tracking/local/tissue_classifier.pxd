@@ -31,6 +31,8 @@ cdef class ThresholdTissueClassifier(TissueClassifier):
 cdef class ConstrainedTissueClassifier(TissueClassifier):
     cdef:
         double[:, :, :] include_map, exclude_map
+        signed char[:, :, :] cell_lut
+    cdef int lookup_cell_c(self, double* point)
     cpdef double get_exclude(self, double[::1] point)
     cdef double get_exclude_c(self, double* point)
     cpdef double get_include(self, double[::1] point)
@@ -9,10 +9,46 @@ cimport numpy as np
 cdef extern from "dpy_math.h" nogil:
     int dpy_rint(double)
 
+from libc.math cimport floor
+
 from .interpolation cimport trilinear_interpolate4d_c
 
 import numpy as np
 
+# Value of the cells of ``ConstrainedTissueClassifier.cell_lut`` for which the
+# tissue class depends on the position of the point inside the cell.
+cdef signed char INTERPOLATE = 127
+
+
+def _cell_bounds(volume):
+    """Minimum and maximum of ``volume`` over the trilinear interpolation
+    cells.
+
+    A point whose coordinates are ``(x, y, z)`` is interpolated from the 8
+    voxels of the cell ``floor((x, y, z)) + 1``, with the voxel indices clipped
+    to the volume like ``trilinear_interpolate4d_c`` does. The interpolated
+    value is a convex combination of these 8 voxels, so it is bounded by the
+    returned values.
+
+    Parameters
+    ----------
+    volume : array, shape (X, Y, Z)
+
+    Returns
+    -------
+    cell_min, cell_max : arrays, shape (X + 1, Y + 1, Z + 1)
+    """
+    volume = np.pad(volume, 1, mode='edge')
+    shape = tuple(n - 1 for n in volume.shape)
+    corners = [volume[i:i + shape[0], j:j + shape[1], k:k + shape[2]]
+               for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+    cell_min = corners[0].copy()
+    cell_max = corners[0].copy()
+    for corner in corners[1:]:
+        np.minimum(cell_min, corner, out=cell_min)
+        np.maximum(cell_max, corner, out=cell_max)
+    return cell_min, cell_max
+
 cdef class TissueClassifier:
     cpdef TissueClass check_point(self, double[::1] point):
         if point.shape[0] != 3:
@@ -105,16 +141,23 @@ cdef class ConstrainedTissueClassifier(TissueClassifier):
     image should be added to the 'include_map' to keep streamlines exiting the
     brain (e.g. through the brain stem).
 
+    Subclasses can fill 'cell_lut', a table of the tissue class of each
+    trilinear interpolation cell, to skip the interpolation of the maps for
+    the points in cells where the tissue class does not depend on the position
+    of the point (see ``lookup_cell_c``).
+
     cdef:
         double interp_out_double[1]
         double[:]  interp_out_view = interp_out_view
         double[:, :, :] include_map, exclude_map
+        signed char[:, :, :] cell_lut
 
     """
     def __cinit__(self, include_map, exclude_map, *args, **kw):
         self.interp_out_view = self.interp_out_double
         self.include_map = np.asarray(include_map, 'float64')
         self.exclude_map = np.asarray(exclude_map, 'float64')
+        self.cell_lut = None
 
     @classmethod
     def from_pve(klass, wm_map, gm_map, csf_map, **kw):
@@ -139,6 +182,30 @@ cdef class ConstrainedTissueClassifier(TissueClassifier):
         exclude_map = np.copy(csf_map)
         return klass(include_map, exclude_map, **kw)
 
+    cdef int lookup_cell_c(self, double* point):
+        """Tissue class of the point from ``cell_lut``.
+
+        Returns
+        -------
+        tissue_class : int
+            OUTSIDEIMAGE if the point is outside the maps, the tissue class
+            of the cell of the point if it is homogeneous and ``INTERPOLATE``
+            otherwise (or if there is no ``cell_lut``).
+        """
+        cdef:
+            np.npy_intp cell[3]
+
+        if self.cell_lut is None:
+            return INTERPOLATE
+
+        for i in range(3):
+            if (point[i] < -.5 or
+                    point[i] >= (self.include_map.shape[i] - .5)):
+                return OUTSIDEIMAGE
+            cell[i] = <np.npy_intp> floor(point[i]) + 1
+
+        return self.cell_lut[cell[0], cell[1], cell[2]]
+
     cpdef double get_exclude(self, double[::1] point):
         if point.shape[0] != 3:
             raise ValueError("Point has wrong shape")
@@ -178,6 +245,7 @@ cdef class ActTissueClassifier(ConstrainedTissueClassifier):
         double interp_out_double[1]
         double[:]  interp_out_view = interp_out_view
         double[:, :, :] include_map, exclude_map
+        signed char[:, :, :] cell_lut
     References
     ----------
     .. [1] Smith, R. E., Tournier, J.-D., Calamante, F., & Connelly, A.
@@ -191,10 +259,27 @@ cdef class ActTissueClassifier(ConstrainedTissueClassifier):
         self.include_map = np.asarray(include_map, 'float64')
         self.exclude_map = np.asarray(exclude_map, 'float64')
 
+        if self.include_map.shape != self.exclude_map.shape:
+            return
+        # The interpolated values are bounded by the values of the 8 voxels
+        # of the cell, the thresholds give the same tissue class everywhere
+        # in the cell when the bounds are on the same side of the thresholds.
+        include_min, include_max = _cell_bounds(self.include_map)
+        exclude_min, exclude_max = _cell_bounds(self.exclude_map)
+        lut = np.full(include_min.shape, INTERPOLATE, dtype=np.int8)
+        lut[(include_max <= 0.5) & (exclude_max <= 0.5)] = TRACKPOINT
+        lut[(include_max <= 0.5) & (exclude_min > 0.5)] = INVALIDPOINT
+        lut[include_min > 0.5] = ENDPOINT
+        self.cell_lut = lut
+
     cdef TissueClass check_point_c(self, double* point):
         cdef:
             double include_result, exclude_result
-            int include_err, exclude_err
+            int include_err, exclude_err, cell_class
+
+        cell_class = self.lookup_cell_c(point)
+        if cell_class != INTERPOLATE:
+            return <TissueClass> cell_class
 
         include_err = trilinear_interpolate4d_c(
             self.include_map[..., None],
@@ -237,6 +322,7 @@ cdef class CmcTissueClassifier(ConstrainedTissueClassifier):
         double interp_out_double[1]
         double[:]  interp_out_view = interp_out_view
         double[:, :, :] include_map, exclude_map
+        signed char[:, :, :] cell_lut
         double step_size
         double average_voxel_size
         double correction_factor
@@ -253,10 +339,25 @@ cdef class CmcTissueClassifier(ConstrainedTissueClassifier):
         self.average_voxel_size = average_voxel_size
         self.correction_factor = step_size / average_voxel_size
 
+        if self.include_map.shape != self.exclude_map.shape:
+            return
+        # Only the cells without any include and exclude tissue are
+        # homogeneous, the tissue class of the other cells is drawn at random
+        # from the interpolated maps.
+        include_min, include_max = _cell_bounds(self.include_map)
+        exclude_min, exclude_max = _cell_bounds(self.exclude_map)
+        lut = np.full(include_min.shape, INTERPOLATE, dtype=np.int8)
+        lut[(include_max <= 0) & (exclude_max <= 0)] = TRACKPOINT
+        self.cell_lut = lut
+
     cdef TissueClass check_point_c(self, double* point):
         cdef:
             double include_result, exclude_result
-            int include_err, exclude_err
+            int include_err, exclude_err, cell_class
+
+        cell_class = self.lookup_cell_c(point)
+        if cell_class != INTERPOLATE:
+            return <TissueClass> cell_class
 
         include_err = trilinear_interpolate4d_c(self.include_map[..., None],
                                                 point, self.interp_out_view)
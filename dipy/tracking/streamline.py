@@ -1,4 +1,5 @@
 from copy import deepcopy
+from itertools import compress
 from warnings import warn
 import types
 
@@ -252,12 +253,18 @@ def select_by_rois(streamlines, rois, include, mode=None, affine=None,
 
     if mode is None:
         mode = "any"
-    for sl in streamlines:
-        include = streamline_near_roi(sl, x_include_roi_coords, tol=tol,
-                                      mode=mode)
-        exclude = streamline_near_roi(sl, x_exclude_roi_coords, tol=tol,
-                                      mode=mode)
-        if include & ~exclude:
+    ut._check_near_roi_mode(mode)
+
+    # The spatial indices of the ROIs are built once and queried with the
+    # points of many streamlines at a time.
+    include_index = ut._roi_index(x_include_roi_coords)
+    exclude_index = ut._roi_index(x_exclude_roi_coords)
+    for chunk in ut._chunks(streamlines):
+        include = ut._streamlines_near_roi(chunk, include_index, tol=tol,
+                                           mode=mode)
+        exclude = ut._streamlines_near_roi(chunk, exclude_index, tol=tol,
+                                           mode=mode)
+        for sl in compress(chunk, include & ~exclude):
             yield sl
 
 
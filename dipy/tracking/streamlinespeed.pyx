@@ -3,12 +3,15 @@
 
 import cython
 import numpy as np
+from itertools import islice
+from cython.parallel import prange
 from libc.math cimport sqrt
 from libc.stdlib cimport malloc, free
 
 cimport numpy as np
 
 from dipy.tracking import Streamlines
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 
 cdef extern from "dpy_math.h" nogil:
@@ -16,15 +19,22 @@ cdef extern from "dpy_math.h" nogil:
 
 
 cdef double c_length(Streamline streamline) nogil:
+    return c_length_from_offset(streamline, 0, streamline.shape[0])
+
+
+cdef double c_length_from_offset(Streamline points, np.npy_intp offset,
+                                 np.npy_intp length) nogil:
+    """ Length of the streamline made of `length` rows of `points` starting at
+    row `offset`. """
     cdef:
-        np.npy_intp i
+        np.npy_intp i, j
         double out = 0.0
         double dn, sum_dn_sqr
 
-    for i in range(1, streamline.shape[0]):
+    for i in range(offset+1, offset+length):
         sum_dn_sqr = 0.0
-        for j in range(streamline.shape[1]):
-            dn = streamline[i, j] - streamline[i-1, j]
+        for j in range(points.shape[1]):
+            dn = points[i, j] - points[i-1, j]
             sum_dn_sqr += dn*dn
 
         out += sqrt(sum_dn_sqr)
@@ -37,24 +47,53 @@ cdef void c_arclengths_from_arraysequence(Streamline points,
                                           np.npy_intp[:] lengths,
                                           double[:] arclengths) nogil:
     cdef:
-        np.npy_intp i, j, k
-        np.npy_intp offset
-        double dn, sum_dn_sqr
+        np.npy_intp i
 
-    for i in range(offsets.shape[0]):
-        offset = offsets[i]
+    for i in prange(offsets.shape[0], schedule='guided'):
+        arclengths[i] = c_length_from_offset(points, offsets[i], lengths[i])
+
+
+def _pack_streamlines(streamlines):
+    """ Concatenates the points of a list of streamlines
 
-        arclengths[i] = 0
-        for j in range(1, lengths[i]):
-            sum_dn_sqr = 0.0
-            for k in range(points.shape[1]):
-                dn = points[offset+j, k] - points[offset+j-1, k]
-                sum_dn_sqr += dn*dn
+    Parameters
+    ----------
+    streamlines : list
+        Each item must be ndarray shape (Ni, D) where Ni is the number of
+        points of streamline i.
 
-            arclengths[i] += sqrt(sum_dn_sqr)
+    Returns
+    -------
+    points : ndarray shape (sum(Ni), D) or None
+        Points of all the streamlines, converted to float32 or float64 like
+        a single streamline would be. None if the streamlines do not share the
+        same dtype and number of dimensions.
+    offsets : ndarray shape (N,)
+        Index in `points` of the first point of each streamline.
+    lengths : ndarray shape (N,)
+        Number of points of each streamline.
+    """
+    dtype = streamlines[0].dtype
+    shape = streamlines[0].shape[1:]
+    for streamline in streamlines:
+        if streamline.dtype != dtype or streamline.shape[1:] != shape:
+            return None, None, None
+
+    if len(shape) != 1:
+        return None, None, None
+
+    if dtype != np.float32 and dtype != np.float64:
+        is_integer = dtype == np.int64 or dtype == np.uint64
+        dtype = np.float64 if is_integer else np.float32
 
+    lengths = np.array([len(s) for s in streamlines], dtype=np.intp)
+    offsets = np.zeros(len(streamlines), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    points = np.concatenate(streamlines).astype(dtype, copy=False)
+    return points, offsets, lengths
 
-def length(streamlines):
+
+def length(streamlines, num_threads=None):
     ''' Euclidean length of streamlines
 
     Length is in mm only if streamlines are expressed in world coordinates.
@@ -67,6 +106,13 @@ def length(streamlines):
         If list, each item must be ndarray shape (Ni,3) where Ni is the number
         of points of streamline i.
         If :class:`dipy.tracking.Streamlines`, its `common_shape` must be 3.
+    num_threads : int
+        Number of threads used to process a list or
+        :class:`dipy.tracking.Streamlines`. If None (default) then all
+        available threads will be used. To be processed by several threads,
+        the points of a list of streamlines are first copied into a single
+        array, which doubles the memory used by the streamlines. Use 1 to
+        process a list one streamline at the time without this copy.
 
     Returns
     ---------
@@ -99,22 +145,9 @@ def length(streamlines):
         if len(streamlines) == 0:
             return 0.0
 
-        arclengths = np.zeros(len(streamlines), dtype=np.float64)
-
-        if streamlines.data.dtype == np.float32:
-            c_arclengths_from_arraysequence[float2d](
-                                    streamlines.data,
-                                    streamlines._offsets.astype(np.intp),
-                                    streamlines._lengths.astype(np.intp),
-                                    arclengths)
-        else:
-            c_arclengths_from_arraysequence[double2d](
-                                      streamlines.data,
-                                      streamlines._offsets.astype(np.intp),
-                                      streamlines._lengths.astype(np.intp),
-                                      arclengths)
-
-        return arclengths
+        return _arclengths_from_arraysequence(
+            streamlines._data, streamlines._offsets.astype(np.intp),
+            streamlines._lengths.astype(np.intp), num_threads)
 
     only_one_streamlines = False
     if type(streamlines) is np.ndarray:
@@ -124,6 +157,12 @@ def length(streamlines):
     if len(streamlines) == 0:
         return 0.0
 
+    if not only_one_streamlines and num_threads != 1:
+        points, offsets, lengths = _pack_streamlines(streamlines)
+        if points is not None:
+            return _arclengths_from_arraysequence(points, offsets, lengths,
+                                                  num_threads)
+
     dtype = streamlines[0].dtype
     for streamline in streamlines:
         if streamline.dtype != dtype:
@@ -181,6 +220,31 @@ def length(streamlines):
         return streamlines_length
 
 
+def _arclengths_from_arraysequence(points, offsets, lengths, num_threads):
+    cdef:
+        float2d points_float
+        double2d points_double
+        np.npy_intp[:] offsets_view = offsets
+        np.npy_intp[:] lengths_view = lengths
+        double[:] arclengths = np.zeros(len(offsets), dtype=np.float64)
+
+    set_num_threads(num_threads)
+    if points.dtype == np.float32:
+        points_float = points
+        with nogil:
+            c_arclengths_from_arraysequence(points_float, offsets_view,
+                                            lengths_view, arclengths)
+    else:
+        points_double = points.astype(np.float64, copy=False)
+        with nogil:
+            c_arclengths_from_arraysequence(points_double, offsets_view,
+                                            lengths_view, arclengths)
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    return np.asarray(arclengths)
+
+
 cdef void c_arclengths(Streamline streamline, double* out) nogil:
     cdef np.npy_intp i = 0
     cdef double dn
@@ -196,16 +260,33 @@ cdef void c_arclengths(Streamline streamline, double* out) nogil:
 
 
 cdef void c_set_number_of_points(Streamline streamline, Streamline out) nogil:
+    c_set_number_of_points_from_offset(streamline, 0, streamline.shape[0],
+                                       out, 0, out.shape[0])
+
+
+cdef void c_set_number_of_points_from_offset(Streamline points,
+                                             np.npy_intp offset,
+                                             np.npy_intp N,
+                                             Streamline out,
+                                             np.npy_intp offset_out,
+                                             np.npy_intp new_N) nogil:
+    """ Resamples the streamline made of `N` rows of `points` starting at row
+    `offset` into the `new_N` rows of `out` starting at row `offset_out`. """
     cdef:
-        np.npy_intp N = streamline.shape[0]
-        np.npy_intp D = streamline.shape[1]
-        np.npy_intp new_N = out.shape[0]
-        double ratio, step, next_point, delta
+        np.npy_intp D = points.shape[1]
+        double ratio, step, next_point, delta, dn
         np.npy_intp i, j, k, dim
 
     # Get arclength at each point.
-    arclengths = <double*> malloc(streamline.shape[0] * sizeof(double))
-    c_arclengths(streamline, arclengths)
+    arclengths = <double*> malloc(N * sizeof(double))
+    arclengths[0] = 0.0
+    for i in range(1, N):
+        arclengths[i] = 0.0
+        for dim in range(D):
+            dn = points[offset+i, dim] - points[offset+i-1, dim]
+            arclengths[i] += dn*dn
+
+        arclengths[i] = arclengths[i-1] + sqrt(arclengths[i])
 
     step = arclengths[N-1] / (new_N-1)
 
@@ -217,7 +298,7 @@ cdef void c_set_number_of_points(Streamline streamline, Streamline out) nogil:
     while next_point < arclengths[N-1]:
         if next_point == arclengths[k]:
             for dim in range(D):
-                out[i, dim] = streamline[j, dim]
+                out[offset_out+i, dim] = points[offset+j, dim]
 
             next_point += step
             i += 1
@@ -228,8 +309,8 @@ cdef void c_set_number_of_points(Streamline streamline, Streamline out) nogil:
                          (arclengths[k]-arclengths[k-1]))
 
             for dim in range(D):
-                delta = streamline[j, dim] - streamline[j-1, dim]
-                out[i, dim] = streamline[j-1, dim] + ratio * delta
+                delta = points[offset+j, dim] - points[offset+j-1, dim]
+                out[offset_out+i, dim] = points[offset+j-1, dim] + ratio*delta
 
             next_point += step
             i += 1
@@ -239,7 +320,7 @@ cdef void c_set_number_of_points(Streamline streamline, Streamline out) nogil:
 
     # Last resampled point always the one from original streamline.
     for dim in range(D):
-        out[new_N-1, dim] = streamline[N-1, dim]
+        out[offset_out+new_N-1, dim] = points[offset+N-1, dim]
 
     free(arclengths)
 
@@ -250,22 +331,14 @@ cdef void c_set_number_of_points_from_arraysequence(Streamline points,
                                                     long nb_points,
                                                     Streamline out) nogil:
     cdef:
-        np.npy_intp i, j, k
-        np.npy_intp offset, length
-        np.npy_intp offset_out = 0
-        double dn, sum_dn_sqr
-
-    for i in range(offsets.shape[0]):
-        offset = offsets[i]
-        length = lengths[i]
-
-        c_set_number_of_points(points[offset:offset+length, :],
-                               out[offset_out:offset_out+nb_points, :])
+        np.npy_intp i
 
-        offset_out += nb_points
+    for i in prange(offsets.shape[0], schedule='guided'):
+        c_set_number_of_points_from_offset(points, offsets[i], lengths[i],
+                                           out, i*nb_points, nb_points)
 
 
-def set_number_of_points(streamlines, nb_points=3):
+def set_number_of_points(streamlines, nb_points=3, num_threads=None):
     ''' Change the number of points of streamlines
         (either by downsampling or upsampling)
 
@@ -284,6 +357,13 @@ def set_number_of_points(streamlines, nb_points=3):
 
     nb_points : int
         integer representing number of points wanted along the curve.
+    num_threads : int
+        Number of threads used to process a list or
+        :class:`dipy.tracking.Streamlines`. If None (default) then all
+        available threads will be used. To be processed by several threads,
+        the points of a list of streamlines are first copied into a single
+        array, which doubles the memory used by the streamlines. Use 1 to
+        process a list one streamline at the time without this copy.
 
     Returns
     -------
@@ -321,26 +401,14 @@ def set_number_of_points(streamlines, nb_points=3):
             return Streamlines()
 
         nb_streamlines = len(streamlines)
-        dtype = streamlines._data.dtype
         new_streamlines = Streamlines()
-        new_streamlines._data = np.zeros((nb_streamlines * nb_points, 3),
-                                         dtype=dtype)
+        new_streamlines._data = _set_number_of_points_from_arraysequence(
+            streamlines._data, streamlines._offsets.astype(np.intp),
+            streamlines._lengths.astype(np.intp), nb_points, num_threads)
         new_streamlines._offsets = nb_points * np.arange(nb_streamlines,
                                                          dtype=np.intp)
         new_streamlines._lengths = nb_points * np.ones(nb_streamlines,
                                                        dtype=np.intp)
-
-        if dtype == np.float32:
-            c_set_number_of_points_from_arraysequence[float2d](
-                streamlines._data, streamlines._offsets.astype(np.intp),
-                streamlines._lengths.astype(np.intp), nb_points,
-                new_streamlines._data)
-        else:
-            c_set_number_of_points_from_arraysequence[double2d](
-                streamlines._data, streamlines._offsets.astype(np.intp),
-                streamlines._lengths.astype(np.intp), nb_points,
-                new_streamlines._data)
-
         return new_streamlines
 
     only_one_streamlines = False
@@ -362,6 +430,14 @@ def set_number_of_points(streamlines, nb_points=3):
         if len(streamline) < 2:
             raise ValueError("All streamlines must have at least 2 points.")
 
+    if not only_one_streamlines and num_threads != 1:
+        points, offsets, lengths = _pack_streamlines(streamlines)
+        if points is not None:
+            new_points = _set_number_of_points_from_arraysequence(
+                points, offsets, lengths, nb_points, num_threads)
+            new_points = new_points.reshape((len(streamlines), nb_points, -1))
+            return [s.copy() for s in new_points]
+
     # Allocate memory for each modified streamline
     new_streamlines = []
     cdef np.npy_intp i
@@ -434,6 +510,38 @@ def set_number_of_points(streamlines, nb_points=3):
         return new_streamlines
 
 
+def _set_number_of_points_from_arraysequence(points, offsets, lengths,
+                                             long nb_points, num_threads):
+    cdef:
+        float2d points_float, new_points_float
+        double2d points_double, new_points_double
+        np.npy_intp[:] offsets_view = offsets
+        np.npy_intp[:] lengths_view = lengths
+
+    new_points = np.zeros((len(offsets) * nb_points, points.shape[1]),
+                          dtype=points.dtype)
+
+    set_num_threads(num_threads)
+    if points.dtype == np.float32:
+        points_float = points
+        new_points_float = new_points
+        with nogil:
+            c_set_number_of_points_from_arraysequence(
+                points_float, offsets_view, lengths_view, nb_points,
+                new_points_float)
+    else:
+        points_double = points
+        new_points_double = new_points
+        with nogil:
+            c_set_number_of_points_from_arraysequence(
+                points_double, offsets_view, lengths_view, nb_points,
+                new_points_double)
+    if num_threads is not None:
+        restore_default_num_threads()
+
+    return new_points
+
+
 cdef double c_norm_of_cross_product(double bx, double by, double bz,
                                     double cx, double cy, double cz) nogil:
     """ Computes the norm of the cross-product in 3D. """
@@ -490,28 +598,49 @@ cdef double c_segment_length(Streamline streamline,
 cdef np.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
                                        double tol_error, double max_segment_length) nogil:
     """ Compresses a streamline (see function `compress_streamlines`)."""
+    return c_compress_streamline_from_offset(streamline, 0,
+                                             streamline.shape[0], out, 0,
+                                             tol_error, max_segment_length)
+
+
+cdef np.npy_intp c_compress_streamline_from_offset(Streamline points,
+                                                   np.npy_intp offset,
+                                                   np.npy_intp N,
+                                                   Streamline out,
+                                                   np.npy_intp offset_out,
+                                                   double tol_error,
+                                                   double max_segment_length) nogil:
+    """ Compresses the streamline made of `N` rows of `points` starting at row
+    `offset` into the rows of `out` starting at row `offset_out`. Returns the
+    number of points of the compressed streamline. """
     cdef:
-        np.npy_intp N = streamline.shape[0]
-        np.npy_intp D = streamline.shape[1]
+        np.npy_intp D = points.shape[1]
         np.npy_intp nb_points = 0
-        np.npy_intp d, prev, next, curr
-        double segment_length
+        np.npy_intp i, d, prev, next, curr
+        double dist
+
+    if N <= 2:
+        # Streamlines of two points or less are uncompressable.
+        for i in range(N):
+            for d in range(D):
+                out[offset_out+i, d] = points[offset+i, d]
+        return N
 
     # Copy first point since it is always kept.
     for d in range(D):
-        out[0, d] = streamline[0, d]
+        out[offset_out, d] = points[offset, d]
 
     nb_points = 1
-    prev = 0
+    prev = offset
 
     # Loop through the points of the streamline checking if we can use the
     # linearized segment: next-prev. We start with next=2 (third points) since
     # we already added point 0 and segment between the two firsts is linear.
-    for next in range(2, N):
+    for next in range(offset+2, offset+N):
         # Euclidean distance between last added point and current point.
-        if c_segment_length(streamline, prev, next) > max_segment_length:
+        if c_segment_length(points, prev, next) > max_segment_length:
             for d in range(D):
-                out[nb_points, d] = streamline[next-1, d]
+                out[offset_out+nb_points, d] = points[next-1, d]
 
             nb_points += 1
             prev = next-1
@@ -519,11 +648,11 @@ cdef np.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
 
         # Check that each point is not offset by more than `tol_error` mm.
         for curr in range(prev+1, next):
-            dist = c_dist_to_line(streamline, prev, next, curr)
+            dist = c_dist_to_line(points, prev, next, curr)
 
             if dpy_isnan(dist) or dist > tol_error:
                 for d in range(D):
-                    out[nb_points, d] = streamline[next-1, d]
+                    out[offset_out+nb_points, d] = points[next-1, d]
 
                 nb_points += 1
                 prev = next-1
@@ -531,13 +660,109 @@ cdef np.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
 
     # Copy last point since it is always kept.
     for d in range(D):
-        out[nb_points, d] = streamline[N-1, d]
+        out[offset_out+nb_points, d] = points[offset+N-1, d]
 
     nb_points += 1
     return nb_points
 
 
-def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
+cdef void c_compress_streamlines_from_arraysequence(Streamline points,
+                                                    np.npy_intp[:] offsets,
+                                                    np.npy_intp[:] lengths,
+                                                    double tol_error,
+                                                    double max_segment_length,
+                                                    Streamline out,
+                                                    np.npy_intp[:] offsets_out,
+                                                    np.npy_intp[:] lengths_out) nogil:
+    cdef:
+        np.npy_intp i
+
+    for i in prange(offsets.shape[0], schedule='guided'):
+        lengths_out[i] = c_compress_streamline_from_offset(
+            points, offsets[i], lengths[i], out, offsets_out[i], tol_error,
+            max_segment_length)
+
+
+cdef void c_pack_rows(Streamline points, np.npy_intp[:] offsets,
+                      np.npy_intp[:] lengths) nogil:
+    """ Moves the rows of each streamline of `points` right after those of
+    the previous one, in place. Sequential, since the rows of a streamline
+    can be moved over those of the previous ones. """
+    cdef:
+        np.npy_intp i, j, d, nb_rows = 0
+
+    for i in range(offsets.shape[0]):
+        for j in range(lengths[i]):
+            for d in range(points.shape[1]):
+                points[nb_rows+j, d] = points[offsets[i]+j, d]
+
+        nb_rows += lengths[i]
+
+
+def _compress_streamlines_from_arraysequence(points, offsets, lengths,
+                                             double tol_error,
+                                             double max_segment_length,
+                                             num_threads, in_place=False):
+    """ Compresses packed streamlines into a single output buffer.
+
+    The streamlines are first compressed in place of the original ones, into
+    `points` itself if `in_place` or into a buffer of the same size
+    otherwise, then packed together at the start of this buffer, which is
+    finally shrunk to the compressed points.
+
+    Returns
+    -------
+    new_points : ndarray shape (sum(Mi), D)
+        Points of the compressed streamlines.
+    new_offsets : ndarray shape (N,)
+        Index in `new_points` of the first point of each streamline.
+    new_lengths : ndarray shape (N,)
+        Number of points Mi of each compressed streamline.
+    """
+    cdef:
+        float2d points_float, new_points_float
+        double2d points_double, new_points_double
+        np.npy_intp[:] offsets_view = offsets
+        np.npy_intp[:] lengths_view = lengths
+        np.npy_intp[:] new_lengths_view
+
+    new_lengths = np.zeros(len(offsets), dtype=np.intp)
+    new_lengths_view = new_lengths
+    new_points = points if in_place else np.empty_like(points)
+
+    set_num_threads(num_threads)
+    try:
+        if points.dtype == np.float32:
+            points_float = points
+            new_points_float = new_points
+            with nogil:
+                c_compress_streamlines_from_arraysequence(
+                    points_float, offsets_view, lengths_view, tol_error,
+                    max_segment_length, new_points_float, offsets_view,
+                    new_lengths_view)
+                c_pack_rows(new_points_float, offsets_view, new_lengths_view)
+        else:
+            points_double = points
+            new_points_double = new_points
+            with nogil:
+                c_compress_streamlines_from_arraysequence(
+                    points_double, offsets_view, lengths_view, tol_error,
+                    max_segment_length, new_points_double, offsets_view,
+                    new_lengths_view)
+                c_pack_rows(new_points_double, offsets_view,
+                            new_lengths_view)
+    finally:
+        if num_threads is not None:
+            restore_default_num_threads()
+
+    new_offsets = np.zeros(len(offsets), dtype=np.intp)
+    np.cumsum(new_lengths[:-1], out=new_offsets[1:])
+    new_points.resize((new_lengths.sum(), points.shape[1]), refcheck=False)
+    return new_points, new_offsets, new_lengths
+
+
+def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10,
+                         num_threads=None, chunk_size=10000):
     """ Compress streamlines by linearization as in [Presseau15]_.
 
     The compression consists in merging consecutive segments that are
@@ -557,8 +782,11 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
 
     Parameters
     ----------
-    streamlines : one or a list of array-like of shape (N,3)
-        Array representing x,y,z of N points in a streamline.
+    streamlines : one or a list or an iterable of array-like of shape (N,3)
+        or a :class:`dipy.tracking.Streamlines`.
+        Array representing x,y,z of N points in a streamline. If an iterable
+        which is not a list (e.g. the streamlines generated by a tracker),
+        the streamlines are compressed by chunks as they are generated.
     tol_error : float (optional)
         Tolerance error in mm (default: 0.01). A rule of thumb is to set it
         to 0.01mm for deterministic streamlines and 0.1mm for probabilitic
@@ -566,11 +794,25 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     max_segment_length : float (optional)
         Maximum length in mm of any given segment produced by the compression.
         The default is 10mm. (In [Presseau15]_, they used a value of `np.inf`).
+    num_threads : int (optional)
+        Number of threads used to process a list, an iterable or a
+        :class:`dipy.tracking.Streamlines`. If None (default) then all
+        available threads will be used. To be processed by several threads,
+        the points of a list of streamlines are first copied into a single
+        array, which doubles the memory used by the streamlines. Use 1 to
+        process a list one streamline at the time without this copy.
+    chunk_size : int (optional)
+        Number of streamlines compressed together when `streamlines` is an
+        iterable which is not a list. Default: 10000.
 
     Returns
     -------
-    compressed_streamlines : one or a list of array-like
-        Results of the linearization process.
+    compressed_streamlines : one or a list or a generator of array-like
+        or a :class:`dipy.tracking.Streamlines`.
+        Results of the linearization process. A
+        :class:`dipy.tracking.Streamlines` if `streamlines` is one, its points
+        being stored in a single array. A generator of the compressed
+        streamlines if `streamlines` is an iterable which is not a list.
 
     Examples
     --------
@@ -592,6 +834,10 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     [100, 50]
     >>> [len(s) for s in c_streamlines]
     [10, 7]
+    >>> # Streamlines compressed as they are generated
+    >>> c_streamlines = compress_streamlines(iter(streamlines), tol_error=0.2)
+    >>> [len(s) for s in c_streamlines]
+    [10, 7]
 
 
     Notes
@@ -608,14 +854,54 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     .. [Houde15] Houde J.-C. et al. How to Avoid Biased Streamlines-Based
                  Metrics for Streamlines with Variable Step Sizes, ISMRM, 2015.
     """
+    if isinstance(streamlines, Streamlines):
+        if len(streamlines) == 0:
+            return Streamlines()
+
+        points = streamlines._data
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError("The points of the streamlines must be 3D.")
+
+        # A converted copy of the points can be compressed in place
+        in_place = False
+        if points.dtype != np.float32 and points.dtype != np.float64:
+            is_integer = points.dtype == np.int64 or points.dtype == np.uint64
+            points = points.astype(np.float64 if is_integer else np.float32)
+            in_place = True
+
+        new_streamlines = Streamlines()
+        (new_streamlines._data, new_streamlines._offsets,
+         new_streamlines._lengths) = _compress_streamlines_from_arraysequence(
+            points, streamlines._offsets.astype(np.intp),
+            streamlines._lengths.astype(np.intp), tol_error,
+            max_segment_length, num_threads, in_place)
+        return new_streamlines
+
     only_one_streamlines = False
     if type(streamlines) is np.ndarray:
         only_one_streamlines = True
         streamlines = [streamlines]
 
+    if not hasattr(streamlines, '__len__'):
+        return _compress_streamlines_by_chunks(streamlines, tol_error,
+                                               max_segment_length,
+                                               num_threads, chunk_size)
+
     if len(streamlines) == 0:
         return []
 
+    if (not only_one_streamlines and num_threads != 1 and
+            streamlines[0].ndim == 2 and streamlines[0].shape[1] == 3):
+        points, offsets, lengths = _pack_streamlines(streamlines)
+        if points is not None:
+            # The packed points are a copy, they are compressed in place
+            new_points, new_offsets, new_lengths = \
+                _compress_streamlines_from_arraysequence(
+                    points, offsets, lengths, tol_error, max_segment_length,
+                    num_threads, in_place=True)
+            return [new_points[o:o+l].copy()
+                    for o, l in zip(new_offsets, new_lengths)]
+
     compressed_streamlines = []
     cdef np.npy_intp i
     for i in range(len(streamlines)):
@@ -649,3 +935,19 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
         return compressed_streamlines[0]
     else:
         return compressed_streamlines
+
+
+def _compress_streamlines_by_chunks(streamlines, tol_error, max_segment_length,
+                                    num_threads, chunk_size):
+    """ Generator of the compressed streamlines of an iterable, compressed by
+    chunks of `chunk_size` streamlines. """
+    streamlines = iter(streamlines)
+    while True:
+        chunk = list(islice(streamlines, chunk_size))
+        if len(chunk) == 0:
+            break
+
+        for streamline in compress_streamlines(chunk, tol_error,
+                                               max_segment_length,
+                                               num_threads):
+            yield streamline
@@ -1,9 +1,13 @@
 from __future__ import division, print_function, absolute_import
 
+import os
+import shutil
+import tempfile
+
 import numpy as np
 import nose
 from nose.tools import (assert_true, assert_false, assert_equal,
-                        assert_almost_equal)
+                        assert_almost_equal, assert_raises)
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 from dipy.tracking import metrics as tm
 from dipy.tracking import distances as pf
@@ -165,6 +169,44 @@ def test_bundles_distances_mdf():
     assert_array_almost_equal(DM, DM2, 4)
 
 
+def test_bundles_distances_num_threads_and_out():
+    rng = np.random.RandomState(0)
+    tracksA = [rng.rand(rng.randint(2, 20), 3) for _ in range(30)]
+    tracksB = [rng.rand(rng.randint(2, 20), 3) for _ in range(20)]
+    tracks12A = [rng.rand(12, 3) for _ in range(30)]
+    tracks12B = [rng.rand(12, 3) for _ in range(20)]
+
+    for metric in ('avg', 'min', 'max'):
+        expected = np.array([[pf.mam_distances(ta.astype('f4'),
+                                               tb.astype('f4'), metric)
+                              for tb in tracksB] for ta in tracksA])
+        for num_threads in [None, 1, 2]:
+            DM = pf.bundles_distances_mam(tracksA, tracksB, metric=metric,
+                                          num_threads=num_threads)
+            assert_array_almost_equal(DM, expected, 5)
+
+    expected = pf.bundles_distances_mdf(tracks12A, tracks12B, num_threads=1)
+    for num_threads in [None, 2]:
+        assert_array_equal(pf.bundles_distances_mdf(tracks12A, tracks12B,
+                                                    num_threads=num_threads),
+                           expected)
+
+    # Write into an existing array, e.g. a memmap
+    tmpdir = tempfile.mkdtemp()
+    try:
+        out = np.memmap(os.path.join(tmpdir, 'dm.dat'), dtype=np.double,
+                        mode='w+', shape=(30, 20))
+        DM = pf.bundles_distances_mdf(tracks12A, tracks12B, out=out)
+        assert_true(DM is out)
+        assert_array_equal(out, expected)
+        del DM, out
+    finally:
+        shutil.rmtree(tmpdir)
+    assert_raises(ValueError, pf.bundles_distances_mam, tracksA, tracksB,
+                  out=np.zeros((20, 30)))
+    assert_equal(pf.bundles_distances_mdf([], tracks12B).shape, (0, 20))
+
+
 def test_mam_distances():
     xyz1 = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0]])
     xyz2 = np.array([[0, 1, 1], [1, 0, 1], [2, 3, -2]])
@@ -1,5 +1,7 @@
 import os
 import os.path as op
+import shutil
+import tempfile
 
 import numpy as np
 import numpy.testing as npt
@@ -27,6 +29,18 @@ def test_streamline_gradients():
     npt.assert_array_equal(life.streamline_gradients(streamline), grads)
 
 
+def test_packed_gradients():
+    rng = np.random.RandomState(0)
+    streamlines = [rng.rand(n, 3) for n in [1, 2, 5, 3]]
+    lengths = np.array([len(s) for s in streamlines])
+    grads = life._packed_gradients(np.concatenate(streamlines), lengths)
+    npt.assert_array_equal(grads[0], np.zeros(3))
+    npt.assert_array_almost_equal(
+        grads[1:],
+        np.concatenate([life.streamline_gradients(s)
+                        for s in streamlines[1:]]))
+
+
 def test_streamline_tensors():
     # Small streamline
     streamline = [[1, 2, 3], [4, 5, 3], [5, 6, 3]]
@@ -126,6 +140,50 @@ def test_FiberModel_init():
                                               len(streamline)))
 
 
+def test_FiberModel_setup_matrix():
+    # The matrix holds the summed signal of the nodes of each fiber in each
+    # voxel:
+    data_file, bval_file, bvec_file = dpd.get_data('small_64D')
+    bvals, bvecs = (np.load(f) for f in (bval_file, bvec_file))
+    gtab = dpg.gradient_table(bvals, bvecs)
+    FM = life.FiberModel(gtab)
+    rng = np.random.RandomState(0)
+    streamline = [np.cumsum(rng.randn(rng.randint(2, 20), 3), 0) + 10
+                  for _ in range(20)]
+    sphere = dpd.get_sphere('symmetric362')
+    fiber_matrix, vox_coords = FM.setup(streamline, None, sphere=sphere)
+
+    SignalMaker = life.LifeSignalMaker(gtab, sphere=sphere)
+    v2f, v2fn = life.voxel2streamline(streamline, transformed=True,
+                                      unique_idx=vox_coords)
+    fiber_matrix = fiber_matrix.toarray()
+    n_bvecs = np.sum(~gtab.b0s_mask)
+    for v_idx in range(len(vox_coords)):
+        rows = slice(v_idx * n_bvecs, (v_idx + 1) * n_bvecs)
+        for f_idx in range(len(streamline)):
+            sig = SignalMaker.streamline_signal(streamline[f_idx])
+            expected = np.zeros(n_bvecs)
+            for node_idx in v2fn[f_idx].get(v_idx, []):
+                expected += sig[node_idx]
+            npt.assert_array_almost_equal(fiber_matrix[rows, f_idx],
+                                          expected)
+
+    # The same matrix is built by blocks of rows, in memory or in files:
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for block_size in [1, 50]:
+            matrix, _ = FM.setup(streamline, None, sphere=sphere,
+                                 block_size=block_size)
+            npt.assert_array_equal(matrix.toarray(), fiber_matrix)
+            matrix, _ = FM.setup(streamline, None, sphere=sphere,
+                                 matrix_dir=tmpdir, block_size=block_size)
+            npt.assert_array_equal(matrix.dot(np.eye(matrix.shape[1])),
+                                   fiber_matrix)
+            del matrix
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_FiberFit():
     data_file, bval_file, bvec_file = dpd.get_data('small_64D')
     data_ni = nib.load(data_file)
@@ -165,6 +223,25 @@ def test_FiberFit():
         this_data[vox_coords[:, 0], vox_coords[:, 1], vox_coords[:, 2]],
         fit.data)
 
+    # Reading the matrix from memory-mapped files gives the same fit:
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fit_blocks = FM.fit(this_data, streamline, matrix_dir=tmpdir,
+                            block_size=10)
+        npt.assert_almost_equal(fit_blocks.beta, fit.beta, decimal=3)
+        npt.assert_almost_equal(fit_blocks.predict(), fit.predict(),
+                                decimal=-1)
+        del fit_blocks
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # Warm started from its own solution, the solver stops right away:
+    iterations = []
+    fit_warm = FM.fit(this_data, streamline, beta0=fit.beta, rtol=1,
+                      callback=lambda *args: iterations.append(args[0]))
+    npt.assert_equal(iterations, [1])
+    npt.assert_array_equal(fit_warm.beta, fit.beta)
+
 def test_fit_data():
     fdata, fbval, fbvec = dpd.get_data('small_25')
     gtab = grad.gradient_table(fbval, fbvec)
@@ -465,6 +465,34 @@ def test_length():
                               [length_python(s) for s in streamlines_readonly])
 
 
+def test_set_number_of_points_and_length_num_threads():
+    rng = np.random.RandomState(42)
+    for dtype in [np.float32, np.float64, np.int64]:
+        streamlines = [(10 * rng.rand(rng.randint(2, 100), 3)).astype(dtype)
+                       for _ in range(200)]
+        arrseq = Streamlines(streamlines)
+
+        lengths = [length(s) for s in streamlines]
+        resampled = [set_number_of_points(s, 12) for s in streamlines]
+        for num_threads in [None, 1, 2]:
+            assert_array_almost_equal(
+                length(streamlines, num_threads=num_threads), lengths)
+            assert_array_almost_equal(
+                length(arrseq, num_threads=num_threads), lengths)
+
+            new_streamlines = set_number_of_points(streamlines, 12,
+                                                   num_threads=num_threads)
+            assert_true(isinstance(new_streamlines, list))
+            assert_arrays_equal(new_streamlines, resampled)
+            for s in new_streamlines:
+                assert_equal(s.dtype, resampled[0].dtype)
+
+            if dtype != np.int64:
+                new_arrseq = set_number_of_points(arrseq, 12,
+                                                  num_threads=num_threads)
+                assert_arrays_equal(new_arrseq, resampled)
+
+
 def test_length_memory_leaks():
     # Test some dtypes
     dtypes = [np.float32, np.float64, np.int32, np.int64]
@@ -686,6 +714,45 @@ def test_compress_streamlines():
         assert_array_almost_equal(cspecial_streamline, cstreamline_python)
 
 
+def test_compress_streamlines_num_threads_and_chunks():
+    rng = np.random.RandomState(42)
+    for dtype in [np.float32, np.float64, np.int64]:
+        streamlines = [(10 * rng.rand(rng.randint(1, 100), 3)).astype(dtype)
+                       for _ in range(200)]
+        expected = [compress_streamlines(s, tol_error=0.5)
+                    for s in streamlines]
+
+        for num_threads in [None, 1, 2]:
+            cstreamlines = compress_streamlines(streamlines, tol_error=0.5,
+                                                num_threads=num_threads)
+            assert_true(isinstance(cstreamlines, list))
+            assert_arrays_equal(cstreamlines, expected)
+
+            # ArraySequence, compressed into a single buffer
+            sequence = Streamlines(streamlines)
+            cstreamlines = compress_streamlines(sequence, tol_error=0.5,
+                                                num_threads=num_threads)
+            assert_true(isinstance(cstreamlines, Streamlines))
+            assert_arrays_equal(cstreamlines, expected)
+            assert_arrays_equal(sequence, streamlines)
+
+            # Streamlines compressed as they are generated
+            cstreamlines = compress_streamlines(generate_sl(streamlines),
+                                                tol_error=0.5,
+                                                num_threads=num_threads,
+                                                chunk_size=30)
+            assert_true(not isinstance(cstreamlines, (list, Streamlines)))
+            assert_true(hasattr(cstreamlines, '__next__') or
+                        hasattr(cstreamlines, 'next'))
+            assert_arrays_equal(list(cstreamlines), expected)
+
+    assert_equal(len(compress_streamlines(Streamlines())), 0)
+    assert_equal(list(compress_streamlines(generate_sl([]))), [])
+    # The points of an ArraySequence must be 3D
+    assert_raises(ValueError, compress_streamlines,
+                  Streamlines([np.ones((5, 2))]))
+
+
 def test_compress_streamlines_memory_leaks():
     # Test some dtypes
     dtypes = [np.float32, np.float64, np.int32, np.int64]
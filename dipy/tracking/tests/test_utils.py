@@ -4,6 +4,7 @@ from dipy.utils.six.moves import xrange
 
 import numpy as np
 import nose
+import scipy.sparse as sps
 
 from dipy.io.bvectxt import orientation_from_string
 from dipy.tracking.utils import (affine_for_trackvis, connectivity_matrix,
@@ -12,14 +13,16 @@ from dipy.tracking.utils import (affine_for_trackvis, connectivity_matrix,
                                  reorder_voxels_affine, seeds_from_mask,
                                  random_seeds_from_mask, target,
                                  target_line_based, unique_rows, near_roi,
+                                 streamline_near_roi,
                                  reduce_rois, path_length, flexi_tvis_affine,
-                                 get_flexi_tvis_affine, _min_at)
+                                 get_flexi_tvis_affine, _min_at, subsegment)
 
 from dipy.tracking._utils import _to_voxel_coordinates
 
 import dipy.tracking.metrics as metrix
 
-from dipy.tracking.vox2track import streamline_mapping
+from dipy.tracking.vox2track import (streamline_mapping, _density_map,
+                                     _density_map_partials)
 import numpy.testing as npt
 from numpy.testing import assert_array_almost_equal, assert_array_equal
 from nose.tools import assert_equal, assert_raises, assert_true
@@ -76,6 +79,63 @@ def test_density_map():
     dm = density_map(streamlines, new_shape, affine=affine)
     assert_array_equal(dm, expected)
 
+    # Points outside of the volume
+    assert_raises(IndexError, density_map, [np.array([[5., 5, 5]])], shape,
+                  affine=np.eye(4))
+    assert_raises(IndexError, density_map, [np.array([[-1., 0, 0]])], shape,
+                  affine=np.eye(4))
+    for bad in [np.nan, np.inf]:
+        streamline = np.array([[1., 1, 1], [bad, 2, 2], [3, 3, 3]])
+        assert_raises(IndexError, density_map, [streamline], shape,
+                      affine=np.eye(4))
+    # The points must be 3D
+    assert_raises(ValueError, density_map, [np.array([[1., 1], [2, 2]])],
+                  shape, affine=np.eye(4))
+
+
+def test_density_map_exact_and_num_threads():
+    # A step from [0, 0, 0] to [0, 0, 2] passes through [0, 0, 1]
+    streamlines = [np.array([[0., 0, 0], [0, 0, 2]])]
+    expected = np.zeros((3, 3, 3))
+    expected[0, 0, :] = 1
+    assert_array_equal(density_map(streamlines, (3, 3, 3), affine=np.eye(4),
+                                   exact=True),
+                       expected)
+
+    # Random streamlines with long steps, exact traversal should give the
+    # same result as very finely subsegmented streamlines.
+    rng = np.random.RandomState(0)
+    shape = (20, 20, 20)
+    streamlines = [rng.rand(rng.randint(1, 10), 3) * 19 for _ in range(30)]
+    fine = list(subsegment(streamlines, 0.001))
+    expected = density_map(fine, shape, affine=np.eye(4))
+    for num_threads in [None, 1, 2]:
+        dm = density_map(streamlines, shape, affine=np.eye(4), exact=True,
+                         num_threads=num_threads)
+        assert_array_equal(dm, expected)
+        assert_array_equal(density_map(streamlines, shape, affine=np.eye(4),
+                                       num_threads=num_threads),
+                           density_map(streamlines, shape, affine=np.eye(4),
+                                       num_threads=1))
+
+    # Invalid numbers of threads
+    for num_threads in [0, -1]:
+        assert_raises(ValueError, density_map, streamlines, shape,
+                      affine=np.eye(4), num_threads=num_threads)
+
+    # The partial counts are bounded in memory and can not be fewer than the
+    # threads used
+    assert_equal(_density_map_partials(2 ** 40, None), 1)
+    assert_equal(_density_map_partials(10, 1), 1)
+    nb_voxels = int(np.prod(shape))
+    counts = np.zeros((1, nb_voxels), dtype=np.intp)
+    last_streamline = np.full(counts.shape, -1, dtype=np.intp)
+    points = np.zeros((1, 3))
+    offsets = np.zeros(1, dtype=np.intp)
+    lengths = np.ones(1, dtype=np.intp)
+    assert_raises(ValueError, _density_map, points, offsets, lengths, 0,
+                  counts, last_streamline, shape, False, 2)
+
 
 def test_to_voxel_coordinates_precision():
     # To simplify tests, use an identity affine. This would be the result of
@@ -147,6 +207,29 @@ def test_connectivity_matrix():
     assert_equal(matrix[4, 3], matrix[4, 3])
 
 
+def test_connectivity_matrix_sparse_and_compact_mapping():
+    rng = np.random.RandomState(0)
+    label_volume = rng.randint(0, 50, size=(10, 10, 10))
+    streamlines = [rng.rand(rng.randint(2, 10), 3) * 9 for _ in range(300)]
+
+    for symmetric in [True, False]:
+        matrix, mapping = connectivity_matrix(streamlines, label_volume,
+                                              affine=np.eye(4),
+                                              symmetric=symmetric,
+                                              return_mapping=True)
+        sparse, (pairs, indptr, indices) = connectivity_matrix(
+            iter(streamlines), label_volume, affine=np.eye(4),
+            symmetric=symmetric, return_mapping=True, sparse=True,
+            compact_mapping=True)
+        assert_true(sps.issparse(sparse))
+        assert_array_equal(sparse.toarray(), matrix)
+        assert_equal(len(pairs), len(mapping))
+        assert_equal(indptr[-1], len(streamlines))
+        for p, (a, b) in enumerate(pairs):
+            assert_equal(indices[indptr[p]:indptr[p + 1]].tolist(),
+                         mapping[a, b])
+
+
 def test_ndbincount():
     def check(expected):
         assert_equal(bc[0, 0], expected[0])
@@ -696,3 +779,23 @@ def test_min_at():
 
     _min_at(a, (i, j, k), values)
     npt.assert_array_equal(a, [[[100, 11, 1, 10]]])
+
+
+def test_near_roi_matches_streamline_near_roi():
+    rng = np.random.RandomState(0)
+    streamlines = [rng.rand(rng.randint(1, 20), 3) * 10 for _ in range(200)]
+    mask = rng.rand(10, 10, 10) > 0.97
+    roi_coords = np.array(np.where(mask)).T
+
+    for mode in ["any", "all", "either_end", "both_end"]:
+        for tol in [1, 1.5]:
+            expected = [streamline_near_roi(sl, roi_coords, tol, mode)
+                        for sl in streamlines]
+            assert_array_equal(near_roi(streamlines, mask, tol=tol,
+                                        mode=mode), expected)
+
+    # Empty ROI or no streamlines
+    assert_array_equal(near_roi(streamlines, np.zeros_like(mask), mode="all"),
+                       np.zeros(len(streamlines), dtype=bool))
+    assert_equal(near_roi([], mask).shape, (0,))
+    assert_raises(ValueError, near_roi, streamlines, mask, mode="none")
@@ -49,9 +49,11 @@ And the letters A-D represent the following points in
 from __future__ import division, print_function, absolute_import
 
 from functools import wraps
+from itertools import islice
 from warnings import warn
 
 from nibabel.affines import apply_affine
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from numpy import ravel_multi_index
 
@@ -61,10 +63,12 @@ from collections import defaultdict
 from dipy.utils.six.moves import xrange, map
 
 import numpy as np
+import scipy.sparse as sps
 from numpy import (asarray, ceil, dot, empty, eye, sqrt)
 from dipy.io.bvectxt import ornt_mapping
 from dipy.tracking import metrics
-from dipy.tracking.vox2track import _streamlines_in_mask
+from dipy.tracking.vox2track import (_density_map, _density_map_partials,
+                                     _streamlines_in_mask)
 from dipy.testing import setup_test
 
 # Import helper functions shared with vox2track
@@ -73,7 +77,8 @@ from dipy.io.bvectxt import orientation_from_string
 import nibabel as nib
 
 
-def density_map(streamlines, vol_dims, voxel_size=None, affine=None):
+def density_map(streamlines, vol_dims, voxel_size=None, affine=None,
+                exact=False, num_threads=None):
     """Counts the number of unique streamlines that pass through each voxel.
 
     Parameters
@@ -88,6 +93,15 @@ def density_map(streamlines, vol_dims, voxel_size=None, affine=None):
         This argument is deprecated.
     affine : array_like (4, 4)
         The mapping from voxel coordinates to streamline points.
+    exact : bool, optional
+        If True, a streamline is counted in every voxel crossed by its
+        segments. Otherwise (default), it is counted only in the voxels
+        containing its points.
+    num_threads : int, optional
+        Number of threads to use. If None (default), all available threads are
+        used. Each thread accumulates its own counts, which needs two arrays
+        of the size of the volume per thread, so fewer threads are used if
+        these arrays would take more than 256 MB.
 
     Returns
     -------
@@ -98,29 +112,47 @@ def density_map(streamlines, vol_dims, voxel_size=None, affine=None):
     ------
     IndexError
         When the points of the streamlines lie outside of the return volume.
+    ValueError
+        When `num_threads` is not None and smaller than 1.
 
     Notes
     -----
     A streamline can pass through a voxel even if one of the points of the
     streamline does not lie in the voxel. For example a step from [0,0,0] to
-    [0,0,2] passes through [0,0,1]. Consider subsegmenting the streamlines when
-    the edges of the voxels are smaller than the steps of the streamlines.
+    [0,0,2] passes through [0,0,1]. Use `exact=True` rather than
+    subsegmenting the streamlines when the edges of the voxels are smaller
+    than the steps of the streamlines.
 
     """
     lin_T, offset = _mapping_to_voxel(affine, voxel_size)
-    counts = np.zeros(vol_dims, 'int')
-    for sl in streamlines:
-        inds = _to_voxel_coordinates(sl, lin_T, offset)
-        i, j, k = inds.T
-        # this takes advantage of the fact that numpy's += operator only
-        # acts once even if there are repeats in inds
-        counts[i, j, k] += 1
-    return counts
+    vol_dims = tuple(int(d) for d in vol_dims)
+    nb_voxels = int(np.prod(vol_dims))
+    nb_threads = _density_map_partials(nb_voxels, num_threads)
+    counts = np.zeros((nb_threads, nb_voxels), dtype=np.intp)
+    last_streamline = np.full(counts.shape, -1, dtype=np.intp)
+
+    first_streamline = 0
+    for chunk in _chunks(streamlines):
+        points, lengths = _pack_points(chunk)
+        _map_points_to_voxels(points, lin_T, offset)
+        # NaN fails both comparisons below, so it is rejected first
+        if len(points) and (not np.isfinite(points).all() or
+                            points.min().round(decimals=6) < 0 or
+                            (points.max(axis=0) >= vol_dims).any()):
+            raise IndexError('streamlines have points outside of the volume')
+        offsets = np.cumsum(lengths)
+        offsets -= lengths
+        _density_map(points, offsets, lengths, first_streamline, counts,
+                     last_streamline, vol_dims, exact, nb_threads)
+        first_streamline += len(chunk)
+
+    return counts.sum(axis=0).astype('int').reshape(vol_dims)
 
 
 def connectivity_matrix(streamlines, label_volume, voxel_size=None,
                         affine=None, symmetric=True, return_mapping=False,
-                        mapping_as_streamlines=False):
+                        mapping_as_streamlines=False, sparse=False,
+                        compact_mapping=False):
     """Counts the streamlines that start and end at each label pair.
 
     Parameters
@@ -142,18 +174,34 @@ def connectivity_matrix(streamlines, label_volume, voxel_size=None,
         streamlines.
     mapping_as_streamlines : bool, False by default
         If True voxel indices map to lists of streamline objects. Otherwise
-        voxel indices map to lists of integers.
+        voxel indices map to lists of integers. Ignored if `compact_mapping`
+        is True.
+    sparse : bool, False by default
+        If True, the matrix is returned as a ``scipy.sparse.csr_matrix``,
+        which is much smaller than a dense matrix when there are many labels.
+    compact_mapping : bool, False by default
+        If True, the mapping is returned as arrays in a compressed sparse row
+        layout instead of a dictionary of lists.
 
     Returns
     -------
-    matrix : ndarray
+    matrix : ndarray or csr_matrix
         The number of connection between each pair of regions in
         `label_volume`.
-    mapping : defaultdict(list)
+    mapping : defaultdict(list) or tuple of arrays
         ``mapping[i, j]`` returns all the streamlines that connect region `i`
         to region `j`. If `symmetric` is True mapping will only have one key
         for each start end pair such that if ``i < j`` mapping will have key
-        ``(i, j)`` but not key ``(j, i)``.
+        ``(i, j)`` but not key ``(j, i)``. If `compact_mapping` is True,
+        mapping is ``(pairs, indptr, indices)``: ``pairs`` is an array (P, 2)
+        of the label pairs connected by at least one streamline and the
+        indices of the streamlines connecting ``pairs[p]`` are
+        ``indices[indptr[p]:indptr[p + 1]]``.
+
+    Notes
+    -----
+    The streamlines are processed by chunks, only their end labels are kept
+    in memory, so `streamlines` can be a generator.
 
     """
     # Error checking on label_volume
@@ -166,40 +214,82 @@ def connectivity_matrix(streamlines, label_volume, voxel_size=None,
                          "non-negative label values")
 
     # If streamlines is an iterators
-    if return_mapping and mapping_as_streamlines:
+    if return_mapping and mapping_as_streamlines and not compact_mapping:
         streamlines = list(streamlines)
-    # take the first and last point of each streamline
-    endpoints = [sl[0::len(sl)-1] for sl in streamlines]
 
-    # Map the streamlines coordinates to voxel coordinates
     lin_T, offset = _mapping_to_voxel(affine, voxel_size)
-    endpoints = _to_voxel_coordinates(endpoints, lin_T, offset)
-
-    # get labels for label_volume
-    i, j, k = endpoints.T
-    endlabels = label_volume[i, j, k]
-    if symmetric:
-        endlabels.sort(0)
     mx = label_volume.max() + 1
-    matrix = ndbincount(endlabels, shape=(mx, mx))
-    if symmetric:
-        matrix = np.maximum(matrix, matrix.T)
-
-    if return_mapping:
-        mapping = defaultdict(list)
-        for i, (a, b) in enumerate(endlabels.T):
-            mapping[a, b].append(i)
-
-        # Replace each list of indices with the streamlines they index
-        if mapping_as_streamlines:
-            for key in mapping:
-                mapping[key] = [streamlines[i] for i in mapping[key]]
-
-        # Return the mapping matrix and the mapping
-        return matrix, mapping
+    if sparse:
+        pair_ids, pair_counts = [], []
     else:
+        matrix = np.zeros(mx * mx, dtype='int')
+    all_pair_ids = []
+
+    for chunk in _chunks(streamlines):
+        # take the first and last point of each streamline
+        endpoints = np.array([[sl[0], sl[-1]] for sl in chunk])
+        # Map the streamlines coordinates to voxel coordinates
+        endpoints = _to_voxel_coordinates(endpoints, lin_T, offset)
+
+        # get labels for label_volume
+        i, j, k = endpoints.T
+        endlabels = label_volume[i, j, k]
+        if symmetric:
+            endlabels.sort(0)
+        chunk_pair_ids = ravel_multi_index(endlabels.astype(np.intp),
+                                           (mx, mx))
+        if sparse:
+            ids, counts = np.unique(chunk_pair_ids, return_counts=True)
+            pair_ids.append(ids)
+            pair_counts.append(counts)
+        else:
+            matrix += np.bincount(chunk_pair_ids, minlength=mx * mx)
+        if return_mapping:
+            all_pair_ids.append(chunk_pair_ids)
+
+    if sparse:
+        if len(pair_ids):
+            pair_ids = np.concatenate(pair_ids)
+            pair_counts = np.concatenate(pair_counts)
+        rows, cols = np.unravel_index(np.asarray(pair_ids, dtype=np.intp),
+                                      (mx, mx))
+        matrix = sps.csr_matrix((np.asarray(pair_counts, dtype='int'),
+                                 (rows, cols)), shape=(mx, mx))
+        if symmetric:
+            matrix = matrix.maximum(matrix.T)
+    else:
+        matrix = matrix.reshape((mx, mx))
+        if symmetric:
+            matrix = np.maximum(matrix, matrix.T)
+
+    if not return_mapping:
         return matrix
 
+    # Group the streamlines by label pair
+    if len(all_pair_ids):
+        all_pair_ids = np.concatenate(all_pair_ids)
+    all_pair_ids = np.asarray(all_pair_ids, dtype=np.intp)
+    indices = np.argsort(all_pair_ids, kind='mergesort')
+    ids, counts = np.unique(all_pair_ids[indices], return_counts=True)
+    pairs = np.array(np.unravel_index(ids, (mx, mx))).T
+    indptr = np.zeros(len(ids) + 1, dtype=np.intp)
+    np.cumsum(counts, out=indptr[1:])
+
+    if compact_mapping:
+        return matrix, (pairs, indptr, indices)
+
+    mapping = defaultdict(list)
+    for p, (a, b) in enumerate(pairs):
+        mapping[a, b] = indices[indptr[p]:indptr[p + 1]].tolist()
+
+    # Replace each list of indices with the streamlines they index
+    if mapping_as_streamlines:
+        for key in mapping:
+            mapping[key] = [streamlines[i] for i in mapping[key]]
+
+    # Return the mapping matrix and the mapping
+    return matrix, mapping
+
 
 def ndbincount(x, weights=None, shape=None):
     """Like bincount, but for nd-indicies.
@@ -562,15 +652,20 @@ def target(streamlines, target_mask, affine, include=True):
     yield
     # End of initialization
 
-    for sl in streamlines:
+    # The points of several streamlines are mapped to voxels at once.
+    for chunk in _chunks(streamlines):
+        points, lengths = _pack_points(chunk)
+        _map_points_to_voxels(points, lin_T, offset)
+        if len(points) and points.min().round(decimals=6) < 0:
+            raise ValueError("streamlines points are outside of target_mask")
+        i, j, k = points.astype(int).T
         try:
-            ind = _to_voxel_coordinates(sl, lin_T, offset)
-            i, j, k = ind.T
             state = target_mask[i, j, k]
         except IndexError:
             raise ValueError("streamlines points are outside of target_mask")
-        if state.any() == include:
-            yield sl
+        for sl, n in zip(chunk, _count_per_streamline(state, lengths)):
+            if (n > 0) == include:
+                yield sl
 
 
 @_with_initialize
@@ -624,6 +719,105 @@ def target_line_based(streamlines, target_mask, affine=None, include=True):
         yield streamlines[idx]
 
 
+def _chunks(streamlines, chunk_size=10000):
+    """Generates lists of `chunk_size` consecutive streamlines."""
+    streamlines = iter(streamlines)
+    while True:
+        chunk = list(islice(streamlines, chunk_size))
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+
+def _pack_points(streamlines):
+    """Returns the points of all the `streamlines` in a single (N, 3) float
+    array and the number of points of each streamline."""
+    lengths = np.array([len(sl) for sl in streamlines], dtype=np.intp)
+    streamlines = [sl for sl in streamlines if len(sl)]
+    for sl in streamlines:
+        if np.ndim(sl) != 2 or np.shape(sl)[1] != 3:
+            raise ValueError("streamlines must be arrays of shape (N, 3)")
+    points = np.empty((lengths.sum(), 3))
+    if len(streamlines):
+        np.concatenate(streamlines, out=points)
+    return points, lengths
+
+
+def _map_points_to_voxels(points, lin_T, offset, block_size=10000):
+    """Maps in place the points packed by ``_pack_points`` to voxel
+    coordinates, ``lin_T`` and ``offset`` being as returned by
+    ``_mapping_to_voxel``. The points are mapped by blocks so that only a
+    block of them is copied at a time."""
+    buffer = np.empty((min(block_size, len(points)), 3))
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        np.dot(block, lin_T, out=buffer[:len(block)])
+        block[...] = buffer[:len(block)]
+    points += offset
+
+
+def _count_per_streamline(state, lengths):
+    """Number of True values of `state` over the points of each streamline,
+    the points of all the streamlines being packed as done by
+    ``_pack_points``."""
+    cumulative = np.zeros(len(state) + 1, dtype=np.intp)
+    np.cumsum(state, out=cumulative[1:])
+    ends = np.cumsum(lengths)
+    return cumulative[ends] - cumulative[ends - lengths]
+
+
+def _check_near_roi_mode(mode):
+    if mode not in ("any", "all", "either_end", "both_end"):
+        e_s = "For determining relationship to an array, you can use "
+        e_s += "one of the following modes: 'any', 'all', 'both_end',"
+        e_s += "'either_end', but you entered: %s." % mode
+        raise ValueError(e_s)
+
+
+def _roi_index(roi_coords):
+    """Spatial index over ROI coordinates used to know which streamlines are
+    near an ROI (see ``_streamlines_near_roi``). None if the ROI is empty."""
+    if len(roi_coords) == 0:
+        return None
+    return cKDTree(roi_coords)
+
+
+def _streamlines_near_roi(streamlines, roi_index, tol, mode='any'):
+    """Is each streamline of a sequence near an ROI.
+
+    Vectorized version of :func:`streamline_near_roi`. All the points of the
+    streamlines are queried at once against a spatial index of the ROI
+    coordinates, as returned by ``_roi_index``, instead of computing the
+    distances to every ROI coordinate.
+
+    Returns
+    -------
+    out : 1D array of boolean dtype, shape (len(streamlines), )
+    """
+    out = np.zeros(len(streamlines), dtype=bool)
+    if roi_index is None or len(streamlines) == 0:
+        return out
+
+    if mode == "either_end" or mode == "both_end":
+        # 'end' modes, use streamlines with 2 nodes:
+        points = np.array([[sl[0], sl[-1]] for sl in streamlines])
+        points = points.reshape((-1, 3))
+        lengths = np.full(len(streamlines), 2, dtype=np.intp)
+    else:
+        points, lengths = _pack_points(streamlines)
+
+    # The query is bounded by `tol` so the tree can prune far away leaves.
+    # Points farther than that from the ROI get an infinite distance.
+    dist, _ = roi_index.query(points,
+                              distance_upper_bound=np.nextafter(tol, np.inf))
+    near = _count_per_streamline(dist <= tol, lengths)
+
+    if mode == "any" or mode == "either_end":
+        return near > 0
+    else:
+        return near == lengths
+
+
 def streamline_near_roi(streamline, roi_coords, tol, mode='any'):
     """Is a streamline near an ROI.
 
@@ -728,24 +922,19 @@ def near_roi(streamlines, region_of_interest, affine=None, tol=None,
         warn(w_s)
         tol = dtc
 
+    _check_near_roi_mode(mode)
+
     roi_coords = np.array(np.where(region_of_interest)).T
     x_roi_coords = apply_affine(affine, roi_coords)
-
-    # If it's already a list, we can save time by preallocating the output
-    if isinstance(streamlines, list):
-        out = np.zeros(len(streamlines), dtype=bool)
-        for ii, sl in enumerate(streamlines):
-            out[ii] = streamline_near_roi(sl, x_roi_coords, tol=tol,
-                                          mode=mode)
-        return out
-    # If it's a generator, we'll need to generate the output into a list
-    else:
-        out = []
-        for sl in streamlines:
-            out.append(streamline_near_roi(sl, x_roi_coords, tol=tol,
-                                           mode=mode))
-
-        return(np.array(out, dtype=bool))
+    roi_index = _roi_index(x_roi_coords)
+
+    # The streamlines are processed by chunks so that generators don't have
+    # to be loaded in memory all at once.
+    out = [_streamlines_near_roi(chunk, roi_index, tol=tol, mode=mode)
+           for chunk in _chunks(streamlines)]
+    if len(out) == 0:
+        return np.zeros(0, dtype=bool)
+    return np.concatenate(out)
 
 
 def reorder_voxels_affine(input_ornt, output_ornt, shape, voxel_size):
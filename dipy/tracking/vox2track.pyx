@@ -3,6 +3,7 @@
 implemented in cython.
 """
 import cython
+from cython.parallel import prange, threadid
 
 cdef extern from "dpy_math.h" nogil:
     double fmin(double x, double y)
@@ -11,6 +12,8 @@ from libc.math cimport ceil, floor, fabs, sqrt
 import numpy as np
 cimport numpy as cnp
 from ._utils import _mapping_to_voxel, _to_voxel_coordinates
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
+from dipy.utils.omp import thread_count
 
 from ..utils.six.moves import xrange
 
@@ -320,6 +323,170 @@ cdef cnp.npy_intp _streamline_in_mask(
     return mask[x, y, z]
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _count_voxel(cnp.npy_intp[:, :] counts,
+                              cnp.npy_intp[:, :] last_streamline,
+                              cnp.npy_intp thread, cnp.npy_intp streamline,
+                              cnp.npy_intp x, cnp.npy_intp y, cnp.npy_intp z,
+                              cnp.npy_intp ny, cnp.npy_intp nz) nogil:
+    """Counts the streamline in voxel [x, y, z] if not already done."""
+    cdef cnp.npy_intp v = (x * ny + y) * nz + z
+    if last_streamline[thread, v] != streamline:
+        last_streamline[thread, v] = streamline
+        counts[thread, v] += 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _count_segment_voxels(cnp.double_t[:, :] points, cnp.npy_intp i,
+                                cnp.npy_intp[:, :] counts,
+                                cnp.npy_intp[:, :] last_streamline,
+                                cnp.npy_intp thread, cnp.npy_intp streamline,
+                                cnp.npy_intp ny, cnp.npy_intp nz) nogil:
+    """Counts the streamline in every voxel crossed by the segment going from
+    point `i` to point `i + 1`, using a 3D digital differential analyzer
+    (Amanatides and Woo, 1987). The voxel of point `i` is not counted."""
+    cdef:
+        cnp.npy_intp d, axis, k, nb_steps = 0
+        cnp.npy_intp voxel[3]
+        cnp.npy_intp end[3]
+        cnp.npy_intp step[3]
+        double t_max[3]
+        double t_delta[3]
+        double direction
+
+    for d in range(3):
+        voxel[d] = <cnp.npy_intp>points[i, d]
+        end[d] = <cnp.npy_intp>points[i + 1, d]
+        direction = points[i + 1, d] - points[i, d]
+        if direction > 0:
+            step[d] = 1
+            t_max[d] = (voxel[d] + 1 - points[i, d]) / direction
+            t_delta[d] = 1 / direction
+        elif direction < 0:
+            step[d] = -1
+            t_max[d] = (voxel[d] - points[i, d]) / direction
+            t_delta[d] = -1 / direction
+        else:
+            step[d] = 0
+        nb_steps += end[d] - voxel[d] if end[d] > voxel[d] \
+            else voxel[d] - end[d]
+
+    for k in range(nb_steps):
+        # Step along the axis whose voxel boundary is crossed first, among the
+        # axes on which the voxel of the next point isn't reached yet.
+        axis = -1
+        for d in range(3):
+            if voxel[d] != end[d] and (axis == -1 or t_max[d] < t_max[axis]):
+                axis = d
+        voxel[axis] += step[axis]
+        t_max[axis] += t_delta[axis]
+        _count_voxel(counts, last_streamline, thread, streamline,
+                     voxel[0], voxel[1], voxel[2], ny, nz)
+
+
+# Maximum memory taken by the per-thread counts of _density_map, in bytes
+_DENSITY_MAP_MAX_BYTES = 2 ** 28
+
+
+def _density_map_partials(cnp.npy_intp nb_voxels, num_threads=None):
+    """Number of partial counts accumulated in parallel by _density_map.
+
+    One partial count (and its array of last streamlines) is used for each of
+    the threads OpenMP uses with `num_threads`, but no more than fit in
+    _DENSITY_MAP_MAX_BYTES, and at least one. `_density_map` must then be
+    called with the returned number of threads.
+    """
+    if num_threads is not None and num_threads < 1:
+        raise ValueError("num_threads must be None or a positive integer")
+    set_num_threads(num_threads)
+    nb_threads = thread_count()
+    if num_threads is not None:
+        restore_default_num_threads()
+    nb_fitting = _DENSITY_MAP_MAX_BYTES // (2 * sizeof(cnp.npy_intp) *
+                                            max(1, nb_voxels))
+    return max(1, min(nb_threads, nb_fitting))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _density_map(cnp.double_t[:, :] points, cnp.npy_intp[:] offsets,
+                 cnp.npy_intp[:] lengths, cnp.npy_intp first_streamline,
+                 cnp.npy_intp[:, :] counts,
+                 cnp.npy_intp[:, :] last_streamline, vol_dims,
+                 bint exact=False, num_threads=None):
+    """Accumulates the number of streamlines going through each voxel.
+
+    This function is private because it's supposed to be called only by
+    tracking.utils.density_map.
+
+    Parameters
+    ----------
+    points : array (N, 3)
+        Points of the streamlines in voxel coordinates, such that truncating
+        them gives the indices of their voxel. No point can lie outside the
+        volume.
+    offsets : array (S,)
+        Index in `points` of the first point of each streamline.
+    lengths : array (S,)
+        Number of points of each streamline.
+    first_streamline : int
+        Index of the first streamline, used to count each streamline once per
+        voxel over successive calls.
+    counts : array (T, prod(vol_dims))
+        Counts of each thread, updated in place. `T` must be at least the
+        number of threads used, see `_density_map_partials`.
+    last_streamline : array (T, prod(vol_dims))
+        Index of the last streamline counted in each voxel by each thread,
+        updated in place. Must be initialized to -1.
+    vol_dims : 3 ints
+        Shape of the volume.
+    exact : bool
+        If True, the streamlines are counted in all the voxels crossed by
+        their segments. Otherwise, only in the voxels containing their points.
+    num_threads : int
+        Number of threads to use. If None, all available threads are used.
+    """
+    cdef:
+        cnp.npy_intp s, i, thread, streamline
+        cnp.npy_intp nb_streamlines = offsets.shape[0]
+        cnp.npy_intp ny = vol_dims[1]
+        cnp.npy_intp nz = vol_dims[2]
+
+    if num_threads is not None and num_threads < 1:
+        raise ValueError("num_threads must be None or a positive integer")
+    set_num_threads(num_threads)
+    if (thread_count() > counts.shape[0] or
+            thread_count() > last_streamline.shape[0]):
+        if num_threads is not None:
+            restore_default_num_threads()
+        raise ValueError("counts and last_streamline need one row per thread")
+    with nogil:
+        for s in prange(nb_streamlines, schedule='guided'):
+            thread = threadid()
+            streamline = first_streamline + s
+            if lengths[s] == 0:
+                continue
+            i = offsets[s]
+            _count_voxel(counts, last_streamline, thread, streamline,
+                         <cnp.npy_intp>points[i, 0],
+                         <cnp.npy_intp>points[i, 1],
+                         <cnp.npy_intp>points[i, 2], ny, nz)
+            for i in range(offsets[s], offsets[s] + lengths[s] - 1):
+                if exact:
+                    _count_segment_voxels(points, i, counts, last_streamline,
+                                          thread, streamline, ny, nz)
+                else:
+                    _count_voxel(counts, last_streamline, thread, streamline,
+                                 <cnp.npy_intp>points[i + 1, 0],
+                                 <cnp.npy_intp>points[i + 1, 1],
+                                 <cnp.npy_intp>points[i + 1, 2], ny, nz)
+    if num_threads is not None:
+        restore_default_num_threads()
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.profile(False)
@@ -0,0 +1,22 @@
+""" Utilities for multiprocessing """
+
+import multiprocessing
+import sys
+
+
+def fork_context():
+    """Multiprocessing context starting the worker processes by forking the
+    parent, or None if forking is not available.
+
+    Objects which can not be pickled (e.g. extension types) can be shared
+    with forked workers through module level variables set before the pool
+    is created. The global start method of ``multiprocessing`` is left
+    untouched.
+    """
+    try:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('fork')
+        return None
+    except AttributeError:
+        # Python 2 always forks on posix platforms
+        return multiprocessing if sys.platform != 'win32' else None
@@ -42,8 +42,9 @@ class ResliceFlow(Workflow):
         out_dir : string, optional
             Output directory (default input file directory)
         out_resliced : string, optional
-            Name of the resliced dataset to be saved
-            (default 'resliced.nii.gz')
+            Name of the resliced dataset to be saved. An uncompressed (.nii)
+            dataset is written volume by volume without holding the resliced
+            data in memory (default 'resliced.nii.gz')
         """
         
         io_it = self.get_io_iterator()
@@ -52,9 +53,16 @@ class ResliceFlow(Workflow):
             
             data, affine, vox_sz = load_nifti(inputfile, return_voxsize=True)
             logging.info('Processing {0}'.format(inputfile))
-            new_data, new_affine = reslice(data, affine, vox_sz, new_vox_size,
-                                           order, mode=mode, cval=cval,
-                                           num_processes=num_processes)
-            save_nifti(outpfile, new_data, new_affine)
+            if outpfile.endswith('.nii'):
+                # Uncompressed outputs are written volume by volume
+                reslice(data, affine, vox_sz, new_vox_size, order, mode=mode,
+                        cval=cval, num_processes=num_processes,
+                        out_fname=outpfile)
+            else:
+                new_data, new_affine = reslice(data, affine, vox_sz,
+                                               new_vox_size, order, mode=mode,
+                                               cval=cval,
+                                               num_processes=num_processes)
+                save_nifti(outpfile, new_data, new_affine)
             logging.info('Resliced file save in {0}'.format(outpfile))
         
\ No newline at end of file
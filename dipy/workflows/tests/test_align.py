@@ -25,6 +25,17 @@ def test_reslice():
         npt.assert_equal(resliced.shape[1] > volume.shape[1], True)
         npt.assert_equal(resliced.shape[2] > volume.shape[2], True)
         npt.assert_equal(resliced.shape[-1], volume.shape[-1])
+
+        # Uncompressed outputs are written volume by volume
+        reslice_flow = ResliceFlow()
+        reslice_flow.run(data_path, [1.5, 1.5, 1.5], out_dir=out_dir,
+                         out_resliced='resliced.nii')
+        out_path = reslice_flow.last_generated_outputs['out_resliced']
+        out_img2 = nib.load(out_path)
+        npt.assert_array_equal(out_img2.get_data(), resliced)
+        npt.assert_array_almost_equal(out_img2.affine, out_img.affine)
+        for code in ['sform_code', 'qform_code']:
+            npt.assert_equal(out_img2.header[code], out_img.header[code])
         
 
 if __name__ == '__main__':